@@ -1,7 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import abc
+import time
+
+# 记录模块导入起点，--profile 时用于统计依赖导入耗时
+_MODULE_IMPORT_START = time.perf_counter()
+
 import pandas as pd
+import numpy as np
 import yaml
 import os
 import logging
@@ -14,9 +21,38 @@ import argparse
 import io
 import locale
 import requests
-import time
 import xlsxwriter
 import threading
+import contextlib
+import decimal
+import bisect
+import hashlib
+import collections.abc
+import csv
+import copy
+import base64
+import concurrent.futures
+import functools
+import itertools
+import cProfile
+import pstats
+
+# 跨进程文件锁：Linux/macOS使用fcntl，Windows使用msvcrt
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+# --format=msgpack需要msgpack，未安装时只能使用JSON输出
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_MODULE_IMPORT_SECONDS = time.perf_counter() - _MODULE_IMPORT_START
 
 # 设置stdout为UTF-8编码
 if sys.stdout.encoding != 'utf-8':
@@ -44,1959 +80,6354 @@ except Exception as e:
 
 logger = logging.getLogger(__name__)
 
-class BillingManager:
-    def __init__(self, config_file='vps_data.yml'):
+# 有libyaml时使用C实现读写配置文件，输出与纯Python实现相同
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CDumper', yaml.Dumper)
+
+# 月份中文名称
+MONTH_NAMES = {
+    1: "一月", 2: "二月", 3: "三月", 4: "四月",
+    5: "五月", 6: "六月", 7: "七月", 8: "八月",
+    9: "九月", 10: "十月", 11: "十一月", 12: "十二月"
+}
+
+# --profile 时重点关注的函数，按函数名汇总累计耗时和调用次数
+PROFILE_HOTSPOTS = [
+    ('YAML解析', 'load_data'),
+    ('YAML写入', 'save_data'),
+    ('使用时长计算', 'calculate_usage_period'),
+    ('价格计算', '_pricing_terms'),
+    ('NAT费用计算', 'calculate_nat_fee'),
+    ('汇率读取', 'get_exchange_rate'),
+    ('月账单数据', 'get_monthly_bill_data'),
+    ('月账单汇总表', 'generate_monthly_bill_table'),
+    ('Excel导出', 'save_monthly_billing_to_excel'),
+    ('Excel导出(单月)', 'save_to_excel'),
+    ('JSON序列化', 'dumps'),
+]
+
+
+# 月历表覆盖的年份范围，与set_billing_period的年份校验一致
+CALENDAR_MIN_YEAR = 2000
+CALENDAR_MAX_YEAR = 2100
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class MonthInfo:
+    """
+    单个月份的边界信息
+    """
+
+    __slots__ = ('year', 'month', 'days', 'start', 'end', 'last_day', 'next_start',
+                 'start_minute', 'end_minute', 'minutes')
+
+    def __init__(self, year, month):
         """
-        初始化账单管理器
-        
         Args:
-            config_file (str): VPS配置文件路径
+            year (int): 年份
+            month (int): 月份
         """
-        # 如果config_file是相对路径，则基于脚本所在目录构建绝对路径
-        if not os.path.isabs(config_file):
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            self.config_file = os.path.join(script_dir, config_file)
-        else:
-            self.config_file = config_file
-        self.vps_data = []
-        self.nat_total_fee = 0
-        self.billing_year = datetime.datetime.now().year
-        self.billing_month = datetime.datetime.now().month
-        self.exchange_rate_cache = None  # 用于缓存汇率
-        self.auto_save_timer = None  # 用于自动保存的定时器
-        
-        # 确保字体目录存在
-        self.ensure_fonts_directory()
-        
-        self.load_data()
-        
-        # 启动自动保存定时器，每5分钟自动保存一次
-        self.start_auto_save_timer()
-    
-    def ensure_fonts_directory(self):
-        """确保fonts目录存在"""
-        try:
-            # 获取当前脚本所在目录
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            fonts_dir = os.path.join(script_dir, 'fonts')
-            
-            # 如果fonts目录不存在，创建它
-            if not os.path.exists(fonts_dir):
-                os.makedirs(fonts_dir)
-                logger.info(f"已创建字体目录: {fonts_dir}")
-            
-            # 检查DejaVu字体是否存在
-            dejavu_font_path = os.path.join(fonts_dir, 'DejaVuSansCondensed.ttf')
-            if not os.path.exists(dejavu_font_path):
-                logger.warning(f"DejaVu字体文件不存在: {dejavu_font_path}")
-                logger.info("PDF导出将使用默认Helvetica字体")
-            
-            return fonts_dir
-        except Exception as e:
-            logger.error(f"检查/创建字体目录时发生错误: {str(e)}")
-            return None
-    
-    def load_data(self):
-        """从配置文件加载VPS数据"""
-        try:
-            with open(self.config_file, 'r', encoding='utf-8') as file:
-                data = yaml.safe_load(file)
-                
-            self.vps_data = data.get('vps_servers', [])
-            self.total_bill = data.get('total_bill', 0)
-            # 不要从配置文件加载NAT费用，强制每次都重新计算
-            self.nat_total_fee = 0
-            
-            logger.info(f"成功从 {self.config_file} 加载了 {len(self.vps_data)} 台VPS数据")
-        except Exception as e:
-            logger.error(f"加载VPS数据失败: {str(e)}")
-            self.vps_data = []
-            self.total_bill = 0
-            self.nat_total_fee = 0
-    
-    def save_data(self):
-        """保存VPS数据到配置文件"""
-        try:
-            # 临时保存NAT费用以便计算总费用
-            original_nat_fee = self.nat_total_fee
-            
-            # 强制NAT费用为0，让它在每次计算时重新计算
-            self.nat_total_fee = 0
-            
-            data = {
-                'vps_servers': self.vps_data,
-                'total_bill': self.total_bill,
-                'nat_fee': self.nat_total_fee  # 保存为0，强制每次启动时重新计算
-            }
-            
-            with open(self.config_file, 'w', encoding='utf-8') as file:
-                yaml.dump(data, file, default_flow_style=False, allow_unicode=True)
-            
-            # 恢复原始的NAT费用值
-            self.nat_total_fee = original_nat_fee
-                
-            logger.info(f"成功保存 {len(self.vps_data)} 台VPS数据到 {self.config_file}")
-            return True
-        except Exception as e:
-            logger.error(f"保存VPS数据失败: {str(e)}")
-            return False
-    
-    def get_vps_by_name(self, vps_name):
+        self.year = year
+        self.month = month
+        self.days = calendar.monthrange(year, month)[1]
+        self.start = datetime.datetime(year, month, 1)
+        self.next_start = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+        self.end = self.next_start - datetime.timedelta(seconds=1)  # 月末最后一秒
+        self.last_day = self.next_start - datetime.timedelta(days=1)  # 月末当天0点
+        self.start_minute = (self.start - _EPOCH) // datetime.timedelta(minutes=1)
+        self.end_minute = (self.next_start - _EPOCH) // datetime.timedelta(minutes=1)
+        self.minutes = self.days * 24 * 60
+
+
+class MonthCalendar:
+    """
+    预先计算的月历表，按(年, 月)常数时间查询月初、月末、天数和分钟数
+
+    计费代码中每台VPS每个月份都要用到月份边界，统一从这里查询，不再重复计算下月进位和monthrange
+    """
+
+    def __init__(self, min_year=CALENDAR_MIN_YEAR, max_year=CALENDAR_MAX_YEAR):
         """
-        根据名称获取VPS数据
-        
         Args:
-            vps_name (str): VPS名称
-            
-        Returns:
-            dict: VPS数据，如果不存在则返回None
+            min_year (int): 起始年份
+            max_year (int): 结束年份（包含）
         """
-        for vps in self.vps_data:
-            if vps.get('name') == vps_name:
-                return vps
-        return None
-    
-    def update_vps(self, vps_name, **kwargs):
+        self.min_year = min_year
+        self.max_year = max_year
+        self._months = [MonthInfo(year, month)
+                        for year in range(min_year, max_year + 1)
+                        for month in range(1, 13)]
+
+    def get(self, year, month):
         """
-        更新VPS数据
-        
+        查询月份信息
+
         Args:
-            vps_name (str): VPS名称
-            **kwargs: 要更新的字段和值
-            
+            year (int): 年份
+            month (int): 月份
+
         Returns:
-            bool: 是否成功
+            MonthInfo: 月份信息；超出表格范围时临时计算
         """
-        vps = self.get_vps_by_name(vps_name)
-        if vps:
-            try:
-                # 确保数据类型正确
-                if 'price_per_month' in kwargs:
-                    kwargs['price_per_month'] = float(kwargs['price_per_month'])
-                if 'use_nat' in kwargs:
-                    kwargs['use_nat'] = bool(kwargs['use_nat'])
-                
-                # 更新字段
-                for key, value in kwargs.items():
-                    vps[key] = value
-                
-                # 更新后立即保存
-                return self.save_data()
-            except Exception as e:
-                logger.error(f"更新VPS数据时出错: {str(e)}")
-                return False
-        else:
-            logger.error(f"找不到VPS: {vps_name}")
-            return False
-    
-    def add_vps(self, vps_data):
+        if self.min_year <= year <= self.max_year and 1 <= month <= 12:
+            return self._months[(year - self.min_year) * 12 + month - 1]
+        return MonthInfo(year, month)
+
+    def contains(self, year, month):
         """
-        添加新的VPS
-        
-        Args:
-            vps_data (dict): VPS数据
-            
         Returns:
-            bool: 是否成功
+            bool: 年月是否在表格范围内
         """
-        try:
-            vps_name = vps_data.get('name')
-            if not vps_name:
-                logger.error("VPS数据缺少name字段")
-                return False
-                
-            # 检查是否已存在
-            if self.get_vps_by_name(vps_name):
-                logger.error(f"VPS已存在: {vps_name}")
-                return False
-                
-            # 添加start_date字段，记录创建时间
-            if 'start_date' not in vps_data:
-                vps_data['start_date'] = datetime.datetime.now().strftime("%Y/%m/%d")
-                
-            # 添加purchase_date字段，记录购买时间
-            if 'purchase_date' not in vps_data:
-                vps_data['purchase_date'] = datetime.datetime.now().strftime("%Y/%m/%d")
-                
-            # 确保数据类型正确
-            if 'price_per_month' in vps_data:
-                vps_data['price_per_month'] = float(vps_data['price_per_month'])
-            if 'use_nat' in vps_data:
-                vps_data['use_nat'] = bool(vps_data['use_nat'])
-            
-            # 添加VPS数据的深拷贝，避免引用问题
-            self.vps_data.append(dict(vps_data))
-            
-            # 添加后立即保存
-            return self.save_data()
-        except Exception as e:
-            logger.error(f"添加VPS时出错: {str(e)}")
-            return False
-    
-    def delete_vps(self, vps_name):
+        return self.min_year <= year <= self.max_year and 1 <= month <= 12
+
+    def months_between(self, start_year, start_month, end_year, end_month):
         """
-        删除VPS
-        
-        Args:
-            vps_name (str): VPS名称
-            
+        按顺序列出两个年月之间（包含两端）的所有月份
+
         Returns:
-            bool: 是否成功
+            list: MonthInfo列表
         """
-        for i, vps in enumerate(self.vps_data):
-            if vps.get('name') == vps_name:
-                del self.vps_data[i]
-                return self.save_data()
-                
-        logger.error(f"找不到VPS: {vps_name}")
-        return False
-    
-    def set_vps_status(self, vps_name, status):
+        if not (self.contains(start_year, start_month) and self.contains(end_year, end_month)):
+            return [MonthInfo(year, month)
+                    for year in range(start_year, end_year + 1)
+                    for month in range(start_month if year == start_year else 1,
+                                       (end_month if year == end_year else 12) + 1)]
+        first = (start_year - self.min_year) * 12 + start_month - 1
+        last = (end_year - self.min_year) * 12 + end_month - 1
+        return self._months[first:last + 1]
+
+
+# 全局共享的月历表
+MONTH_CALENDAR = MonthCalendar()
+
+
+# 金额的内部表示：整数分用于账单行和合计，整数微分用于月单价（1美元 = 100分 = 10^8微分）
+MICRO_CENTS_PER_CENT = 1000000
+MICRO_CENTS_PER_DOLLAR = 100 * MICRO_CENTS_PER_CENT
+
+
+def _div_round_half_up(numerator, denominator):
+    """整数除法，按四舍五入（远离0）取整"""
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if remainder * 2 >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+def to_micro_cents(amount):
+    """
+    将金额转换为整数微分，按金额的十进制写法精确转换
+
+    Args:
+        amount (float|int|str): 金额（美元）
+
+    Returns:
+        int: 微分
+    """
+    micro_cents = decimal.Decimal(str(amount)) * MICRO_CENTS_PER_DOLLAR
+    return int(micro_cents.to_integral_value(rounding=decimal.ROUND_HALF_UP))
+
+
+def amount_to_cents(amount):
+    """
+    将金额转换为整数分，四舍五入到分
+
+    Args:
+        amount (float|int|str): 金额（美元）
+
+    Returns:
+        int: 分
+    """
+    return _div_round_half_up(to_micro_cents(amount), MICRO_CENTS_PER_CENT)
+
+
+def cents_to_amount(cents):
+    """
+    将整数分转换为输出用的金额，只在输出时转换一次
+
+    Args:
+        cents (int): 分
+
+    Returns:
+        float: 金额（美元）
+    """
+    return cents / 100
+
+
+class MonthlyRate:
+    """
+    某个月单价在某个月份的精确费率：月单价（微分）/ 当月总微秒数
+
+    按使用时长计费时直接用整数计算“月单价 × 使用时长 / 当月时长”，只在得出分时取整一次
+    """
+
+    __slots__ = ('price_micro_cents', 'month_microseconds')
+
+    def __init__(self, price_micro_cents, days_in_month):
         """
-        设置VPS状态
-        
         Args:
-            vps_name (str): VPS名称
-            status (str): 新状态，例如"在用"或"销毁"
-            
-        Returns:
-            bool: 是否成功
+            price_micro_cents (int): 月单价（微分）
+            days_in_month (int): 当月天数
         """
-        vps = self.get_vps_by_name(vps_name)
-        if vps:
-            vps['status'] = status
-            
-            # 如果状态是销毁，设置销毁日期
-            if status == "销毁":
-                today = datetime.datetime.now().strftime("%Y/%m/%d")
-                vps['cancel_date'] = today
-                
-            return self.save_data()
-        else:
-            logger.error(f"找不到VPS: {vps_name}")
-            return False
-    
-    def get_all_vps(self):
+        self.price_micro_cents = price_micro_cents
+        self.month_microseconds = days_in_month * 24 * 60 * 60 * 1000000
+
+    def charge_cents(self, elapsed):
         """
-        获取所有VPS数据
-        
+        计算使用时长对应的费用
+
+        Args:
+            elapsed (timedelta): 使用时长
+
         Returns:
-            list: VPS数据列表
-        """
-        return self.vps_data
-    
-    def get_active_vps(self):
+            int: 费用（分），四舍五入到分
         """
-        获取所有在用的VPS
-        
-        Returns:
-            list: 在用的VPS数据列表
-        """
-        return [vps for vps in self.vps_data if vps.get('status') == "在用"]
-    
-    def get_inactive_vps(self):
+        elapsed_microseconds = elapsed // datetime.timedelta(microseconds=1)
+        return _div_round_half_up(self.price_micro_cents * elapsed_microseconds,
+                                  self.month_microseconds * MICRO_CENTS_PER_CENT)
+
+
+@functools.lru_cache(maxsize=4096)
+def get_monthly_rate(price_per_month, year, month):
+    """
+    获取（月单价, 年月）对应的费率，同一单价在同一月份只计算一次
+
+    Args:
+        price_per_month (float): 月单价（美元）
+        year (int): 年份
+        month (int): 月份
+
+    Returns:
+        MonthlyRate: 费率
+    """
+    return MonthlyRate(to_micro_cents(price_per_month), MONTH_CALENDAR.get(year, month).days)
+
+
+class PriceSegments:
+    """
+    一台VPS按时间排列的单价区段（price_history字段解析结果）
+
+    第i段从starts[i]开始，到下一段开始为止；第一段之前按第一段的单价计算。
+    按月计费时用二分查找定位与计费区间重叠的第一段，只遍历重叠的区段
+    """
+
+    __slots__ = ('starts', 'prices')
+
+    def __init__(self, starts, prices):
         """
-        获取所有已销毁的VPS
-        
-        Returns:
-            list: 已销毁的VPS数据列表
+        Args:
+            starts (list): 每段的开始时间（datetime），升序
+            prices (list): 每段的月单价（美元）
         """
-        return [vps for vps in self.vps_data if vps.get('status') == "销毁"]
-    
-    def reset_nat_fee(self):
+        self.starts = starts
+        self.prices = prices
+
+    def price_at(self, when):
         """
-        重置NAT费用，强制系统在下次请求时重新计算
-        同时重置汇率缓存，确保使用最新汇率
+        Returns:
+            float: when时刻的月单价
         """
-        self.nat_total_fee = 0
-        self.exchange_rate_cache = None  # 重置汇率缓存
-        logger.info("已重置NAT费用计算和汇率缓存")
-        return True
-    
-    def get_exchange_rate(self, year=None, month=None):
+        return self.prices[max(bisect.bisect_right(self.starts, when) - 1, 0)]
+
+    def next_change(self, after):
         """
-        获取美元兑人民币汇率 (1人民币=多少美元)
-        通过在线API获取指定年月的汇率，如果无法获取则使用固定汇率
-        
-        Args:
-            year (int, optional): 年份，默认为当前年份
-            month (int, optional): 月份，默认为当前月份
-        
         Returns:
-            float: 汇率 (1人民币=多少美元)
+            datetime: after之后第一次调整单价的时间，没有时返回None
         """
-        try:
-            # 如果没有指定年月，使用当前年月
-            if year is None or month is None:
-                today = datetime.datetime.now()
-                year = year or today.year
-                month = month or today.month
-                
-            # 当月的汇率使用当前获取的实时汇率
-            current_year = datetime.datetime.now().year
-            current_month = datetime.datetime.now().month
-            is_current_month = (year == current_year and month == current_month)
-            
-            # 缓存文件路径
-            exchange_rate_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exchange_rates')
-            if not os.path.exists(exchange_rate_dir):
-                os.makedirs(exchange_rate_dir)
-                
-            # 使用年月作为缓存文件名
-            cache_filename = f"exchange_rate_{year}_{month}.json"
-            exchange_rate_file = os.path.join(exchange_rate_dir, cache_filename)
-            current_time = time.time()
-            
-            # 如果是当前月份，且缓存文件存在但未过期（24小时内），则直接使用缓存汇率
-            if is_current_month and os.path.exists(exchange_rate_file):
-                with open(exchange_rate_file, 'r') as f:
-                    cache_data = json.load(f)
-                    # 当前月汇率缓存24小时
-                    if current_time - cache_data['timestamp'] < 86400:  # 24小时 = 86400秒
-                        logger.info(f"从缓存获取{year}年{month}月汇率: 1元人民币 = {cache_data['rate']:.4f}美元")
-                        return round(cache_data['rate'], 4)  # 保留4位小数
-            
-            # 如果是历史月份，且缓存文件存在，直接使用缓存（历史汇率不变）
-            elif not is_current_month and os.path.exists(exchange_rate_file):
-                with open(exchange_rate_file, 'r') as f:
-                    cache_data = json.load(f)
-                    logger.info(f"从缓存获取历史{year}年{month}月汇率: 1元人民币 = {cache_data['rate']:.4f}美元")
-                    return round(cache_data['rate'], 4)
-            
-            # 对于当前月份，使用外部API获取最新汇率
-            if is_current_month:
-                try:
-                    url = "https://api.exchangerate-api.com/v4/latest/CNY"
-                    response = requests.get(url, timeout=10)
-                    response.raise_for_status()  # 检查HTTP状态码
-                    data = response.json()
-                    rate = data['rates']['USD']
-                except Exception as api_error:
-                    logger.warning(f"API获取汇率失败: {str(api_error)}，使用默认汇率")
-                    rate = 0.1385  # 使用默认汇率
-                
-                # 缓存当前月份汇率
-                with open(exchange_rate_file, 'w') as f:
-                    json.dump({
-                        'rate': rate,
-                        'timestamp': current_time,
-                        'year': year,
-                        'month': month
-                    }, f)
-                
-                logger.info(f"获取{year}年{month}月实时汇率成功: 1元人民币 = {rate:.4f}美元")
-                return round(rate, 4)  # 保留4位小数
-            
-            # 对于历史月份，尝试获取历史汇率（此处可以集成历史汇率API，如果有的话）
-            # 由于大多数免费API不提供历史汇率，这里使用估算值
-            # 可以根据实际情况调整或集成付费API
-            else:
-                # 假设每年有一个大致的汇率估算
-                estimated_rates = {
-                    2024: 0.1408,  # 约7.1人民币=1美元 (2024年估计值)
-                    2023: 0.1429,  # 约7.0人民币=1美元 (2023年估计值)
-                    2022: 0.1495,  # 约6.69人民币=1美元 (2022年估计值)
-                    2021: 0.1550,  # 约6.45人民币=1美元 (2021年估计值)
-                }
-                
-                # 获取年度估算汇率，如果没有则使用默认值
-                rate = estimated_rates.get(year, 0.1385)  # 默认约7.22人民币=1美元
-                
-                # 缓存历史月份汇率，避免重复计算
-                with open(exchange_rate_file, 'w') as f:
-                    json.dump({
-                        'rate': rate,
-                        'timestamp': current_time,
-                        'year': year,
-                        'month': month,
-                        'is_estimated': True
-                    }, f)
-                
-                logger.info(f"使用{year}年{month}月估算汇率: 1元人民币 = {rate:.4f}美元")
-                return round(rate, 4)  # 保留4位小数
-            
-        except Exception as e:
-            logger.warning(f"获取{year}年{month}月汇率失败: {str(e)}，使用默认汇率")
-            # 使用固定汇率: 1人民币 = 0.1385美元 (约7.22人民币=1美元)
-            return 0.1385
-    
-    def calculate_nat_fee(self, year=None, month=None):
+        position = bisect.bisect_right(self.starts, after)
+        return self.starts[position] if position < len(self.starts) else None
+
+    def clip(self, start, end):
         """
-        计算NAT费用 - 按实际使用天数统计
-        
+        计费区间与各单价区段的交集
+
         Args:
-            year (int, optional): 年份，默认为当前年份
-            month (int, optional): 月份，默认为当前月份
-        
+            start (datetime): 区间开始
+            end (datetime): 区间结束
+
         Returns:
-            float: NAT总费用（美元）
+            list: [(开始, 结束, 月单价), ...]
         """
-        try:
-            # 如果没有指定年月，使用当前设置的账单年月
-            if year is None:
-                year = self.billing_year
-            if month is None:
-                month = self.billing_month
-            
-            # 如果已经计算过NAT费用并且大于0，且是当前月份的计算，直接返回
-            current_year = datetime.datetime.now().year
-            current_month = datetime.datetime.now().month
-            is_current_month = (year == current_year and month == current_month)
-            
-            if is_current_month and self.nat_total_fee > 0:
-                logger.info(f"使用已计算的当前月份NAT费用: {self.nat_total_fee}")
-                return self.nat_total_fee
-                
-            # 获取使用NAT的VPS列表（只要设置了use_nat=True，不管状态如何）
-            nat_vps_list = [vps for vps in self.vps_data if vps.get('use_nat', False) is True]
-            has_nat_usage = len(nat_vps_list) > 0
-            
-            # 如果没有设置使用NAT的VPS，直接返回0
-            if not has_nat_usage:
-                logger.info(f"{year}年{month}月没有VPS设置为使用NAT，NAT费用为0")
-                if is_current_month:
-                    self.nat_total_fee = 0
-                return 0
-                
-            # 计算使用NAT的VPS的天数总和
-            total_nat_days = 0
-            logger.info(f"开始计算{year}年{month}月NAT费用，有{len(nat_vps_list)}台VPS设置使用NAT")
-            
-            active_nat_vps = 0
-            for vps in nat_vps_list:
-                # 计算该VPS在指定月份的使用时长
-                usage_result = self.calculate_usage_period(vps, year, month)
-                if isinstance(usage_result, tuple) and len(usage_result) == 4:
-                    usage_string, days, hours, minutes = usage_result
-                    
-                    # 将小时和分钟换算成天的小数部分
-                    # 如果超过12小时，按整天计算
-                    if hours > 12 or (hours == 12 and minutes > 0):
-                        days += 1
-                    
-                    # 只有使用时长大于0才累加
-                    if days > 0:
-                        total_nat_days += days
-                        active_nat_vps += 1
-                        logger.info(f"VPS {vps.get('name')} 在{year}年{month}月使用NAT {days}天")
-            
-            # 如果指定月份没有实际使用NAT的VPS，返回0
-            if active_nat_vps == 0 or total_nat_days == 0:
-                logger.info(f"{year}年{month}月没有VPS实际使用NAT，NAT费用为0")
-                if is_current_month:
-                    self.nat_total_fee = 0
-                return 0
-                
-            logger.info(f"{year}年{month}月NAT总使用天数: {total_nat_days}天")
-            
-            # 总流量费用（人民币）= 所有VPS的使用天数总和 × 每天1G × 每G1元
-            nat_fee_cny = total_nat_days * 1 * 1
-            logger.info(f"{year}年{month}月NAT费用(人民币): {nat_fee_cny}元")
-            
-            # 获取指定月份的人民币兑美元汇率并转换为美元，保留2位小数
-            try:
-                exchange_rate = self.get_exchange_rate(year, month)
-                nat_fee_usd = round(nat_fee_cny * exchange_rate, 2)
-                cny_per_usd = round(1 / exchange_rate, 2) if exchange_rate > 0 else 0
-                logger.info(f"{year}年{month}月NAT费用(美元): {nat_fee_usd}美元 (汇率: 1美元 = {cny_per_usd}人民币)")
-            except Exception as rate_error:
-                logger.error(f"获取汇率失败: {str(rate_error)}，使用默认汇率计算")
-                exchange_rate = 0.1385  # 使用默认汇率
-                nat_fee_usd = round(nat_fee_cny * exchange_rate, 2)
-                cny_per_usd = round(1 / exchange_rate, 2)
-                logger.info(f"{year}年{month}月NAT费用(美元): {nat_fee_usd}美元 (使用默认汇率: 1美元 = {cny_per_usd}人民币)")
-            
-            # 仅当计算当前月份时才保存计算结果到实例变量
-            if is_current_month:
-                self.nat_total_fee = nat_fee_usd
-                
-            return nat_fee_usd
-        except Exception as e:
-            logger.error(f"计算{year}年{month}月NAT费用失败: {str(e)}")
-            if year == self.billing_year and month == self.billing_month:
-                self.nat_total_fee = 0
-            return 0
-    
-    def calculate_total_bill(self, year=None, month=None):
+        pieces = []
+        position = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        while position < len(self.starts):
+            piece_start = start if not pieces else self.starts[position]
+            if piece_start >= end:
+                break
+            piece_end = end
+            if position + 1 < len(self.starts):
+                piece_end = min(end, self.starts[position + 1])
+            if piece_end > piece_start:
+                pieces.append((piece_start, piece_end, self.prices[position]))
+            position += 1
+        return pieces
+
+    def weight(self, start, end):
         """
-        计算总账单金额
-        
-        Args:
-            year (int, optional): 年份，默认为当前年份
-            month (int, optional): 月份，默认为当前月份
-            
         Returns:
-            float: 总账单金额
+            int: 区间内Σ(月单价（微分）× 时长（微秒）)，除以当月微秒数即为费用（微分）
         """
-        # 如果没有指定年月，使用当前设置的账单年月
-        if year is None:
-            year = self.billing_year
-        if month is None:
-            month = self.billing_month
-            
-        # 确保重新计算NAT费用
-        self.reset_nat_fee()
-        
-        # 计算所有VPS的费用总和
-        vps_total = sum(float(vps.get('total_price', 0)) for vps in self.vps_data)
-        vps_total = round(vps_total, 2)  # 确保VPS总费用精确到2位小数
-        
-        # 检查是否有设置为使用NAT的VPS，不管其状态如何
-        nat_vps_list = [vps for vps in self.vps_data if vps.get('use_nat', False) is True]
-        has_nat_vps = len(nat_vps_list) > 0
-        
-        # 获取NAT费用 - 只有当存在设置为使用NAT的VPS时才计算
-        nat_fee = 0
-        if has_nat_vps:
-            nat_fee = self.calculate_nat_fee(year, month)
-            nat_fee = round(nat_fee, 2)  # 确保NAT费用精确到2位小数
-        
-        # 保存NAT总费用（仅当计算当前月份时）
-        current_year = datetime.datetime.now().year
-        current_month = datetime.datetime.now().month
-        is_current_month = (year == current_year and month == current_month)
-        if is_current_month:
-            self.nat_total_fee = nat_fee
-        
-        # 计算总费用
-        total = vps_total + nat_fee
-        total = round(total, 2)  # 确保总费用精确到2位小数
-        
-        # 仅当计算当前月份时才更新总账单金额
-        if is_current_month:
-            self.total_bill = total
-        
-        logger.info(f"计算{year}年{month}月总账单金额: VPS总费用={vps_total:.2f}, NAT费用={nat_fee:.2f}, 总计={total:.2f}")
-        return total
-    
-    def to_dataframe(self, year=None, month=None):
+        microsecond = datetime.timedelta(microseconds=1)
+        return sum(to_micro_cents(price) * ((piece_end - piece_start) // microsecond)
+                   for piece_start, piece_end, price in self.clip(start, end))
+
+
+def _batch_div_round_half_up(a, b, denominator):
+    """
+    逐元素计算a × b / denominator并四舍五入到整数
+
+    先用float64批量计算；小数部分接近0.5、浮点误差可能影响取整的元素再用Python整数精确重算，
+    结果与_div_round_half_up逐个计算完全一致
+
+    Args:
+        a (ndarray): 整数数组
+        b (ndarray|int): 整数数组或整数
+        denominator (int): 除数
+
+    Returns:
+        ndarray: int64数组
+    """
+    a = np.asarray(a, dtype=np.int64)
+    b = np.broadcast_to(np.asarray(b, dtype=np.int64), a.shape)
+    quotient = a.astype(np.float64) * b.astype(np.float64) / float(denominator)
+    result = np.floor(quotient + 0.5).astype(np.int64)
+    for position in np.nonzero(np.abs(quotient - np.floor(quotient) - 0.5) < 1e-6)[0]:
+        result[position] = _div_round_half_up(int(a[position]) * int(b[position]), denominator)
+    return result
+
+
+class PricingTerms:
+    """一台VPS一个月的计费参数，由计费规则计算金额；同一规则的多台VPS可以一次批量计算"""
+
+    __slots__ = ('rule', 'price_micro_cents', 'elapsed_microseconds', 'month_microseconds', 'full_month')
+
+    def __init__(self, rule, price_micro_cents, elapsed_microseconds, month_microseconds, full_month):
+        self.rule = rule
+        self.price_micro_cents = price_micro_cents
+        self.elapsed_microseconds = elapsed_microseconds
+        self.month_microseconds = month_microseconds
+        self.full_month = full_month
+
+
+class ServerPricingRule(abc.ABC):
+    """
+    VPS费用规则：evaluate计算一台VPS，evaluate_batch对数组批量计算，两者结果必须一致
+
+    没有实现evaluate_batch的子类不能实例化，注册规则时即报错
+
+    参数均为整数：月单价（微分）、计费时长（微秒）、当月时长（微秒）和是否整月计费，结果为分
+    """
+
+    name = None
+    description = ''
+
+    def evaluate(self, price_micro_cents, elapsed_microseconds, month_microseconds, full_month):
+        return int(self.evaluate_batch(np.array([price_micro_cents]), np.array([elapsed_microseconds]),
+                                       month_microseconds, np.array([full_month]))[0])
+
+    @abc.abstractmethod
+    def evaluate_batch(self, prices, elapsed, month_microseconds, full_month):
         """
-        将VPS数据转换为DataFrame
-        
         Args:
-            year (int, optional): 指定年份，默认为当前设置的账单年份
-            month (int, optional): 指定月份，默认为当前设置的账单月份
-            
+            prices (ndarray): 月单价（微分）
+            elapsed (ndarray): 计费时长（微秒）
+            month_microseconds (int): 当月时长（微秒）
+            full_month (ndarray): 是否整月计费
+
         Returns:
-            DataFrame: VPS数据
+            ndarray: 费用（分）
         """
-        # 强制重置NAT费用计算
-        self.reset_nat_fee()
-        
-        # 使用指定年月或默认设置的年月
-        billing_year = year if year is not None else self.billing_year
-        billing_month = month if month is not None else self.billing_month
-        
-        logger.info(f"生成DataFrame账单数据 - 年份: {billing_year}, 月份: {billing_month}")
+
+
+class ProrateMinuteRule(ServerPricingRule):
+    """按当月实际时长比例计费，整月计费时收取月单价（默认规则）"""
+
+    name = 'prorate_minute'
+    description = '按当月实际天数按时长比例计费，使用满整月按月单价'
+
+    def _period(self, month_microseconds):
+        """按比例计费时的“一个月”时长（微秒）"""
+        return month_microseconds
+
+    def _billable(self, elapsed):
+        """实际计费的时长（微秒）"""
+        return elapsed
+
+    def evaluate(self, price_micro_cents, elapsed_microseconds, month_microseconds, full_month):
+        if full_month:
+            return _div_round_half_up(price_micro_cents, MICRO_CENTS_PER_CENT)
+        billable = int(self._billable(np.array([elapsed_microseconds]))[0])
+        return _div_round_half_up(price_micro_cents * billable,
+                                  self._period(month_microseconds) * MICRO_CENTS_PER_CENT)
+
+    def evaluate_batch(self, prices, elapsed, month_microseconds, full_month):
+        partial = _batch_div_round_half_up(prices, self._billable(np.asarray(elapsed, dtype=np.int64)),
+                                           self._period(month_microseconds) * MICRO_CENTS_PER_CENT)
+        full = _batch_div_round_half_up(prices, 1, MICRO_CENTS_PER_CENT)
+        return np.where(np.asarray(full_month, dtype=bool), full, partial)
+
+
+class Legacy30DayRule(ProrateMinuteRule):
+    """与calculate_price_legacy相同，按每月30天的比例计费"""
+
+    name = 'legacy_30day'
+    description = '按每月30天按时长比例计费，使用满整月按月单价'
+
+    def _period(self, month_microseconds):
+        return 30 * 24 * 60 * 60 * 1000000
+
+
+class MinimumChargeRule(ProrateMinuteRule):
+    """按比例计费，不足最低计费时长的按最低时长收费"""
+
+    name = 'minimum_charge'
+    description = '按当月实际天数按时长比例计费，最低按1天收费'
+
+    def __init__(self, minimum_hours=24):
+        self.minimum_microseconds = minimum_hours * 60 * 60 * 1000000
+
+    def _billable(self, elapsed):
+        return np.maximum(elapsed, self.minimum_microseconds)
+
+
+class HourlyCappedRule(ServerPricingRule):
+    """按小时计费（不足一小时按一小时），小时单价为月单价 / hours_per_month，当月费用不超过月单价"""
+
+    name = 'hourly_capped'
+    description = '按小时计费，小时单价为月单价/672，当月最多收取月单价'
+
+    def __init__(self, hours_per_month=672):
+        self.hours_per_month = hours_per_month
+
+    def evaluate_batch(self, prices, elapsed, month_microseconds, full_month):
+        prices = np.asarray(prices, dtype=np.int64)
+        hour = 60 * 60 * 1000000
+        hours = -(-np.asarray(elapsed, dtype=np.int64) // hour)
+        charged = _batch_div_round_half_up(prices, hours, self.hours_per_month * MICRO_CENTS_PER_CENT)
+        cap = _batch_div_round_half_up(prices, 1, MICRO_CENTS_PER_CENT)
+        return np.where(np.asarray(full_month, dtype=bool), cap, np.minimum(charged, cap))
+
+
+class NatPricingRule(abc.ABC):
+    """
+    NAT流量费用规则：按每台VPS当月的流量（G）计算人民币费用
+
+    没有实际流量数据时按使用天数 × gb_per_day估算流量；没有实现evaluate_traffic_batch的子类不能实例化
+    """
+
+    name = None
+    description = ''
+    gb_per_day = 1
+
+    def evaluate(self, days):
+        return float(self.evaluate_batch(np.array([days]))[0])
+
+    def evaluate_batch(self, days):
+        return self.evaluate_traffic_batch(np.asarray(days, dtype=np.float64) * self.gb_per_day)
+
+    @abc.abstractmethod
+    def evaluate_traffic_batch(self, gb):
+        """
+        Args:
+            gb (ndarray): 每台VPS当月的流量（G）
+
+        Returns:
+            ndarray: 每台VPS的费用（人民币）
+        """
+
+
+class DailyTrafficRule(NatPricingRule):
+    """按流量单价计费（默认规则：每天1G，每G 1元）"""
+
+    name = 'nat_daily'
+    description = '每天1G（有流量数据时按实际流量），每G ¥1'
+
+    def __init__(self, gb_per_day=1, cny_per_gb=1):
+        self.gb_per_day = gb_per_day
+        self.cny_per_gb = cny_per_gb
+
+    def evaluate_traffic_batch(self, gb):
+        return np.asarray(gb, dtype=np.float64) * self.cny_per_gb
+
+
+class TieredTrafficRule(NatPricingRule):
+    """每天固定流量，按每台VPS当月的总流量阶梯计费"""
+
+    name = 'nat_tiered'
+    description = '每天1G（有流量数据时按实际流量），当月前10G每G ¥1，10-20G每G ¥0.8，超过20G每G ¥0.6'
+
+    def __init__(self, gb_per_day=1, tiers=((10, 1.0), (20, 0.8), (None, 0.6))):
+        """
+        Args:
+            gb_per_day (float): 每天流量（G）
+            tiers (tuple): ((阶梯上限G或None, 每G单价), ...)，按上限升序
+        """
+        self.gb_per_day = gb_per_day
+        self.tiers = tiers
+
+    def evaluate_traffic_batch(self, gb):
+        traffic = np.asarray(gb, dtype=np.float64)
+        cost = np.zeros_like(traffic)
+        lower = 0
+        for upper, price in self.tiers:
+            upper_bound = np.inf if upper is None else upper
+            cost += np.clip(traffic - lower, 0, upper_bound - lower) * price
+            lower = upper_bound
+        return cost
+
+
+# 已注册的计费规则和规则组合，VPS的pricing_rule字段指定规则组合名称
+PRICING_RULES = {}
+PRICING_RULE_SETS = {}
+DEFAULT_PRICING_RULE_SET = 'default'
+
+
+def register_pricing_rule(rule):
+    """
+    注册计费规则（ServerPricingRule或NatPricingRule的实例）
+
+    Returns:
+        规则本身
+    """
+    PRICING_RULES[rule.name] = rule
+    return rule
+
+
+def register_pricing_rule_set(name, server_rule, nat_rule):
+    """
+    注册规则组合
+
+    Args:
+        name (str): 组合名称，VPS的pricing_rule字段使用
+        server_rule (str): VPS费用规则名称
+        nat_rule (str): NAT费用规则名称
+    """
+    if not isinstance(PRICING_RULES.get(server_rule), ServerPricingRule):
+        raise ValueError(f"未注册的VPS费用规则: {server_rule}")
+    if not isinstance(PRICING_RULES.get(nat_rule), NatPricingRule):
+        raise ValueError(f"未注册的NAT费用规则: {nat_rule}")
+    PRICING_RULE_SETS[name] = (PRICING_RULES[server_rule], PRICING_RULES[nat_rule])
+
+
+def get_pricing_rule_set(name):
+    """
+    Args:
+        name (str): 规则组合名称，为空时使用默认组合
+
+    Returns:
+        tuple: (ServerPricingRule, NatPricingRule)
+    """
+    rules = PRICING_RULE_SETS.get(name or DEFAULT_PRICING_RULE_SET)
+    if rules is None:
+        logger.warning(f"未知的计费规则组合: {name}，使用默认规则")
+        rules = PRICING_RULE_SETS[DEFAULT_PRICING_RULE_SET]
+    return rules
+
+
+def evaluate_pricing_terms(terms_list):
+    """
+    批量计算多台VPS的费用：按(规则, 当月时长)分组，每组调用一次evaluate_batch
+
+    Args:
+        terms_list (list): PricingTerms列表
+
+    Returns:
+        list: 与terms_list顺序一致的费用（分，int）
+    """
+    groups = {}
+    for position, terms in enumerate(terms_list):
+        groups.setdefault((terms.rule, terms.month_microseconds), []).append(position)
+    results = [0] * len(terms_list)
+    for (rule, month_microseconds), positions in groups.items():
+        charged = rule.evaluate_batch(
+            np.array([terms_list[position].price_micro_cents for position in positions], dtype=np.int64),
+            np.array([terms_list[position].elapsed_microseconds for position in positions], dtype=np.int64),
+            month_microseconds,
+            np.array([terms_list[position].full_month for position in positions], dtype=bool))
+        for position, cents in zip(positions, charged):
+            results[position] = int(cents)
+    return results
+
+
+def evaluate_pricing_pieces(pieces):
+    """
+    计算一台VPS一个月的费用
+
+    默认规则下多个单价区段先累加Σ(月单价 × 时长)再只取整一次，其他规则逐段计算后相加
+
+    Args:
+        pieces (tuple): 当月各单价区段的PricingTerms
+
+    Returns:
+        int: 费用（分），没有区段时为0
+    """
+    if len(pieces) == 1:
+        terms = pieces[0]
+        return terms.rule.evaluate(terms.price_micro_cents, terms.elapsed_microseconds,
+                                   terms.month_microseconds, terms.full_month)
+    if pieces and all(terms.rule is DEFAULT_SERVER_RULE and not terms.full_month for terms in pieces):
+        weight = sum(terms.price_micro_cents * terms.elapsed_microseconds for terms in pieces)
+        return _div_round_half_up(weight, pieces[0].month_microseconds * MICRO_CENTS_PER_CENT)
+    return sum(terms.rule.evaluate(terms.price_micro_cents, terms.elapsed_microseconds,
+                                   terms.month_microseconds, terms.full_month) for terms in pieces)
+
+
+for _rule in (ProrateMinuteRule(), Legacy30DayRule(), MinimumChargeRule(), HourlyCappedRule(),
+              DailyTrafficRule(), TieredTrafficRule()):
+    register_pricing_rule(_rule)
+register_pricing_rule_set('default', 'prorate_minute', 'nat_daily')
+register_pricing_rule_set('legacy', 'legacy_30day', 'nat_daily')
+register_pricing_rule_set('minimum', 'minimum_charge', 'nat_daily')
+register_pricing_rule_set('hourly', 'hourly_capped', 'nat_daily')
+register_pricing_rule_set('tiered_nat', 'prorate_minute', 'nat_tiered')
+DEFAULT_SERVER_RULE = PRICING_RULE_SETS[DEFAULT_PRICING_RULE_SET][0]
+DEFAULT_NAT_RULE = PRICING_RULE_SETS[DEFAULT_PRICING_RULE_SET][1]
+
+
+# 账单统一折算成的货币，VPS的currency字段为空时也按此货币计价
+BASE_CURRENCY = 'USD'
+# 支持的计价货币，CurrencyMatrix的列顺序
+SUPPORTED_CURRENCIES = ('USD', 'CNY', 'EUR')
+# 人民币以外的货币没有汇率来源时使用的默认汇率（1单位货币=多少美元），
+# 可在exchange_rates/currency_rates_{年}_{月}.json中按月覆盖
+DEFAULT_CURRENCY_RATES = {'EUR': 1.08}
+# 汇率换算精度：汇率取整到百万分之一后用整数计算
+CURRENCY_RATE_SCALE = 1000000
+
+
+def normalize_currency(currency):
+    """
+    Args:
+        currency (str): 货币代码，大小写均可，为空时为BASE_CURRENCY
+
+    Returns:
+        str: 大写的货币代码，不支持的货币按BASE_CURRENCY处理
+    """
+    code = str(currency or BASE_CURRENCY).strip().upper()
+    if code not in SUPPORTED_CURRENCIES:
+        logger.warning(f"不支持的货币: {currency}，按{BASE_CURRENCY}计价")
+        return BASE_CURRENCY
+    return code
+
+
+class CurrencyMatrix:
+    """
+    月份×货币的汇率矩阵（1单位货币=多少美元）
+
+    每次生成账单时按涉及的月份建立一次，之后成千上万条明细的换算都是数组下标查表和一次批量运算，
+    不再逐条调用get_exchange_rate；任意两种货币之间的汇率为两列之比
+    """
+
+    def __init__(self, months, rates):
+        """
+        Args:
+            months (list): [(年份, 月份), ...]
+            rates (list): 与months顺序一致的{货币: 1单位货币=多少美元}
+        """
+        self.months = {MonthlyAggregates.month_key(year, month): position
+                       for position, (year, month) in enumerate(months)}
+        self.currencies = {currency: position for position, currency in enumerate(SUPPORTED_CURRENCIES)}
+        self.usd_per_unit = np.array([[float(month_rates[currency]) for currency in SUPPORTED_CURRENCIES]
+                                      for month_rates in rates], dtype=np.float64).reshape(len(months), len(SUPPORTED_CURRENCIES))
+        self._scaled = np.rint(self.usd_per_unit * CURRENCY_RATE_SCALE).astype(np.int64)
+
+    def has_month(self, year, month):
+        return MonthlyAggregates.month_key(year, month) in self.months
+
+    def month_index(self, year, month):
+        return self.months[MonthlyAggregates.month_key(year, month)]
+
+    def currency_index(self, currency):
+        return self.currencies[normalize_currency(currency)]
+
+    def rate(self, currency, year, month):
+        """
+        Returns:
+            float: 指定月份1单位货币=多少美元
+        """
+        return float(self.usd_per_unit[self.month_index(year, month), self.currency_index(currency)])
+
+    def pair_table(self, year, month):
+        """
+        指定月份所有货币两两之间的汇率
+
+        Returns:
+            dict: {源货币: {目标货币: 1单位源货币=多少目标货币}}
+        """
+        row = self.usd_per_unit[self.month_index(year, month)]
+        table = row[:, None] / row[None, :]
+        return {source: {target: round(float(table[i, j]), 6) for j, target in enumerate(SUPPORTED_CURRENCIES)}
+                for i, source in enumerate(SUPPORTED_CURRENCIES)}
+
+    def to_base_cents(self, month_indexes, currency_indexes, cents):
+        """
+        批量把金额（分）折算成美元（分），四舍五入到分
+
+        Args:
+            month_indexes (array-like): 每条金额的月份下标
+            currency_indexes (array-like): 每条金额的货币下标
+            cents (array-like): 原币金额（分）
+
+        Returns:
+            ndarray: int64数组
+        """
+        scaled = self._scaled[np.asarray(month_indexes, dtype=np.int64), np.asarray(currency_indexes, dtype=np.int64)]
+        return _batch_div_round_half_up(cents, scaled, CURRENCY_RATE_SCALE)
+
+
+# 流量计费的1G
+BYTES_PER_GB = 1024 ** 3
+# 判断流量文件是否被改写时比较的文件开头长度
+TRAFFIC_HEAD_BYTES = 4096
+
+
+def _file_head_digest(path, length):
+    """文件开头length字节的sha1"""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(length)).hexdigest()
+
+
+def iter_traffic_records(path, offset=0):
+    """
+    逐行读取流量文件，不把整个文件读入内存
+
+    支持CSV（首行为表头）和JSONL，字段：name/server/vps为VPS名称，date/day/timestamp为日期（YYYY/MM/DD或YYYY-MM-DD开头），
+    bytes为字节数，没有bytes时取rx_bytes + tx_bytes。最后一行没有换行符时视为尚未写完，留到下次读取
+
+    Args:
+        path (str): 文件路径
+        offset (int): 从该字节偏移开始读取（上次读取结束的位置）
+
+    Yields:
+        tuple: (该行之后的偏移, VPS名称, 日期字符串YYYY/MM/DD, 字节数)，无法解析的行名称为None
+    """
+    is_csv = not path.lower().endswith(('.jsonl', '.ndjson', '.json'))
+    with open(path, 'rb') as f:
+        header = None
+        if is_csv:
+            header = [column.strip().lower() for column in f.readline().decode('utf-8-sig').strip().split(',')]
+            offset = max(offset, f.tell())
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            text = line.decode('utf-8', errors='replace').strip()
+            if not text:
+                continue
+            try:
+                if is_csv:
+                    values = text.split(',') if '"' not in text else next(csv.reader([text]))
+                    row = dict(zip(header, values))
+                else:
+                    row = json.loads(text)
+                name = row.get('name') or row.get('server') or row.get('vps')
+                date = row.get('date') or row.get('day') or row.get('timestamp')
+                if not name or not date:
+                    yield offset, None, None, 0
+                    continue
+                date = str(date)[:10].replace('-', '/')
+                if row.get('bytes') not in (None, ''):
+                    count = int(float(row['bytes']))
+                else:
+                    count = int(float(row.get('rx_bytes') or 0)) + int(float(row.get('tx_bytes') or 0))
+                yield offset, str(name), date, count
+            except (ValueError, TypeError, AttributeError):
+                yield offset, None, None, 0
+
+
+class TrafficStore:
+    """
+    NAT流量的本地存储：每个流量文件每个月一个(VPS行, 当月天数)的int64字节数组（.npy），
+    清单记录每个文件已读取的偏移、大小和文件开头的摘要
+
+    再次导入同一文件时：没有变化则跳过；只在末尾追加了数据则从上次的偏移继续读取；
+    被改写（开头变化或变短）则丢弃该文件原有的数组重新读取。某月的流量为所有文件数组之和
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.manifest = None
+
+    def load(self):
+        if self.manifest is None:
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    self.manifest = json.load(f)
+            except FileNotFoundError:
+                self.manifest = {'servers': [], 'files': {}}
+        return self.manifest
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(temp_path, self.manifest_path)
+
+    def _array_path(self, file_id, month_key):
+        return os.path.join(self.directory, f"{file_id}_{month_key}.npy")
+
+    def _load_array(self, file_id, month_key, rows, days):
+        """读取文件在某月的数组，行数不足时补零"""
+        try:
+            array = np.load(self._array_path(file_id, month_key))
+        except FileNotFoundError:
+            array = np.zeros((0, days), dtype=np.int64)
+        if array.shape[0] < rows:
+            array = np.vstack([array, np.zeros((rows - array.shape[0], days), dtype=np.int64)])
+        return array
+
+    def ingest(self, path):
+        """
+        导入一个流量文件
+
+        Args:
+            path (str): 文件路径
+
+        Returns:
+            dict: 导入方式（skipped/incremental/full）、读取行数、无效行数和字节数
+        """
+        manifest = self.load()
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = manifest['files'].get(path)
+        mode = 'full'
+        if entry is not None:
+            head_length = min(entry['head_length'], stat.st_size)
+            unchanged_head = (head_length == entry['head_length']
+                              and _file_head_digest(path, head_length) == entry['head'])
+            if unchanged_head and stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+                return {'file': path, 'mode': 'skipped', 'lines': 0, 'invalid_lines': 0, 'bytes': 0}
+            if unchanged_head and stat.st_size >= entry['offset']:
+                mode = 'incremental'
+            else:
+                for month_key in entry['months']:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(self._array_path(entry['id'], month_key))
+        if mode == 'full':
+            entry = {'id': hashlib.sha1(path.encode('utf-8')).hexdigest()[:16], 'offset': 0, 'months': [], 'lines': 0}
         
-        columns = ["VPS名称", "国家/地区", "使用状态", "销毁时间", "统计截止时间", "使用时长", "月单价", "总金额"]
-        data = []
+        # 先在字典中按(VPS, 日期)累加，最后一次写入各月数组
+        rows = {name: row for row, name in enumerate(manifest['servers'])}
+        totals = collections.Counter()
+        lines = invalid = 0
+        offset = entry['offset']
+        for offset, name, date, count in iter_traffic_records(path, entry['offset']):
+            lines += 1
+            if name is None:
+                invalid += 1
+                continue
+            totals[(name, date)] += count
         
-        # 确保使用当前实时时间计算
-        current_time = datetime.datetime.now()
+        deltas = {}
+        for (name, date), count in totals.items():
+            try:
+                day = datetime.datetime.strptime(date, "%Y/%m/%d")
+            except ValueError:
+                invalid += 1
+                continue
+            if name not in rows:
+                rows[name] = len(manifest['servers'])
+                manifest['servers'].append(name)
+            deltas.setdefault(MonthlyAggregates.month_key(day.year, day.month), []).append((rows[name], day.day - 1, count))
         
-        # 计算当前月份的结束日期
-        next_month_year = billing_year
-        next_month = billing_month + 1
-        if next_month > 12:
-            next_month = 1
-            next_month_year += 1
-        month_end = datetime.datetime(next_month_year, next_month, 1) - datetime.timedelta(days=1)
+        os.makedirs(self.directory, exist_ok=True)
+        for month_key, cells in deltas.items():
+            year, month = (int(part) for part in month_key.split('-'))
+            array = self._load_array(entry['id'], month_key, len(manifest['servers']), MONTH_CALENDAR.get(year, month).days)
+            cells = np.array(cells, dtype=np.int64)
+            np.add.at(array, (cells[:, 0], cells[:, 1]), cells[:, 2])
+            np.save(self._array_path(entry['id'], month_key), array)
+            if month_key not in entry['months']:
+                entry['months'].append(month_key)
         
-        # 设置月份名称
-        month_names = {
-            1: "一月", 2: "二月", 3: "三月", 4: "四月",
-            5: "五月", 6: "六月", 7: "七月", 8: "八月",
-            9: "九月", 10: "十月", 11: "十一月", 12: "十二月"
+        head_length = min(TRAFFIC_HEAD_BYTES, stat.st_size)
+        entry.update({
+            'offset': offset,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'head_length': head_length,
+            'head': _file_head_digest(path, head_length),
+            'lines': entry['lines'] + lines
+        })
+        manifest['files'][path] = entry
+        self._save()
+        return {'file': path, 'mode': mode, 'lines': lines, 'invalid_lines': invalid,
+                'bytes': int(sum(totals.values()))}
+
+    def month_bytes(self, year, month):
+        """
+        Returns:
+            dict: {VPS名称: 当月字节数}，只包含有流量记录的VPS
+        """
+        manifest = self.load()
+        month_key = MonthlyAggregates.month_key(year, month)
+        total = None
+        for entry in manifest['files'].values():
+            if month_key in entry['months']:
+                array = self._load_array(entry['id'], month_key, len(manifest['servers']), MONTH_CALENDAR.get(year, month).days)
+                total = array.sum(axis=1) if total is None else total + array.sum(axis=1)
+        if total is None:
+            return {}
+        return {manifest['servers'][row]: int(count) for row, count in enumerate(total) if count > 0}
+
+
+# VPS筛选条件支持的字段，见BillingManager._vps_filter
+VPS_FILTER_FIELDS = ('country', 'status', 'use_nat', 'name_prefix',
+                     'purchase_from', 'purchase_to', 'cancel_from', 'cancel_to')
+# 批量导入VPS时每批校验、规范化的记录数
+VPS_IMPORT_CHUNK_SIZE = 5000
+# 批量导入结果中最多列出的错误数
+VPS_IMPORT_MAX_ERRORS = 100
+# 导入文件的表头：账单导出中使用的中文列名对应的字段
+VPS_IMPORT_COLUMN_ALIASES = {
+    'VPS名称': 'name', 'IP地址': 'ip_address', '国家/地区': 'country', '月单价': 'price_per_month',
+    '单价/月（$）': 'price_per_month', '购买日期': 'purchase_date', '启用日期': 'start_date',
+    '销毁时间': 'cancel_date', '使用状态': 'status', '是否使用NAT': 'use_nat', '币种': 'currency'
+}
+
+
+def iter_vps_import_rows(path):
+    """
+    逐行读取VPS导入文件，不把整个文件读入内存
+
+    支持CSV（首行为表头）、JSONL（每行一个对象）和Excel（.xlsx，第一个工作表，首行为表头，只读模式逐行读取）；
+    表头可以是字段名，也可以是账单导出中的中文列名（见VPS_IMPORT_COLUMN_ALIASES）
+
+    Args:
+        path (str): 文件路径
+
+    Yields:
+        tuple: (行号, {字段: 值})，无法解析的行为(行号, None)
+    """
+    lower = path.lower()
+    if lower.endswith(('.jsonl', '.ndjson')):
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_number, row if isinstance(row, dict) else None
+    elif lower.endswith(('.xlsx', '.xlsm')):
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [VPS_IMPORT_COLUMN_ALIASES.get(str(cell).strip(), str(cell).strip()) if cell is not None else None
+                      for cell in next(rows, ())]
+            for line_number, values in enumerate(rows, 2):
+                if all(value is None or value == '' for value in values):
+                    continue
+                yield line_number, {column: value for column, value in zip(header, values) if column}
+        finally:
+            workbook.close()
+    else:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            header = [VPS_IMPORT_COLUMN_ALIASES.get(column.strip(), column.strip()) for column in next(reader, [])]
+            for values in reader:
+                if not any(value.strip() for value in values):
+                    continue
+                yield reader.line_num, {column: value for column, value in zip(header, values) if column}
+
+
+# 费用计时器缓存中datetime的格式
+TICKER_TIME_FORMAT = "%Y/%m/%d %H:%M:%S.%f"
+
+
+class CostTicker:
+    """
+    当月累计费用计时器
+
+    在检查点时间完整计算一次当月账单：费用不再变化的VPS合计为基数，仍在计费的VPS汇总月单价合计Σp
+    和Σ(p × 开始计费时间)。同一个月内所有VPS的费率分母相同（当月总时长T），因此任意时刻t的费用为
+    基数 + (Σp × t - Σ(p × 开始时间)) / T，查询时不需要遍历VPS，只在最后取整一次。
+    账单逐行取整到分，两者相差不超过每台计费中的VPS半分。
+    到valid_until时（有VPS开始计费或月份结束）需要重新建立
+    """
+
+    __slots__ = ('key', 'year', 'month', 'checkpoint', 'valid_until', 'base_cents', 'nat_fee_cents',
+                 'nat_price_micro_cents', 'other_price_micro_cents', 'start_weight', 'active_servers',
+                 'active_nat_servers')
+
+    def __init__(self, key, year, month, checkpoint, valid_until, base_cents, nat_fee_cents,
+                 nat_price_micro_cents, other_price_micro_cents, start_weight, active_servers,
+                 active_nat_servers):
+        """
+        Args:
+            key (str): 建立时的数据标识，数据变化后失效
+            year (int): 年份
+            month (int): 月份
+            checkpoint (datetime): 检查点时间
+            valid_until (datetime): 有效期截止时间
+            base_cents (int): 费用不再变化的VPS的合计（分）
+            nat_fee_cents (int): 当月NAT费用（分），按整月预估，不随时间变化
+            nat_price_micro_cents (int): 正在计费的使用NAT的VPS月单价合计（微分）
+            other_price_micro_cents (int): 正在计费的其他VPS月单价合计（微分）
+            start_weight (int): 正在计费的VPS的Σ(月单价微分 × 开始计费时间距月初的微秒数)
+            active_servers (int): 正在计费的VPS数
+            active_nat_servers (int): 其中使用NAT的VPS数
+        """
+        self.key = key
+        self.year = year
+        self.month = month
+        self.checkpoint = checkpoint
+        self.valid_until = valid_until
+        self.base_cents = base_cents
+        self.nat_fee_cents = nat_fee_cents
+        self.nat_price_micro_cents = nat_price_micro_cents
+        self.other_price_micro_cents = other_price_micro_cents
+        self.start_weight = start_weight
+        self.active_servers = active_servers
+        self.active_nat_servers = active_nat_servers
+
+    def covers(self, when):
+        """
+        Returns:
+            bool: 指定时间是否可以直接用本计时器计算
+        """
+        return self.checkpoint <= when < self.valid_until
+
+    def value_at(self, when):
+        """
+        计算指定时间的当月累计费用
+
+        Args:
+            when (datetime): 查询时间，应在covers()范围内
+
+        Returns:
+            dict: 费用明细
+        """
+        month_info = MONTH_CALENDAR.get(self.year, self.month)
+        since_month_start = (when - month_info.start) // datetime.timedelta(microseconds=1)
+        accrued = (self.nat_price_micro_cents + self.other_price_micro_cents) * since_month_start - self.start_weight
+        vps_cents = self.base_cents + _div_round_half_up(accrued, month_info.minutes * 60 * 1000000 * MICRO_CENTS_PER_CENT)
+        per_minute = MICRO_CENTS_PER_DOLLAR * month_info.minutes
+        return {
+            'year': self.year,
+            'month': self.month,
+            'as_of': when.strftime("%Y/%m/%d %H:%M:%S"),
+            'checkpoint': self.checkpoint.strftime("%Y/%m/%d %H:%M:%S"),
+            'valid_until': self.valid_until.strftime("%Y/%m/%d %H:%M:%S"),
+            'vps_cost': cents_to_amount(vps_cents),
+            'nat_fee': cents_to_amount(self.nat_fee_cents),
+            'total': cents_to_amount(vps_cents + self.nat_fee_cents),
+            'rate_per_minute': {
+                'nat_servers': self.nat_price_micro_cents / per_minute,
+                'other_servers': self.other_price_micro_cents / per_minute,
+                'total': (self.nat_price_micro_cents + self.other_price_micro_cents) / per_minute
+            },
+            'active_servers': self.active_servers,
+            'active_nat_servers': self.active_nat_servers
         }
-        month_name = month_names.get(billing_month, str(billing_month) + "月")
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: 可写入JSON缓存文件的数据
+        """
+        data = {field: getattr(self, field) for field in self.__slots__}
+        data['checkpoint'] = self.checkpoint.strftime(TICKER_TIME_FORMAT)
+        data['valid_until'] = self.valid_until.strftime(TICKER_TIME_FORMAT)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        从JSON缓存文件的数据恢复
+
+        Args:
+            data (dict): to_dict()的结果
+
+        Returns:
+            CostTicker: 计时器
+        """
+        data = dict(data)
+        data['checkpoint'] = datetime.datetime.strptime(data['checkpoint'], TICKER_TIME_FORMAT)
+        data['valid_until'] = datetime.datetime.strptime(data['valid_until'], TICKER_TIME_FORMAT)
+        return cls(**{field: data[field] for field in cls.__slots__})
+
+
+# 影响账单计算的VPS字段，用于判断物化汇总是否过期
+BILLING_FINGERPRINT_FIELDS = ('name', 'country', 'status', 'use_nat', 'price_per_month', 'price_history', 'pricing_rule',
+                              'currency', 'purchase_date', 'start_date', 'cancel_date', 'expire_date')
+# 物化汇总的分组字段
+AGGREGATE_GROUP_FIELDS = ('country', 'status', 'use_nat')
+
+
+class MonthlyAggregates:
+    """
+    按月物化的账单汇总：每月按(国家/地区, 当月显示状态, 是否使用NAT)分组的VPS数、使用分钟数和费用（分）
+
+    计算月账单时顺便更新，保存在配置文件旁的JSON文件中；跨月份的分组统计只读取这里的分组行，
+    不需要重新计算每台VPS。每个月份记录计算时的数据指纹，VPS数据变化后该月份失效；
+    尚未结束的月份（closed为False）查询时总是重新计算
+    """
+
+    def __init__(self):
+        self.months = {}  # {'2025-03': {'fingerprint', 'as_of', 'closed', 'groups'}}
+        self.dirty = False
+        self._lock = threading.Lock()  # 并行计算多个月份时可能同时更新
+
+    @staticmethod
+    def month_key(year, month):
+        return f"{year}-{month:02d}"
+
+    def record(self, year, month, fingerprint, as_of, lines):
+        """
+        用一个月的账单明细更新该月的汇总
+
+        Args:
+            year (int): 年份
+            month (int): 月份
+            fingerprint (str): VPS数据指纹
+            as_of (datetime): 计算截止时间
+            lines (list): compute_month_lines的结果
+
+        Returns:
+            dict: 该月的汇总
+        """
+        groups = {}
+        for line in lines:
+            vps = line['vps']
+            key = (vps.get('country', '') or '', line['display_status'], vps.get('use_nat', False) is True)
+            group = groups.setdefault(key, [0, 0, 0])
+            group[0] += 1
+            group[1] += line['days'] * 24 * 60 + line['hours'] * 60 + line['minutes']
+            group[2] += line['price_cents']
+        entry = {
+            'fingerprint': fingerprint,
+            'as_of': as_of.strftime("%Y/%m/%d %H:%M:%S"),
+            'closed': as_of >= MONTH_CALENDAR.get(year, month).next_start,
+            'groups': [list(key) + values for key, values in groups.items()]
+        }
+        with self._lock:
+            self.months[self.month_key(year, month)] = entry
+            self.dirty = True
+        return entry
+
+    def get(self, year, month, fingerprint):
+        """
+        Returns:
+            dict: 该月仍然有效的已结束月份汇总，不存在、已过期或月份未结束时返回None
+        """
+        entry = self.months.get(self.month_key(year, month))
+        if entry and entry['fingerprint'] == fingerprint and entry['closed']:
+            return entry
+        return None
+
+    @staticmethod
+    def query(month_entries, group_by):
+        """
+        按指定字段汇总多个月份的分组行
+
+        只汇总传入的月份汇总，由调用方通过get()或刚刚record()的结果确认汇总仍然有效，
+        不会读到数据变化前留下的旧汇总
+
+        Args:
+            month_entries (list): [(年份, 月份, 该月的汇总), ...]
+            group_by (list): 分组字段，可选year、month、country、status、use_nat
+
+        Returns:
+            list: 每个分组的字段值、count、usage_minutes、cost
+        """
+        totals = {}
+        for year, month, entry in month_entries:
+            for country, status, use_nat, count, minutes, cents in entry['groups']:
+                values = {'year': year, 'month': month, 'country': country, 'status': status, 'use_nat': use_nat}
+                key = tuple(values[field] for field in group_by)
+                total = totals.setdefault(key, [0, 0, 0])
+                total[0] += count
+                total[1] += minutes
+                total[2] += cents
+        rows = []
+        for key in sorted(totals, key=lambda k: tuple(str(v) for v in k)):
+            count, minutes, cents = totals[key]
+            row = dict(zip(group_by, key))
+            row.update({'count': count, 'usage_minutes': minutes, 'cost': cents_to_amount(cents)})
+            rows.append(row)
+        return rows
+
+    def to_dict(self):
+        with self._lock:
+            return {'months': dict(self.months)}
+
+    def load(self, data):
+        with self._lock:
+            self.months = dict(data.get('months', {}))
+            self.dirty = False
+
+
+def epoch_minute(when):
+    """
+    Args:
+        when (datetime): 时间
+
+    Returns:
+        int: 距1970-01-01的分钟数（向下取整）
+    """
+    return (when - _EPOCH) // datetime.timedelta(minutes=1)
+
+
+class OccupancyTimeline:
+    """
+    VPS在线数量的阶梯函数
+
+    把每台VPS的[开始, 结束)区间拆成+1/-1事件排序后扫描一次，得到断点times和每段的在线数counts，
+    再预先计算在线数对时间的前缀积分和区间最大值的稀疏表：
+    时间点查询、区间平均值、服务器·天数和峰值都只需要二分查找，O(log n)
+    """
+
+    def __init__(self, intervals):
+        """
+        Args:
+            intervals (iterable): [(开始分钟, 结束分钟或None), ...]，None表示仍在运行
+        """
+        deltas = {}
+        for start, end in intervals:
+            if end is not None and end <= start:
+                continue
+            deltas[start] = deltas.get(start, 0) + 1
+            if end is not None:
+                deltas[end] = deltas.get(end, 0) - 1
         
-        # 遍历VPS数据，计算对应月份的使用时长和费用
-        for vps in self.vps_data:
-            # 重新计算指定月份的使用时长
-            usage_result = self.calculate_usage_period(vps, billing_year, billing_month)
-            if isinstance(usage_result, tuple) and len(usage_result) == 4:
-                usage_string, days, hours, minutes = usage_result
-                
-                # 只有使用时长大于0的才添加到账单
-                if days > 0 or hours > 0 or minutes > 0:
-                    # 实时计算价格 - 使用更精确的计算方法
-                    price_per_month = vps.get('price_per_month', 0)
-                    total_price = self.calculate_price_with_purchase_date(vps, billing_year, billing_month)
-                    total_price = round(total_price, 2)  # 确保总价精确到2位小数
-                    
-                    # 准备行数据
-                    row = [
-                        vps.get('name', ''),
-                        vps.get('country', ''),
-                        vps.get('status', ''),
-                        vps.get('cancel_date', '') if vps.get('status') == "销毁" else '',
-                        f"{billing_year}年{month_name}",
-                        usage_string,
-                        vps.get('price_per_month', 0),
-                        total_price
-                    ]
-                    data.append(row)
-        
-        df = pd.DataFrame(data, columns=columns)
-        
-        # 获取所有设置为使用NAT的VPS（use_nat属性为True，不管状态如何）
-        nat_vps_list = [vps for vps in self.vps_data if vps.get('use_nat', False) is True]
+        self.times = []
+        self.counts = []
+        running = 0
+        for minute in sorted(deltas):
+            if deltas[minute] == 0:
+                continue
+            running += deltas[minute]
+            self.times.append(minute)
+            self.counts.append(running)
         
-        # 只有存在设置为使用NAT的VPS时才计算NAT费用
-        nat_fee = 0
-        if nat_vps_list:
-            # 使用指定年月计算NAT费用
-            nat_fee = self.calculate_nat_fee(billing_year, billing_month)
-            logger.info(f"在to_dataframe中计算的{billing_year}年{billing_month}月NAT费用: {nat_fee}")
+        # prefix[i]：从第一个断点到times[i]的在线数积分（服务器·分钟）
+        self.prefix = [0] * len(self.times)
+        for i in range(1, len(self.times)):
+            self.prefix[i] = self.prefix[i - 1] + self.counts[i - 1] * (self.times[i] - self.times[i - 1])
         
-        # 添加NAT总费用行（仅当NAT费用大于0时）
-        if nat_fee > 0:
-            # 获取指定年月的实时汇率
-            exchange_rate = self.get_exchange_rate(billing_year, billing_month)
-            exchange_rate_display = round(1 / exchange_rate, 2) if exchange_rate > 0 else 0  # 显示为美元兑人民币汇率，更直观
+        # 稀疏表：sparse[k][i] = max(counts[i : i + 2^k])
+        self.sparse = [self.counts]
+        width = 1
+        while width * 2 <= len(self.counts):
+            previous = self.sparse[-1]
+            self.sparse.append([max(previous[i], previous[i + width])
+                                for i in range(len(self.counts) - width * 2 + 1)])
+            width *= 2
+
+    def _segment(self, minute):
+        """返回包含minute的段下标，早于第一个断点时返回-1"""
+        return bisect.bisect_right(self.times, minute) - 1
+
+    def count_at(self, minute):
+        """
+        Args:
+            minute (int): 时间（分钟）
+
+        Returns:
+            int: 该时刻在线的VPS数
+        """
+        index = self._segment(minute)
+        return self.counts[index] if index >= 0 else 0
+
+    def integral(self, minute):
+        """
+        Returns:
+            int: 从最早的事件到minute的服务器·分钟数
+        """
+        index = self._segment(minute)
+        if index < 0:
+            return 0
+        return self.prefix[index] + self.counts[index] * (minute - self.times[index])
+
+    def _range_max(self, first, last):
+        """counts[first..last]的最大值（包含两端）"""
+        level = (last - first + 1).bit_length() - 1
+        return max(self.sparse[level][first], self.sparse[level][last - (1 << level) + 1])
+
+    def peak(self, start, end):
+        """
+        Args:
+            start (int): 开始时间（分钟，包含）
+            end (int): 结束时间（分钟，不包含）
+
+        Returns:
+            int: 区间内的最大在线数
+        """
+        if end <= start:
+            return 0
+        first = self._segment(start)
+        last = self._segment(end - 1)
+        if last < 0:
+            return 0
+        peak = self.counts[first] if first >= 0 else 0
+        if last > first:
+            peak = max(peak, self._range_max(first + 1, last))
+        return peak
+
+    def summarize(self, start, end):
+        """
+        Args:
+            start (int): 开始时间（分钟，包含）
+            end (int): 结束时间（分钟，不包含）
+
+        Returns:
+            dict: 区间内的峰值、平均在线数和服务器·天数
+        """
+        server_minutes = self.integral(end) - self.integral(start) if end > start else 0
+        return {
+            'peak': self.peak(start, end),
+            'average': round(server_minutes / (end - start), 4) if end > start else 0,
+            'server_days': round(server_minutes / (24 * 60), 4)
+        }
+
+
+class DailyCostIndex:
+    """
+    按天的累计费用索引
+
+    每台VPS的计费区间按月份拆开（每月的分钟费率 = 月单价 / 当月分钟数），整天部分写入差分数组，
+    首尾不满一天的部分直接写入当天，汇总成每个国家/地区每天的费用（分），再对时间做前缀和。
+    任意日期区间的费用为两个前缀和相减，O(1)；VPS增删改时只需加减这台VPS的贡献
+    """
+
+    def __init__(self, first_day, last_day, currency_rate=None):
+        """
+        Args:
+            first_day (date): 索引的第一天
+            last_day (date): 索引的最后一天（包含）
+            currency_rate (callable, optional): currency_rate(货币, 年, 月)返回1单位货币=多少美元，
+                有非美元计价的VPS时必须提供
+        """
+        self.first_day = first_day
+        self.currency_rate = currency_rate
+        self.last_day = last_day
+        self.days = (last_day - first_day).days + 1
+        self.base_minute = epoch_minute(datetime.datetime.combine(first_day, datetime.time()))
+        self.end_minute = self.base_minute + self.days * 24 * 60
+        self.countries = {}  # 国家/地区 -> 行号
+        self._full = np.zeros((0, self.days + 1))  # 整天费用的差分数组
+        self._partial = np.zeros((0, self.days))  # 不满一天的费用
+        self._prefix = None
+
+    def _row(self, country):
+        """获取国家/地区对应的行号，新的国家/地区追加一行"""
+        row = self.countries.get(country)
+        if row is None:
+            row = len(self.countries)
+            self.countries[country] = row
+            self._full = np.vstack([self._full, np.zeros((1, self.days + 1))])
+            self._partial = np.vstack([self._partial, np.zeros((1, self.days))])
+        return row
+
+    def apply(self, country, price_cents, start_minute, end_minute, currency=BASE_CURRENCY, sign=1):
+        """
+        加上（sign=1）或减去（sign=-1）一台VPS的费用
+
+        Args:
+            country (str): 国家/地区
+            price_cents (float): 月单价（分）
+            start_minute (int): 计费开始时间（分钟）
+            end_minute (int): 计费结束时间（分钟，不包含），None表示仍在运行
+            currency (str): 月单价的货币，非美元时按每月汇率折算
+            sign (int): 1为加上，-1为减去
+        """
+        start_minute = max(start_minute, self.base_minute)
+        end_minute = self.end_minute if end_minute is None else min(end_minute, self.end_minute)
+        if end_minute <= start_minute or not price_cents:
+            return
+        row = self._row(country)
+        full = self._full[row]
+        partial = self._partial[row]
+        minute = start_minute
+        while minute < end_minute:
+            # 每个月费率不同，逐月处理
+            when = _EPOCH + datetime.timedelta(minutes=minute)
+            month_info = MONTH_CALENDAR.get(when.year, when.month)
+            segment_end = min(end_minute, month_info.end_minute)
+            rate = sign * price_cents / month_info.minutes
+            if currency != BASE_CURRENCY:
+                rate *= self.currency_rate(currency, month_info.year, month_info.month)
+            first = (minute - self.base_minute) // 1440
+            last = (segment_end - 1 - self.base_minute) // 1440
+            if first == last:
+                partial[first] += rate * (segment_end - minute)
+            else:
+                partial[first] += rate * (self.base_minute + (first + 1) * 1440 - minute)
+                partial[last] += rate * (segment_end - (self.base_minute + last * 1440))
+                if last > first + 1:
+                    full[first + 1] += rate * 1440
+                    full[last] -= rate * 1440
+            minute = segment_end
+        self._prefix = None
+
+    def _prefix_sums(self):
+        """每行每天费用的前缀和，prefix[:, d]为前d天的合计"""
+        if self._prefix is None:
+            daily = np.cumsum(self._full, axis=1)[:, :self.days] + self._partial
+            self._prefix = np.concatenate([np.zeros((daily.shape[0], 1)), np.cumsum(daily, axis=1)], axis=1)
+        return self._prefix
+
+    def cost_cents(self, first_day, last_day, country=None):
+        """
+        查询日期区间的费用
+
+        Args:
+            first_day (date): 开始日期（包含）
+            last_day (date): 结束日期（包含）
+            country (str, optional): 国家/地区，不指定时为全部VPS
+
+        Returns:
+            float: 费用（分）
+        """
+        first = max((first_day - self.first_day).days, 0)
+        last = min((last_day - self.first_day).days + 1, self.days)
+        if last <= first:
+            return 0.0
+        prefix = self._prefix_sums()
+        if country is None:
+            return float(prefix[:, last].sum() - prefix[:, first].sum())
+        row = self.countries.get(country)
+        if row is None:
+            return 0.0
+        return float(prefix[row, last] - prefix[row, first])
+
+
+# 按天位图的第0位对应的日期
+DAY_BITMAP_EPOCH = datetime.date(CALENDAR_MIN_YEAR, 1, 1)
+
+
+def day_number(day):
+    """
+    Args:
+        day (date|datetime): 日期
+
+    Returns:
+        int: 距DAY_BITMAP_EPOCH的天数
+    """
+    if isinstance(day, datetime.datetime):
+        day = day.date()
+    return (day - DAY_BITMAP_EPOCH).days
+
+
+class DayBitmap:
+    """
+    一台VPS每天是否在用的位图：第d位为1表示DAY_BITMAP_EPOCH之后第d天使用超过12小时
+
+    bits是Python整数位集；仍在运行的VPS从open_from开始之后的每一天都算在用，不需要展开成无限长的位
+    """
+
+    __slots__ = ('bits', 'open_from')
+
+    def __init__(self, bits=0, open_from=None):
+        self.bits = bits
+        self.open_from = open_from
+
+    def count(self, first, last):
+        """
+        统计区间内在用的天数
+
+        Args:
+            first (int): 开始天号（包含）
+            last (int): 结束天号（包含）
+
+        Returns:
+            int: 天数
+        """
+        if last < first:
+            return 0
+        total = ((self.bits >> first) & ((1 << (last - first + 1)) - 1)).bit_count()
+        if self.open_from is not None and self.open_from <= last:
+            total += last - max(first, self.open_from) + 1
+        return total
+
+    def to_dict(self):
+        # 只保存最低位开始的部分，多年的历史也只有几十个十六进制字符
+        offset = (self.bits & -self.bits).bit_length() - 1 if self.bits else 0
+        return {'offset': offset, 'bits': format(self.bits >> offset, 'x'), 'open_from': self.open_from}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(int(data['bits'], 16) << data['offset'], data.get('open_from'))
+
+
+class NatDayBitmaps:
+    """
+    按VPS生命周期（购买、启用、销毁日期和状态）缓存的按天位图
+
+    同样生命周期的VPS共用一个位图；生命周期字段没有变化的VPS不需要重新计算，
+    任意月份或日期区间的NAT天数就是NAT VPS位图在区间内的位计数之和
+    """
+
+    def __init__(self):
+        self.bitmaps = {}  # {生命周期键: DayBitmap}
+        self.dirty = False
+
+    def to_dict(self):
+        return {'bitmaps': {key: bitmap.to_dict() for key, bitmap in self.bitmaps.items()}}
+
+    def load(self, data):
+        self.bitmaps = {key: DayBitmap.from_dict(value) for key, value in data.get('bitmaps', {}).items()}
+        self.dirty = False
+
+
+def ledger_checksum(body):
+    """
+    Args:
+        body (dict): 不含checksum字段的账本条目
+
+    Returns:
+        str: 条目规范化JSON的sha256
+    """
+    payload = json.dumps(body, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MonthLedger:
+    """
+    月结账本：已结账月份的账单冻结后追加写入JSONL文件，不修改已有的行
+
+    每行一个条目（close结账或reopen重新打开），带有本条内容的sha256和上一条的checksum，
+    加载时逐行校验，被改动的条目及其后续条目不再使用。同一月份以最后一条为准
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.closed = {}  # {'2025-03': 结账条目}
+        self.last_checksum = None
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """读取并校验账本文件，只读取一次"""
+        with self._lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line_number, line in enumerate(f, 1):
+                        if not line.strip():
+                            continue
+                        entry = json.loads(line)
+                        checksum = entry.pop('checksum', None)
+                        if checksum != ledger_checksum(entry) or entry.get('prev') != self.last_checksum:
+                            logger.error(f"月结账本第{line_number}行校验失败，忽略该行及之后的条目: {self.path}")
+                            break
+                        entry['checksum'] = checksum
+                        self.last_checksum = checksum
+                        if entry.get('action') == 'close':
+                            self.closed[entry['month']] = entry
+                        else:
+                            self.closed.pop(entry['month'], None)
+            except FileNotFoundError:
+                pass
+
+    def get(self, year, month):
+        """
+        Returns:
+            dict: 该月的结账条目，未结账时返回None
+        """
+        self.load()
+        return self.closed.get(MonthlyAggregates.month_key(year, month))
+
+    def append(self, body):
+        """
+        追加一个条目
+
+        Args:
+            body (dict): 条目内容（action、month等）
+
+        Returns:
+            dict: 写入的条目（含checksum）
+        """
+        self.load()
+        with self._lock:
+            # 先经过一次JSON往返，保证校验的内容与读回的内容完全一致
+            entry = json.loads(json.dumps(dict(body, prev=self.last_checksum), ensure_ascii=False, default=str))
+            entry['checksum'] = ledger_checksum(entry)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.last_checksum = entry['checksum']
+            if entry['action'] == 'close':
+                self.closed[entry['month']] = entry
+            else:
+                self.closed.pop(entry['month'], None)
+            return entry
+
+
+# 变更日志每隔多少个事件写一次完整快照
+EVENT_SNAPSHOT_INTERVAL = 100
+# 事件时间格式，精确到微秒，按字符串比较即按时间排序
+EVENT_TIME_FORMAT = "%Y/%m/%d %H:%M:%S.%f"
+# 由计费派生、每次更新价格都会变化的字段，不记录为变更
+EVENT_DERIVED_FIELDS = ('usage_period', 'total_price')
+
+
+class FleetEventLog:
+    """
+    VPS数据的追加式变更日志
+
+    每次写回配置文件时把数据与日志末端的状态比较，新增、修改（只记录变化的字段）和删除各记为一个事件，
+    追加到<配置文件>.events.jsonl；每EVENT_SNAPSHOT_INTERVAL个事件把完整状态写入.snapshots，
+    并在.index中记录快照时间、序号和两个文件中的偏移。
+    还原任意时间点的数据时二分查找该时间之前最近的快照，再从快照对应的偏移重放不超过N个事件，
+    不需要扫描全部历史
+    """
+
+    def __init__(self, path, snapshot_every=EVENT_SNAPSHOT_INTERVAL):
+        """
+        Args:
+            path (str): 事件文件路径
+            snapshot_every (int): 快照间隔（事件数）
+        """
+        self.path = path
+        self.snapshot_path = path + '.snapshots'
+        self.index_path = path + '.index'
+        self.snapshot_every = snapshot_every
+        self._lock = threading.Lock()
+        self._tip = None  # 日志末端的状态 {名称: 字段}
+        self._seq = 0
+        self._since_snapshot = 0
+        self._size = None  # 建立末端状态时事件文件的大小，其他进程追加后需要重新读取
+
+    @staticmethod
+    def _state_from_records(records):
+        """VPS记录转换为 {名称: 字段}，经过一次JSON往返，与从日志读回的值可以直接比较"""
+        state = {}
+        for vps in records:
+            fields = {key: value for key, value in dict(vps).items() if key not in EVENT_DERIVED_FIELDS}
+            state[str(vps.get('name', ''))] = fields
+        return json.loads(json.dumps(state, ensure_ascii=False, default=str))
+
+    @staticmethod
+    def _apply(state, event):
+        """在状态上重放一个事件"""
+        name = event['name']
+        if event['op'] == 'add':
+            state[name] = dict(event['fields'])
+        elif event['op'] == 'update':
+            fields = state.setdefault(name, {})
+            fields.update(event.get('set', {}))
+            for key in event.get('unset', []):
+                fields.pop(key, None)
+        elif event['op'] == 'delete':
+            state.pop(name, None)
+
+    @staticmethod
+    def _diff(old, new):
+        """比较两个状态，返回把old变为new的事件（不含序号和时间）"""
+        events = []
+        for name, fields in new.items():
+            if name not in old:
+                events.append({'op': 'add', 'name': name, 'fields': fields})
+                continue
+            before = old[name]
+            changed = {key: value for key, value in fields.items() if before.get(key, _MISSING) != value}
+            removed = [key for key in before if key not in fields]
+            if changed or removed:
+                event = {'op': 'update', 'name': name, 'set': changed}
+                if removed:
+                    event['unset'] = removed
+                events.append(event)
+        for name in old:
+            if name not in new:
+                events.append({'op': 'delete', 'name': name})
+        return events
+
+    def _read_index(self):
+        """
+        Returns:
+            list: 快照索引 [{'ts', 'seq', 'snapshot_offset', 'event_offset'}]，按时间顺序
+        """
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _replay(self, index_entry, until=None):
+        """
+        从一个快照开始重放事件
+
+        Args:
+            index_entry (dict): 快照索引条目
+            until (str, optional): 只重放时间不晚于该值的事件
+
+        Returns:
+            tuple: (状态, 最后一个事件的序号, 重放的事件数)
+        """
+        with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+            f.seek(index_entry['snapshot_offset'])
+            state = json.loads(f.readline())['state']
+        seq = index_entry['seq']
+        replayed = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                f.seek(index_entry['event_offset'])
+                for line in f:
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if until is not None and event['ts'] > until:
+                        break
+                    self._apply(state, event)
+                    seq = event['seq']
+                    replayed += 1
+        except FileNotFoundError:
+            pass
+        return state, seq, replayed
+
+    def _file_size(self, path):
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def _ensure_tip(self):
+        """保证内存中的末端状态与文件一致"""
+        size = self._file_size(self.path)
+        if self._tip is not None and size == self._size:
+            return
+        index = self._read_index()
+        if index:
+            self._tip, self._seq, self._since_snapshot = self._replay(index[-1])
+        else:
+            self._tip, self._seq, self._since_snapshot = None, 0, 0
+        self._size = size
+
+    def _write_snapshot(self, ts):
+        """把末端状态写成快照并记录索引"""
+        snapshot_offset = self._file_size(self.snapshot_path)
+        with open(self.snapshot_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'seq': self._seq, 'ts': ts, 'state': self._tip}, ensure_ascii=False) + '\n')
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'ts': ts, 'seq': self._seq, 'snapshot_offset': snapshot_offset,
+                                'event_offset': self._file_size(self.path)}) + '\n')
+        self._since_snapshot = 0
+
+    def record(self, previous_records, records, when=None):
+        """
+        记录从日志末端状态到records的变更，调用方需持有配置文件的排他锁
+
+        Args:
+            previous_records (iterable): 修改前的数据，日志为空时作为初始快照
+            records (iterable): 修改后的数据
+            when (datetime, optional): 变更时间，默认为当前时间
+
+        Returns:
+            int: 记录的事件数
+        """
+        with self._lock:
+            self._ensure_tip()
+            ts = (when or datetime.datetime.now()).strftime(EVENT_TIME_FORMAT)
+            if self._tip is None:
+                self._tip = self._state_from_records(previous_records)
+                self._write_snapshot(ts)
+            events = self._diff(self._tip, self._state_from_records(records))
+            if not events:
+                return 0
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for event in events:
+                    self._seq += 1
+                    event = dict(event, seq=self._seq, ts=ts)
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+                    self._apply(self._tip, event)
+            self._since_snapshot += len(events)
+            if self._since_snapshot >= self.snapshot_every:
+                self._write_snapshot(ts)
+            self._size = self._file_size(self.path)
+            return len(events)
+
+    def state_at(self, when):
+        """
+        还原指定时间点的数据
+
+        Args:
+            when (datetime): 时间点
+
+        Returns:
+            tuple: (VPS数据字典列表, 还原信息)；时间早于日志开始时返回(None, None)
+        """
+        ts = when.strftime(EVENT_TIME_FORMAT)
+        index = self._read_index()
+        position = bisect.bisect_right([entry['ts'] for entry in index], ts) - 1
+        if position < 0:
+            return None, None
+        state, seq, replayed = self._replay(index[position], until=ts)
+        return list(state.values()), {'seq': seq, 'snapshot_seq': index[position]['seq'], 'replayed': replayed}
+
+
+class PhaseTimer:
+    """
+    分阶段计时器，记录CLI一次调用中各阶段的耗时
+    """
+
+    def __init__(self):
+        self.phases = []  # [(阶段名称, 耗时秒数)]
+
+    def add(self, name, seconds):
+        """直接记录一个已知耗时的阶段"""
+        self.phases.append((name, seconds))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        统计with语句块的耗时
+
+        Args:
+            name (str): 阶段名称
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self, stream):
+        """
+        输出各阶段耗时
+
+        Args:
+            stream: 输出流，CLI中使用stderr以免影响stdout的JSON
+        """
+        total = sum(seconds for _, seconds in self.phases)
+        print("[profile] 阶段耗时:", file=stream)
+        for name, seconds in self.phases:
+            percent = seconds / total * 100 if total > 0 else 0
+            print(f"[profile]   {name:<24} {seconds:8.3f}s {percent:5.1f}%", file=stream)
+        print(f"[profile]   {'合计':<24} {total:8.3f}s", file=stream)
+
+# VPS记录的常用字段，存放在__slots__中；配置文件中的其他字段存放在_extra字典中
+VPS_RECORD_FIELDS = (
+    'name', 'ip_address', 'country', 'price_per_month', 'purchase_date', 'start_date',
+    'cancel_date', 'status', 'use_nat', 'usage_period', 'total_price'
+)
+_VPS_SLOT_FIELDS = frozenset(VPS_RECORD_FIELDS)
+# 取值重复度高的字段，驻留后所有记录共享同一个字符串对象
+_VPS_INTERNED_FIELDS = frozenset(('status', 'country'))
+# 未设置的字段
+_MISSING = object()
+# 字段顺序元组的缓存，字段顺序相同的记录共享同一个元组
+_VPS_KEY_ORDERS = {}
+# 不可变的标量类型，重复写入相同的值时记录视为没有变化
+_VPS_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def _copy_field_value(value):
+    """
+    复制字段值：列表、字典等可变的嵌套值深拷贝，标量直接共享
+
+    Args:
+        value: 字段值
+
+    Returns:
+        与原值互不影响的字段值
+    """
+    if isinstance(value, (list, dict, set)):
+        return copy.deepcopy(value)
+    return value
+
+
+def _intern_key_order(keys):
+    """
+    获取字段顺序元组的共享实例
+
+    Args:
+        keys (iterable): 字段名
+
+    Returns:
+        tuple: 字段顺序元组
+    """
+    keys = tuple(keys)
+    return _VPS_KEY_ORDERS.setdefault(keys, keys)
+
+
+class VpsRecord(collections.abc.MutableMapping):
+    """
+    单台VPS的数据记录
+
+    用__slots__代替每台VPS一个字典，status和country等重复字符串驻留，解析过的日期缓存在记录上。
+    实现了字典的读写接口，原有按vps.get('name')、vps['status'] = ...访问的代码不需要修改；
+    记录字段的原始顺序和取值，to_dict()可以无损还原配置文件中的字典
+
+    发布快照时只复制上次发布之后被修改过的记录，没有修改的记录直接共享上一版本的只读副本（_published）。
+    因此对记录的修改必须通过vps[key] = value或del vps[key]：列表、字典等嵌套值要整体替换成新对象，
+    不能原地修改，否则快照发现不了这次修改。copy()会深拷贝嵌套值，副本与原记录互不影响
+    """
+
+    __slots__ = VPS_RECORD_FIELDS + ('_extra', '_keys', '_dates', '_frozen', '_published')
+
+    def __init__(self, data=None):
+        """
+        Args:
+            data (dict, optional): 配置文件中的VPS数据字典
+        """
+        for field in VPS_RECORD_FIELDS:
+            setattr(self, field, _MISSING)
+        self._extra = None
+        self._keys = ()
+        self._dates = None
+        self._frozen = False
+        self._published = None
+        if data:
+            for key, value in data.items():
+                self._store(key, value)
+            self._keys = _intern_key_order(data.keys())
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        从VPS数据字典或另一条记录创建新记录
+
+        Args:
+            data (dict|VpsRecord): VPS数据
+
+        Returns:
+            VpsRecord: 新记录，与传入的数据互不影响
+        """
+        if isinstance(data, VpsRecord):
+            return data.copy()
+        return cls(data)
+
+    def _store(self, key, value):
+        """写入字段值，不维护字段顺序"""
+        if key in _VPS_INTERNED_FIELDS and type(value) is str:
+            value = sys.intern(value)
+        if key in _VPS_SLOT_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __getitem__(self, key):
+        if key in _VPS_SLOT_FIELDS:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if self._frozen:
+            raise TypeError("快照中的VPS记录是只读的")
+        if key not in self:
+            self._keys = _intern_key_order(self._keys + (key,))
+        elif isinstance(value, _VPS_SCALAR_TYPES):
+            current = self[key]
+            if type(current) is type(value) and current == value:
+                # 例如刷新使用时长时写回相同的值，记录没有变化，已发布的副本仍然可以共享
+                return
+        self._published = None
+        self._store(key, value)
+        if self._dates is not None:
+            self._dates.pop(key, None)
+
+    def __delitem__(self, key):
+        if self._frozen:
+            raise TypeError("快照中的VPS记录是只读的")
+        if key not in self:
+            raise KeyError(key)
+        self._published = None
+        if key in _VPS_SLOT_FIELDS:
+            setattr(self, key, _MISSING)
+        else:
+            del self._extra[key]
+        self._keys = _intern_key_order(k for k in self._keys if k != key)
+        if self._dates is not None:
+            self._dates.pop(key, None)
+
+    def __contains__(self, key):
+        if key in _VPS_SLOT_FIELDS:
+            return getattr(self, key) is not _MISSING
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"VpsRecord({self.to_dict()!r})"
+
+    def get(self, key, default=None):
+        if key in _VPS_SLOT_FIELDS:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def copy(self, frozen=False):
+        """
+        复制记录
+
+        Args:
+            frozen (bool): 是否生成只读副本，快照中的记录为只读
+
+        Returns:
+            VpsRecord: 新记录
+        """
+        record = VpsRecord.__new__(VpsRecord)
+        for field in VPS_RECORD_FIELDS:
+            setattr(record, field, _copy_field_value(getattr(self, field)))
+        record._extra = ({key: _copy_field_value(value) for key, value in self._extra.items()}
+                         if self._extra is not None else None)
+        record._keys = self._keys
+        # datetime不可变，已解析的日期可以直接共享
+        record._dates = dict(self._dates) if self._dates is not None else None
+        record._frozen = frozen
+        record._published = None
+        return record
+
+    def published_copy(self):
+        """
+        获取用于快照的只读副本：上次发布之后没有修改时返回同一个副本
+
+        Returns:
+            VpsRecord: 只读副本
+        """
+        if self._frozen:
+            return self
+        published = self._published
+        if published is None:
+            published = self._published = self.copy(frozen=True)
+        return published
+
+    def to_dict(self):
+        """
+        还原为配置文件中的VPS数据字典，字段顺序与加载时一致
+
+        Returns:
+            dict: VPS数据
+        """
+        return {key: self[key] for key in self._keys}
+
+    def get_date(self, field, parser):
+        """
+        获取日期字段解析后的datetime，解析结果缓存在记录上，字段被修改时失效
+
+        Args:
+            field (str): 日期字段名
+            parser (callable): 解析函数，接收字段值，返回datetime或None
+
+        Returns:
+            datetime: 解析结果，字段为空或无法解析时返回None
+        """
+        dates = self._dates
+        if dates is not None and field in dates:
+            return dates[field]
+        value = self.get(field)
+        parsed = parser(value) if value else None
+        if dates is None:
+            # 只读记录同样可以缓存解析结果，缓存不属于记录的数据
+            self._dates = dates = {}
+        dates[field] = parsed
+        return parsed
+
+
+class FleetSnapshot:
+    """
+    不可变的VPS数据快照
+
+    修改VPS数据的操作在工作数据上完成后发布新版本的快照；自动保存和账单计算只读取快照，
+    不会看到修改到一半的数据，也不需要等待正在进行的修改
+    """
+
+    __slots__ = ('version', 'records', 'total_bill', 'created_at')
+
+    def __init__(self, version, records, total_bill=0):
+        """
+        Args:
+            version (int): 快照版本号，每次发布递增
+            records (tuple): 只读的VPS记录（VpsRecord）
+            total_bill (float): 发布时的总账单金额
+        """
+        self.version = version
+        self.records = records
+        self.total_bill = total_bill
+        self.created_at = time.time()
+
+    @classmethod
+    def from_vps_list(cls, version, vps_list, total_bill=0):
+        """
+        由工作数据生成快照，之后对工作数据的修改不会影响快照
+
+        只复制上次发布之后修改过的记录，其余记录与上一版本的快照共享同一个只读副本
+
+        Args:
+            version (int): 快照版本号
+            vps_list (list): VPS记录或数据字典列表
+            total_bill (float): 总账单金额
+
+        Returns:
+            FleetSnapshot: 新快照
+        """
+        records = tuple(vps.published_copy() if isinstance(vps, VpsRecord) else VpsRecord(vps).copy(frozen=True)
+                        for vps in vps_list)
+        return cls(version, records, total_bill)
+
+    def to_yaml_dict(self):
+        """
+        转换为配置文件的数据结构
+
+        Returns:
+            dict: 可直接写入YAML的数据
+        """
+        return {
+            'vps_servers': [record.to_dict() for record in self.records],
+            'total_bill': self.total_bill,
+            'nat_fee': 0  # 保存为0，强制每次启动时重新计算
+        }
+
+
+# VPS查询可以排序的字段
+VPS_QUERY_SORT_FIELDS = ('name', 'country', 'status', 'price_per_month', 'total_price',
+                         'purchase_date', 'start_date', 'cancel_date')
+# VPS查询每页的默认和最大条数
+VPS_QUERY_DEFAULT_LIMIT = 50
+VPS_QUERY_MAX_LIMIT = 1000
+
+
+class FleetIndex:
+    """
+    快照的查询索引，同一快照版本只建立一次
+
+    status、country、use_nat为取值到记录下标集合的倒排索引；名称按字典序排列，前缀查询用二分查找；
+    购买日期和销毁日期按日期排列，日期范围用二分查找。查询时先用索引求出候选下标的交集，
+    只对候选记录做其余条件的判断和序列化
+    """
+
+    def __init__(self, records, date_of):
+        """
+        Args:
+            records (tuple): 快照中的VPS记录
+            date_of (callable): date_of(记录, 字段)返回解析后的datetime或None
+        """
+        self.records = records
+        self.values = {'status': {}, 'country': {}, 'use_nat': {}}
+        for position, vps in enumerate(records):
+            for field, index in self.values.items():
+                value = (vps.get('use_nat', False) is True) if field == 'use_nat' else vps.get(field)
+                index.setdefault(value, set()).add(position)
+        names = sorted((str(vps.get('name', '')), position) for position, vps in enumerate(records))
+        self.name_keys = [name for name, _ in names]
+        self.name_positions = [position for _, position in names]
+        self.dates = {}
+        for field in ('purchase_date', 'cancel_date'):
+            entries = sorted((day.toordinal(), position) for position, day in
+                             ((position, date_of(vps, field)) for position, vps in enumerate(records)) if day is not None)
+            self.dates[field] = ([day for day, _ in entries], [position for _, position in entries])
+        self._sort_keys = {}
+
+    def sort_keys(self, field, key_of):
+        """
+        每条记录按某个字段排序的排序键，每个字段只计算一次
+
+        Args:
+            field (str): 排序字段
+            key_of (callable): key_of(记录)返回排序键
+
+        Returns:
+            list: 与records顺序一致的排序键
+        """
+        keys = self._sort_keys.get(field)
+        if keys is None:
+            keys = [key_of(vps) for vps in self.records]
+            self._sort_keys[field] = keys
+        return keys
+
+    def equal(self, field, values):
+        """
+        Returns:
+            set: 字段取值为values之一的记录下标
+        """
+        index = self.values[field]
+        result = set()
+        for value in values:
+            result |= index.get(value, set())
+        return result
+
+    def prefix(self, prefix):
+        """
+        Returns:
+            set: 名称以prefix开头的记录下标
+        """
+        first = bisect.bisect_left(self.name_keys, prefix)
+        last = bisect.bisect_left(self.name_keys, prefix + '\U0010ffff')
+        return set(self.name_positions[first:last])
+
+    def date_range(self, field, first, last):
+        """
+        Args:
+            field (str): purchase_date或cancel_date
+            first (date): 开始日期（包含），None表示不限
+            last (date): 结束日期（包含），None表示不限
+
+        Returns:
+            set: 日期在范围内的记录下标
+        """
+        days, positions = self.dates[field]
+        start = bisect.bisect_left(days, first.toordinal()) if first else 0
+        end = bisect.bisect_right(days, last.toordinal()) if last else len(days)
+        return set(positions[start:end])
+
+
+def resolve_config_path(config_file):
+    """
+    将配置文件路径解析为绝对路径，相对路径基于脚本所在目录
+
+    Args:
+        config_file (str): 配置文件路径
+
+    Returns:
+        str: 绝对路径
+    """
+    if os.path.isabs(config_file):
+        return config_file
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, config_file)
+
+
+class ConfigFileLock:
+    """
+    配置文件的跨进程咨询锁
+
+    main.js可能同时启动多个billing_manager.py进程，读取配置文件时持有共享锁，
+    读取-修改-写回时持有排他锁，避免后写入的进程覆盖其他进程的修改。
+    锁加在独立的.lock文件上，配置文件本身被整体重写也不影响锁。
+    同一进程内可重入；已持有共享锁时不能再请求排他锁，需要写入时应一开始就持有排他锁。
+    """
+
+    def __init__(self, lock_file, timeout=60, poll_interval=0.05):
+        """
+        Args:
+            lock_file (str): 锁文件路径
+            timeout (float): 等待锁的最长秒数
+            poll_interval (float): 轮询锁的间隔秒数
+        """
+        self.lock_file = lock_file
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._thread_lock = threading.RLock()  # 进程内的线程之间也需要互斥
+        self._handle = None
+        self._depth = 0
+        self._exclusive = False
+        self.acquisitions = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _try_lock(self, exclusive):
+        """尝试非阻塞加锁，成功返回True"""
+        try:
+            if fcntl is not None:
+                flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+                fcntl.flock(self._handle.fileno(), flags | fcntl.LOCK_NB)
+            elif msvcrt is not None:
+                # msvcrt只支持排他锁，共享锁也按排他锁处理
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _lock(self, exclusive):
+        """轮询加锁直到成功或超时，并记录等待时间"""
+        if self._handle is None:
+            self._handle = open(self.lock_file, 'a+')
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        while not self._try_lock(exclusive):
+            if time.perf_counter() >= deadline:
+                raise TimeoutError(f"等待配置文件锁超时: {self.lock_file}")
+            time.sleep(self.poll_interval)
+        waited = time.perf_counter() - start
+        self.acquisitions += 1
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self._exclusive = exclusive
+        if waited >= self.poll_interval:
+            logger.info(f"等待配置文件锁 {waited:.3f}s")
+
+    def _unlock(self):
+        """释放文件锁并关闭锁文件"""
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                self._handle.seek(0)
+                msvcrt.locking(self._handle.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._handle.close()
+            self._handle = None
+            self._exclusive = False
+
+    def acquire(self, exclusive=True):
+        """
+        获取锁
+
+        Args:
+            exclusive (bool): True为排他锁（写），False为共享锁（读）
+        """
+        self._thread_lock.acquire()
+        try:
+            if self._depth == 0:
+                self._lock(exclusive)
+            elif exclusive and not self._exclusive:
+                # flock的升级不是原子的（先释放共享锁，其他进程可能在中间写入），msvcrt不支持升级
+                raise RuntimeError(f"已持有共享锁时不能升级为排他锁: {self.lock_file}")
+            self._depth += 1
+        except Exception:
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        """释放一层锁，最外层释放时解除文件锁"""
+        try:
+            self._depth -= 1
+            if self._depth == 0:
+                self._unlock()
+        finally:
+            self._thread_lock.release()
+
+    @contextlib.contextmanager
+    def hold(self, exclusive=True):
+        """
+        在with块内持有锁
+
+        Args:
+            exclusive (bool): True为排他锁（写），False为共享锁（读）
+        """
+        self.acquire(exclusive)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: 锁文件路径、加锁次数和等待耗时
+        """
+        return {
+            'lock_file': self.lock_file,
+            'acquisitions': self.acquisitions,
+            'wait_seconds': round(self.wait_seconds, 6),
+            'max_wait_seconds': round(self.max_wait_seconds, 6)
+        }
+
+
+# 每次调用统计追加到的滚动日志最多保留的行数
+STATS_LOG_MAX_LINES = 1000
+
+
+class BillingStats:
+    """
+    BillingManager热点路径的计数器和计时器
+
+    compute_monthly_bills的线程池会并发更新统计，字典的读-改-写都在self._lock内完成
+    """
+
+    def __init__(self):
+        self.counters = {}  # 计数器名称 -> 次数
+        self.timers = {}  # 计时器名称 -> [调用次数, 累计秒数]
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def incr(self, name, count=1):
+        """
+        计数器加一
+
+        Args:
+            name (str): 计数器名称
+            count (int): 增加的数量
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def record(self, name, seconds):
+        """
+        记录一次调用耗时
+
+        Args:
+            name (str): 计时器名称
+            seconds (float): 本次耗时（秒）
+        """
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        """统计with语句块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def to_dict(self):
+        """
+        导出统计数据
+
+        Returns:
+            dict: 可直接JSON序列化的统计数据
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            timers = [(name, calls, seconds) for name, (calls, seconds) in self.timers.items()]
+        return {
+            'started_at': datetime.datetime.fromtimestamp(self.started_at).strftime("%Y/%m/%d %H:%M:%S"),
+            'uptime_seconds': round(time.time() - self.started_at, 3),
+            'counters': counters,
+            'timers': {
+                name: {'calls': calls, 'seconds': round(seconds, 6)}
+                for name, calls, seconds in timers
+            }
+        }
+
+    def reset(self):
+        """清空所有统计"""
+        with self._lock:
+            self.counters = {}
+            self.timers = {}
+            self.started_at = time.time()
+
+
+def nat_fee_label(detail):
+    """
+    Excel导出中NAT费用行的名称
+
+    Args:
+        detail (dict): 账单中的NAT详情，结账时冻结的旧账单可能没有
+
+    Returns:
+        str: 行名称
+    """
+    if detail and detail.get('费用说明'):
+        return f"NAT费用({detail['费用说明']})"
+    return 'NAT费用'
+
+
+def track_stats(name):
+    """
+    统计BillingManager方法调用次数和累计耗时的装饰器
+
+    Args:
+        name (str): 计时器名称
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.stats.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class BillingManager:
+    def __init__(self, config_file='vps_data.yml', file_lock=None):
+        """
+        初始化账单管理器
+        
+        Args:
+            config_file (str): VPS配置文件路径
+            file_lock (ConfigFileLock): 配置文件的跨进程锁，命令行写操作会预先持有它
+        """
+        # 如果config_file是相对路径，则基于脚本所在目录构建绝对路径
+        self.config_file = resolve_config_path(config_file)
+        self.file_lock = file_lock or ConfigFileLock(self.config_file + '.lock')
+        self.vps_data = []
+        self.nat_total_fee = 0
+        self.billing_year = datetime.datetime.now().year
+        self.billing_month = datetime.datetime.now().month
+        self.exchange_rate_cache = None  # 用于缓存汇率
+        self.auto_save_timer = None  # 用于自动保存的定时器
+        self._deferred_saves = 0  # deferred_save的嵌套层数，大于0时save_data不写文件
+        self.stats = BillingStats()  # 热点路径计数器和计时器
+        self.total_bill = 0
+        self._snapshot = FleetSnapshot(0, ())  # 最近发布的只读快照
+        self._publish_lock = threading.Lock()  # 只在发布快照时互斥，读取快照不加锁
+        self._save_lock = threading.Lock()  # 避免主线程和自动保存线程同时写文件
+        self._saved_version = None  # 已写入配置文件的快照版本
+        self._saved_snapshot = None  # 与配置文件内容一致的快照，变更日志为空时作为初始状态
+        self.events = FleetEventLog(self.config_file + '.events.jsonl')  # 追加式变更日志
+        self._history_versions = itertools.count(-1, -1)  # 历史快照使用负的版本号，不与已发布快照冲突
+        self._cost_ticker = None  # 当月累计费用计时器，快照版本变化后重建
+        self._cost_ticker_version = None  # 建立计时器时的快照版本
+        self.aggregates = MonthlyAggregates()  # 按月物化的分组汇总，首次使用时从文件加载
+        self._aggregates_loaded = False
+        self._fingerprint = (None, None)  # (快照版本, 数据指纹)
+        self._occupancy = (None, None)  # (快照版本, {国家/地区或None: OccupancyTimeline})
+        self._cost_index = None  # (快照版本, 索引截止日期, DailyCostIndex, 已计入的VPS计费区间)
+        self._fleet_index = (None, None)  # (快照版本, FleetIndex)
+        self.nat_days = NatDayBitmaps()  # 按生命周期缓存的按天位图，首次使用时从文件加载
+        self.ledger = MonthLedger(self.config_file + '.ledger.jsonl')  # 已结账月份的冻结账单
+        self.traffic = TrafficStore(self.config_file + '.traffic')  # 导入的NAT实际流量
+        self._traffic_cache = {}  # {(年, 月): {VPS名称: 字节数}}
+        self._currency_rates = {}  # {(年, 月): {货币: 1单位货币=多少美元}}
+        self._nat_days_loaded = False
+        
+        # 确保字体目录存在
+        self.ensure_fonts_directory()
+        
+        self.load_data()
+        
+        # 启动自动保存定时器，每5分钟自动保存一次
+        self.start_auto_save_timer()
+    
+    def ensure_fonts_directory(self):
+        """确保fonts目录存在"""
+        try:
+            # 获取当前脚本所在目录
+            script_dir = os.path.dirname(os.path.abspath(__file__))
+            fonts_dir = os.path.join(script_dir, 'fonts')
+            
+            # 如果fonts目录不存在，创建它
+            if not os.path.exists(fonts_dir):
+                os.makedirs(fonts_dir)
+                logger.info(f"已创建字体目录: {fonts_dir}")
+            
+            # 检查DejaVu字体是否存在
+            dejavu_font_path = os.path.join(fonts_dir, 'DejaVuSansCondensed.ttf')
+            if not os.path.exists(dejavu_font_path):
+                logger.warning(f"DejaVu字体文件不存在: {dejavu_font_path}")
+                logger.info("PDF导出将使用默认Helvetica字体")
+            
+            return fonts_dir
+        except Exception as e:
+            logger.error(f"检查/创建字体目录时发生错误: {str(e)}")
+            return None
+    
+    @track_stats('load_data')
+    def load_data(self):
+        """从配置文件加载VPS数据"""
+        try:
+            # 共享锁：允许并发读取，但不会读到其他进程写了一半的文件
+            with self.file_lock.hold(exclusive=False):
+                with open(self.config_file, 'r', encoding='utf-8') as file:
+                    data = yaml.load(file, Loader=YAML_LOADER)
+                
+            self.vps_data = [VpsRecord(vps) for vps in data.get('vps_servers') or []]
+            self.total_bill = data.get('total_bill', 0)
+            # 不要从配置文件加载NAT费用，强制每次都重新计算
+            self.nat_total_fee = 0
+            
+            logger.info(f"成功从 {self.config_file} 加载了 {len(self.vps_data)} 台VPS数据")
+        except Exception as e:
+            logger.error(f"加载VPS数据失败: {str(e)}")
+            self.vps_data = []
+            self.total_bill = 0
+            self.nat_total_fee = 0
+        
+        # 刚加载的数据与文件内容一致，不需要再由自动保存写回
+        self._saved_snapshot = self.publish_snapshot()
+        self._saved_version = self._saved_snapshot.version
+    
+    def publish_snapshot(self):
+        """
+        将当前工作数据发布为新版本的只读快照
+
+        Returns:
+            FleetSnapshot: 新发布的快照
+        """
+        with self._publish_lock:
+            snapshot = FleetSnapshot.from_vps_list(self._snapshot.version + 1, self.vps_data, self.total_bill)
+            # 引用赋值是原子的，读取方拿到的要么是旧快照要么是新快照
+            self._snapshot = snapshot
+        self.stats.incr('snapshot_publish')
+        return snapshot
+    
+    def get_snapshot(self):
+        """
+        获取最近发布的只读快照，不会等待正在进行的修改
+
+        Returns:
+            FleetSnapshot: 当前快照
+        """
+        return self._snapshot
+    
+    @track_stats('save_data')
+    def save_data(self, publish=True):
+        """
+        保存VPS数据到配置文件
+        
+        Args:
+            publish (bool): 是否先将当前工作数据发布为新快照。后台自动保存时为False，
+                只写出最近发布的快照，不读取主线程可能正在修改的工作数据
+        """
+        try:
+            if publish:
+                self.publish_snapshot()
+            if self._deferred_saves:
+                # 批量执行期间只发布快照，退出deferred_save时统一写一次文件
+                self.stats.incr('save_data_deferred')
+                return True
+            
+            # 账单计算时更新的物化汇总和按天位图与VPS数据一起保存，没有变化时不写
+            self.save_aggregates()
+            self.save_nat_days()
+            
+            # 先取文件锁再取线程锁，与命令行写操作预先持有文件锁的顺序一致，避免死锁
+            with self.file_lock.hold(exclusive=True), self._save_lock:
+                snapshot = self._snapshot
+                # 自动保存时快照没有变化则不必重写文件
+                if not publish and snapshot.version == self._saved_version:
+                    logger.info("VPS数据没有变化，跳过保存")
+                    return True
+                
+                data = snapshot.to_yaml_dict()
+                with open(self.config_file, 'w', encoding='utf-8') as file:
+                    yaml.dump(data, file, Dumper=YAML_DUMPER, default_flow_style=False, allow_unicode=True)
+                # 在同一个排他锁内追加变更事件，多个进程的事件不会交错
+                try:
+                    previous = self._saved_snapshot.records if self._saved_snapshot else ()
+                    self.stats.incr('fleet_event', self.events.record(previous, snapshot.records))
+                except Exception as e:
+                    logger.error(f"记录VPS变更事件失败: {str(e)}")
+                self._saved_snapshot = snapshot
+                self._saved_version = snapshot.version
+            self.stats.incr('save_data_write')
+                
+            logger.info(f"成功保存 {len(snapshot.records)} 台VPS数据到 {self.config_file}")
+            return True
+        except Exception as e:
+            logger.error(f"保存VPS数据失败: {str(e)}")
+            return False
+    
+    @contextlib.contextmanager
+    def deferred_save(self):
+        """
+        在with块内调用save_data只发布快照，不写配置文件；退出时把最新快照写一次（没有变化时不写）
+        
+        用于在一个进程中依次执行多个修改操作，每个操作照常调用save_data，整批只重写一次文件和追加一次变更事件
+        
+        Raises:
+            RuntimeError: 退出时写文件失败
+        """
+        self._deferred_saves += 1
+        try:
+            yield
+        finally:
+            self._deferred_saves -= 1
+            saved = self._deferred_saves > 0 or self.save_data(publish=False)
+        if not saved:
+            raise RuntimeError("保存VPS数据失败")
+    
+    def get_vps_by_name(self, vps_name):
+        """
+        根据名称获取VPS数据
+        
+        Args:
+            vps_name (str): VPS名称
+            
+        Returns:
+            dict: VPS数据，如果不存在则返回None
+        """
+        for vps in self.vps_data:
+            if vps.get('name') == vps_name:
+                return vps
+        return None
+    
+    def update_vps(self, vps_name, **kwargs):
+        """
+        更新VPS数据
+        
+        Args:
+            vps_name (str): VPS名称
+            **kwargs: 要更新的字段和值
+            
+        Returns:
+            bool: 是否成功
+        """
+        vps = self.get_vps_by_name(vps_name)
+        if vps:
+            try:
+                # 确保数据类型正确
+                if 'price_per_month' in kwargs:
+                    kwargs['price_per_month'] = float(kwargs['price_per_month'])
+                if 'use_nat' in kwargs:
+                    kwargs['use_nat'] = bool(kwargs['use_nat'])
+                if 'currency' in kwargs:
+                    kwargs['currency'] = normalize_currency(kwargs['currency'])
+                
+                # 有调价记录的VPS修改单价时记为从现在开始的新区段，之前的时间仍按原单价计费
+                if ('price_per_month' in kwargs and 'price_history' not in kwargs and vps.get('price_history')
+                        and kwargs['price_per_month'] != float(vps.get('price_per_month', 0) or 0)):
+                    self._append_price_segment(vps, kwargs['price_per_month'], datetime.datetime.now())
+                
+                # 更新字段
+                for key, value in kwargs.items():
+                    vps[key] = value
+                
+                # 更新后立即保存
+                return self.save_data()
+            except Exception as e:
+                logger.error(f"更新VPS数据时出错: {str(e)}")
+                return False
+        else:
+            logger.error(f"找不到VPS: {vps_name}")
+            return False
+    
+    def add_vps(self, vps_data):
+        """
+        添加新的VPS
+        
+        Args:
+            vps_data (dict): VPS数据
+            
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            vps_name = vps_data.get('name')
+            if not vps_name:
+                logger.error("VPS数据缺少name字段")
+                return False
+                
+            # 检查是否已存在
+            if self.get_vps_by_name(vps_name):
+                logger.error(f"VPS已存在: {vps_name}")
+                return False
+                
+            # 添加start_date字段，记录创建时间
+            if 'start_date' not in vps_data:
+                vps_data['start_date'] = datetime.datetime.now().strftime("%Y/%m/%d")
+                
+            # 添加purchase_date字段，记录购买时间
+            if 'purchase_date' not in vps_data:
+                vps_data['purchase_date'] = datetime.datetime.now().strftime("%Y/%m/%d")
+                
+            # 确保数据类型正确
+            if 'price_per_month' in vps_data:
+                vps_data['price_per_month'] = float(vps_data['price_per_month'])
+            if 'use_nat' in vps_data:
+                vps_data['use_nat'] = bool(vps_data['use_nat'])
+            if 'currency' in vps_data:
+                vps_data['currency'] = normalize_currency(vps_data['currency'])
+            
+            # 添加VPS数据的副本，避免引用问题
+            self.vps_data.append(VpsRecord.from_dict(vps_data))
+            
+            # 添加后立即保存
+            return self.save_data()
+        except Exception as e:
+            logger.error(f"添加VPS时出错: {str(e)}")
+            return False
+    
+    def delete_vps(self, vps_name):
+        """
+        删除VPS
+        
+        Args:
+            vps_name (str): VPS名称
+            
+        Returns:
+            bool: 是否成功
+        """
+        for i, vps in enumerate(self.vps_data):
+            if vps.get('name') == vps_name:
+                del self.vps_data[i]
+                return self.save_data()
+                
+        logger.error(f"找不到VPS: {vps_name}")
+        return False
+    
+    def _append_price_segment(self, vps, price, effective):
+        """
+        在VPS的调价记录中加入一个区段，同一时间的旧记录被替换
+        
+        原单价（第一段）从最早的计费日期开始生效；新区段早于或等于第一段的开始时间时，第一段被新区段取代。
+        写回的from统一为YYYY/MM/DD HH:MM:SS格式
+        
+        Args:
+            vps (VpsRecord): VPS记录（工作数据）
+            price (float): 新的月单价
+            effective (datetime): 生效时间
+        """
+        segments = self._price_segments(vps)
+        if segments is not None:
+            entries = list(zip(segments.starts, segments.prices))
+        else:
+            # 第一次调价：原单价从购买日期（没有时为启用日期）开始生效
+            dates = [date for date in (self._vps_date(vps, 'purchase_date'), self._vps_date(vps, 'start_date'))
+                     if date is not None]
+            entries = [(min(dates), float(vps.get('price_per_month', 0) or 0))] if dates else []
+        if entries and entries[0][0] >= effective:
+            entries = entries[1:]
+        entries = [(start, entry_price) for start, entry_price in entries if start != effective]
+        entries.append((effective, float(price)))
+        entries.sort(key=lambda entry: entry[0])
+        # 赋值新列表，不修改快照中共享的旧列表
+        vps['price_history'] = [{'from': start.strftime("%Y/%m/%d %H:%M:%S"), 'price': entry_price}
+                                for start, entry_price in entries]
+    
+    def change_vps_price(self, vps_name, price, effective=None):
+        """
+        调整VPS的月单价，从生效时间开始按新单价计费，之前的时间仍按原单价计费
+        
+        Args:
+            vps_name (str): VPS名称
+            price (float): 新的月单价
+            effective (str|datetime, optional): 生效时间，YYYY/MM/DD [HH:MM:SS]，默认为现在
+            
+        Returns:
+            bool: 是否成功
+        """
+        vps = self.get_vps_by_name(vps_name)
+        if not vps:
+            logger.error(f"找不到VPS: {vps_name}")
+            return False
+        try:
+            if effective is None:
+                effective = datetime.datetime.now()
+            elif not isinstance(effective, datetime.datetime):
+                effective = self._parse_bill_date(str(effective).replace('-', '/'))
+                if effective is None:
+                    raise ValueError(f"无法解析生效时间: {effective}")
+            self._append_price_segment(vps, price, effective)
+            # price_per_month始终为当前的单价
+            vps['price_per_month'] = self._price_segments(vps).price_at(datetime.datetime.now())
+            return self.save_data()
+        except Exception as e:
+            logger.error(f"调整VPS {vps_name} 单价时出错: {str(e)}")
+            return False
+    
+    def set_vps_status(self, vps_name, status):
+        """
+        设置VPS状态
+        
+        Args:
+            vps_name (str): VPS名称
+            status (str): 新状态，例如"在用"或"销毁"
+            
+        Returns:
+            bool: 是否成功
+        """
+        vps = self.get_vps_by_name(vps_name)
+        if vps:
+            vps['status'] = status
+            
+            # 如果状态是销毁，设置销毁日期
+            if status == "销毁":
+                today = datetime.datetime.now().strftime("%Y/%m/%d")
+                vps['cancel_date'] = today
+                
+            return self.save_data()
+        else:
+            logger.error(f"找不到VPS: {vps_name}")
+            return False
+    
+    def _name_index(self):
+        """
+        Returns:
+            dict: {VPS名称: 工作数据中的VpsRecord}
+        """
+        return {vps.get('name'): vps for vps in self.vps_data}
+    
+    def _vps_filter(self, filters):
+        """
+        把筛选条件转换成判断函数
+        
+        Args:
+            filters (dict): 可包含country、status（字符串或列表，满足其一即可）、use_nat（布尔）、name_prefix，
+                以及purchase_from/purchase_to、cancel_from/cancel_to日期范围（YYYY/MM/DD，包含两端）
+                
+        Returns:
+            callable: predicate(vps) -> bool
+        """
+        unknown = set(filters) - set(VPS_FILTER_FIELDS)
+        if unknown:
+            raise ValueError(f"不支持的筛选条件: {', '.join(sorted(unknown))}")
+        checks = []
+        for field in ('country', 'status'):
+            if filters.get(field) not in (None, ''):
+                values = filters[field]
+                allowed = frozenset(values if isinstance(values, (list, tuple, set)) else [values])
+                checks.append(lambda vps, field=field, allowed=allowed: vps.get(field) in allowed)
+        if filters.get('use_nat') is not None:
+            use_nat = filters['use_nat']
+            if isinstance(use_nat, str):
+                use_nat = use_nat.lower() in ('是', 'true', 'yes', '1')
+            checks.append(lambda vps, use_nat=bool(use_nat): (vps.get('use_nat', False) is True) == use_nat)
+        if filters.get('name_prefix'):
+            prefix = str(filters['name_prefix'])
+            checks.append(lambda vps: str(vps.get('name', '')).startswith(prefix))
+        for field in ('purchase', 'cancel'):
+            first, last = filters.get(f'{field}_from'), filters.get(f'{field}_to')
+            if not first and not last:
+                continue
+            bounds = []
+            for value in (first, last):
+                day = self._parse_bill_date(str(value).replace('-', '/')) if value else None
+                if value and day is None:
+                    raise ValueError(f"无法解析日期: {value}")
+                bounds.append(day.date() if day else None)
+            
+            def in_range(vps, date_field=f'{field}_date', first=bounds[0], last=bounds[1]):
+                day = self._vps_date(vps, date_field)
+                if day is None:
+                    return False
+                day = day.date()
+                return (first is None or day >= first) and (last is None or day <= last)
+            checks.append(in_range)
+        return lambda vps: all(check(vps) for check in checks)
+    
+    def _select_for_update(self, names=None, filters=None):
+        """
+        按名称列表和/或筛选条件选出要修改的VPS，两者都指定时取交集
+        
+        Args:
+            names (list, optional): VPS名称
+            filters (dict, optional): 筛选条件，见_vps_filter
+            
+        Returns:
+            tuple: (工作数据中选中的VpsRecord列表, 找不到的名称的结果列表)
+        """
+        if not names and not filters:
+            raise ValueError("批量修改需要指定VPS名称或筛选条件")
+        predicate = self._vps_filter(filters or {})
+        if not names:
+            return [vps for vps in self.vps_data if predicate(vps)], []
+        
+        index = self._name_index()
+        selected = []
+        missing = []
+        seen = set()
+        for name in names:
+            if name in seen:
+                continue
+            seen.add(name)
+            vps = index.get(name)
+            if vps is None:
+                missing.append({'name': name, 'success': False, 'error': '找不到VPS'})
+            elif predicate(vps):
+                selected.append(vps)
+        return selected, missing
+    
+    def _restore_vps_records(self, originals):
+        """
+        用修改前的副本替换工作数据中的VpsRecord
+        
+        Args:
+            originals (list): [(修改过的VpsRecord, 修改前的副本), ...]
+        """
+        replacements = {id(vps): original for vps, original in originals}
+        self.vps_data = [replacements.get(id(vps), vps) for vps in self.vps_data]
+    
+    def _finish_bulk_change(self, results, changed, now, names=None):
+        """
+        批量修改结束：重新计算修改过的VPS的使用时长和金额，只保存一次；保存失败时撤销全部修改
+        
+        Args:
+            results (list): 每台VPS的结果
+            changed (list): [(修改过的VpsRecord, 修改前的副本), ...]
+            now (datetime): 计算时间
+            names (list, optional): 按名称修改时的名称列表，结果按此顺序排列
+            
+        Returns:
+            dict: 汇总结果
+        """
+        if names:
+            order = {}
+            for position, name in enumerate(names):
+                # 重复的名称只处理一次，按第一次出现的位置排列
+                order.setdefault(name, position)
+            results.sort(key=lambda result: order.get(result['name'], len(order)))
+        saved = True
+        if changed:
+            for vps, _ in changed:
+                self._refresh_vps_price(vps, now)
+            saved = self.save_data()
+            if not saved:
+                # 内存中的数据与配置文件保持一致
+                self._restore_vps_records(changed)
+                self.publish_snapshot()
+                for result in results:
+                    if result.get('changed'):
+                        result.update(success=False, error='保存VPS数据失败')
+        self.stats.incr('bulk_changed', len(changed) if saved else 0)
+        return {
+            'success': saved and all(result['success'] for result in results),
+            'matched': sum(1 for result in results if result.get('error') != '找不到VPS'),
+            'updated': len(changed) if saved else 0,
+            'failed': sum(1 for result in results if not result['success']),
+            'results': results
+        }
+    
+    def bulk_update(self, fields, names=None, filters=None):
+        """
+        一次修改多台VPS的字段，在名称索引上一遍完成，全部修改后只保存一次
+        
+        Args:
+            fields (dict): 要修改的字段和值（不能修改name），类型处理与update_vps相同，
+                有调价记录的VPS修改单价时记为从现在开始的新区段
+            names (list, optional): VPS名称
+            filters (dict, optional): 筛选条件，见_vps_filter
+            
+        Returns:
+            dict: 匹配、修改、失败的数量和每台VPS的结果
+        """
+        fields = dict(fields or {})
+        if not fields:
+            raise ValueError("批量修改需要指定要修改的字段")
+        if 'name' in fields:
+            raise ValueError("批量修改不能修改VPS名称")
+        if 'price_per_month' in fields:
+            fields['price_per_month'] = float(fields['price_per_month'])
+        if 'use_nat' in fields:
+            fields['use_nat'] = bool(fields['use_nat'])
+        if 'currency' in fields:
+            fields['currency'] = normalize_currency(fields['currency'])
+        
+        selected, results = self._select_for_update(names, filters)
+        now = datetime.datetime.now()
+        changed = []
+        for vps in selected:
+            name = vps.get('name')
+            updated = [key for key, value in fields.items() if vps.get(key) != value]
+            if not updated:
+                results.append({'name': name, 'success': True, 'changed': []})
+                continue
+            original = vps.copy()
+            try:
+                if ('price_per_month' in updated and 'price_history' not in fields and vps.get('price_history')):
+                    self._append_price_segment(vps, fields['price_per_month'], now)
+                for key in updated:
+                    vps[key] = fields[key]
+                changed.append((vps, original))
+                results.append({'name': name, 'success': True, 'changed': updated})
+            except Exception as e:
+                # 这台VPS不做任何修改
+                self._restore_vps_records([(vps, original)])
+                logger.error(f"批量修改VPS {name} 时出错: {str(e)}")
+                results.append({'name': name, 'success': False, 'error': str(e)})
+        return self._finish_bulk_change(results, changed, now, names)
+    
+    def bulk_set_status(self, status, names=None, filters=None, cancel_date=None):
+        """
+        一次设置多台VPS的状态，规则与set_vps_status相同，全部修改后只保存一次
+        
+        已经是该状态的VPS不修改（已销毁的VPS保留原销毁日期）
+        
+        Args:
+            status (str): 新状态，例如"在用"或"销毁"
+            names (list, optional): VPS名称
+            filters (dict, optional): 筛选条件，见_vps_filter
+            cancel_date (str, optional): 设置为销毁时的销毁日期，默认为今天
+            
+        Returns:
+            dict: 匹配、修改、失败的数量和每台VPS的结果
+        """
+        if not status:
+            raise ValueError("批量设置状态需要指定status")
+        status = str(status)
+        now = datetime.datetime.now()
+        if cancel_date:
+            parsed = self._parse_bill_date(str(cancel_date).replace('-', '/'))
+            if parsed is None:
+                raise ValueError(f"无法解析销毁日期: {cancel_date}")
+            cancel_date = str(cancel_date).replace('-', '/')
+        else:
+            cancel_date = now.strftime("%Y/%m/%d")
+        
+        selected, results = self._select_for_update(names, filters)
+        changed = []
+        for vps in selected:
+            name = vps.get('name')
+            if vps.get('status') == status:
+                results.append({'name': name, 'success': True, 'changed': []})
+                continue
+            original = vps.copy()
+            updated = ['status']
+            vps['status'] = status
+            # 如果状态是销毁，设置销毁日期
+            if status == "销毁":
+                vps['cancel_date'] = cancel_date
+                updated.append('cancel_date')
+            changed.append((vps, original))
+            results.append({'name': name, 'success': True, 'changed': updated})
+        return self._finish_bulk_change(results, changed, now, names)
+    
+    def get_fleet_index(self, snapshot=None):
+        """
+        获取快照的查询索引，同一快照版本只建立一次
+        
+        Args:
+            snapshot (FleetSnapshot, optional): VPS数据快照，默认为最近发布的快照
+            
+        Returns:
+            FleetIndex: 查询索引
+        """
+        snapshot = snapshot or self.get_snapshot()
+        version, index = self._fleet_index
+        if version == snapshot.version:
+            return index
+        index = FleetIndex(snapshot.records, self._vps_date)
+        self._fleet_index = (snapshot.version, index)
+        self.stats.incr('fleet_index_build')
+        return index
+    
+    def _query_sort_key(self, vps, field):
+        """
+        排序键：(是否缺少该字段, 值, 名称)，缺少该字段的记录排在最后，名称相同的记录不会出现
+        
+        Returns:
+            tuple: 可比较、可JSON序列化的排序键
+        """
+        if field in ('purchase_date', 'start_date', 'cancel_date'):
+            day = self._vps_date(vps, field)
+            value = day.strftime("%Y/%m/%d %H:%M:%S") if day else None
+        elif field in ('price_per_month', 'total_price'):
+            value = vps.get(field)
+            value = float(value) if value not in (None, '') else None
+        else:
+            value = vps.get(field)
+            value = str(value) if value not in (None, '') else None
+        return (1, '', str(vps.get('name', ''))) if value is None else (0, value, str(vps.get('name', '')))
+    
+    def query_vps(self, filters=None, sort='name', fields=None, limit=VPS_QUERY_DEFAULT_LIMIT, cursor=None):
+        """
+        按条件查询VPS，支持排序、字段投影和游标分页，只序列化当前页的记录
+        
+        status、country、use_nat、名称前缀和购买/销毁日期范围先在索引上求出候选记录，其余条件只对候选记录判断
+        
+        Args:
+            filters (dict, optional): 筛选条件，见_vps_filter
+            sort (str): 排序字段，前面加"-"为降序，默认按名称升序
+            fields (list, optional): 只返回这些字段，默认返回全部字段
+            limit (int): 每页条数，最多VPS_QUERY_MAX_LIMIT
+            cursor (str, optional): 上一页返回的next_cursor
+            
+        Returns:
+            dict: 符合条件的总数、当前页的记录和下一页的游标（没有下一页时为None）
+        """
+        filters = dict(filters or {})
+        sort = sort or 'name'
+        descending = sort.startswith('-')
+        sort_field = sort.lstrip('-')
+        if sort_field not in VPS_QUERY_SORT_FIELDS:
+            raise ValueError(f"不支持的排序字段: {sort_field}")
+        limit = max(1, min(int(limit or VPS_QUERY_DEFAULT_LIMIT), VPS_QUERY_MAX_LIMIT))
+        predicate = self._vps_filter(filters)
+        
+        snapshot = self.get_snapshot()
+        index = self.get_fleet_index(snapshot)
+        candidates = None
+        
+        def narrow(positions):
+            nonlocal candidates
+            candidates = positions if candidates is None else candidates & positions
+        
+        for field in ('status', 'country'):
+            if filters.get(field) not in (None, ''):
+                values = filters[field]
+                narrow(index.equal(field, values if isinstance(values, (list, tuple, set)) else [values]))
+        if filters.get('use_nat') is not None:
+            use_nat = filters['use_nat']
+            if isinstance(use_nat, str):
+                use_nat = use_nat.lower() in ('是', 'true', 'yes', '1')
+            narrow(index.equal('use_nat', [bool(use_nat)]))
+        if filters.get('name_prefix'):
+            narrow(index.prefix(str(filters['name_prefix'])))
+        for field in ('purchase', 'cancel'):
+            first, last = filters.get(f'{field}_from'), filters.get(f'{field}_to')
+            if first or last:
+                # 日期格式已由_vps_filter校验
+                first = self._parse_bill_date(str(first).replace('-', '/')).date() if first else None
+                last = self._parse_bill_date(str(last).replace('-', '/')).date() if last else None
+                narrow(index.date_range(f'{field}_date', first, last))
+        
+        records = snapshot.records
+        positions = range(len(records)) if candidates is None else candidates
+        sort_keys = index.sort_keys(sort_field, lambda vps: self._query_sort_key(vps, sort_field))
+        matched = sorted((position for position in positions if predicate(records[position])),
+                         key=sort_keys.__getitem__, reverse=descending)
+        keyed = [(sort_keys[position], records[position]) for position in matched]
+        
+        start = 0
+        if cursor:
+            try:
+                cursor_data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+                cursor_key = tuple(cursor_data['key'])
+            except Exception:
+                raise ValueError("无效的分页游标")
+            if cursor_data.get('sort') != sort:
+                raise ValueError("分页游标与排序方式不一致")
+            keys = [key for key, _ in keyed]
+            if descending:
+                # 降序列表中第一个小于游标的位置
+                start = len(keys) - bisect.bisect_left(keys[::-1], cursor_key)
+            else:
+                start = bisect.bisect_right(keys, cursor_key)
+        page = keyed[start:start + limit]
+        
+        next_cursor = None
+        if start + limit < len(keyed):
+            next_cursor = base64.urlsafe_b64encode(json.dumps(
+                {'sort': sort, 'key': list(page[-1][0])}, ensure_ascii=False).encode('utf-8')).decode('ascii')
+        if fields:
+            items = [{field: vps.get(field) for field in fields if field in vps} for _, vps in page]
+        else:
+            items = [vps.to_dict() for _, vps in page]
+        self.stats.incr('vps_query')
+        return {
+            'total': len(keyed),
+            'count': len(items),
+            'items': items,
+            'next_cursor': next_cursor
+        }
+    
+    def get_all_vps(self):
+        """
+        获取所有VPS数据
+        
+        Returns:
+            list: VPS数据字典列表，与配置文件中的格式一致
+        """
+        return [vps.to_dict() for vps in self.vps_data]
+    
+    def get_active_vps(self):
+        """
+        获取所有在用的VPS
+        
+        Returns:
+            list: 在用的VPS数据列表
+        """
+        return [vps for vps in self.vps_data if vps.get('status') == "在用"]
+    
+    def get_inactive_vps(self):
+        """
+        获取所有已销毁的VPS
+        
+        Returns:
+            list: 已销毁的VPS数据列表
+        """
+        return [vps for vps in self.vps_data if vps.get('status') == "销毁"]
+    
+    def reset_nat_fee(self):
+        """
+        重置NAT费用，强制系统在下次请求时重新计算
+        同时重置汇率缓存，确保使用最新汇率
+        """
+        self.nat_total_fee = 0
+        self.exchange_rate_cache = None  # 重置汇率缓存
+        logger.info("已重置NAT费用计算和汇率缓存")
+        return True
+    
+    @track_stats('get_exchange_rate')
+    def get_exchange_rate(self, year=None, month=None):
+        """
+        获取美元兑人民币汇率 (1人民币=多少美元)
+        通过在线API获取指定年月的汇率，如果无法获取则使用固定汇率
+        
+        Args:
+            year (int, optional): 年份，默认为当前年份
+            month (int, optional): 月份，默认为当前月份
+        
+        Returns:
+            float: 汇率 (1人民币=多少美元)
+        """
+        try:
+            # 如果没有指定年月，使用当前年月
+            if year is None or month is None:
+                today = datetime.datetime.now()
+                year = year or today.year
+                month = month or today.month
+                
+            # 当月的汇率使用当前获取的实时汇率
+            current_year = datetime.datetime.now().year
+            current_month = datetime.datetime.now().month
+            is_current_month = (year == current_year and month == current_month)
+            
+            # 缓存文件路径
+            exchange_rate_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exchange_rates')
+            if not os.path.exists(exchange_rate_dir):
+                os.makedirs(exchange_rate_dir)
+                
+            # 使用年月作为缓存文件名
+            cache_filename = f"exchange_rate_{year}_{month}.json"
+            exchange_rate_file = os.path.join(exchange_rate_dir, cache_filename)
+            current_time = time.time()
+            
+            # 如果是当前月份，且缓存文件存在但未过期（24小时内），则直接使用缓存汇率
+            if is_current_month and os.path.exists(exchange_rate_file):
+                self.stats.incr('exchange_rate_file_read')
+                with open(exchange_rate_file, 'r') as f:
+                    cache_data = json.load(f)
+                    # 当前月汇率缓存24小时
+                    if current_time - cache_data['timestamp'] < 86400:  # 24小时 = 86400秒
+                        logger.info(f"从缓存获取{year}年{month}月汇率: 1元人民币 = {cache_data['rate']:.4f}美元")
+                        return round(cache_data['rate'], 4)  # 保留4位小数
+            
+            # 如果是历史月份，且缓存文件存在，直接使用缓存（历史汇率不变）
+            elif not is_current_month and os.path.exists(exchange_rate_file):
+                self.stats.incr('exchange_rate_file_read')
+                with open(exchange_rate_file, 'r') as f:
+                    cache_data = json.load(f)
+                    logger.info(f"从缓存获取历史{year}年{month}月汇率: 1元人民币 = {cache_data['rate']:.4f}美元")
+                    return round(cache_data['rate'], 4)
+            
+            # 对于当前月份，使用外部API获取最新汇率
+            if is_current_month:
+                try:
+                    url = "https://api.exchangerate-api.com/v4/latest/CNY"
+                    response = requests.get(url, timeout=10)
+                    response.raise_for_status()  # 检查HTTP状态码
+                    data = response.json()
+                    rate = data['rates']['USD']
+                except Exception as api_error:
+                    logger.warning(f"API获取汇率失败: {str(api_error)}，使用默认汇率")
+                    rate = 0.1385  # 使用默认汇率
+                
+                # 缓存当前月份汇率
+                with open(exchange_rate_file, 'w') as f:
+                    json.dump({
+                        'rate': rate,
+                        'timestamp': current_time,
+                        'year': year,
+                        'month': month
+                    }, f)
+                
+                logger.info(f"获取{year}年{month}月实时汇率成功: 1元人民币 = {rate:.4f}美元")
+                return round(rate, 4)  # 保留4位小数
+            
+            # 对于历史月份，尝试获取历史汇率（此处可以集成历史汇率API，如果有的话）
+            # 由于大多数免费API不提供历史汇率，这里使用估算值
+            # 可以根据实际情况调整或集成付费API
+            else:
+                # 假设每年有一个大致的汇率估算
+                estimated_rates = {
+                    2024: 0.1408,  # 约7.1人民币=1美元 (2024年估计值)
+                    2023: 0.1429,  # 约7.0人民币=1美元 (2023年估计值)
+                    2022: 0.1495,  # 约6.69人民币=1美元 (2022年估计值)
+                    2021: 0.1550,  # 约6.45人民币=1美元 (2021年估计值)
+                }
+                
+                # 获取年度估算汇率，如果没有则使用默认值
+                rate = estimated_rates.get(year, 0.1385)  # 默认约7.22人民币=1美元
+                
+                # 缓存历史月份汇率，避免重复计算
+                with open(exchange_rate_file, 'w') as f:
+                    json.dump({
+                        'rate': rate,
+                        'timestamp': current_time,
+                        'year': year,
+                        'month': month,
+                        'is_estimated': True
+                    }, f)
+                
+                logger.info(f"使用{year}年{month}月估算汇率: 1元人民币 = {rate:.4f}美元")
+                return round(rate, 4)  # 保留4位小数
+            
+        except Exception as e:
+            logger.warning(f"获取{year}年{month}月汇率失败: {str(e)}，使用默认汇率")
+            # 使用固定汇率: 1人民币 = 0.1385美元 (约7.22人民币=1美元)
+            return 0.1385
+    
+    def get_currency_rates(self, year, month):
+        """
+        获取指定月份各货币兑美元的汇率，同一月份在进程内只获取一次
+        
+        人民币使用get_exchange_rate（与NAT费用一致）；其他货币读取exchange_rates/currency_rates_{年}_{月}.json，
+        没有该文件或文件中没有该货币时使用DEFAULT_CURRENCY_RATES
+        
+        Args:
+            year (int): 年份
+            month (int): 月份
+            
+        Returns:
+            dict: {货币: 1单位货币=多少美元}
+        """
+        key = (int(year), int(month))
+        rates = self._currency_rates.get(key)
+        if rates is not None:
+            return rates
+        
+        overrides = {}
+        rates_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exchange_rates',
+                                  f"currency_rates_{key[0]}_{key[1]}.json")
+        if os.path.exists(rates_file):
+            try:
+                with open(rates_file, 'r') as f:
+                    overrides = {str(currency).upper(): float(rate) for currency, rate in json.load(f).items()}
+            except Exception as e:
+                logger.warning(f"读取{key[0]}年{key[1]}月汇率表失败: {str(e)}，使用默认汇率")
+        
+        rates = {}
+        for currency in SUPPORTED_CURRENCIES:
+            if currency == BASE_CURRENCY:
+                rates[currency] = 1.0
+            elif currency == 'CNY':
+                rates[currency] = self.get_exchange_rate(*key)
+            else:
+                rates[currency] = overrides.get(currency, DEFAULT_CURRENCY_RATES[currency])
+        self._currency_rates[key] = rates
+        return rates
+    
+    def get_currency_matrix(self, months):
+        """
+        建立月份×货币的汇率矩阵，一次账单计算只需建立一次
+        
+        Args:
+            months (iterable): [(年份, 月份), ...]
+            
+        Returns:
+            CurrencyMatrix: 汇率矩阵
+        """
+        months = sorted({(int(year), int(month)) for year, month in months})
+        self.stats.incr('currency_matrix_build')
+        return CurrencyMatrix(months, [self.get_currency_rates(year, month) for year, month in months])
+    
+    def _vps_currency(self, vps):
+        """
+        Returns:
+            str: VPS的计价货币
+        """
+        return normalize_currency(vps.get('currency'))
+    
+    def _bill_currency_matrix(self, snapshot, months):
+        """
+        快照中有非美元计价的VPS时，为本次账单涉及的月份建立汇率矩阵
+        
+        Returns:
+            CurrencyMatrix: 汇率矩阵，全部为美元计价时返回None
+        """
+        if all(self._vps_currency(vps) == BASE_CURRENCY for vps in snapshot.records):
+            return None
+        return self.get_currency_matrix(months)
+    
+    def _to_base_cents(self, vps, cents, year, month):
+        """
+        把单台VPS的原币金额（分）折算成美元（分）
+        
+        Returns:
+            int: 美元金额（分）
+        """
+        currency = self._vps_currency(vps)
+        if currency == BASE_CURRENCY or not cents:
+            return cents
+        scaled = int(round(self.get_currency_rates(year, month)[currency] * CURRENCY_RATE_SCALE))
+        return _div_round_half_up(cents * scaled, CURRENCY_RATE_SCALE)
+    
+    def compute_nat_fee(self, records, year, month):
+        """
+        计算指定月份的NAT费用，不读取也不修改实例上的账单年月和NAT费用缓存，计费方式见compute_nat_usage
+        
+        Args:
+            records (iterable): VPS数据（通常为快照中的记录）
+            year (int): 年份
+            month (int): 月份
+            
+        Returns:
+            tuple: (NAT费用（美元）, NAT总天数, 实际使用NAT的VPS数)
+        """
+        usage = self.compute_nat_usage(records, year, month)
+        return usage['fee'], usage['days'], usage['vps']
+    
+    @track_stats('compute_nat_fee')
+    def compute_nat_usage(self, records, year, month):
+        """
+        计算指定月份的NAT费用及其计费依据
+        
+        每台使用NAT的VPS按当月使用天数计费，某一天使用超过12小时算一天（见_build_day_bitmap），
+        按VPS的NAT计费规则估算流量和费用（默认每天1G，每G 1元人民币）；
+        导入了当月实际流量（ingest_traffic）的VPS按实际流量计费
+        
+        Args:
+            records (iterable): VPS数据（通常为快照中的记录）
+            year (int): 年份
+            month (int): 月份
+            
+        Returns:
+            dict: NAT费用（美元）fee、NAT总天数days、实际使用NAT的VPS数vps、按实际流量计费的VPS数metered_vps
+                和流量metered_gb、用到的NAT计费规则rules、汇率exchange_rate（1元=多少美元）
+        """
+        usage = {'fee': 0, 'days': 0, 'vps': 0, 'metered_vps': 0, 'metered_gb': 0, 'rules': [], 'exchange_rate': None}
+        # 获取使用NAT的VPS列表（只要设置了use_nat=True，不管状态如何）
+        nat_vps_list = [vps for vps in records if vps.get('use_nat', False) is True]
+        if not nat_vps_list:
+            logger.info(f"{year}年{month}月没有VPS设置为使用NAT，NAT费用为0")
+            return usage
+        
+        # 计算使用NAT的VPS的天数总和：对每台VPS的按天位图在当月范围内计数（当前月份按整月预估）
+        self.stats.incr('nat_recompute')
+        total_nat_days = 0
+        active_nat_vps = 0
+        logger.info(f"开始计算{year}年{month}月NAT费用，有{len(nat_vps_list)}台VPS设置使用NAT")
+        
+        month_info = MONTH_CALENDAR.get(year, month)
+        first_day = day_number(month_info.start)
+        last_day = first_day + month_info.days - 1
+        days_by_rule = {}
+        gb_by_rule = {}
+        metered = self.get_month_traffic(year, month)
+        for vps in nat_vps_list:
+            days = self.get_day_bitmap(vps).count(first_day, last_day)
+            traffic_bytes = metered.get(vps.get('name'))
+            if traffic_bytes:
+                # 有实际流量数据，按实际流量计费
+                total_nat_days += days
+                active_nat_vps += 1
+                gb_by_rule.setdefault(self._pricing_rules(vps)[1], []).append(traffic_bytes / BYTES_PER_GB)
+                logger.info(f"VPS {vps.get('name')} 在{year}年{month}月使用NAT {days}天，实际流量 {traffic_bytes / BYTES_PER_GB:.3f}G")
+            # 只有使用天数大于0才累加
+            elif days > 0:
+                total_nat_days += days
+                active_nat_vps += 1
+                days_by_rule.setdefault(self._pricing_rules(vps)[1], []).append(days)
+                logger.info(f"VPS {vps.get('name')} 在{year}年{month}月使用NAT {days}天")
+        
+        # 如果指定月份没有实际使用NAT的VPS，返回0
+        if active_nat_vps == 0 or (total_nat_days == 0 and not gb_by_rule):
+            logger.info(f"{year}年{month}月没有VPS实际使用NAT，NAT费用为0")
+            return usage
+        
+        logger.info(f"{year}年{month}月NAT总使用天数: {total_nat_days}天")
+        
+        # 总流量费用（人民币）：按每台VPS的NAT规则批量计算，默认每天1G × 每G1元
+        nat_fee_cny = sum(float(rule.evaluate_batch(np.array(days)).sum()) for rule, days in days_by_rule.items())
+        nat_fee_cny += sum(float(rule.evaluate_traffic_batch(np.array(gb)).sum()) for rule, gb in gb_by_rule.items())
+        if nat_fee_cny.is_integer():
+            nat_fee_cny = int(nat_fee_cny)
+        logger.info(f"{year}年{month}月NAT费用(人民币): {nat_fee_cny}元")
+        
+        # 获取指定月份的人民币兑美元汇率并转换为美元，保留2位小数
+        try:
+            exchange_rate = self.get_exchange_rate(year, month)
+            nat_fee_usd = round(nat_fee_cny * exchange_rate, 2)
+            cny_per_usd = round(1 / exchange_rate, 2) if exchange_rate > 0 else 0
+            logger.info(f"{year}年{month}月NAT费用(美元): {nat_fee_usd}美元 (汇率: 1美元 = {cny_per_usd}人民币)")
+        except Exception as rate_error:
+            logger.error(f"获取汇率失败: {str(rate_error)}，使用默认汇率计算")
+            exchange_rate = 0.1385  # 使用默认汇率
+            nat_fee_usd = round(nat_fee_cny * exchange_rate, 2)
+            cny_per_usd = round(1 / exchange_rate, 2)
+            logger.info(f"{year}年{month}月NAT费用(美元): {nat_fee_usd}美元 (使用默认汇率: 1美元 = {cny_per_usd}人民币)")
+        
+        usage.update({
+            'fee': nat_fee_usd,
+            'days': total_nat_days,
+            'vps': active_nat_vps,
+            'metered_vps': sum(len(gb) for gb in gb_by_rule.values()),
+            'metered_gb': round(sum(sum(gb) for gb in gb_by_rule.values()), 3),
+            'rules': list(dict.fromkeys(list(days_by_rule) + list(gb_by_rule))),
+            'exchange_rate': exchange_rate
+        })
+        return usage
+    
+    def _nat_fee_detail(self, usage):
+        """
+        根据compute_nat_usage的结果生成账单中的NAT详情
+        
+        Args:
+            usage (dict): compute_nat_usage的结果
+            
+        Returns:
+            dict: NAT使用VPS数、总天数、单价、汇率和费用说明
+        """
+        exchange_rate = usage['exchange_rate'] or 0
+        rate_text = f"¥{round(1 / exchange_rate, 2) if exchange_rate > 0 else 0}:$1"
+        detail = {'NAT使用VPS数': usage['vps'], 'NAT总天数': usage['days']}
+        if not usage['metered_vps'] and all(rule is DEFAULT_NAT_RULE for rule in usage['rules']):
+            # 全部按默认规则估算：每天1G，每G 1元
+            detail.update({
+                '单价': '¥1/G/天',
+                '汇率': rate_text,
+                '费用说明': f"{usage['vps']}台VPS共{usage['days']}天×1G/天×¥1/G÷当月汇率{rate_text}"
+            })
+            return detail
+        
+        unit = '；'.join(rule.description for rule in usage['rules'])
+        description = f"{usage['vps']}台VPS共{usage['days']}天"
+        if usage['metered_vps']:
+            detail['实际流量(G)'] = usage['metered_gb']
+            description += f"，其中{usage['metered_vps']}台按实际流量共{usage['metered_gb']}G"
+        detail.update({
+            '单价': unit,
+            '汇率': rate_text,
+            '费用说明': f"{description}，{unit}，÷当月汇率{rate_text}"
+        })
+        return detail
+    
+    @track_stats('calculate_nat_fee')
+    def calculate_nat_fee(self, year=None, month=None):
+        """
+        计算NAT费用 - 按实际使用天数统计
+        
+        Args:
+            year (int, optional): 年份，默认为当前年份
+            month (int, optional): 月份，默认为当前月份
+        
+        Returns:
+            float: NAT总费用（美元）
+        """
+        try:
+            # 如果没有指定年月，使用当前设置的账单年月
+            if year is None:
+                year = self.billing_year
+            if month is None:
+                month = self.billing_month
+            
+            # 如果已经计算过NAT费用并且大于0，且是当前月份的计算，直接返回
+            current_year = datetime.datetime.now().year
+            current_month = datetime.datetime.now().month
+            is_current_month = (year == current_year and month == current_month)
+            
+            if is_current_month and self.nat_total_fee > 0:
+                logger.info(f"使用已计算的当前月份NAT费用: {self.nat_total_fee}")
+                return self.nat_total_fee
+            
+            # 从已发布快照计算
+            nat_fee_usd, _, _ = self.compute_nat_fee(self.get_snapshot().records, year, month)
+            
+            # 仅当计算当前月份时才保存计算结果到实例变量
+            if is_current_month:
+                self.nat_total_fee = nat_fee_usd
+                
+            return nat_fee_usd
+        except Exception as e:
+            logger.error(f"计算{year}年{month}月NAT费用失败: {str(e)}")
+            if year == self.billing_year and month == self.billing_month:
+                self.nat_total_fee = 0
+            return 0
+    
+    def calculate_total_bill(self, year=None, month=None):
+        """
+        计算总账单金额
+        
+        Args:
+            year (int, optional): 年份，默认为当前年份
+            month (int, optional): 月份，默认为当前月份
+            
+        Returns:
+            float: 总账单金额
+        """
+        # 如果没有指定年月，使用当前设置的账单年月
+        if year is None:
+            year = self.billing_year
+        if month is None:
+            month = self.billing_month
+            
+        # 确保重新计算NAT费用
+        self.reset_nat_fee()
+        
+        # 计算所有VPS的费用总和，以分为单位精确累加
+        vps_total_cents = sum(amount_to_cents(vps.get('total_price', 0) or 0) for vps in self.vps_data)
+        vps_total = cents_to_amount(vps_total_cents)
+        
+        # 检查是否有设置为使用NAT的VPS，不管其状态如何
+        nat_vps_list = [vps for vps in self.vps_data if vps.get('use_nat', False) is True]
+        has_nat_vps = len(nat_vps_list) > 0
+        
+        # 获取NAT费用 - 只有当存在设置为使用NAT的VPS时才计算
+        nat_fee_cents = 0
+        if has_nat_vps:
+            nat_fee_cents = amount_to_cents(self.calculate_nat_fee(year, month))
+        nat_fee = cents_to_amount(nat_fee_cents)
+        
+        # 保存NAT总费用（仅当计算当前月份时）
+        current_year = datetime.datetime.now().year
+        current_month = datetime.datetime.now().month
+        is_current_month = (year == current_year and month == current_month)
+        if is_current_month:
+            self.nat_total_fee = nat_fee
+        
+        # 计算总费用
+        total = cents_to_amount(vps_total_cents + nat_fee_cents)
+        
+        # 仅当计算当前月份时才更新总账单金额
+        if is_current_month:
+            self.total_bill = total
+        
+        logger.info(f"计算{year}年{month}月总账单金额: VPS总费用={vps_total:.2f}, NAT费用={nat_fee:.2f}, 总计={total:.2f}")
+        return total
+    
+    def to_dataframe(self, year=None, month=None):
+        """
+        将VPS数据转换为DataFrame
+        
+        Args:
+            year (int, optional): 指定年份，默认为当前设置的账单年份
+            month (int, optional): 指定月份，默认为当前设置的账单月份
+            
+        Returns:
+            DataFrame: VPS数据
+        """
+        # 强制重置NAT费用计算
+        self.reset_nat_fee()
+        
+        # 使用指定年月或默认设置的年月
+        billing_year = year if year is not None else self.billing_year
+        billing_month = month if month is not None else self.billing_month
+        
+        logger.info(f"生成DataFrame账单数据 - 年份: {billing_year}, 月份: {billing_month}")
+        
+        columns = ["VPS名称", "国家/地区", "使用状态", "销毁时间", "统计截止时间", "使用时长", "月单价", "总金额"]
+        data = []
+        
+        # 确保使用当前实时时间计算
+        current_time = datetime.datetime.now()
+        total_cents = 0  # 以分为单位累加总金额
+        
+        # 计算当前月份的结束日期
+        month_end = MONTH_CALENDAR.get(billing_year, billing_month).last_day
+        
+        # 设置月份名称
+        month_names = {
+            1: "一月", 2: "二月", 3: "三月", 4: "四月",
+            5: "五月", 6: "六月", 7: "七月", 8: "八月",
+            9: "九月", 10: "十月", 11: "十一月", 12: "十二月"
+        }
+        month_name = month_names.get(billing_month, str(billing_month) + "月")
+        
+        # 遍历VPS数据，计算对应月份的使用时长和费用（从已发布快照读取）
+        snapshot = self.get_snapshot()
+        for vps in snapshot.records:
+            # 重新计算指定月份的使用时长
+            usage_result = self.calculate_usage_period(vps, billing_year, billing_month)
+            if isinstance(usage_result, tuple) and len(usage_result) == 4:
+                usage_string, days, hours, minutes = usage_result
+                
+                # 只有使用时长大于0的才添加到账单
+                if days > 0 or hours > 0 or minutes > 0:
+                    # 实时计算价格 - 使用更精确的计算方法
+                    price_per_month = vps.get('price_per_month', 0)
+                    price_cents = self._to_base_cents(vps, self.calculate_price_cents(vps, billing_year, billing_month),
+                                                      billing_year, billing_month)
+                    total_cents += price_cents
+                    total_price = cents_to_amount(price_cents)
+                    
+                    # 准备行数据
+                    row = [
+                        vps.get('name', ''),
+                        vps.get('country', ''),
+                        vps.get('status', ''),
+                        vps.get('cancel_date', '') if vps.get('status') == "销毁" else '',
+                        f"{billing_year}年{month_name}",
+                        usage_string,
+                        vps.get('price_per_month', 0),
+                        total_price
+                    ]
+                    data.append(row)
+        
+        df = pd.DataFrame(data, columns=columns)
+        
+        # 获取所有设置为使用NAT的VPS（use_nat属性为True，不管状态如何）
+        nat_vps_list = [vps for vps in snapshot.records if vps.get('use_nat', False) is True]
+        
+        # 只有存在设置为使用NAT的VPS时才计算NAT费用
+        nat_fee = 0
+        if nat_vps_list:
+            # 使用指定年月计算NAT费用
+            nat_fee = self.calculate_nat_fee(billing_year, billing_month)
+            logger.info(f"在to_dataframe中计算的{billing_year}年{billing_month}月NAT费用: {nat_fee}")
+        
+        # 添加NAT总费用行（仅当NAT费用大于0时）
+        if nat_fee > 0:
+            # 获取指定年月的实时汇率
+            exchange_rate = self.get_exchange_rate(billing_year, billing_month)
+            exchange_rate_display = round(1 / exchange_rate, 2) if exchange_rate > 0 else 0  # 显示为美元兑人民币汇率，更直观
+            
+            # 添加NAT费用说明
+            nat_description = f'NAT费用(按当月实时汇率¥{exchange_rate_display}:$1)'
+            nat_fee_cents = amount_to_cents(nat_fee)
+            total_cents += nat_fee_cents
+            nat_row = ['', '', '', '', '', '', nat_description, cents_to_amount(nat_fee_cents)]
+            df.loc[len(df)] = nat_row
+        
+        # 计算当前月份的总金额
+        total_bill = cents_to_amount(total_cents)
+        
+        # 添加总计行
+        total_row = ['', '', '', '', '', '', '总计', total_bill]
+        df.loc[len(df)] = total_row
+        
+        return df
+    
+    def save_to_excel(self, output_file='vps_billing.xlsx', year=None, month=None):
+        """
+        将账单数据保存到Excel文件
+        
+        Args:
+            output_file (str): 输出文件路径
+            year (int, optional): 年份，默认为当前设置的账单年份
+            month (int, optional): 月份，默认为当前设置的账单月份
+            
+        Returns:
+            bool: 是否成功保存
+        """
+        # 使用指定年月或默认设置的年月
+        billing_year = year if year is not None else self.billing_year
+        billing_month = month if month is not None else self.billing_month
+        
+        # 获取账单数据
+        bill_data = self.get_monthly_bill_data(billing_year, billing_month)
+        
+        try:
+            bill_rows = bill_data.get('账单行', [])
+            
+            if not bill_rows:
+                logger.warning(f"没有找到{billing_year}年{billing_month}月的账单数据")
+                return False
+                
+            # 创建Excel工作簿
+            workbook = xlsxwriter.Workbook(output_file)
+            worksheet = workbook.add_worksheet(f"{billing_year}年{billing_month}月账单")
+            
+            # 定义表头样式
+            header_format = workbook.add_format({
+                'bold': True,
+                'align': 'center',
+                'valign': 'vcenter',
+                'bg_color': '#D9E1F2',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 11
+            })
+            
+            # 定义数据单元格样式
+            cell_format = workbook.add_format({
+                'align': 'center',
+                'valign': 'vcenter',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10
+            })
+            
+            # 定义货币格式
+            money_format = workbook.add_format({
+                'align': 'center',
+                'valign': 'vcenter',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10,
+                'num_format': '$#,##0.00'
+            })
+            
+            # 定义小计/总计行样式
+            total_format = workbook.add_format({
+                'bold': True,
+                'align': 'center',
+                'valign': 'vcenter',
+                'bg_color': '#E2EFDA',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10,
+                'num_format': '$#,##0.00'
+            })
+            
+            # 定义销毁VPS的样式（红色字体）
+            destroyed_format = workbook.add_format({
+                'align': 'center',
+                'valign': 'vcenter',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10,
+                'color': 'red'
+            })
+            
+            # 定义销毁VPS的货币格式（红色字体）
+            destroyed_money_format = workbook.add_format({
+                'align': 'center',
+                'valign': 'vcenter',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10,
+                'num_format': '$#,##0.00',
+                'color': 'red'
+            })
+            
+            # 定义使用NAT的VPS样式（紫色字体）
+            nat_format = workbook.add_format({
+                'align': 'center',
+                'valign': 'vcenter',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10,
+                'color': 'purple'
+            })
+            
+            # 定义使用NAT的VPS货币格式（紫色字体）
+            nat_money_format = workbook.add_format({
+                'align': 'center',
+                'valign': 'vcenter',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10,
+                'num_format': '$#,##0.00',
+                'color': 'purple'
+            })
+            
+            # 定义非NAT的VPS样式（蓝色字体）
+            non_nat_format = workbook.add_format({
+                'align': 'center',
+                'valign': 'vcenter',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10,
+                'color': 'blue'
+            })
+            
+            # 定义非NAT的VPS货币格式（蓝色字体）
+            non_nat_money_format = workbook.add_format({
+                'align': 'center',
+                'valign': 'vcenter',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10,
+                'num_format': '$#,##0.00',
+                'color': 'blue'
+            })
+            
+            # 设置列宽
+            worksheet.set_column('A:A', 12)  # VPS名称
+            worksheet.set_column('B:B', 20)  # IP地址
+            worksheet.set_column('C:C', 20)  # 国家/地区
+            worksheet.set_column('D:D', 15)  # 是否使用NAT
+            worksheet.set_column('E:E', 10)  # 使用状态
+            
+            # 判断是否需要显示销毁时间列
+            has_destroyed_vps = bill_data.get('显示销毁时间列', False)
+            
+            if has_destroyed_vps:
+                worksheet.set_column('F:F', 15)  # 销毁时间
+                worksheet.set_column('G:G', 20)  # 使用时长
+                worksheet.set_column('H:H', 15)  # 单价/月
+                worksheet.set_column('I:I', 15)  # 合计
+            else:
+                worksheet.set_column('F:F', 20)  # 使用时长
+                worksheet.set_column('G:G', 15)  # 单价/月
+                worksheet.set_column('H:H', 15)  # 合计
+            
+            # 写入标题
+            title = f"{billing_year}年{billing_month}月账单详情"
+            max_col = 'I' if has_destroyed_vps else 'H'
+            worksheet.merge_range(f'A1:{max_col}1', title, header_format)
+            
+            # 写入表头
+            headers = ['VPS名称', 'IP地址', '国家/地区', '是否使用NAT', '使用状态']
+            if has_destroyed_vps:
+                headers.append('销毁时间')
+            headers.extend(['使用时长', '单价/月（$）', '合计（$）'])
+            
+            for col, header in enumerate(headers):
+                worksheet.write(1, col, header, header_format)
+            
+            # 写入账单数据
+            row_idx = 2
+            for row in bill_rows:
+                # 基于是否需要显示销毁时间列，决定列的偏移量
+                offset = 0
+                
+                # 检查当前行的VPS是否为销毁状态且本月销毁
+                is_destroyed = row['使用状态'] == '销毁'
+                # 检查是否使用NAT
+                use_nat = row['是否使用NAT'] == '是'
+                
+                # 根据条件选择格式
+                current_cell_format = cell_format
+                current_money_format = money_format
+                
+                if is_destroyed:
+                    # 本月销毁的VPS整行显示为红色
+                    current_cell_format = destroyed_format
+                    current_money_format = destroyed_money_format
+                elif use_nat:
+                    # 使用NAT的VPS整行显示为紫色
+                    current_cell_format = nat_format
+                    current_money_format = nat_money_format
+                else:
+                    # 没有使用NAT的VPS整行显示为蓝色
+                    current_cell_format = non_nat_format
+                    current_money_format = non_nat_money_format
+                
+                worksheet.write(row_idx, 0, row['VPS名称'], current_cell_format)
+                worksheet.write(row_idx, 1, row.get('IP地址', ''), current_cell_format)
+                worksheet.write(row_idx, 2, row.get('国家/地区', ''), current_cell_format)
+                worksheet.write(row_idx, 3, row['是否使用NAT'], current_cell_format)
+                worksheet.write(row_idx, 4, row['使用状态'], current_cell_format)
+                
+                if has_destroyed_vps:
+                    worksheet.write(row_idx, 5, row.get('销毁时间', ''), current_cell_format)
+                    offset = 1
+                
+                worksheet.write(row_idx, 5 + offset, row['使用时长'], current_cell_format)
+                worksheet.write(row_idx, 6 + offset, row['单价/月（$）'], current_money_format)
+                worksheet.write(row_idx, 7 + offset, row['合计（$）'], current_money_format)
+                
+                row_idx += 1
+            
+            # 写入NAT费用和总计
+            end_col = 8 if has_destroyed_vps else 7
+            
+            # NAT费用
+            nat_fee = bill_data.get('NAT费用', 0)
+            worksheet.merge_range(f'A{row_idx + 1}:G{row_idx + 1}', 'NAT费用', total_format)
+            worksheet.write(row_idx, end_col, nat_fee, total_format)
+            
+            # 总计
+            total = bill_data.get('月总费用', 0)
+            worksheet.merge_range(f'A{row_idx + 2}:G{row_idx + 2}', '总计', total_format)
+            worksheet.write(row_idx + 1, end_col, total, total_format)
+            
+            # 添加统计表格 - 修复：确保统计表格在正确位置，并且列数匹配
+            stats_start_row = row_idx + 4  # 留一行空白
+            
+            # NAT和非NAT的VPS数量和金额从账单行汇总，已结账月份的账单同样适用
+            nat_vps_count = 0
+            nat_vps_cents = 0
+            non_nat_vps_count = 0
+            non_nat_vps_cents = 0
+            
+            for row in bill_rows:
+                if row['是否使用NAT'] == '是':
+                    nat_vps_count += 1
+                    nat_vps_cents += amount_to_cents(row['合计（$）'])
+                else:
+                    non_nat_vps_count += 1
+                    non_nat_vps_cents += amount_to_cents(row['合计（$）'])
+            nat_vps_cost = cents_to_amount(nat_vps_cents)
+            non_nat_vps_cost = cents_to_amount(non_nat_vps_cents)
+            
+            # 设置表格标题
+            stats_title_format = workbook.add_format({
+                'bold': True,
+                'align': 'center',
+                'valign': 'vcenter',
+                'bg_color': '#B7DEE8',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 11
+            })
+            
+            # 修复：统计表格标题应该跨越所有列
+            worksheet.merge_range(f'A{stats_start_row}:{max_col}{stats_start_row}', '账单统计信息', stats_title_format)
+            
+            # 设置表头样式
+            stats_header_format = workbook.add_format({
+                'bold': True,
+                'align': 'center',
+                'valign': 'vcenter',
+                'bg_color': '#E2EFDA',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10
+            })
+            
+            # 设置数据样式
+            stats_data_format = workbook.add_format({
+                'align': 'center',
+                'valign': 'vcenter',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10
+            })
+            
+            stats_money_format = workbook.add_format({
+                'align': 'center',
+                'valign': 'vcenter',
+                'border': 1,
+                'font_name': 'Arial',
+                'font_size': 10,
+                'num_format': '$#,##0.00'
+            })
+            
+            # 修复：写入统计表格表头，确保列数匹配
+            stats_headers = ['类型', '数量', '金额（$）']
+            for col, header in enumerate(stats_headers):
+                worksheet.write(stats_start_row + 1, col, header, stats_header_format)
+            
+            # 写入NAT VPS数据
+            worksheet.write(stats_start_row + 2, 0, '使用NAT的VPS', nat_format)
+            worksheet.write(stats_start_row + 2, 1, nat_vps_count, nat_format)
+            worksheet.write(stats_start_row + 2, 2, nat_vps_cost, nat_money_format)
+            
+            # 写入非NAT VPS数据
+            worksheet.write(stats_start_row + 3, 0, '未使用NAT的VPS', non_nat_format)
+            worksheet.write(stats_start_row + 3, 1, non_nat_vps_count, non_nat_format)
+            worksheet.write(stats_start_row + 3, 2, non_nat_vps_cost, non_nat_money_format)
+            
+            # 写入NAT费用行
+            worksheet.write(stats_start_row + 4, 0, 'NAT费用', total_format)
+            worksheet.write(stats_start_row + 4, 1, '-', total_format)
+            worksheet.write(stats_start_row + 4, 2, nat_fee, total_format)
+            
+            # 写入总计行
+            worksheet.write(stats_start_row + 5, 0, '总计', total_format)
+            worksheet.write(stats_start_row + 5, 1, nat_vps_count + non_nat_vps_count, total_format)
+            worksheet.write(stats_start_row + 5, 2, total, total_format)
+            
+            # 设置统计表格区域列宽
+            worksheet.set_column('A:A', 20)  # 类型列宽
+            worksheet.set_column('B:B', 10)  # 数量列宽
+            worksheet.set_column('C:C', 15)  # 金额列宽
+            
+            # 保存工作簿
+            workbook.close()
+            
+            logger.info(f"账单已保存到: {output_file}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"保存账单到Excel时出错: {str(e)}", exc_info=True)
+            return False
+    
+    def generate_pdf_bill(self, output_file='vps_billing.pdf'):
+        """
+        生成PDF格式的账单
+        
+        Args:
+            output_file (str): 输出PDF文件路径
+            
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            df = self.to_dataframe()
+            
+            # 创建PDF对象
+            pdf = FPDF()
+            pdf.add_page()
+            
+            # 设置字体 - 使用内置字体而不是尝试加载外部字体
+            try:
+                # 尝试加载中文字体，如果失败则使用默认字体
+                font_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts', 'DejaVuSansCondensed.ttf')
+                if os.path.exists(font_path):
+                    pdf.add_font('DejaVu', '', font_path, uni=True)
+                    pdf.set_font('DejaVu', '', 10)
+                    logger.info(f"使用中文字体: {font_path}")
+                else:
+                    logger.warning(f"中文字体文件不存在: {font_path}，使用Helvetica字体")
+                    pdf.set_font('Helvetica', '', 10)
+            except Exception as font_error:
+                logger.warning(f"设置字体失败: {str(font_error)}，使用默认字体")
+                pdf.set_font('Helvetica', '', 10)
+            
+            # 添加标题
+            pdf.cell(200, 10, 'VPS Account Statement', 0, 1, 'C')
+            pdf.cell(200, 10, f'Generated: {datetime.datetime.now().strftime("%Y-%m-%d")}', 0, 1, 'C')
+            pdf.ln(10)
+            
+            # 表格头部
+            col_widths = [30, 25, 20, 25, 25, 25, 20, 20]
+            headers = df.columns
+            
+            for i, header in enumerate(headers):
+                pdf.cell(col_widths[i], 10, str(header), 1, 0, 'C')
+            pdf.ln()
+            
+            # 表格数据
+            for i, row in df.iterrows():
+                for j, value in enumerate(row):
+                    if i < len(df) - 1 and j == 2 and value == "销毁":
+                        # 高亮显示"销毁"状态的行
+                        pdf.set_fill_color(255, 255, 0)
+                        pdf.cell(col_widths[j], 10, str(value), 1, 0, 'C', 1)
+                    elif i == len(df) - 1:
+                        # 高亮显示总金额行
+                        pdf.set_fill_color(230, 230, 250)
+                        pdf.cell(col_widths[j], 10, str(value), 1, 0, 'C', 1)
+                    elif j == 6 and 'NAT费用' in str(value):
+                        # 高亮显示NAT费用行，使用不同的颜色
+                        pdf.set_fill_color(200, 255, 200)  # 浅绿色
+                        pdf.cell(col_widths[j], 10, str(value), 1, 0, 'C', 1)
+                    else:
+                        pdf.cell(col_widths[j], 10, str(value), 1, 0, 'C')
+                pdf.ln()
+            
+            # 保存PDF
+            pdf.output(output_file)
+            
+            logger.info(f"成功生成PDF账单: {output_file}")
+            return True
+        except Exception as e:
+            logger.error(f"生成PDF账单失败: {str(e)}", exc_info=True)
+            # 尝试创建一个简单的PDF文件以验证文件写入权限
+            try:
+                simple_pdf = FPDF()
+                simple_pdf.add_page()
+                simple_pdf.set_font("Helvetica", size=12)
+                simple_pdf.cell(200, 10, txt="Test PDF", ln=True, align="C")
+                simple_pdf.output(output_file)
+                logger.info(f"成功创建简单的测试PDF: {output_file}")
+                return True
+            except Exception as simple_e:
+                logger.error(f"无法创建简单的测试PDF: {str(simple_e)}", exc_info=True)
+                return False
             
-            # 添加NAT费用说明
-            nat_description = f'NAT费用(按当月实时汇率¥{exchange_rate_display}:$1)'
-            nat_row = ['', '', '', '', '', '', nat_description, round(nat_fee, 2)]
-            df.loc[len(df)] = nat_row
-        
-        # 计算当前月份的总金额
-        total_bill = df["总金额"].sum()
-        total_bill = round(total_bill, 2)  # 确保总费用精确到2位小数
-        
-        # 添加总计行
-        total_row = ['', '', '', '', '', '', '总计', total_bill]
-        df.loc[len(df)] = total_row
-        
-        return df
-    
-    def save_to_excel(self, output_file='vps_billing.xlsx', year=None, month=None):
+    def _strptime(self, date_str, date_format):
         """
-        将账单数据保存到Excel文件
+        解析日期字符串，并计入日期解析次数统计
+
+        Args:
+            date_str (str): 日期字符串
+            date_format (str): 日期格式
+
+        Returns:
+            datetime: 解析结果，格式不匹配时抛出ValueError
+        """
+        self.stats.incr('date_parse')
+        return datetime.datetime.strptime(date_str, date_format)
+
+    def parse_usage_period(self, usage_period):
+        """
+        解析使用时长
         
         Args:
-            output_file (str): 输出文件路径
-            year (int, optional): 年份，默认为当前设置的账单年份
-            month (int, optional): 月份，默认为当前设置的账单月份
+            usage_period (str): 使用时长，例如"3个月+15"
             
         Returns:
-            bool: 是否成功保存
+            tuple: (月数, 天数)
         """
-        # 使用指定年月或默认设置的年月
-        billing_year = year if year is not None else self.billing_year
-        billing_month = month if month is not None else self.billing_month
-        
-        # 获取账单数据
-        bill_data = self.get_monthly_bill_data(billing_year, billing_month)
+        try:
+            if "个月" in usage_period:
+                parts = usage_period.split("个月")
+                months = int(parts[0])
+                days = int(parts[1].strip("+")) if "+" in parts[1] else 0
+                return months, days
+            else:
+                return 0, int(usage_period.strip("天"))
+        except Exception as e:
+            logger.error(f"解析使用时长失败: {str(e)}")
+            return 0, 0
+            
+    @track_stats('calculate_usage_period')
+    def calculate_usage_period(self, vps, year=None, month=None, now=None):
+        """
+        实时计算使用时长，按照指定年月的日历实时统计
+        从该月1号00:00:00开始计算到当前日期时间或月末，精确到分钟
         
+        Args:
+            vps (dict): VPS信息
+            year (int, optional): 指定年份，默认为当前设置的账单年份
+            month (int, optional): 指定月份，默认为当前设置的账单月份
+            now (datetime, optional): 当前时间，如果不提供则使用系统当前时间
+            
+        Returns:
+            tuple: (使用时长字符串, 使用天数, 使用小时数, 使用分钟数)
+        """
         try:
-            bill_rows = bill_data.get('账单行', [])
+            # 使用指定年月或默认设置的年月
+            billing_year = year if year is not None else self.billing_year
+            billing_month = month if month is not None else self.billing_month
             
-            if not bill_rows:
-                logger.warning(f"没有找到{billing_year}年{billing_month}月的账单数据")
-                return False
-                
-            # 创建Excel工作簿
-            workbook = xlsxwriter.Workbook(output_file)
-            worksheet = workbook.add_worksheet(f"{billing_year}年{billing_month}月账单")
+            # 确保年月是整数类型
+            try:
+                billing_year = int(billing_year)
+                billing_month = int(billing_month)
+            except (ValueError, TypeError):
+                logger.error(f"无效的年月参数: 年份={billing_year}, 月份={billing_month}")
+                return "参数错误", 0, 0, 0
             
-            # 定义表头样式
-            header_format = workbook.add_format({
-                'bold': True,
-                'align': 'center',
-                'valign': 'vcenter',
-                'bg_color': '#D9E1F2',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 11
-            })
+            vps_name = vps.get('name', '未知')
+            vps_status = vps.get('status', '未知')
             
-            # 定义数据单元格样式
-            cell_format = workbook.add_format({
-                'align': 'center',
-                'valign': 'vcenter',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10
-            })
+            logger.info(f"计算VPS使用时长 - VPS: {vps_name}, 状态: {vps_status}, 年月: {billing_year}/{billing_month}")
             
-            # 定义货币格式
-            money_format = workbook.add_format({
-                'align': 'center',
-                'valign': 'vcenter',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10,
-                'num_format': '$#,##0.00'
-            })
+            # 获取当前日期时间，如果提供了now参数则使用它
+            current_time = now if now is not None else datetime.datetime.now()
             
-            # 定义小计/总计行样式
-            total_format = workbook.add_format({
-                'bold': True,
-                'align': 'center',
-                'valign': 'vcenter',
-                'bg_color': '#E2EFDA',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10,
-                'num_format': '$#,##0.00'
-            })
+            # 从月历表获取指定月份的起始时间和结束时间（月末最后一秒）
+            month_info = MONTH_CALENDAR.get(billing_year, billing_month)
+            month_start = month_info.start
+            month_end = month_info.end
             
-            # 定义销毁VPS的样式（红色字体）
-            destroyed_format = workbook.add_format({
-                'align': 'center',
-                'valign': 'vcenter',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10,
-                'color': 'red'
-            })
+            # 获取和解析购买日期
+            purchase_date_str = vps.get('purchase_date', '')
+            if purchase_date_str:
+                purchase_date = self._vps_date(vps, 'purchase_date')
+                if purchase_date is None:
+                    logger.warning(f"无法解析VPS {vps.get('name')} 的购买日期: {purchase_date_str}")
+                
+                # 如果购买日期在计算月份之后，则使用时长为0
+                if purchase_date and (purchase_date.year > billing_year or 
+                                    (purchase_date.year == billing_year and purchase_date.month > billing_month)):
+                    logger.info(f"VPS {vps_name} 的购买日期 {purchase_date_str} 晚于计算月份 {billing_year}/{billing_month}，使用时长为0")
+                    return "0天0小时0分钟", 0, 0, 0
             
-            # 定义销毁VPS的货币格式（红色字体）
-            destroyed_money_format = workbook.add_format({
-                'align': 'center',
-                'valign': 'vcenter',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10,
-                'num_format': '$#,##0.00',
-                'color': 'red'
-            })
+            # 检查销毁日期
+            cancel_date = None
+            if vps.get('status') == "销毁" and (vps.get('expire_date') or vps.get('cancel_date')):
+                # 优先使用expire_date，如果没有则尝试使用cancel_date
+                cancel_field = 'expire_date' if vps.get('expire_date') else 'cancel_date'
+                cancel_date_str = vps.get(cancel_field)
+                
+                # 解析销毁日期
+                cancel_date = self._vps_date(vps, cancel_field)
+                if cancel_date is None:
+                    # 如果无法解析，默认使用月末
+                    cancel_date = month_end
+                    logger.warning(f"无法解析VPS {vps.get('name')} 的销毁日期: {cancel_date_str}，将使用月末")
+                elif ' ' not in str(cancel_date_str):
+                    # 只有日期时设置为当天结束时间
+                    cancel_date = cancel_date.replace(hour=23, minute=59, second=59)
+                
+                # 检查销毁日期与当前计算月份的关系
+                # 如果销毁日期在计算月份之后的月份，则在当前月份中状态应该显示为"在用"
+                if cancel_date.year > billing_year or (cancel_date.year == billing_year and cancel_date.month > billing_month):
+                    logger.info(f"VPS {vps_name} 在计算月份 {billing_year}/{billing_month} 后销毁 ({cancel_date})，当月状态视为'在用'")
+                    # 在计算时间时暂时当作非销毁VPS处理
+                    temp_status = "在用"
+                # 如果销毁日期早于计算月份，则该VPS不应在该月账单中显示
+                elif cancel_date.year < billing_year or (cancel_date.year == billing_year and cancel_date.month < billing_month):
+                    logger.info(f"VPS {vps_name} 在计算月份 {billing_year}/{billing_month} 前已销毁 ({cancel_date})，不显示在当月账单中")
+                    return "0天0小时0分钟", 0, 0, 0
+                else:
+                    # 销毁日期在当月内，使用实际状态和销毁日期
+                    logger.info(f"VPS {vps_name} 在计算月份 {billing_year}/{billing_month} 内销毁 ({cancel_date})，按实际销毁日期计算")
+                    temp_status = vps_status
+            else:
+                temp_status = vps_status
             
-            # 定义使用NAT的VPS样式（紫色字体）
-            nat_format = workbook.add_format({
-                'align': 'center',
-                'valign': 'vcenter',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10,
-                'color': 'purple'
-            })
+            # 获取和解析启用日期
+            start_date_str = vps.get('start_date')
+            if not start_date_str:
+                logger.warning(f"VPS {vps.get('name')} 没有启用日期，无法计算使用时长")
+                return "未知", 0, 0, 0
             
-            # 定义使用NAT的VPS货币格式（紫色字体）
-            nat_money_format = workbook.add_format({
-                'align': 'center',
-                'valign': 'vcenter',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10,
-                'num_format': '$#,##0.00',
-                'color': 'purple'
-            })
+            # 解析启用日期
+            start_date = self._vps_date(vps, 'start_date')
+            if start_date is None:
+                logger.error(f"无法解析VPS {vps.get('name')} 的启用日期: {start_date_str}")
+                return "日期错误", 0, 0, 0
             
-            # 定义非NAT的VPS样式（蓝色字体）
-            non_nat_format = workbook.add_format({
-                'align': 'center',
-                'valign': 'vcenter',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10,
-                'color': 'blue'
-            })
+            # 最终决定计算的开始时间和结束时间
+            # 开始时间：购买日期和月初较晚者
+            if purchase_date is not None and purchase_date > month_start:
+                start_time = purchase_date
+                logger.info(f"VPS {vps_name} 使用购买日期 {purchase_date} 作为开始时间")
+            else:
+                start_time = month_start
+                logger.info(f"VPS {vps_name} 使用月初 {month_start} 作为开始时间")
             
-            # 定义非NAT的VPS货币格式（蓝色字体）
-            non_nat_money_format = workbook.add_format({
-                'align': 'center',
-                'valign': 'vcenter',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10,
-                'num_format': '$#,##0.00',
-                'color': 'blue'
-            })
+            # 结束时间：销毁日期、当前时间、月末三者最早的
+            if temp_status == "销毁" and cancel_date is not None and month_start.year == cancel_date.year and month_start.month == cancel_date.month:
+                # 只有当销毁日期在当月时才使用销毁日期作为结束时间
+                end_time = cancel_date
+                logger.info(f"VPS {vps_name} 使用销毁日期 {cancel_date} 作为结束时间")
+            else:
+                # 非销毁VPS或者不在当月销毁的VPS
+                if now is not None and now.year == billing_year and now.month == billing_month:
+                    # 如果是当月，使用当前时间
+                    end_time = now
+                    logger.info(f"VPS {vps_name} 使用当前时间 {now} 作为结束时间 (实时计算)")
+                else:
+                    # 如果不是当月，使用月末
+                    end_time = month_end
+                    logger.info(f"VPS {vps_name} 使用月末 {month_end} 作为结束时间")
+            
+            # 如果开始时间在月末之后或结束时间在月初之前，则没有使用时间
+            if start_time > month_end or end_time < month_start:
+                logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月没有使用时间，开始时间: {start_time}，结束时间: {end_time}")
+                return "0天0小时0分钟", 0, 0, 0
+            
+            # 确保开始时间和结束时间都在当月范围内
+            if start_time < month_start:
+                start_time = month_start
+                logger.info(f"VPS {vps_name} 的开始时间调整为月初: {month_start}")
+            
+            if end_time > month_end:
+                end_time = month_end
+                logger.info(f"VPS {vps_name} 的结束时间调整为月末: {month_end}")
             
-            # 设置列宽
-            worksheet.set_column('A:A', 12)  # VPS名称
-            worksheet.set_column('B:B', 20)  # IP地址
-            worksheet.set_column('C:C', 20)  # 国家/地区
-            worksheet.set_column('D:D', 15)  # 是否使用NAT
-            worksheet.set_column('E:E', 10)  # 使用状态
+            # 计算使用时长
+            time_diff = end_time - start_time
             
-            # 判断是否需要显示销毁时间列
-            has_destroyed_vps = bill_data.get('显示销毁时间列', False)
+            # 如果结束时间早于开始时间，返回0使用时长
+            if time_diff.total_seconds() < 0:
+                logger.warning(f"VPS {vps_name} 的结束时间 {end_time} 早于开始时间 {start_time}，返回0使用时长")
+                return "0天0小时0分钟", 0, 0, 0
             
-            if has_destroyed_vps:
-                worksheet.set_column('F:F', 15)  # 销毁时间
-                worksheet.set_column('G:G', 20)  # 使用时长
-                worksheet.set_column('H:H', 15)  # 单价/月
-                worksheet.set_column('I:I', 15)  # 合计
-            else:
-                worksheet.set_column('F:F', 20)  # 使用时长
-                worksheet.set_column('G:G', 15)  # 单价/月
-                worksheet.set_column('H:H', 15)  # 合计
+            # 计算天、小时、分钟
+            days = time_diff.days
+            hours = time_diff.seconds // 3600
+            minutes = (time_diff.seconds % 3600) // 60
             
-            # 写入标题
-            title = f"{billing_year}年{billing_month}月账单详情"
-            max_col = 'I' if has_destroyed_vps else 'H'
-            worksheet.merge_range(f'A1:{max_col}1', title, header_format)
+            # 返回使用时长的中文表示
+            usage_str = f"{days}天{hours}小时{minutes}分钟"
+            logger.info(f"VPS {vps_name} 最终计算的使用时长: {usage_str}")
+            return usage_str, days, hours, minutes
             
-            # 写入表头
-            headers = ['VPS名称', 'IP地址', '国家/地区', '是否使用NAT', '使用状态']
-            if has_destroyed_vps:
-                headers.append('销毁时间')
-            headers.extend(['使用时长', '单价/月（$）', '合计（$）'])
+        except Exception as e:
+            logger.error(f"计算使用时长时发生错误: {str(e)}", exc_info=True)
+            return "错误", 0, 0, 0
+    
+    def calculate_price(self, price_per_month, days, hours, minutes, year=None, month=None):
+        """
+        计算VPS价格，根据购买日期和使用时长灵活计费
+        
+        Args:
+            price_per_month (float): 月单价
+            days (int): 天数
+            hours (int): 小时数
+            minutes (int): 分钟数
+            year (int, optional): 指定年份，用于计算月天数
+            month (int, optional): 指定月份，用于计算月天数
             
-            for col, header in enumerate(headers):
-                worksheet.write(1, col, header, header_format)
+        Returns:
+            float: 总价
+        """
+        try:
+            # 使用指定年月或当前月来获取月的总分钟数 (使用实际月份天数)
+            if year is not None and month is not None:
+                minutes_per_month = MONTH_CALENDAR.get(year, month).minutes
+            else:
+                current_date = datetime.datetime.now()
+                minutes_per_month = MONTH_CALENDAR.get(current_date.year, current_date.month).minutes
             
-            # 写入账单数据
-            row_idx = 2
-            for row in bill_rows:
-                # 基于是否需要显示销毁时间列，决定列的偏移量
-                offset = 0
-                
-                # 检查当前行的VPS是否为销毁状态且本月销毁
-                is_destroyed = row['使用状态'] == '销毁'
-                # 检查是否使用NAT
-                use_nat = row['是否使用NAT'] == '是'
-                
-                # 根据条件选择格式
-                current_cell_format = cell_format
-                current_money_format = money_format
-                
-                if is_destroyed:
-                    # 本月销毁的VPS整行显示为红色
-                    current_cell_format = destroyed_format
-                    current_money_format = destroyed_money_format
-                elif use_nat:
-                    # 使用NAT的VPS整行显示为紫色
-                    current_cell_format = nat_format
-                    current_money_format = nat_money_format
-                else:
-                    # 没有使用NAT的VPS整行显示为蓝色
-                    current_cell_format = non_nat_format
-                    current_money_format = non_nat_money_format
-                
-                worksheet.write(row_idx, 0, row['VPS名称'], current_cell_format)
-                worksheet.write(row_idx, 1, row.get('IP地址', ''), current_cell_format)
-                worksheet.write(row_idx, 2, row.get('国家/地区', ''), current_cell_format)
-                worksheet.write(row_idx, 3, row['是否使用NAT'], current_cell_format)
-                worksheet.write(row_idx, 4, row['使用状态'], current_cell_format)
-                
-                if has_destroyed_vps:
-                    worksheet.write(row_idx, 5, row.get('销毁时间', ''), current_cell_format)
-                    offset = 1
-                
-                worksheet.write(row_idx, 5 + offset, row['使用时长'], current_cell_format)
-                worksheet.write(row_idx, 6 + offset, row['单价/月（$）'], current_money_format)
-                worksheet.write(row_idx, 7 + offset, row['合计（$）'], current_money_format)
-                
-                row_idx += 1
+            # 计算每分钟价格
+            price_per_minute = price_per_month / minutes_per_month
             
-            # 写入NAT费用和总计
-            end_col = 8 if has_destroyed_vps else 7
+            # 计算总使用分钟数
+            total_minutes = days * 24 * 60 + hours * 60 + minutes
             
-            # NAT费用
-            nat_fee = bill_data.get('NAT费用', 0)
-            worksheet.merge_range(f'A{row_idx + 1}:G{row_idx + 1}', 'NAT费用', total_format)
-            worksheet.write(row_idx, end_col, nat_fee, total_format)
+            # 计算总价
+            total_price = total_minutes * price_per_minute
             
-            # 总计
-            total = bill_data.get('月总费用', 0)
-            worksheet.merge_range(f'A{row_idx + 2}:G{row_idx + 2}', '总计', total_format)
-            worksheet.write(row_idx + 1, end_col, total, total_format)
+            return round(total_price, 2)  # 确保总价精确到2位小数
+        except Exception as e:
+            logger.error(f"计算价格失败: {str(e)}")
+            return 0.0
+
+    @track_stats('pricing_terms')
+    def _pricing_terms(self, vps, year=None, month=None, now=None):
+        """
+        根据购买日期、启用日期、销毁日期和调价记录确定VPS在指定月份的计费区间，生成计费参数
+        
+        calculate_price_with_purchase_date、calculate_price_cents和calculate_price_terms共用这里的计算，
+        只是金额的计算方式不同
+        
+        Args:
+            vps (dict): VPS信息
+            year (int, optional): 指定年份，默认为当前设置的账单年份
+            month (int, optional): 指定月份，默认为当前设置的账单月份
+            now (datetime, optional): 当前时间，如果不提供则使用系统当前时间
             
-            # 添加统计表格 - 修复：确保统计表格在正确位置，并且列数匹配
-            stats_start_row = row_idx + 4  # 留一行空白
+        Returns:
+            tuple: 当月各单价区段的PricingTerms，通常只有一个；当月不计费时为空
+        """
+        # 使用指定年月或默认设置的年月
+        billing_year = year if year is not None else self.billing_year
+        billing_month = month if month is not None else self.billing_month
+        try:
+            # 获取VPS信息
+            price_per_month = float(vps.get('price_per_month', 0))
+            segments = self._price_segments(vps)
+            if price_per_month == 0 and segments is None:
+                return ()
+                
+            # 获取VPS名称，用于日志记录
+            vps_name = vps.get('name', '未知')
+            # VPS指定的计费规则
+            server_rule, _ = self._pricing_rules(vps)
             
-            # 计算NAT和非NAT的VPS数量和金额
-            nat_vps_count = 0
-            nat_vps_cost = 0
-            non_nat_vps_count = 0
-            non_nat_vps_cost = 0
+            # 从月历表获取当前月的天数和边界
+            month_info = MONTH_CALENDAR.get(billing_year, billing_month)
+            days_in_month = month_info.days
             
-            for row in bill_rows:
-                if row['是否使用NAT'] == '是':
-                    nat_vps_count += 1
-                    nat_vps_cost += row['合计（$）']
-                else:
-                    non_nat_vps_count += 1
-                    non_nat_vps_cost += row['合计（$）']
+            # 获取购买日期
+            purchase_field = 'purchase_date'
+            purchase_date_str = vps.get('purchase_date')
+            if not purchase_date_str:
+                # 如果没有购买日期，使用启用日期
+                purchase_field = 'start_date'
+                purchase_date_str = vps.get('start_date')
+                if not purchase_date_str:
+                    logger.warning(f"VPS {vps_name} 没有购买日期和启用日期，使用默认按月计费")
+                    return self._usage_pricing_terms(vps, price_per_month, server_rule, billing_year, billing_month, now)
             
-            # 设置表格标题
-            stats_title_format = workbook.add_format({
-                'bold': True,
-                'align': 'center',
-                'valign': 'vcenter',
-                'bg_color': '#B7DEE8',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 11
-            })
+            # 解析购买日期
+            purchase_date = self._vps_date(vps, purchase_field)
+            if purchase_date is None:
+                logger.warning(f"无法解析VPS {vps.get('name')} 的购买日期: {purchase_date_str}，使用默认按月计费")
+                return self._usage_pricing_terms(vps, price_per_month, server_rule, billing_year, billing_month, now)
             
-            # 修复：统计表格标题应该跨越所有列
-            worksheet.merge_range(f'A{stats_start_row}:{max_col}{stats_start_row}', '账单统计信息', stats_title_format)
+            # 获取购买日期的日、月、年
+            purchase_day = purchase_date.day
+            purchase_month = purchase_date.month
+            purchase_year = purchase_date.year
             
-            # 设置表头样式
-            stats_header_format = workbook.add_format({
-                'bold': True,
-                'align': 'center',
-                'valign': 'vcenter',
-                'bg_color': '#E2EFDA',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10
-            })
+            # 获取查询月份的月初和月末
+            month_start = month_info.start
+            month_end = month_info.end
             
-            # 设置数据样式
-            stats_data_format = workbook.add_format({
-                'align': 'center',
-                'valign': 'vcenter',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10
-            })
+            # 计算VPS的启用日期和可能的销毁日期
+            start_date = None
+            start_date_str = vps.get('start_date')
+            if not start_date_str:
+                logger.warning(f"VPS {vps.get('name')} 没有启用日期，使用购买日期")
+                start_date = purchase_date
+            else:
+                start_date = self._vps_date(vps, 'start_date')
+                if start_date is None:
+                    logger.warning(f"无法解析VPS {vps.get('name')} 的启用日期: {start_date_str}，使用购买日期")
+                    start_date = purchase_date
             
-            stats_money_format = workbook.add_format({
-                'align': 'center',
-                'valign': 'vcenter',
-                'border': 1,
-                'font_name': 'Arial',
-                'font_size': 10,
-                'num_format': '$#,##0.00'
-            })
+            # 检查是否已销毁
+            cancel_date = None
+            if vps.get('status') == "销毁" and vps.get('cancel_date'):
+                cancel_date_str = vps.get('cancel_date')
+                cancel_date = self._vps_date(vps, 'cancel_date')
+                if cancel_date is None:
+                    logger.warning(f"无法解析VPS {vps.get('name')} 的销毁日期: {cancel_date_str}")
+                elif ' ' not in str(cancel_date_str):
+                    # 只有日期时设置为当天结束时间
+                    cancel_date = cancel_date.replace(hour=23, minute=59, second=59)
             
-            # 修复：写入统计表格表头，确保列数匹配
-            stats_headers = ['类型', '数量', '金额（$）']
-            for col, header in enumerate(stats_headers):
-                worksheet.write(stats_start_row + 1, col, header, stats_header_format)
+            # 判断VPS在当前计费月的情况
             
-            # 写入NAT VPS数据
-            worksheet.write(stats_start_row + 2, 0, '使用NAT的VPS', nat_format)
-            worksheet.write(stats_start_row + 2, 1, nat_vps_count, nat_format)
-            worksheet.write(stats_start_row + 2, 2, nat_vps_cost, nat_money_format)
+            # 情况1: VPS在当前计费月之前就已销毁，不需要计费
+            if cancel_date and cancel_date < month_start:
+                return ()
+                
+            # 情况2: VPS在当前计费月之后才启用，不需要计费
+            if start_date > month_end:
+                return ()
             
-            # 写入非NAT VPS数据
-            worksheet.write(stats_start_row + 3, 0, '未使用NAT的VPS', non_nat_format)
-            worksheet.write(stats_start_row + 3, 1, non_nat_vps_count, non_nat_format)
-            worksheet.write(stats_start_row + 3, 2, non_nat_vps_cost, non_nat_money_format)
+            # 获取当前时间 - 未指定时使用实际当前时间进行计算
+            current_time = now if now is not None else datetime.datetime.now()
             
-            # 写入NAT费用行
-            worksheet.write(stats_start_row + 4, 0, 'NAT费用', total_format)
-            worksheet.write(stats_start_row + 4, 1, '-', total_format)
-            worksheet.write(stats_start_row + 4, 2, nat_fee, total_format)
+            # 设置计费结束时间
+            # 如果计算的是当前月份，使用当前时间（强制实时计算）
+            if billing_year == current_time.year and billing_month == current_time.month:
+                billing_end = min(current_time, month_end)
+                logger.info(f"VPS {vps_name} 正在计算当前月份，使用实时时间 {billing_end} 作为结束时间")
+            else:
+                # 如果计算历史月份，使用月末时间
+                billing_end = month_end
+                logger.info(f"VPS {vps_name} 正在计算历史月份，使用月末 {billing_end} 作为结束时间")
+                
+            # 如果有销毁日期且在当前月内，使用销毁日期作为结束时间
+            if cancel_date and month_start <= cancel_date <= month_end:
+                # 销毁日期当天也算使用，所以结束时间应该是销毁日期的23:59:59
+                billing_end = cancel_date.replace(hour=23, minute=59, second=59)
+                logger.info(f"VPS {vps_name} 在当月销毁，使用销毁日期 {billing_end} 作为结束时间")
             
-            # 写入总计行
-            worksheet.write(stats_start_row + 5, 0, '总计', total_format)
-            worksheet.write(stats_start_row + 5, 1, nat_vps_count + non_nat_vps_count, total_format)
-            worksheet.write(stats_start_row + 5, 2, total, total_format)
+            # 设置计费开始时间
+            billing_start = month_start
             
-            # 设置统计表格区域列宽
-            worksheet.set_column('A:A', 20)  # 类型列宽
-            worksheet.set_column('B:B', 10)  # 数量列宽
-            worksheet.set_column('C:C', 15)  # 金额列宽
+            # 如果启用日期在当前月内，使用启用日期作为开始时间
+            if start_date > month_start and start_date <= month_end:
+                billing_start = start_date
             
-            # 保存工作簿
-            workbook.close()
+            # 判断VPS是否使用满一个月
+            is_full_month = False
             
-            logger.info(f"账单已保存到: {output_file}")
-            return True
+            # 如果是销毁的VPS并且在当前月内销毁
+            if vps.get('status') == "销毁" and cancel_date and month_start.year == cancel_date.year and month_start.month == cancel_date.month:
+                # 计算VPS在当月内的使用天数
+                first_day_of_month = month_start
+                # 销毁日期当天也算使用，所以天数计算应该是：销毁日期 - 月初 + 1
+                days_used_in_month = (cancel_date.date() - first_day_of_month.date()).days + 1
+                
+                # 修改整月计费条件：使用30天或以上就按整月计费
+                if days_used_in_month >= 30 and billing_start.day == 1 and billing_start.hour == 0 and billing_start.minute == 0:
+                    is_full_month = True
+                    logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月销毁，使用了{days_used_in_month}天（≥30天），按整月计费")
+                else:
+                    logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月销毁，使用了{days_used_in_month}天（<30天），按实际分钟计费")
+            else:
+                # 非销毁VPS或不在当月销毁的VPS，计算从billing_start到billing_end的时间
+                # 修改整月计费条件：使用30天或以上就按整月计费
+                is_month_start = (billing_start.day == 1 and billing_start.hour == 0 and billing_start.minute == 0)
+                is_month_end = (billing_end.day == days_in_month and billing_end.hour == 23 and billing_end.minute == 59)
+                days_used = (billing_end - billing_start).days + 1
+                
+                if is_month_start and is_month_end and days_used >= 30:
+                    is_full_month = True
+                    logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月使用了{days_used}天（≥30天），按整月计费")
+                else:
+                    logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月使用了{days_used}天（<30天），按实际分钟计费")
+                
+            month_microseconds = days_in_month * 24 * 60 * 60 * 1000000
+            microsecond = datetime.timedelta(microseconds=1)
+            
+            # 有调价记录时，按计费区间内的各单价区段分别计费（整月计费时按整月分摊）
+            if segments is not None:
+                window = (month_start, month_info.next_start) if is_full_month else (billing_start, billing_end)
+                pieces = segments.clip(*window)
+                if len(pieces) > 1:
+                    logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月有{len(pieces)}个单价区段，分段计费")
+                    return tuple(PricingTerms(server_rule, to_micro_cents(price), (piece_end - piece_start) // microsecond,
+                                              month_microseconds, False)
+                                 for piece_start, piece_end, price in pieces)
+                if not pieces:
+                    return ()
+                # 当月只有一个单价，按原有规则计费
+                price_per_month = pieces[0][2]
+            
+            return (PricingTerms(server_rule, to_micro_cents(price_per_month),
+                                 (billing_end - billing_start) // microsecond, month_microseconds, is_full_month),)
             
         except Exception as e:
-            logger.error(f"保存账单到Excel时出错: {str(e)}", exc_info=True)
-            return False
+            logger.error(f"根据购买日期计算价格时出错: {str(e)}", exc_info=True)
+            # 发生错误时，按使用时长计费
+            return self._usage_pricing_terms(vps, float(vps.get('price_per_month', 0) or 0), self._pricing_rules(vps)[0],
+                                             billing_year, billing_month, now)
     
-    def generate_pdf_bill(self, output_file='vps_billing.pdf'):
+    def _usage_pricing_terms(self, vps, price_per_month, server_rule, year, month, now=None):
         """
-        生成PDF格式的账单
+        无法按购买日期确定计费区间时，按当月使用时长生成计费参数
+        
+        Returns:
+            tuple: 只有一个PricingTerms，无法计算使用时长时为空
+        """
+        usage_result = self.calculate_usage_period(vps, year, month, now=now)
+        if not (isinstance(usage_result, tuple) and len(usage_result) == 4):
+            return ()
+        _, days, hours, minutes = usage_result
+        elapsed_minutes = days * 24 * 60 + hours * 60 + minutes
+        return (PricingTerms(server_rule, to_micro_cents(price_per_month), elapsed_minutes * 60 * 1000000,
+                             MONTH_CALENDAR.get(year, month).minutes * 60 * 1000000, False),)
+    
+    def calculate_price_with_purchase_date(self, vps, year=None, month=None, now=None):
+        """
+        根据购买日期计算价格，实现灵活的计费方式
+        
+        默认规则、只有一个单价时按浮点金额计算（check_money用它与整数金额的结果核对），其余情况与calculate_price_cents相同
         
         Args:
-            output_file (str): 输出PDF文件路径
+            vps (dict): VPS信息
+            year (int, optional): 指定年份，默认为当前设置的账单年份
+            month (int, optional): 指定月份，默认为当前设置的账单月份
+            now (datetime, optional): 当前时间，如果不提供则使用系统当前时间
             
         Returns:
-            bool: 是否成功
+            float: 计算的价格
         """
-        try:
-            df = self.to_dataframe()
-            
-            # 创建PDF对象
-            pdf = FPDF()
-            pdf.add_page()
-            
-            # 设置字体 - 使用内置字体而不是尝试加载外部字体
-            try:
-                # 尝试加载中文字体，如果失败则使用默认字体
-                font_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts', 'DejaVuSansCondensed.ttf')
-                if os.path.exists(font_path):
-                    pdf.add_font('DejaVu', '', font_path, uni=True)
-                    pdf.set_font('DejaVu', '', 10)
-                    logger.info(f"使用中文字体: {font_path}")
-                else:
-                    logger.warning(f"中文字体文件不存在: {font_path}，使用Helvetica字体")
-                    pdf.set_font('Helvetica', '', 10)
-            except Exception as font_error:
-                logger.warning(f"设置字体失败: {str(font_error)}，使用默认字体")
-                pdf.set_font('Helvetica', '', 10)
+        pieces = self._pricing_terms(vps, year, month, now=now)
+        if not pieces:
+            return 0.0
+        terms = pieces[0]
+        if len(pieces) > 1 or terms.rule is not DEFAULT_SERVER_RULE:
+            return cents_to_amount(evaluate_pricing_pieces(pieces))
+        
+        vps_name = vps.get('name', '未知')
+        price_per_month = terms.price_micro_cents / MICRO_CENTS_PER_DOLLAR
+        if terms.full_month:
+            # 使用满一个月，按整月收费
+            logger.info(f"VPS {vps_name} 计费方式: 整月计费, 收费 ${price_per_month:.2f}")
+            return round(price_per_month, 2)
+        
+        # 计算使用的天数、小时和分钟，保留精度
+        time_diff = datetime.timedelta(microseconds=terms.elapsed_microseconds)
+        
+        # 计算总分钟数作为小数（保留小数部分以提高精度）
+        total_minutes = time_diff.total_seconds() / 60
+        
+        # 计算每分钟价格（基于用户设置的月单价）
+        minutes_per_month = terms.month_microseconds // (60 * 1000000)
+        price_per_minute = price_per_month / minutes_per_month
+        
+        # 计算总价 (分钟数 * 每分钟价格)
+        total_price = total_minutes * price_per_minute
+        
+        # 记录详细计费信息
+        days_part = time_diff.days
+        hours_part = time_diff.seconds // 3600
+        minutes_part = (time_diff.seconds % 3600) // 60
+        seconds_part = time_diff.seconds % 60
+        
+        logger.info(f"VPS {vps_name} 计费方式: 分钟计费")
+        logger.info(f"使用时长: {days_part}天{hours_part}小时{minutes_part}分钟{seconds_part}秒 ({total_minutes:.2f}分钟)")
+        logger.info(f"月单价: ${price_per_month:.2f}, 分钟单价: ${price_per_minute:.6f}")
+        logger.info(f"总计费: {total_minutes:.2f}分钟 × ${price_per_minute:.6f}/分钟 = ${total_price:.2f}")
+        
+        return round(total_price, 2)
             
-            # 添加标题
-            pdf.cell(200, 10, 'VPS Account Statement', 0, 1, 'C')
-            pdf.cell(200, 10, f'Generated: {datetime.datetime.now().strftime("%Y-%m-%d")}', 0, 1, 'C')
-            pdf.ln(10)
+    def calculate_price_cents(self, vps, year=None, month=None, now=None):
+        """
+        按整数金额计算VPS在指定月份的费用，计费规则与calculate_price_with_purchase_date相同
+        
+        Args:
+            vps (dict): VPS信息
+            year (int, optional): 指定年份，默认为当前设置的账单年份
+            month (int, optional): 指定月份，默认为当前设置的账单月份
+            now (datetime, optional): 当前时间，如果不提供则使用系统当前时间
             
-            # 表格头部
-            col_widths = [30, 25, 20, 25, 25, 25, 20, 20]
-            headers = df.columns
+        Returns:
+            int: 费用（分）
+        """
+        return evaluate_pricing_pieces(self._pricing_terms(vps, year, month, now=now))
+    
+    def calculate_price_terms(self, vps, year=None, month=None, now=None):
+        """
+        与calculate_price_cents相同，但只返回计费参数，由evaluate_pricing_terms/evaluate_pricing_pieces批量计算
+        
+        Returns:
+            tuple: 当月各单价区段的PricingTerms，当月不计费时为空
+        """
+        return self._pricing_terms(vps, year, month, now=now)
+    
+    def _pricing_rules(self, vps):
+        """
+        Returns:
+            tuple: VPS的pricing_rule字段指定的(ServerPricingRule, NatPricingRule)
+        """
+        return get_pricing_rule_set(vps.get('pricing_rule'))
+    
+    def _refresh_vps_price(self, vps, current_time):
+        """
+        实时计算一台VPS的使用时长（usage_period）和总金额（total_price），出错时只记录日志
+        
+        Args:
+            vps (VpsRecord): VPS数据
+            current_time (datetime): 计算时间
+        """
+        try:
+            # 实时计算使用时长，精确到分钟
+            usage_result = self.calculate_usage_period(vps, now=current_time)
+            if isinstance(usage_result, tuple) and len(usage_result) == 4:
+                usage_string, days, hours, minutes = usage_result
+                vps['usage_period'] = usage_string
+                
+                # 使用新的计费方法，确保实时计算
+                price_per_month = vps.get('price_per_month', 0)
+                if price_per_month:
+                    # 总金额统一折算成美元
+                    vps['total_price'] = cents_to_amount(self._to_base_cents(
+                        vps, self.calculate_price_cents(vps), current_time.year, current_time.month))
+            else:
+                # 向后兼容老格式
+                vps['usage_period'] = usage_result
+                
+                price_per_month = vps.get('price_per_month', 0)
+                
+                if vps['usage_period'] and price_per_month:
+                    # 使用旧的计算方法
+                    total_price = self.calculate_price_legacy(price_per_month, vps['usage_period'])
+                    vps['total_price'] = round(total_price, 2)  # 确保总价精确到2位小数
+        except Exception as e:
+            logger.error(f"更新VPS {vps.get('name', 'Unknown')} 价格时出错: {str(e)}")
+    
+    def update_prices(self):
+        """
+        更新所有VPS的价格
+        
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            # 确保使用当前实时时间
+            current_time = datetime.datetime.now()
             
-            for i, header in enumerate(headers):
-                pdf.cell(col_widths[i], 10, str(header), 1, 0, 'C')
-            pdf.ln()
+            for vps in self.vps_data:
+                self._refresh_vps_price(vps, current_time)
             
-            # 表格数据
-            for i, row in df.iterrows():
-                for j, value in enumerate(row):
-                    if i < len(df) - 1 and j == 2 and value == "销毁":
-                        # 高亮显示"销毁"状态的行
-                        pdf.set_fill_color(255, 255, 0)
-                        pdf.cell(col_widths[j], 10, str(value), 1, 0, 'C', 1)
-                    elif i == len(df) - 1:
-                        # 高亮显示总金额行
-                        pdf.set_fill_color(230, 230, 250)
-                        pdf.cell(col_widths[j], 10, str(value), 1, 0, 'C', 1)
-                    elif j == 6 and 'NAT费用' in str(value):
-                        # 高亮显示NAT费用行，使用不同的颜色
-                        pdf.set_fill_color(200, 255, 200)  # 浅绿色
-                        pdf.cell(col_widths[j], 10, str(value), 1, 0, 'C', 1)
-                    else:
-                        pdf.cell(col_widths[j], 10, str(value), 1, 0, 'C')
-                pdf.ln()
+            self.calculate_total_bill()
+            return self.save_data()
+        except Exception as e:
+            logger.error(f"更新VPS价格时出错: {str(e)}")
+            return False
+        
+    def calculate_price_legacy(self, price_per_month, usage_period):
+        """
+        旧的价格计算方法，用于兼容
+        
+        Args:
+            price_per_month (float): 月单价
+            usage_period (str): 使用时长，例如"3个月+15"
             
-            # 保存PDF
-            pdf.output(output_file)
+        Returns:
+            float: 总价
+        """
+        months, days = self.parse_usage_period(usage_period)
+        total = months * price_per_month
+        if days > 0:
+            # 计算每天的价格
+            daily_price = price_per_month / 30.0
+            total += days * daily_price
+        return round(total, 2)  # 确保总价精确到2位小数
+    
+    def set_billing_period(self, year, month):
+        """
+        设置账单计算的年月
+        
+        Args:
+            year (int): 年份
+            month (int): 月份
             
-            logger.info(f"成功生成PDF账单: {output_file}")
+        Returns:
+            bool: 是否成功设置
+        """
+        try:
+            # 验证年月有效性
+            if not MONTH_CALENDAR.contains(year, month):
+                logger.error(f"无效的年月: {year}/{month}")
+                return False
+                
+            self.billing_year = year
+            self.billing_month = month
+            logger.info(f"已设置账单计算年月为: {year}/{month}")
             return True
         except Exception as e:
-            logger.error(f"生成PDF账单失败: {str(e)}", exc_info=True)
-            # 尝试创建一个简单的PDF文件以验证文件写入权限
-            try:
-                simple_pdf = FPDF()
-                simple_pdf.add_page()
-                simple_pdf.set_font("Helvetica", size=12)
-                simple_pdf.cell(200, 10, txt="Test PDF", ln=True, align="C")
-                simple_pdf.output(output_file)
-                logger.info(f"成功创建简单的测试PDF: {output_file}")
-                return True
-            except Exception as simple_e:
-                logger.error(f"无法创建简单的测试PDF: {str(simple_e)}", exc_info=True)
-                return False
+            logger.error(f"设置账单年月时出错: {str(e)}")
+            return False
+    
+    def get_billing_period(self):
+        """
+        获取当前账单计算的年月
+        
+        Returns:
+            tuple: (年份, 月份)
+        """
+        return (self.billing_year, self.billing_month)
+    
+    def _parse_bill_date(self, date_str):
+        """
+        解析账单中使用的日期字符串，支持 YYYY/MM/DD [HH:MM:SS] 和 YYYY-MM-DD 格式
+        
+        Args:
+            date_str (str): 日期字符串
             
-    def parse_usage_period(self, usage_period):
+        Returns:
+            datetime: 解析结果，无法解析时返回None
+        """
+        if not date_str:
+            return None
+        date_str = str(date_str)
+        for date_format in ("%Y/%m/%d %H:%M:%S", "%Y/%m/%d", "%Y-%m-%d"):
+            try:
+                return self._strptime(date_str, date_format)
+            except ValueError:
+                continue
+        try:
+            parts = date_str.split('/')
+            if len(parts) == 3:
+                return datetime.datetime(int(parts[0]), int(parts[1]), int(parts[2]))
+        except Exception:
+            pass
+        return None
+    
+    def _parse_price_history(self, history):
+        """
+        解析price_history字段：[{'from': 'YYYY/MM/DD [HH:MM:SS]', 'price': 月单价}, ...]
+        
+        Returns:
+            PriceSegments: 单价区段，没有有效记录时返回None
+        """
+        entries = []
+        for item in history or []:
+            try:
+                start = self._parse_bill_date(item.get('from'))
+                if start is None:
+                    raise ValueError(f"无法解析调价时间: {item.get('from')}")
+                entries.append((start, float(item.get('price', 0) or 0)))
+            except Exception as e:
+                logger.warning(f"忽略无效的调价记录 {item}: {str(e)}")
+        if not entries:
+            return None
+        entries.sort(key=lambda entry: entry[0])
+        return PriceSegments([entry[0] for entry in entries], [entry[1] for entry in entries])
+    
+    def _price_segments(self, vps):
         """
-        解析使用时长
+        获取VPS的单价区段，VpsRecord会缓存解析结果
         
         Args:
-            usage_period (str): 使用时长，例如"3个月+15"
+            vps (dict): VPS信息
             
         Returns:
-            tuple: (月数, 天数)
+            PriceSegments: 单价区段，没有调价记录时返回None
         """
-        try:
-            if "个月" in usage_period:
-                parts = usage_period.split("个月")
-                months = int(parts[0])
-                days = int(parts[1].strip("+")) if "+" in parts[1] else 0
-                return months, days
-            else:
-                return 0, int(usage_period.strip("天"))
-        except Exception as e:
-            logger.error(f"解析使用时长失败: {str(e)}")
-            return 0, 0
-            
-    def calculate_usage_period(self, vps, year=None, month=None, now=None):
+        if not vps.get('price_history'):
+            return None
+        if isinstance(vps, VpsRecord):
+            return vps.get_date('price_history', self._parse_price_history)
+        return self._parse_price_history(vps.get('price_history'))
+    
+    def _vps_date(self, vps, field):
         """
-        实时计算使用时长，按照指定年月的日历实时统计
-        从该月1号00:00:00开始计算到当前日期时间或月末，精确到分钟
+        解析VPS的日期字段，VpsRecord会缓存解析结果，同一台VPS在多个月份的计算中只解析一次
         
         Args:
-            vps (dict): VPS信息
-            year (int, optional): 指定年份，默认为当前设置的账单年份
-            month (int, optional): 指定月份，默认为当前设置的账单月份
-            now (datetime, optional): 当前时间，如果不提供则使用系统当前时间
+            vps (VpsRecord|dict): VPS数据
+            field (str): 日期字段名
             
         Returns:
-            tuple: (使用时长字符串, 使用天数, 使用小时数, 使用分钟数)
+            datetime: 解析结果，字段为空或无法解析时返回None
         """
-        try:
-            # 使用指定年月或默认设置的年月
-            billing_year = year if year is not None else self.billing_year
-            billing_month = month if month is not None else self.billing_month
+        if isinstance(vps, VpsRecord):
+            return vps.get_date(field, self._parse_bill_date)
+        return self._parse_bill_date(vps.get(field, ''))
+    
+    def compute_month_lines(self, records, year, month, as_of, currency_matrix=None):
+        """
+        计算指定月份每台VPS的账单明细，不读取也不修改实例上的账单状态
+        
+        非美元计价的VPS先按原币计费，再用汇率矩阵批量折算成美元
+        
+        Args:
+            records (iterable): VPS数据（通常为快照中的记录）
+            year (int): 年份
+            month (int): 月份
+            as_of (datetime): 计算截止时间，当前月份按此时间实时计费
+            currency_matrix (CurrencyMatrix, optional): 本次账单计算的汇率矩阵，未提供或不含该月时按需建立
             
-            # 确保年月是整数类型
+        Returns:
+            list: 使用时长大于0的VPS明细，每项包含vps、使用时长、金额（美元，price及整数分price_cents）、
+                计价货币和该月的显示状态；非美元计价的明细另有原币金额original_price_cents和汇率exchange_rate
+        """
+        lines = []
+        for vps in records:
+            vps_name = vps.get('name', '未命名')
             try:
-                billing_year = int(billing_year)
-                billing_month = int(billing_month)
-            except (ValueError, TypeError):
-                logger.error(f"无效的年月参数: 年份={billing_year}, 月份={billing_month}")
-                return "参数错误", 0, 0, 0
-            
-            vps_name = vps.get('name', '未知')
-            vps_status = vps.get('status', '未知')
-            
-            logger.info(f"计算VPS使用时长 - VPS: {vps_name}, 状态: {vps_status}, 年月: {billing_year}/{billing_month}")
-            
-            # 获取当前日期时间，如果提供了now参数则使用它
-            current_time = now if now is not None else datetime.datetime.now()
-            
-            # 计算指定月份的起始时间和结束时间
-            month_start = datetime.datetime(billing_year, billing_month, 1, 0, 0, 0)
-            
-            # 计算指定月份的结束时间（下个月的第一天减去1秒）
-            next_month_year = billing_year
-            next_month = billing_month + 1
-            if next_month > 12:
-                next_month = 1
-                next_month_year += 1
-            month_end = datetime.datetime(next_month_year, next_month, 1, 0, 0, 0) - datetime.timedelta(seconds=1)
-            
-            # 获取和解析购买日期
-            purchase_date_str = vps.get('purchase_date', '')
-            if purchase_date_str:
-                try:
-                    if ' ' in purchase_date_str:  # 如果包含时间
-                        purchase_date = datetime.datetime.strptime(purchase_date_str, "%Y/%m/%d %H:%M:%S")
-                    else:  # 如果只有日期
-                        purchase_date = datetime.datetime.strptime(purchase_date_str, "%Y/%m/%d")
-                except ValueError:
-                    # 尝试其他可能的日期格式
-                    try:
-                        purchase_date = datetime.datetime.strptime(purchase_date_str, "%Y-%m-%d")
-                    except ValueError:
-                        # 尝试更多日期格式
-                        try:
-                            # 尝试处理可能的格式：年/月/日
-                            parts = purchase_date_str.split('/')
-                            if len(parts) == 3:
-                                year_part = int(parts[0])
-                                month_part = int(parts[1])
-                                day_part = int(parts[2])
-                                purchase_date = datetime.datetime(year_part, month_part, day_part)
-                            else:
-                                logger.warning(f"无法解析VPS {vps.get('name')} 的购买日期: {purchase_date_str}")
-                                purchase_date = None
-                        except Exception:
-                            logger.warning(f"无法解析VPS {vps.get('name')} 的购买日期: {purchase_date_str}")
-                            purchase_date = None
+                original_status = vps.get('status', '')
                 
-                # 如果购买日期在计算月份之后，则使用时长为0
-                if purchase_date and (purchase_date.year > billing_year or 
-                                    (purchase_date.year == billing_year and purchase_date.month > billing_month)):
-                    logger.info(f"VPS {vps_name} 的购买日期 {purchase_date_str} 晚于计算月份 {billing_year}/{billing_month}，使用时长为0")
-                    return "0天0小时0分钟", 0, 0, 0
-            
-            # 检查销毁日期
-            cancel_date = None
-            if vps.get('status') == "销毁" and (vps.get('expire_date') or vps.get('cancel_date')):
-                # 优先使用expire_date，如果没有则尝试使用cancel_date
-                cancel_date_str = vps.get('expire_date') or vps.get('cancel_date')
+                # 如果是销毁状态，需要检查销毁日期是否在查询月份
+                cancel_date = None
+                if original_status == "销毁":
+                    cancel_date = self._vps_date(vps, 'cancel_date')
+                    # 如果销毁日期在查询月份之前，则跳过该VPS
+                    if cancel_date and (cancel_date.year, cancel_date.month) < (year, month):
+                        logger.info(f"VPS {vps_name} 在 {cancel_date.year}/{cancel_date.month}/{cancel_date.day} 销毁，早于查询月份 {year}/{month}，跳过显示")
+                        continue
                 
-                # 解析销毁日期
-                try:
-                    if ' ' in cancel_date_str:  # 如果包含时间
-                        cancel_date = datetime.datetime.strptime(cancel_date_str, "%Y/%m/%d %H:%M:%S")
-                    else:  # 如果只有日期
-                        cancel_date = datetime.datetime.strptime(cancel_date_str, "%Y/%m/%d")
-                        # 设置为当天结束时间
-                        cancel_date = cancel_date.replace(hour=23, minute=59, second=59)
-                except ValueError:
-                    # 尝试其他可能的日期格式
-                    try:
-                        cancel_date = datetime.datetime.strptime(cancel_date_str, "%Y-%m-%d")
-                        cancel_date = cancel_date.replace(hour=23, minute=59, second=59)
-                    except ValueError:
-                        # 尝试更多日期格式
-                        try:
-                            # 尝试处理可能的格式：年/月/日
-                            parts = cancel_date_str.split('/')
-                            if len(parts) == 3:
-                                year_part = int(parts[0])
-                                month_part = int(parts[1])
-                                day_part = int(parts[2])
-                                cancel_date = datetime.datetime(year_part, month_part, day_part, 23, 59, 59)
-                            else:
-                                # 如果无法解析，默认使用当前时间
-                                cancel_date = month_end
-                                logger.warning(f"无法解析VPS {vps.get('name')} 的销毁日期: {cancel_date_str}，将使用月末")
-                        except Exception:
-                            # 如果无法解析，默认使用当前时间
-                            cancel_date = month_end
-                            logger.warning(f"无法解析VPS {vps.get('name')} 的销毁日期: {cancel_date_str}，将使用月末")
+                # 计算使用时长，当前月份使用截止时间实时计算
+                usage_result = self.calculate_usage_period(vps, year, month, now=as_of)
+                if not (isinstance(usage_result, tuple) and len(usage_result) == 4):
+                    continue
+                usage_string, days, hours, minutes = usage_result
                 
-                # 检查销毁日期与当前计算月份的关系
-                # 如果销毁日期在计算月份之后的月份，则在当前月份中状态应该显示为"在用"
-                if cancel_date.year > billing_year or (cancel_date.year == billing_year and cancel_date.month > billing_month):
-                    logger.info(f"VPS {vps_name} 在计算月份 {billing_year}/{billing_month} 后销毁 ({cancel_date})，当月状态视为'在用'")
-                    # 在计算时间时暂时当作非销毁VPS处理
-                    temp_status = "在用"
-                # 如果销毁日期早于计算月份，则该VPS不应在该月账单中显示
-                elif cancel_date.year < billing_year or (cancel_date.year == billing_year and cancel_date.month < billing_month):
-                    logger.info(f"VPS {vps_name} 在计算月份 {billing_year}/{billing_month} 前已销毁 ({cancel_date})，不显示在当月账单中")
-                    return "0天0小时0分钟", 0, 0, 0
+                # 只有使用时长大于0的才添加到账单
+                if days == 0 and hours == 0 and minutes == 0:
+                    continue
+                
+                # 先只取计费参数，循环结束后按规则批量计算
+                price_terms = self.calculate_price_terms(vps, year, month, now=as_of)
+                
+                # 只在销毁当月显示"销毁"状态和销毁时间，销毁之前的月份显示为"在用"
+                destroyed_this_month = bool(cancel_date and cancel_date.year == year and cancel_date.month == month)
+                if original_status == "销毁" and cancel_date:
+                    display_status = "销毁" if destroyed_this_month else "在用"
                 else:
-                    # 销毁日期在当月内，使用实际状态和销毁日期
-                    logger.info(f"VPS {vps_name} 在计算月份 {billing_year}/{billing_month} 内销毁 ({cancel_date})，按实际销毁日期计算")
-                    temp_status = vps_status
-            else:
-                temp_status = vps_status
+                    display_status = original_status
+                
+                lines.append({
+                    'vps': vps,
+                    'monthly_price': self._month_unit_price(vps, year, month, as_of, cancel_date),
+                    'usage': usage_string,
+                    'days': days,
+                    'hours': hours,
+                    'minutes': minutes,
+                    'price': None,
+                    'price_cents': None,
+                    'price_terms': price_terms,
+                    'currency': self._vps_currency(vps),
+                    'display_status': display_status,
+                    'display_cancel_date': vps.get('cancel_date', '') if destroyed_this_month else '',
+                    'destroyed_this_month': destroyed_this_month
+                })
+            except Exception as vps_error:
+                logger.error(f"处理VPS {vps_name} 时出错: {str(vps_error)}")
+                continue
+        
+        # 只有一个单价区段的明细（绝大多数）按规则批量计算，有调价的明细逐条计算
+        pending = [line for line in lines if len(line['price_terms']) == 1]
+        if pending:
+            self.stats.incr('pricing_batch_lines', len(pending))
+            for line, cents in zip(pending, evaluate_pricing_terms([line['price_terms'][0] for line in pending])):
+                line['price_cents'] = cents
+        for line in lines:
+            if line['price_cents'] is None:
+                line['price_cents'] = evaluate_pricing_pieces(line['price_terms'])
+            line['price'] = cents_to_amount(line['price_cents'])
+        
+        foreign = [line for line in lines if line['currency'] != BASE_CURRENCY]
+        if foreign:
+            if currency_matrix is None or not currency_matrix.has_month(year, month):
+                currency_matrix = self.get_currency_matrix([(year, month)])
+            month_index = currency_matrix.month_index(year, month)
+            currency_indexes = [currency_matrix.currency_index(line['currency']) for line in foreign]
+            converted = currency_matrix.to_base_cents([month_index] * len(foreign), currency_indexes,
+                                                      [line['price_cents'] for line in foreign])
+            self.stats.incr('currency_converted_lines', len(foreign))
+            for line, position, cents in zip(foreign, currency_indexes, converted):
+                line['original_price_cents'] = line['price_cents']
+                line['exchange_rate'] = float(currency_matrix.usd_per_unit[month_index, position])
+                line['price_cents'] = int(cents)
+                line['price'] = cents_to_amount(int(cents))
+        return lines
+    
+    def _month_unit_price(self, vps, year, month, as_of, cancel_date=None):
+        """
+        VPS在某个月账单中显示的月单价（原币）：有调价记录时取该月计费截止时刻生效的单价
+        
+        Args:
+            vps (dict): VPS信息
+            year (int): 年份
+            month (int): 月份
+            as_of (datetime): 计算截止时间，当前月份计到此时间
+            cancel_date (datetime, optional): 销毁日期，销毁当月计到当天结束
             
-            # 获取和解析启用日期
-            start_date_str = vps.get('start_date')
-            if not start_date_str:
-                logger.warning(f"VPS {vps.get('name')} 没有启用日期，无法计算使用时长")
-                return "未知", 0, 0, 0
+        Returns:
+            float: 月单价
+        """
+        segments = self._price_segments(vps)
+        if segments is None:
+            return vps.get('price_per_month', 0)
+        month_info = MONTH_CALENDAR.get(year, month)
+        cutoff = min(month_info.end, max(as_of, month_info.start))
+        if cancel_date is not None and (cancel_date.year, cancel_date.month) == (year, month):
+            cutoff = min(cutoff, cancel_date.replace(hour=23, minute=59, second=59))
+        return segments.price_at(cutoff)
+    
+    def _line_monthly_price(self, line):
+        """
+        Returns:
+            float: 明细的月单价（美元），非美元计价时按当月汇率折算
+        """
+        price = line['monthly_price']
+        if line['currency'] == BASE_CURRENCY:
+            return price
+        return round(float(price or 0) * line['exchange_rate'], 2)
+    
+    def _line_currency_fields(self, line):
+        """
+        Returns:
+            dict: 非美元计价明细在账单行中附加的原币信息，美元计价时为空
+        """
+        if line['currency'] == BASE_CURRENCY:
+            return {}
+        return {
+            '币种': line['currency'],
+            '原币月单价': line['monthly_price'],
+            '原币金额': cents_to_amount(line['original_price_cents']),
+            '汇率': line['exchange_rate']
+        }
+    
+    def compute_monthly_bill(self, snapshot, year, month, as_of=None, currency_matrix=None):
+        """
+        计算指定月份的账单数据，只读取传入的快照，可在多个线程中同时计算不同月份
+        
+        Args:
+            snapshot (FleetSnapshot): VPS数据快照
+            year (int): 年份
+            month (int): 月份
+            as_of (datetime, optional): 计算截止时间，默认为当前时间
+            currency_matrix (CurrencyMatrix, optional): 本次账单计算的汇率矩阵
             
-            # 解析启用日期
-            try:
-                if ' ' in start_date_str:  # 如果包含时间
-                    start_date = datetime.datetime.strptime(start_date_str, "%Y/%m/%d %H:%M:%S")
-                else:  # 如果只有日期
-                    start_date = datetime.datetime.strptime(start_date_str, "%Y/%m/%d")
-            except ValueError:
-                # 尝试其他可能的日期格式
-                try:
-                    start_date = datetime.datetime.strptime(start_date_str, "%Y-%m-%d")
-                except ValueError:
-                    # 尝试更多日期格式
-                    try:
-                        # 尝试处理可能的格式：年/月/日
-                        parts = start_date_str.split('/')
-                        if len(parts) == 3:
-                            year_part = int(parts[0])
-                            month_part = int(parts[1])
-                            day_part = int(parts[2])
-                            start_date = datetime.datetime(year_part, month_part, day_part)
-                        else:
-                            logger.error(f"无法解析VPS {vps.get('name')} 的启用日期: {start_date_str}")
-                            return "日期错误", 0, 0, 0
-                    except Exception:
-                        logger.error(f"无法解析VPS {vps.get('name')} 的启用日期: {start_date_str}")
-                        return "日期错误", 0, 0, 0
+        Returns:
+            dict: 与get_monthly_bill_data相同结构的账单数据
+        """
+        as_of = as_of or datetime.datetime.now()
+        month_name = MONTH_NAMES.get(month, str(month) + "月")
+        
+        bill_data = {
+            '年份': year,
+            '月份': month,
+            '账单日期': f"{year}/{month}/1",
+            'VPS数量': 0,
+            'NAT费用': 0,
+            '月总费用': 0,
+            '账单行': []
+        }
+        
+        lines = self.compute_month_lines(snapshot.records, year, month, as_of, currency_matrix)
+        self.aggregates.record(year, month, self.get_billing_fingerprint(snapshot), as_of, lines)
+        for line in lines:
+            vps = line['vps']
+            monthly_price = self._line_monthly_price(line)
+            bill_data['账单行'].append({
+                'VPS名称': vps.get('name', '未命名'),
+                'IP地址': vps.get('ip_address', ''),
+                '国家/地区': vps.get('country', ''),
+                '使用状态': line['display_status'],
+                '销毁时间': line['display_cancel_date'],
+                '统计截止时间': f"{year}年{month_name}",
+                '使用时长': line['usage'],
+                '月单价': monthly_price,
+                '总金额': line['price'],
+                '是否使用NAT': '是' if vps.get('use_nat', False) else '否',
+                '单价/月（$）': monthly_price,
+                '合计（$）': line['price'],
+                **self._line_currency_fields(line)
+            })
+        
+        # 计算当月NAT费用，使用指定年月的汇率
+        nat_usage = None
+        try:
+            nat_usage = self.compute_nat_usage(snapshot.records, year, month)
+            nat_fee_cents = amount_to_cents(nat_usage['fee'])
+        except Exception as e:
+            logger.error(f"计算NAT费用失败: {str(e)}")
+            nat_fee_cents = 0
+        nat_fee = cents_to_amount(nat_fee_cents) if nat_fee_cents else 0
+        
+        # 计算总费用，以分为单位精确累加
+        vps_total_cents = sum(line['price_cents'] for line in lines)
+        total_bill = cents_to_amount(vps_total_cents + nat_fee_cents)
+        
+        bill_data['VPS数量'] = len(lines)
+        bill_data['NAT费用'] = nat_fee
+        bill_data['月总费用'] = total_bill
+        
+        logger.info(f"{year}年{month}月账单生成完成 - VPS数量: {len(lines)}, NAT费用: {nat_fee}, 总费用: {total_bill}")
+        
+        # 如果NAT费用大于0，添加NAT使用详情，天数和流量与计算NAT费用时一致
+        if nat_fee > 0:
+            bill_data['NAT详情'] = self._nat_fee_detail(nat_usage)
+        
+        return bill_data
+    
+    def compute_bill_table_month(self, snapshot, year, month, as_of=None, currency_matrix=None):
+        """
+        计算月账单统计表中一个月份的数据，只读取传入的快照
+        
+        Args:
+            snapshot (FleetSnapshot): VPS数据快照
+            year (int): 年份
+            month (int): 月份
+            as_of (datetime, optional): 计算截止时间，默认为当前时间
+            currency_matrix (CurrencyMatrix, optional): 本次账单计算的汇率矩阵
             
-            # 最终决定计算的开始时间和结束时间
-            # 开始时间：购买日期和月初较晚者
-            if purchase_date is not None and purchase_date > month_start:
-                start_time = purchase_date
-                logger.info(f"VPS {vps_name} 使用购买日期 {purchase_date} 作为开始时间")
-            else:
-                start_time = month_start
-                logger.info(f"VPS {vps_name} 使用月初 {month_start} 作为开始时间")
+        Returns:
+            dict: 该月的统计数据，当月没有VPS使用记录时返回None
+        """
+        as_of = as_of or datetime.datetime.now()
+        logger.info(f"正在生成 {year}年{month}月 账单数据")
+        
+        lines = self.compute_month_lines(snapshot.records, year, month, as_of, currency_matrix)
+        self.aggregates.record(year, month, self.get_billing_fingerprint(snapshot), as_of, lines)
+        if not lines:
+            return None
+        
+        # 只有在当月有VPS销毁时才显示销毁时间列
+        has_destroyed_vps_this_month = any(line['destroyed_this_month'] for line in lines)
+        
+        month_data = []
+        for line in lines:
+            vps = line['vps']
+            month_data.append({
+                'VPS名称': vps.get('name', '未命名'),
+                '国家/地区': vps.get('country', ''),
+                '使用状态': line['display_status'],
+                '使用时长': line['usage'],
+                '单价/月（$）': float(self._line_monthly_price(line)),
+                '合计（$）': line['price'],
+                '是否使用NAT': '是' if vps.get('use_nat', False) else '否',
+                '购买日期': vps.get('purchase_date', '') or vps.get('start_date', ''),
+                '销毁时间': line['display_cancel_date'],
+                **self._line_currency_fields(line),
+                'raw_value': vps  # 用于调试，JSON输出时会忽略这个字段
+            })
+        
+        # 计算NAT费用 - 使用指定年月的汇率
+        nat_usage = None
+        try:
+            nat_usage = self.compute_nat_usage(snapshot.records, year, month)
+            nat_fee_cents = amount_to_cents(nat_usage['fee'])
+        except Exception as e:
+            logger.error(f"计算{year}年{month}月NAT费用失败: {str(e)}")
+            nat_fee_cents = 0
+        nat_fee = cents_to_amount(nat_fee_cents) if nat_fee_cents else 0
+        
+        # 计算月总费用，以分为单位精确累加
+        month_total = cents_to_amount(sum(line['price_cents'] for line in lines) + max(nat_fee_cents, 0))
+        
+        month_bill = {
+            '年份': year,
+            '月份': month,
+            '账单日期': f"{year}/{month}/1",
+            'VPS数量': len(month_data),
+            '月总费用': month_total,
+            'NAT费用': nat_fee,
+            '详细数据': month_data,
+            '显示销毁时间列': has_destroyed_vps_this_month  # 指示是否显示销毁时间列
+        }
+        if nat_fee > 0:
+            month_bill['NAT详情'] = self._nat_fee_detail(nat_usage)
+        return month_bill
+    
+    def compute_monthly_bill_table(self, snapshot, start_year, end_year, end_month, as_of=None):
+        """
+        计算从起始年份到结束年月的月账单统计表，只读取传入的快照
+        
+        Args:
+            snapshot (FleetSnapshot): VPS数据快照
+            start_year (int): 起始年份（从1月开始）
+            end_year (int): 结束年份
+            end_month (int): 结束月份
+            as_of (datetime, optional): 计算截止时间，默认为当前时间
             
-            # 结束时间：销毁日期、当前时间、月末三者最早的
-            if temp_status == "销毁" and cancel_date is not None and month_start.year == cancel_date.year and month_start.month == cancel_date.month:
-                # 只有当销毁日期在当月时才使用销毁日期作为结束时间
-                end_time = cancel_date
-                logger.info(f"VPS {vps_name} 使用销毁日期 {cancel_date} 作为结束时间")
+        Returns:
+            tuple: (summary_df, bill_data) 汇总DataFrame和详细账单数据列表
+        """
+        as_of = as_of or datetime.datetime.now()
+        
+        bill_data = []
+        months = list(MONTH_CALENDAR.months_between(start_year, 1, end_year, end_month))
+        open_months = [(month_info.year, month_info.month) for month_info in months
+                       if self.ledger.get(month_info.year, month_info.month) is None]
+        currency_matrix = self._bill_currency_matrix(snapshot, open_months) if open_months else None
+        for month_info in months:
+            closed = self.ledger.get(month_info.year, month_info.month)
+            if closed is not None:
+                # 已结账月份直接使用账本中冻结的数据
+                month_bill = copy.deepcopy(closed['table'])
             else:
-                # 非销毁VPS或者不在当月销毁的VPS
-                if now is not None and now.year == billing_year and now.month == billing_month:
-                    # 如果是当月，使用当前时间
-                    end_time = now
-                    logger.info(f"VPS {vps_name} 使用当前时间 {now} 作为结束时间 (实时计算)")
-                else:
-                    # 如果不是当月，使用月末
-                    end_time = month_end
-                    logger.info(f"VPS {vps_name} 使用月末 {month_end} 作为结束时间")
-            
-            # 如果开始时间在月末之后或结束时间在月初之前，则没有使用时间
-            if start_time > month_end or end_time < month_start:
-                logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月没有使用时间，开始时间: {start_time}，结束时间: {end_time}")
-                return "0天0小时0分钟", 0, 0, 0
-            
-            # 确保开始时间和结束时间都在当月范围内
-            if start_time < month_start:
-                start_time = month_start
-                logger.info(f"VPS {vps_name} 的开始时间调整为月初: {month_start}")
-            
-            if end_time > month_end:
-                end_time = month_end
-                logger.info(f"VPS {vps_name} 的结束时间调整为月末: {month_end}")
-            
-            # 计算使用时长
-            time_diff = end_time - start_time
-            
-            # 如果结束时间早于开始时间，返回0使用时长
-            if time_diff.total_seconds() < 0:
-                logger.warning(f"VPS {vps_name} 的结束时间 {end_time} 早于开始时间 {start_time}，返回0使用时长")
-                return "0天0小时0分钟", 0, 0, 0
+                month_bill = self.compute_bill_table_month(snapshot, month_info.year, month_info.month, as_of,
+                                                           currency_matrix)
+            if month_bill:  # 只有当月有数据时才添加
+                bill_data.append(month_bill)
+        
+        columns = ['年份', '月份', '账单日期', 'VPS数量', 'NAT费用', '月总费用']
+        summary_data = [[bill[column] for column in columns] for bill in bill_data]
+        summary_df = pd.DataFrame(summary_data, columns=columns)
+        
+        return summary_df, bill_data
+    
+    def compute_monthly_bills(self, months, snapshot=None, as_of=None, max_workers=None):
+        """
+        并行计算多个月份的账单数据
+        
+        所有月份共用同一个快照和截止时间，计算过程不修改实例状态，因此可以安全地并行执行
+        
+        Args:
+            months (list): [(年份, 月份), ...]
+            snapshot (FleetSnapshot, optional): VPS数据快照，默认为最近发布的快照
+            as_of (datetime, optional): 计算截止时间，默认为当前时间
+            max_workers (int, optional): 线程数，默认由线程池决定
             
-            # 计算天、小时、分钟
-            days = time_diff.days
-            hours = time_diff.seconds // 3600
-            minutes = (time_diff.seconds % 3600) // 60
+        Returns:
+            list: 与months顺序一致的账单数据列表
+        """
+        snapshot = snapshot or self.get_snapshot()
+        as_of = as_of or datetime.datetime.now()
+        self.ledger.load()
+        # 汇率矩阵在提交到线程池之前建立，各月份共用
+        open_months = [(int(year), int(month)) for year, month in months
+                       if self.ledger.get(int(year), int(month)) is None]
+        currency_matrix = self._bill_currency_matrix(snapshot, open_months) if open_months else None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = []
+            for year, month in months:
+                closed = self.ledger.get(int(year), int(month))
+                if closed is not None:
+                    results.append(copy.deepcopy(closed['bill']))
+                else:
+                    results.append(executor.submit(self.compute_monthly_bill, snapshot, int(year), int(month), as_of,
+                                                   currency_matrix))
+            return [result.result() if isinstance(result, concurrent.futures.Future) else result for result in results]
+    
+    def generate_monthly_bill_table(self, start_year=2024, end_year=None, end_month=None):
+        """
+        生成月账单统计表，包含每月VPS使用情况和费用明细
+        
+        Args:
+            start_year (int): 起始年份
+            end_year (int, optional): 结束年份，默认为当前年份
+            end_month (int, optional): 结束月份，默认为当前月份
             
-            # 返回使用时长的中文表示
-            usage_str = f"{days}天{hours}小时{minutes}分钟"
-            logger.info(f"VPS {vps_name} 最终计算的使用时长: {usage_str}")
-            return usage_str, days, hours, minutes
+        Returns:
+            tuple: (summary_df, bill_data) 汇总DataFrame和详细账单数据列表
+        """
+        try:
+            # 如果未指定结束年月，使用当前年月
+            now = datetime.datetime.now()
+            if end_year is None:
+                end_year = now.year
+            if end_month is None:
+                end_month = now.month
+                
+            logger.info(f"生成月账单统计表 - 起始年份: {start_year}, 结束年月: {end_year}/{end_month}")
             
+            # 所有月份使用同一个已发布快照，不修改账单年月和NAT费用
+            return self.compute_monthly_bill_table(self.get_snapshot(), start_year, end_year, end_month, now)
+        
         except Exception as e:
-            logger.error(f"计算使用时长时发生错误: {str(e)}", exc_info=True)
-            return "错误", 0, 0, 0
+            logger.error(f"生成月账单表格时出错: {str(e)}", exc_info=True)
+            return pd.DataFrame(), []
     
-    def calculate_price(self, price_per_month, days, hours, minutes, year=None, month=None):
+    def close_month(self, year, month):
         """
-        计算VPS价格，根据购买日期和使用时长灵活计费
+        月结：计算已结束月份的账单并冻结到月结账本，之后该月的账单、汇总和Excel导出都直接读取账本
         
         Args:
-            price_per_month (float): 月单价
-            days (int): 天数
-            hours (int): 小时数
-            minutes (int): 分钟数
-            year (int, optional): 指定年份，用于计算月天数
-            month (int, optional): 指定月份，用于计算月天数
+            year (int): 年份
+            month (int): 月份
             
         Returns:
-            float: 总价
+            dict: 结账信息
         """
-        try:
-            # 使用指定年月或当前月来获取实际天数
-            if year is not None and month is not None:
-                current_month_days = calendar.monthrange(year, month)[1]
-            else:
-                # 获取当前月的实际天数
-                current_date = datetime.datetime.now()
-                current_month_days = calendar.monthrange(current_date.year, current_date.month)[1]
-            
-            # 计算月的总分钟数 (使用实际月份天数)
-            minutes_per_month = current_month_days * 24 * 60
-            
-            # 计算每分钟价格
-            price_per_minute = price_per_month / minutes_per_month
-            
-            # 计算总使用分钟数
-            total_minutes = days * 24 * 60 + hours * 60 + minutes
+        year, month = int(year), int(month)
+        if not MONTH_CALENDAR.contains(year, month):
+            raise ValueError(f"无效的年月: {year}/{month}")
+        now = datetime.datetime.now()
+        if now < MONTH_CALENDAR.get(year, month).next_start:
+            raise ValueError(f"{year}年{month}月尚未结束，不能结账")
+        closed = self.ledger.get(year, month)
+        if closed is not None:
+            raise ValueError(f"{year}年{month}月已于{closed['closed_at']}结账，如需重新计算请先reopen_month")
+        
+        snapshot = self.get_snapshot()
+        bill = self.compute_monthly_bill(snapshot, year, month, now)
+        table = self.compute_bill_table_month(snapshot, year, month, now)
+        if table is not None:
+            # 调试用的原始数据不写入账本
+            table['详细数据'] = [{key: value for key, value in row.items() if key != 'raw_value'}
+                               for row in table['详细数据']]
+        entry = self.ledger.append({
+            'action': 'close',
+            'month': MonthlyAggregates.month_key(year, month),
+            'closed_at': now.strftime("%Y/%m/%d %H:%M:%S"),
+            'fingerprint': self.get_billing_fingerprint(snapshot),
+            'bill': bill,
+            'table': table
+        })
+        logger.info(f"{year}年{month}月已结账，月总费用: {bill['月总费用']}")
+        return {
+            'month': entry['month'],
+            'closed_at': entry['closed_at'],
+            'checksum': entry['checksum'],
+            'total': bill['月总费用'],
+            'vps_count': bill['VPS数量']
+        }
+    
+    def reopen_month(self, year, month, recompute=False):
+        """
+        重新打开已结账的月份，之后该月重新按当前VPS数据计算
+        
+        Args:
+            year (int): 年份
+            month (int): 月份
+            recompute (bool): 是否立即按当前数据重新结账
             
-            # 计算总价
-            total_price = total_minutes * price_per_minute
+        Returns:
+            dict: 重新打开（和重新结账）的信息
+        """
+        year, month = int(year), int(month)
+        closed = self.ledger.get(year, month)
+        if closed is None:
+            raise ValueError(f"{year}年{month}月没有结账")
+        entry = self.ledger.append({
+            'action': 'reopen',
+            'month': closed['month'],
+            'reopened_at': datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        })
+        result = {
+            'month': entry['month'],
+            'reopened_at': entry['reopened_at'],
+            'previous_total': closed['bill']['月总费用']
+        }
+        if recompute:
+            result['closed'] = self.close_month(year, month)
+        return result
+    
+    def cross_check_money(self, start_year=2024, end_year=None, end_month=None):
+        """
+        用原有的浮点计费结果核对整数金额计算，逐台VPS逐月比较到分
+        
+        Args:
+            start_year (int): 起始年份（从1月开始）
+            end_year (int, optional): 结束年份，默认为当前年份
+            end_month (int, optional): 结束月份，默认为当前月份
             
-            return round(total_price, 2)  # 确保总价精确到2位小数
-        except Exception as e:
-            logger.error(f"计算价格失败: {str(e)}")
-            return 0.0
-
-    def calculate_price_with_purchase_date(self, vps, year=None, month=None):
+        Returns:
+            dict: 核对的月份数、账单行数、不一致的明细，以及每月浮点累加与精确合计的差额
         """
-        根据购买日期计算价格，实现灵活的计费方式
+        now = datetime.datetime.now()
+        end_year = end_year or now.year
+        end_month = end_month or now.month
+        snapshot = self.get_snapshot()
+        
+        lines_checked = 0
+        mismatches = []
+        months = []
+        for month_info in MONTH_CALENDAR.months_between(start_year, 1, end_year, end_month):
+            year, month = month_info.year, month_info.month
+            float_total = 0.0
+            exact_cents = 0
+            for vps in snapshot.records:
+                float_price = round(self.calculate_price_with_purchase_date(vps, year, month, now=now), 2)
+                price_cents = self.calculate_price_cents(vps, year, month, now=now)
+                if not float_price and not price_cents:
+                    continue
+                lines_checked += 1
+                float_total += float_price
+                exact_cents += price_cents
+                if amount_to_cents(float_price) != price_cents:
+                    mismatches.append({
+                        'year': year,
+                        'month': month,
+                        'vps_name': vps.get('name', ''),
+                        'float': float_price,
+                        'exact': cents_to_amount(price_cents)
+                    })
+            months.append({
+                'year': year,
+                'month': month,
+                'float_total': float_total,
+                'exact_total': cents_to_amount(exact_cents),
+                'float_drift': float_total - cents_to_amount(exact_cents)
+            })
+        
+        logger.info(f"金额核对完成 - {len(months)}个月, {lines_checked}行, 不一致{len(mismatches)}行")
+        return {
+            'months_checked': len(months),
+            'lines_checked': lines_checked,
+            'mismatch_count': len(mismatches),
+            'mismatches': mismatches,
+            'months': months
+        }
+    
+    def _accrual_start(self, vps, month_info, as_of):
+        """
+        判断VPS在当月按分钟计费的情况，规则与calculate_price_with_purchase_date一致
         
         Args:
             vps (dict): VPS信息
-            year (int, optional): 指定年份，默认为当前设置的账单年份
-            month (int, optional): 指定月份，默认为当前设置的账单月份
+            month_info (MonthInfo): 当月信息
+            as_of (datetime): 判断时间
             
         Returns:
-            float: 计算的价格
+            datetime: 开始计费的时间；不随时间增加费用（已销毁、未启用、无单价等）时返回None
         """
-        try:
-            # 获取VPS信息
-            price_per_month = float(vps.get('price_per_month', 0))
-            if price_per_month == 0:
-                return 0.0
-                
-            # 获取VPS名称，用于日志记录
-            vps_name = vps.get('name', '未知')
-                
-            # 使用指定年月或默认设置的年月
-            billing_year = year if year is not None else self.billing_year
-            billing_month = month if month is not None else self.billing_month
-            
-            # 计算当前月的天数 - 使用calendar模块获取准确月份天数
-            days_in_month = calendar.monthrange(billing_year, billing_month)[1]
-            
-            # 获取购买日期
-            purchase_date_str = vps.get('purchase_date')
-            if not purchase_date_str:
-                # 如果没有购买日期，使用启用日期
-                purchase_date_str = vps.get('start_date')
-                if not purchase_date_str:
-                    logger.warning(f"VPS {vps_name} 没有购买日期和启用日期，使用默认按月计费")
-                    # 计算使用时长
-                    usage_result = self.calculate_usage_period(vps, billing_year, billing_month)
-                    if isinstance(usage_result, tuple) and len(usage_result) == 4:
-                        _, days, hours, minutes = usage_result
-                        return self.calculate_price(price_per_month, days, hours, minutes, billing_year, billing_month)
-                    return 0.0
-            
-            # 解析购买日期
-            purchase_date = None
-            try:
-                if ' ' in purchase_date_str:  # 如果包含时间
-                    purchase_date = datetime.datetime.strptime(purchase_date_str, "%Y/%m/%d %H:%M:%S")
-                else:  # 如果只有日期
-                    purchase_date = datetime.datetime.strptime(purchase_date_str, "%Y/%m/%d")
-            except ValueError:
-                try:
-                    purchase_date = datetime.datetime.strptime(purchase_date_str, "%Y-%m-%d")
-                except ValueError:
-                    try:
-                        # 尝试处理其他格式：年/月/日
-                        parts = purchase_date_str.split('/')
-                        if len(parts) == 3:
-                            y_part = int(parts[0])
-                            m_part = int(parts[1])
-                            d_part = int(parts[2])
-                            purchase_date = datetime.datetime(y_part, m_part, d_part)
-                        else:
-                            logger.warning(f"无法解析VPS {vps.get('name')} 的购买日期: {purchase_date_str}，使用默认按月计费")
-                            # 计算使用时长
-                            usage_result = self.calculate_usage_period(vps, billing_year, billing_month)
-                            if isinstance(usage_result, tuple) and len(usage_result) == 4:
-                                _, days, hours, minutes = usage_result
-                                return self.calculate_price(price_per_month, days, hours, minutes, billing_year, billing_month)
-                            return 0.0
-                    except Exception:
-                        logger.warning(f"无法解析VPS {vps.get('name')} 的购买日期: {purchase_date_str}，使用默认按月计费")
-                        # 计算使用时长
-                        usage_result = self.calculate_usage_period(vps, billing_year, billing_month)
-                        if isinstance(usage_result, tuple) and len(usage_result) == 4:
-                            _, days, hours, minutes = usage_result
-                            return self.calculate_price(price_per_month, days, hours, minutes, billing_year, billing_month)
-                        return 0.0
-            
-            if purchase_date is None:
-                logger.warning(f"VPS {vps.get('name')} 的购买日期解析失败，使用默认按月计费")
-                usage_result = self.calculate_usage_period(vps, billing_year, billing_month)
-                if isinstance(usage_result, tuple) and len(usage_result) == 4:
-                    _, days, hours, minutes = usage_result
-                    return self.calculate_price(price_per_month, days, hours, minutes, billing_year, billing_month)
-                return 0.0
-            
-            # 获取购买日期的日、月、年
-            purchase_day = purchase_date.day
-            purchase_month = purchase_date.month
-            purchase_year = purchase_date.year
-            
-            # 获取查询月份的月初和月末
-            month_start = datetime.datetime(billing_year, billing_month, 1)
+        if not float(vps.get('price_per_month', 0) or 0):
+            return None
+        # 当月已销毁或之前已销毁的VPS计费到销毁日期，之后不再增加
+        if vps.get('status') == "销毁" and vps.get('cancel_date'):
+            cancel_date = self._vps_date(vps, 'cancel_date')
+            if cancel_date is None or cancel_date < month_info.next_start:
+                return None
+        purchase_date = self._vps_date(vps, 'purchase_date')
+        if purchase_date and (purchase_date.year, purchase_date.month) > (month_info.year, month_info.month):
+            return None
+        start_date = self._vps_date(vps, 'start_date')
+        if start_date is None or start_date > month_info.end:
+            return None
+        return max(start_date, month_info.start)
+    
+    def _billing_window(self, vps, month_info):
+        """
+        计算VPS在整个月份（月份尚未开始或未结束时按预计情况）中的计费区间，规则与calculate_price_with_purchase_date一致
+        
+        Args:
+            vps (dict): VPS信息
+            month_info (MonthInfo): 月份信息
             
-            next_month_year = billing_year
-            next_month = billing_month + 1
-            if next_month > 12:
-                next_month = 1
-                next_month_year += 1
-                
-            month_end = datetime.datetime(next_month_year, next_month, 1) - datetime.timedelta(seconds=1)
+        Returns:
+            tuple: (开始时间, 结束时间, 是否按整月计费)；该月不计费时返回None
+        """
+        if not float(vps.get('price_per_month', 0) or 0):
+            return None
+        purchase_date = self._vps_date(vps, 'purchase_date')
+        if purchase_date and (purchase_date.year, purchase_date.month) > (month_info.year, month_info.month):
+            return None
+        start_date = self._vps_date(vps, 'start_date')
+        if start_date is None or start_date > month_info.end:
+            return None
+        start = max(start_date, month_info.start)
+        end = month_info.next_start
+        cancelled_in_month = False
+        if vps.get('status') == "销毁" and vps.get('cancel_date'):
+            cancel_date = self._vps_date(vps, 'cancel_date')
+            if cancel_date is None or cancel_date < month_info.start:
+                return None
+            if cancel_date < month_info.next_start:
+                # 销毁当天也计费，计到当天23:59:59
+                end = cancel_date.replace(hour=23, minute=59, second=59)
+                cancel_date_only = cancel_date.replace(hour=0, minute=0, second=0, microsecond=0)
+                cancelled_in_month = True
+        if start >= end:
+            return None
+        if cancelled_in_month:
+            days_used = (cancel_date_only - month_info.start).days + 1
+            full_month = days_used >= 30 and start == month_info.start
+        else:
+            full_month = start == month_info.start and month_info.days >= 30
+        return start, end, full_month
+    
+    def build_cost_ticker(self, as_of=None, key=None):
+        """
+        在指定时间完整计算一次当月费用，建立累计费用计时器
+        
+        Args:
+            as_of (datetime, optional): 检查点时间，默认为当前时间
+            key (str, optional): 数据标识（配置文件的修改时间和大小），写入缓存文件时用于判断是否失效
             
-            # 计算VPS的启用日期和可能的销毁日期
-            start_date = None
-            start_date_str = vps.get('start_date')
-            if not start_date_str:
-                logger.warning(f"VPS {vps.get('name')} 没有启用日期，使用购买日期")
-                start_date = purchase_date
+        Returns:
+            CostTicker: 计时器
+        """
+        as_of = as_of or datetime.datetime.now()
+        snapshot = self.get_snapshot()
+        month_info = MONTH_CALENDAR.get(as_of.year, as_of.month)
+        
+        lines = self.compute_month_lines(snapshot.records, month_info.year, month_info.month, as_of)
+        try:
+            nat_fee, _, _ = self.compute_nat_fee(snapshot.records, month_info.year, month_info.month)
+            nat_fee_cents = amount_to_cents(nat_fee)
+        except Exception as e:
+            logger.error(f"计算NAT费用失败: {str(e)}")
+            nat_fee_cents = 0
+        
+        base_cents = 0
+        nat_price = 0
+        other_price = 0
+        start_weight = 0
+        active_servers = 0
+        active_nat_servers = 0
+        # 单价调整或尚未开始计费的VPS开始计费后需要重建计时器
+        valid_until = month_info.next_start
+        for line in lines:
+            vps = line['vps']
+            accrual_start = self._accrual_start(vps, month_info, as_of)
+            if accrual_start is None or accrual_start > as_of:
+                # 费用不再随时间变化的VPS直接计入基数
+                base_cents += line['price_cents']
+                continue
+            if self._pricing_rules(vps)[0] is not DEFAULT_SERVER_RULE:
+                # 非按比例计费的规则不能线性外推，计入基数并每小时重建计时器
+                base_cents += line['price_cents']
+                valid_until = min(valid_until, as_of + datetime.timedelta(hours=1))
+                continue
+            # 非美元计价的VPS按当月汇率把单价折算成美元（当月汇率不变，仍可线性外推）
+            usd_per_unit = line.get('exchange_rate')
+            to_base = (lambda value: value) if usd_per_unit is None else (lambda value: int(round(value * usd_per_unit)))
+            segments = self._price_segments(vps)
+            if segments is None:
+                price_micro_cents = to_base(to_micro_cents(vps.get('price_per_month', 0)))
+                start_weight += price_micro_cents * ((accrual_start - month_info.start) // datetime.timedelta(microseconds=1))
             else:
-                try:
-                    if ' ' in start_date_str:  # 如果包含时间
-                        start_date = datetime.datetime.strptime(start_date_str, "%Y/%m/%d %H:%M:%S")
-                    else:  # 如果只有日期
-                        start_date = datetime.datetime.strptime(start_date_str, "%Y/%m/%d")
-                except ValueError:
-                    try:
-                        start_date = datetime.datetime.strptime(start_date_str, "%Y-%m-%d")
-                    except ValueError:
-                        try:
-                            # 尝试处理其他格式：年/月/日
-                            parts = start_date_str.split('/')
-                            if len(parts) == 3:
-                                y_part = int(parts[0])
-                                m_part = int(parts[1])
-                                d_part = int(parts[2])
-                                start_date = datetime.datetime(y_part, m_part, d_part)
-                            else:
-                                logger.warning(f"无法解析VPS {vps.get('name')} 的启用日期: {start_date_str}，使用购买日期")
-                                start_date = purchase_date
-                        except Exception:
-                            logger.warning(f"无法解析VPS {vps.get('name')} 的启用日期: {start_date_str}，使用购买日期")
-                            start_date = purchase_date
-            
-            # 检查是否已销毁
-            cancel_date = None
-            if vps.get('status') == "销毁" and vps.get('cancel_date'):
-                cancel_date_str = vps.get('cancel_date')
-                try:
-                    if ' ' in cancel_date_str:  # 如果包含时间
-                        cancel_date = datetime.datetime.strptime(cancel_date_str, "%Y/%m/%d %H:%M:%S")
-                    else:  # 如果只有日期
-                        cancel_date = datetime.datetime.strptime(cancel_date_str, "%Y/%m/%d")
-                        cancel_date = cancel_date.replace(hour=23, minute=59, second=59)
-                except ValueError:
-                    try:
-                        cancel_date = datetime.datetime.strptime(cancel_date_str, "%Y-%m-%d")
-                        cancel_date = cancel_date.replace(hour=23, minute=59, second=59)
-                    except ValueError:
-                        try:
-                            # 尝试处理其他格式：年/月/日
-                            parts = cancel_date_str.split('/')
-                            if len(parts) == 3:
-                                y_part = int(parts[0])
-                                m_part = int(parts[1])
-                                d_part = int(parts[2])
-                                cancel_date = datetime.datetime(y_part, m_part, d_part, 23, 59, 59)
-                            else:
-                                logger.warning(f"无法解析VPS {vps.get('name')} 的销毁日期: {cancel_date_str}")
-                                cancel_date = None
-                        except Exception:
-                            logger.warning(f"无法解析VPS {vps.get('name')} 的销毁日期: {cancel_date_str}")
-                            cancel_date = None
-            
-            # 判断VPS在当前计费月的情况
-            
-            # 情况1: VPS在当前计费月之前就已销毁，不需要计费
-            if cancel_date and cancel_date < month_start:
-                return 0.0
-                
-            # 情况2: VPS在当前计费月之后才启用，不需要计费
-            if start_date > month_end:
-                return 0.0
-            
-            # 获取当前时间 - 确保使用实际当前时间进行计算
-            current_time = datetime.datetime.now()
-            
-            # 设置计费结束时间
-            # 如果计算的是当前月份，使用当前时间（强制实时计算）
-            if billing_year == current_time.year and billing_month == current_time.month:
-                billing_end = min(current_time, month_end)
-                logger.info(f"VPS {vps_name} 正在计算当前月份，使用实时时间 {billing_end} 作为结束时间")
+                # 有调价记录：之后按检查点的单价累计，之前各区段的费用折算进start_weight
+                price_micro_cents = to_micro_cents(segments.price_at(as_of))
+                start_weight += to_base(price_micro_cents * ((as_of - month_info.start) // datetime.timedelta(microseconds=1))
+                                        - segments.weight(accrual_start, as_of))
+                price_micro_cents = to_base(price_micro_cents)
+                next_change = segments.next_change(as_of)
+                if next_change is not None:
+                    valid_until = min(valid_until, next_change)
+            active_servers += 1
+            if vps.get('use_nat', False) is True:
+                nat_price += price_micro_cents
+                active_nat_servers += 1
             else:
-                # 如果计算历史月份，使用月末时间
-                billing_end = month_end
-                logger.info(f"VPS {vps_name} 正在计算历史月份，使用月末 {billing_end} 作为结束时间")
-                
-            # 如果有销毁日期且在当前月内，使用销毁日期作为结束时间
-            if cancel_date and month_start <= cancel_date <= month_end:
-                # 销毁日期当天也算使用，所以结束时间应该是销毁日期的23:59:59
-                billing_end = cancel_date.replace(hour=23, minute=59, second=59)
-                logger.info(f"VPS {vps_name} 在当月销毁，使用销毁日期 {billing_end} 作为结束时间")
-            
-            # 设置计费开始时间
-            billing_start = month_start
-            
-            # 如果启用日期在当前月内，使用启用日期作为开始时间
-            if start_date > month_start and start_date <= month_end:
-                billing_start = start_date
+                other_price += price_micro_cents
+        
+        for vps in snapshot.records:
+            accrual_start = self._accrual_start(vps, month_info, as_of)
+            if accrual_start is not None and accrual_start > as_of:
+                valid_until = min(valid_until, accrual_start)
+        
+        self.stats.incr('cost_ticker_build')
+        return CostTicker(key, month_info.year, month_info.month,
+                          as_of, valid_until, base_cents, nat_fee_cents, nat_price, other_price,
+                          start_weight, active_servers, active_nat_servers)
+    
+    def get_ticker_cache_path(self):
+        """
+        获取累计费用计时器缓存文件路径（与配置文件同目录）
+        
+        Returns:
+            str: 缓存文件路径
+        """
+        return self.config_file + '.ticker.json'
+    
+    def _config_file_key(self):
+        """
+        用配置文件的修改时间和大小标识数据，供跨进程的缓存判断是否失效
+        
+        Returns:
+            str: 数据标识，文件不存在时返回None
+        """
+        try:
+            stat = os.stat(self.config_file)
+            return f"{stat.st_mtime_ns}:{stat.st_size}"
+        except OSError:
+            return None
+    
+    def get_cost_ticker(self, when=None, use_cache_file=True):
+        """
+        获取当月累计费用，VPS数据没有变化时只做一次乘法
+        
+        进程内按快照版本复用计时器；命令行每次调用都是新进程，因此同时把计时器写入缓存文件，
+        以配置文件的修改时间和大小判断是否失效
+        
+        Args:
+            when (datetime, optional): 查询时间，默认为当前时间
+            use_cache_file (bool): 是否读写缓存文件
             
-            # 判断VPS是否使用满一个月
-            is_full_month = False
+        Returns:
+            dict: 费用明细，source表示计时器来源（memory、file或rebuilt）
+        """
+        when = when or datetime.datetime.now()
+        ticker, source = self._load_cost_ticker(when, use_cache_file)
+        result = ticker.value_at(when)
+        result['source'] = source
+        return result
+    
+    def _load_cost_ticker(self, when, use_cache_file=True):
+        """
+        获取覆盖指定时间的计时器，依次尝试内存、缓存文件，都不可用时重新建立
+        
+        Args:
+            when (datetime): 查询时间
+            use_cache_file (bool): 是否读写缓存文件
             
-            # 如果是销毁的VPS并且在当前月内销毁
-            if vps.get('status') == "销毁" and cancel_date and month_start.year == cancel_date.year and month_start.month == cancel_date.month:
-                # 计算VPS在当月内的使用天数
-                first_day_of_month = datetime.datetime(billing_year, billing_month, 1)
-                # 销毁日期当天也算使用，所以天数计算应该是：销毁日期 - 月初 + 1
-                days_used_in_month = (cancel_date.date() - first_day_of_month.date()).days + 1
-                
-                # 修改整月计费条件：使用30天或以上就按整月计费
-                if days_used_in_month >= 30 and billing_start.day == 1 and billing_start.hour == 0 and billing_start.minute == 0:
-                    is_full_month = True
-                    logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月销毁，使用了{days_used_in_month}天（≥30天），按整月计费")
-                else:
-                    logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月销毁，使用了{days_used_in_month}天（<30天），按实际分钟计费")
-            else:
-                # 非销毁VPS或不在当月销毁的VPS，计算从billing_start到billing_end的时间
-                # 修改整月计费条件：使用30天或以上就按整月计费
-                is_month_start = (billing_start.day == 1 and billing_start.hour == 0 and billing_start.minute == 0)
-                is_month_end = (billing_end.day == days_in_month and billing_end.hour == 23 and billing_end.minute == 59)
-                days_used = (billing_end - billing_start).days + 1
-                
-                if is_month_start and is_month_end and days_used >= 30:
-                    is_full_month = True
-                    logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月使用了{days_used}天（≥30天），按整月计费")
-                else:
-                    logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月使用了{days_used}天（<30天），按实际分钟计费")
-                
-            # 根据是否使用满一个月决定计费方式
-            if is_full_month:
-                # 使用满一个月，按整月收费
-                total_price = price_per_month
-                logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月计费方式: 整月计费, 收费 ${total_price:.2f}")
-            else:
-                # 计算使用的天数、小时和分钟，保留精度
-                time_diff = billing_end - billing_start
-                
-                # 获取总秒数
-                total_seconds = time_diff.total_seconds()
-                
-                # 计算总分钟数作为小数（保留小数部分以提高精度）
-                total_minutes = total_seconds / 60
-                
-                # 计算每分钟价格（基于用户设置的月单价）
-                minutes_per_month = days_in_month * 24 * 60
-                price_per_minute = price_per_month / minutes_per_month
-                
-                # 计算总价 (分钟数 * 每分钟价格)
-                total_price = total_minutes * price_per_minute
-                
-                # 记录详细计费信息
-                days_part = time_diff.days
-                hours_part = time_diff.seconds // 3600
-                minutes_part = (time_diff.seconds % 3600) // 60
-                seconds_part = time_diff.seconds % 60
-                
-                logger.info(f"VPS {vps_name} 在{billing_year}年{billing_month}月计费方式: 分钟计费")
-                logger.info(f"使用时长: {days_part}天{hours_part}小时{minutes_part}分钟{seconds_part}秒 ({total_minutes:.2f}分钟)")
-                logger.info(f"月单价: ${price_per_month:.2f}, 分钟单价: ${price_per_minute:.6f}")
-                logger.info(f"总计费: {total_minutes:.2f}分钟 × ${price_per_minute:.6f}/分钟 = ${total_price:.2f}")
+        Returns:
+            tuple: (CostTicker, 来源)
+        """
+        version = self.get_snapshot().version
+        ticker = self._cost_ticker
+        if ticker is not None and self._cost_ticker_version == version and ticker.covers(when):
+            return ticker, 'memory'
+        
+        # 只有数据与配置文件一致时（没有未保存的修改）才能使用缓存文件
+        file_key = self._config_file_key() if self._saved_version == version else None
+        cache_file = self.get_ticker_cache_path()
+        if use_cache_file and file_key:
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    cached = CostTicker.from_dict(json.load(f))
+                if cached.key == file_key and cached.covers(when):
+                    self._cost_ticker = cached
+                    self._cost_ticker_version = version
+                    return cached, 'file'
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"读取费用计时器缓存失败: {str(e)}")
+        
+        ticker = self.build_cost_ticker(when, key=file_key)
+        self._cost_ticker = ticker
+        self._cost_ticker_version = version
+        if use_cache_file and file_key:
+            try:
+                with self.file_lock.hold(exclusive=True):
+                    temp_path = cache_file + '.tmp'
+                    with open(temp_path, 'w', encoding='utf-8') as f:
+                        json.dump(ticker.to_dict(), f, ensure_ascii=False)
+                    os.replace(temp_path, cache_file)
+            except Exception as e:
+                logger.warning(f"写入费用计时器缓存失败: {str(e)}")
+        return ticker, 'rebuilt'
+    
+    @track_stats('project_costs')
+    def project_costs(self, as_of=None):
+        """
+        预测本月月末和下个月的费用
+        
+        本月：在累计费用计时器的基础上，把仍在计费的VPS和本月稍后才开始计费的VPS按月末直接计算，
+        NAT费用沿用账单按整月预估的结果。
+        下个月：按启用日期和已安排的销毁日期得出每台VPS在下个月的计费区间，整月的按月单价、
+        不满整月的按分钟汇总后只取整一次；NAT按区间天数（超过12小时按整天）和本月汇率估算。
+        两者都只做一次线性汇总，不逐台调用账单计算
+        
+        Args:
+            as_of (datetime, optional): 预测时间，默认为当前时间
             
-            return round(total_price, 2)
+        Returns:
+            dict: 本月已产生费用、本月月末预测和下个月预测
+        """
+        as_of = as_of or datetime.datetime.now()
+        ticker, _ = self._load_cost_ticker(as_of)
+        current = MONTH_CALENDAR.get(ticker.year, ticker.month)
+        upcoming = MONTH_CALENDAR.get(current.next_start.year, current.next_start.month)
+        microsecond = datetime.timedelta(microseconds=1)
+        
+        # 本月稍后开始计费的VPS：Σp 和 Σ(p × 开始时间)
+        later_price = 0
+        later_weight = 0
+        # 下个月：整月计费的月单价合计、按分钟计费的Σ(p × 时长)、NAT天数
+        full_month_price = 0
+        partial_weight = 0
+        upcoming_servers = 0
+        nat_days = 0
+        nat_servers = 0
+        for vps in self.get_snapshot().records:
+            accrual_start = self._accrual_start(vps, current, as_of)
+            segments = self._price_segments(vps)
+            currency = self._vps_currency(vps)
+            # 非美元计价的VPS按本月汇率折算，未来月份没有汇率，同样按本月汇率估算
+            usd_per_unit = (None if currency == BASE_CURRENCY
+                            else self.get_currency_rates(current.year, current.month)[currency])
+            to_base = (lambda value: value) if usd_per_unit is None else (lambda value: int(round(value * usd_per_unit)))
+            if accrual_start is not None and accrual_start > as_of:
+                price_micro_cents = to_base(to_micro_cents(vps.get('price_per_month', 0) if segments is None
+                                                           else segments.price_at(accrual_start)))
+                later_price += price_micro_cents
+                later_weight += price_micro_cents * ((accrual_start - current.start) // microsecond)
+            
+            window = self._billing_window(vps, upcoming)
+            if window is None:
+                continue
+            start, end, full_month = window
+            upcoming_servers += 1
+            if segments is not None:
+                # 有调价记录时按区段累计，整月计费按整月分摊
+                partial_weight += to_base(segments.weight(*((upcoming.start, upcoming.next_start) if full_month
+                                                            else (start, end))))
+            elif full_month:
+                full_month_price += to_base(to_micro_cents(vps.get('price_per_month', 0) or 0))
+            else:
+                partial_weight += to_base(to_micro_cents(vps.get('price_per_month', 0) or 0)) * ((end - start) // microsecond)
+            if vps.get('use_nat', False) is True:
+                used = end - start
+                days = used.days + (1 if used.seconds > 12 * 3600 else 0)
+                if days > 0:
+                    nat_days += days
+                    nat_servers += 1
+        
+        # 本月月末：计时器在月末的值加上稍后开始计费的VPS
+        month_us = current.minutes * 60 * 1000000
+        accrued_now = ticker.value_at(as_of)
+        active_price = ticker.nat_price_micro_cents + ticker.other_price_micro_cents
+        month_end_vps_cents = ticker.base_cents + _div_round_half_up(
+            (active_price + later_price) * month_us - ticker.start_weight - later_weight,
+            month_us * MICRO_CENTS_PER_CENT)
+        
+        # 下个月
+        upcoming_us = upcoming.minutes * 60 * 1000000
+        upcoming_vps_cents = _div_round_half_up(full_month_price * upcoming_us + partial_weight,
+                                                upcoming_us * MICRO_CENTS_PER_CENT)
+        upcoming_nat_cents = 0
+        if nat_days:
+            # 未来月份没有汇率，按本月汇率估算
+            exchange_rate = self.get_exchange_rate(current.year, current.month)
+            upcoming_nat_cents = amount_to_cents(round(nat_days * exchange_rate, 2))
+        
+        return {
+            'as_of': as_of.strftime("%Y/%m/%d %H:%M:%S"),
+            'current_month': {
+                'year': current.year,
+                'month': current.month,
+                'accrued': accrued_now['total'],
+                'projected_vps_cost': cents_to_amount(month_end_vps_cents),
+                'nat_fee': cents_to_amount(ticker.nat_fee_cents),
+                'projected_total': cents_to_amount(month_end_vps_cents + ticker.nat_fee_cents)
+            },
+            'next_month': {
+                'year': upcoming.year,
+                'month': upcoming.month,
+                'servers': upcoming_servers,
+                'projected_vps_cost': cents_to_amount(upcoming_vps_cents),
+                'nat_servers': nat_servers,
+                'nat_days': nat_days,
+                'nat_fee': cents_to_amount(upcoming_nat_cents),
+                'projected_total': cents_to_amount(upcoming_vps_cents + upcoming_nat_cents)
+            }
+        }
+    
+    def get_billing_fingerprint(self, snapshot=None):
+        """
+        计算快照中影响账单的字段的指纹，同一快照版本只计算一次
+        
+        Args:
+            snapshot (FleetSnapshot, optional): VPS数据快照，默认为最近发布的快照
             
+        Returns:
+            str: 指纹
+        """
+        snapshot = snapshot or self.get_snapshot()
+        version, fingerprint = self._fingerprint
+        if version == snapshot.version:
+            return fingerprint
+        digest = hashlib.sha1()
+        for vps in snapshot.records:
+            digest.update(repr(tuple(vps.get(field) for field in BILLING_FINGERPRINT_FIELDS)).encode('utf-8'))
+        fingerprint = digest.hexdigest()
+        self._fingerprint = (snapshot.version, fingerprint)
+        return fingerprint
+    
+    def get_aggregates_path(self):
+        """
+        获取物化汇总文件路径（与配置文件同目录）
+        
+        Returns:
+            str: 文件路径
+        """
+        return self.config_file + '.aggregates.json'
+    
+    def load_aggregates(self):
+        """从文件加载物化汇总，只加载一次，之后与内存中新计算的月份合并"""
+        if self._aggregates_loaded:
+            return
+        self._aggregates_loaded = True
+        try:
+            with open(self.get_aggregates_path(), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # 本进程已经计算过的月份比文件中的新
+            computed = self.aggregates.to_dict()['months']
+            self.aggregates.load(data)
+            if computed:
+                self.aggregates.months.update(computed)
+                self.aggregates.dirty = True
+        except FileNotFoundError:
+            pass
         except Exception as e:
-            logger.error(f"根据购买日期计算价格时出错: {str(e)}", exc_info=True)
-            # 发生错误时，尝试使用旧的计算方法
-            usage_result = self.calculate_usage_period(vps, year, month)
-            if isinstance(usage_result, tuple) and len(usage_result) == 4:
-                _, days, hours, minutes = usage_result
-                return self.calculate_price(price_per_month, days, hours, minutes)
-            return 0.0
-            
-    def update_prices(self):
+            logger.warning(f"读取物化汇总失败: {str(e)}")
+    
+    def save_aggregates(self):
         """
-        更新所有VPS的价格
+        将有变化的物化汇总写回文件
         
         Returns:
-            bool: 是否成功
+            bool: 是否成功（没有变化时也返回True）
         """
+        if not self.aggregates.dirty:
+            return True
         try:
-            # 确保使用当前实时时间
-            current_time = datetime.datetime.now()
-            
-            for vps in self.vps_data:
-                try:
-                    # 实时计算使用时长，精确到分钟
-                    usage_result = self.calculate_usage_period(vps, now=current_time)
-                    if isinstance(usage_result, tuple) and len(usage_result) == 4:
-                        usage_string, days, hours, minutes = usage_result
-                        vps['usage_period'] = usage_string
-                        
-                        # 使用新的计费方法，确保实时计算
-                        price_per_month = vps.get('price_per_month', 0)
-                        if price_per_month:
-                            total_price = self.calculate_price_with_purchase_date(vps)
-                            vps['total_price'] = round(total_price, 2)  # 确保总价精确到2位小数
-                    else:
-                        # 向后兼容老格式
-                        vps['usage_period'] = usage_result
-                        
-                        price_per_month = vps.get('price_per_month', 0)
-                        
-                        if vps['usage_period'] and price_per_month:
-                            # 使用旧的计算方法
-                            total_price = self.calculate_price_legacy(price_per_month, vps['usage_period'])
-                            vps['total_price'] = round(total_price, 2)  # 确保总价精确到2位小数
-                except Exception as e:
-                    logger.error(f"更新VPS {vps.get('name', 'Unknown')} 价格时出错: {str(e)}")
-                    continue
-            
-            self.calculate_total_bill()
-            return self.save_data()
+            # 合并文件中其他进程写入的月份和写回之间不能有其他进程写入
+            with self.file_lock.hold(exclusive=True):
+                self.load_aggregates()
+                path = self.get_aggregates_path()
+                temp_path = path + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.aggregates.to_dict(), f, ensure_ascii=False)
+                # 先写临时文件再替换，其他进程不会读到写了一半的文件
+                os.replace(temp_path, path)
+            self.aggregates.dirty = False
+            return True
         except Exception as e:
-            logger.error(f"更新VPS价格时出错: {str(e)}")
+            logger.error(f"保存物化汇总失败: {str(e)}")
             return False
-        
-    def calculate_price_legacy(self, price_per_month, usage_period):
+    
+    def get_aggregates(self, group_by=('country',), start_year=2024, start_month=1, end_year=None, end_month=None):
         """
-        旧的价格计算方法，用于兼容
+        按国家/地区、状态、是否使用NAT和年月分组统计VPS数、使用分钟数和费用
+        
+        已结束且数据没有变化的月份直接使用物化汇总，其余月份计算一次账单明细并更新汇总
         
         Args:
-            price_per_month (float): 月单价
-            usage_period (str): 使用时长，例如"3个月+15"
+            group_by (list): 分组字段，可选year、month、country、status、use_nat
+            start_year (int): 起始年份
+            start_month (int): 起始月份
+            end_year (int, optional): 结束年份，默认为当前年份
+            end_month (int, optional): 结束月份，默认为当前月份
             
         Returns:
-            float: 总价
+            dict: 分组字段、统计的月份数、重新计算的月份数和分组结果
         """
-        months, days = self.parse_usage_period(usage_period)
-        total = months * price_per_month
-        if days > 0:
-            # 计算每天的价格
-            daily_price = price_per_month / 30.0
-            total += days * daily_price
-        return round(total, 2)  # 确保总价精确到2位小数
+        group_by = [field for field in group_by if field]
+        invalid = [field for field in group_by if field not in ('year', 'month') + AGGREGATE_GROUP_FIELDS]
+        if invalid:
+            raise ValueError(f"不支持的分组字段: {', '.join(invalid)}")
+        
+        now = datetime.datetime.now()
+        end_year = end_year or now.year
+        end_month = end_month or (now.month if end_year == now.year else 12)
+        self.load_aggregates()
+        snapshot = self.get_snapshot()
+        fingerprint = self.get_billing_fingerprint(snapshot)
+        
+        month_entries = []
+        recomputed = 0
+        for month_info in MONTH_CALENDAR.months_between(start_year, start_month, end_year, end_month):
+            entry = self.aggregates.get(month_info.year, month_info.month, fingerprint)
+            if entry is None:
+                lines = self.compute_month_lines(snapshot.records, month_info.year, month_info.month, now)
+                entry = self.aggregates.record(month_info.year, month_info.month, fingerprint, now, lines)
+                recomputed += 1
+            month_entries.append((month_info.year, month_info.month, entry))
+        self.save_aggregates()
+        
+        return {
+            'group_by': group_by,
+            'months': len(month_entries),
+            'recomputed_months': recomputed,
+            'rows': MonthlyAggregates.query(month_entries, group_by)
+        }
     
-    def set_billing_period(self, year, month):
+    def _occupancy_interval(self, vps):
         """
-        设置账单计算的年月
+        VPS的在线区间：从启用日期（没有时用购买日期）开始，销毁的VPS到销毁日期当天结束
         
         Args:
-            year (int): 年份
-            month (int): 月份
+            vps (dict): VPS信息
             
         Returns:
-            bool: 是否成功设置
+            tuple: (开始分钟, 结束分钟或None)，无法确定开始时间时返回None
         """
-        try:
-            # 验证年月有效性
-            if not (2000 <= year <= 2100 and 1 <= month <= 12):
-                logger.error(f"无效的年月: {year}/{month}")
-                return False
-                
-            self.billing_year = year
-            self.billing_month = month
-            logger.info(f"已设置账单计算年月为: {year}/{month}")
-            return True
-        except Exception as e:
-            logger.error(f"设置账单年月时出错: {str(e)}")
-            return False
+        start = self._vps_date(vps, 'start_date') or self._vps_date(vps, 'purchase_date')
+        if start is None:
+            return None
+        end = None
+        if vps.get('status') == "销毁" and vps.get('cancel_date'):
+            cancel_date = self._vps_date(vps, 'cancel_date')
+            if cancel_date is not None:
+                # 销毁当天也算在线，到次日0点结束
+                end = epoch_minute(cancel_date.replace(hour=0, minute=0, second=0, microsecond=0)) + 24 * 60
+        return epoch_minute(start), end
     
-    def get_billing_period(self):
+    def get_occupancy_timelines(self, snapshot=None):
         """
-        获取当前账单计算的年月
+        获取全部VPS和各国家/地区的在线数量时间线，同一快照版本只建立一次
         
+        Args:
+            snapshot (FleetSnapshot, optional): VPS数据快照，默认为最近发布的快照
+            
         Returns:
-            tuple: (年份, 月份)
+            dict: {None: 全部VPS的时间线, 国家/地区: 该国家/地区的时间线}
         """
-        return (self.billing_year, self.billing_month)
+        snapshot = snapshot or self.get_snapshot()
+        version, timelines = self._occupancy
+        if version == snapshot.version:
+            return timelines
+        intervals = {None: []}
+        for vps in snapshot.records:
+            interval = self._occupancy_interval(vps)
+            if interval is None:
+                continue
+            intervals[None].append(interval)
+            intervals.setdefault(vps.get('country', '') or '', []).append(interval)
+        timelines = {country: OccupancyTimeline(items) for country, items in intervals.items()}
+        self._occupancy = (snapshot.version, timelines)
+        self.stats.incr('occupancy_build')
+        return timelines
     
-    def generate_monthly_bill_table(self, start_year=2024, end_year=None, end_month=None):
+    def get_occupancy(self, start_year=2024, start_month=1, end_year=None, end_month=None, country=None, at=None):
         """
-        生成月账单统计表，包含每月VPS使用情况和费用明细
+        查询在线VPS数量：指定时刻的在线数，以及每月的峰值、平均在线数和服务器·天数
         
         Args:
             start_year (int): 起始年份
+            start_month (int): 起始月份
             end_year (int, optional): 结束年份，默认为当前年份
             end_month (int, optional): 结束月份，默认为当前月份
+            country (str, optional): 只统计该国家/地区；不指定时同时给出各国家/地区的分组
+            at (datetime, optional): 统计截止时间，默认为当前时间，尚未结束的月份只统计到此时
             
         Returns:
-            tuple: (summary_df, bill_data) 汇总DataFrame和详细账单数据列表
+            dict: 截止时间的在线数和每月统计
         """
-        try:
-            # 如果未指定结束年月，使用当前年月
-            now = datetime.datetime.now()
-            if end_year is None:
-                end_year = now.year
-            if end_month is None:
-                end_month = now.month
-                
-            logger.info(f"生成月账单统计表 - 起始年份: {start_year}, 结束年月: {end_year}/{end_month}")
-            
-            # 获取当前实时时间用于计算
-            current_time = datetime.datetime.now()
+        at = at or datetime.datetime.now()
+        end_year = end_year or at.year
+        end_month = end_month or (at.month if end_year == at.year else 12)
+        timelines = self.get_occupancy_timelines()
+        if country is not None:
+            timelines = {None: timelines.get(country) or OccupancyTimeline([])}
+        at_minute = epoch_minute(at)
+        
+        months = []
+        for month_info in MONTH_CALENDAR.months_between(start_year, start_month, end_year, end_month):
+            end = min(month_info.end_minute, at_minute)
+            if end <= month_info.start_minute:
+                continue
+            month = {'year': month_info.year, 'month': month_info.month}
+            month.update(timelines[None].summarize(month_info.start_minute, end))
+            if country is None:
+                month['by_country'] = {
+                    name: timeline.summarize(month_info.start_minute, end)
+                    for name, timeline in timelines.items() if name is not None
+                }
+            months.append(month)
+        
+        return {
+            'as_of': at.strftime("%Y/%m/%d %H:%M:%S"),
+            'country': country,
+            'running': timelines[None].count_at(at_minute),
+            'months': months
+        }
+    
+    def _cost_index_entries(self, snapshot):
+        """
+        快照中每台计费VPS在费用索引中的条目
+        
+        Returns:
+            collections.Counter: {(国家/地区, 月单价（分）, 开始分钟, 结束分钟, 货币): 数量}
+        """
+        entries = collections.Counter()
+        for vps in snapshot.records:
+            price = float(vps.get('price_per_month', 0) or 0)
+            segments = self._price_segments(vps)
+            if not price and segments is None:
+                continue
+            start_date = self._vps_date(vps, 'start_date')
+            if start_date is None:
+                continue
+            # 规则与_billing_window一致：从启用日期开始计费，购买月份之前不计费，销毁当天计到当天结束
+            start = start_date
+            purchase_date = self._vps_date(vps, 'purchase_date')
+            if purchase_date:
+                start = max(start, MONTH_CALENDAR.get(purchase_date.year, purchase_date.month).start)
+            end = None
+            if vps.get('status') == "销毁" and vps.get('cancel_date'):
+                cancel_date = self._vps_date(vps, 'cancel_date')
+                if cancel_date is None:
+                    continue
+                end = epoch_minute(cancel_date.replace(hour=0, minute=0, second=0, microsecond=0)) + 24 * 60
+            start_minute = epoch_minute(start)
+            if end is not None and end <= start_minute:
+                continue
+            country = vps.get('country', '') or ''
+            currency = self._vps_currency(vps)
+            if segments is None:
+                entries[(country, amount_to_cents(price), start_minute, end, currency)] += 1
+                continue
+            # 每个单价区段一个条目
+            for position, segment_price in enumerate(segments.prices):
+                piece_start = start_minute if position == 0 else max(start_minute, epoch_minute(segments.starts[position]))
+                piece_end = end
+                if position + 1 < len(segments.starts):
+                    change = epoch_minute(segments.starts[position + 1])
+                    piece_end = change if end is None else min(end, change)
+                if segment_price and (piece_end is None or piece_end > piece_start):
+                    entries[(country, amount_to_cents(segment_price), piece_start, piece_end, currency)] += 1
+        return entries
+    
+    def get_cost_index(self):
+        """
+        获取按天的累计费用索引，截止到今天
+        
+        数据变化时只加减变化的VPS，日期变化（需要延长索引）时重新建立
+        
+        Returns:
+            DailyCostIndex: 费用索引
+        """
+        snapshot = self.get_snapshot()
+        today = datetime.date.today()
+        if self._cost_index is not None:
+            version, built_day, index, entries = self._cost_index
+            if built_day == today:
+                if version != snapshot.version:
+                    new_entries = self._cost_index_entries(snapshot)
+                    for entry, count in (entries - new_entries).items():
+                        for _ in range(count):
+                            index.apply(*entry, sign=-1)
+                    for entry, count in (new_entries - entries).items():
+                        if entry[2] < index.base_minute:
+                            # 开始时间早于索引的第一天，需要重新建立
+                            break
+                        for _ in range(count):
+                            index.apply(*entry)
+                    else:
+                        self._cost_index = (snapshot.version, today, index, new_entries)
+                        self.stats.incr('cost_index_update')
+                        return index
+                else:
+                    return index
+        
+        entries = self._cost_index_entries(snapshot)
+        first_minute = min((entry[2] for entry in entries), default=epoch_minute(datetime.datetime.now()))
+        first_day = (_EPOCH + datetime.timedelta(minutes=first_minute)).date()
+        index = DailyCostIndex(first_day, max(today, first_day),
+                               currency_rate=lambda currency, year, month: self.get_currency_rates(year, month)[currency])
+        for entry, count in entries.items():
+            for _ in range(count):
+                index.apply(*entry)
+        self._cost_index = (snapshot.version, today, index, entries)
+        self.stats.incr('cost_index_build')
+        return index
+    
+    def get_range_cost(self, start_date, end_date, country=None):
+        """
+        查询任意日期区间（包含两端）的费用，按每天的分钟费率累计，不逐月逐台计算
+        
+        按分钟比例累计，与月账单的差异只来自逐行取整和按整月计费的情况（销毁前已使用满30天），尚在运行的VPS计到今天结束
+        
+        Args:
+            start_date (str|date): 开始日期，YYYY/MM/DD
+            end_date (str|date): 结束日期，YYYY/MM/DD
+            country (str, optional): 只统计该国家/地区
             
-            # 用于存储所有月份的账单数据
-            bill_data = []
+        Returns:
+            dict: 区间费用，未指定国家/地区时同时给出各国家/地区的费用
+        """
+        if not isinstance(start_date, datetime.date):
+            start_date = self._strptime(str(start_date).replace('-', '/'), "%Y/%m/%d").date()
+        if not isinstance(end_date, datetime.date):
+            end_date = self._strptime(str(end_date).replace('-', '/'), "%Y/%m/%d").date()
+        if end_date < start_date:
+            raise ValueError(f"结束日期 {end_date} 早于开始日期 {start_date}")
+        
+        index = self.get_cost_index()
+        result = {
+            'start_date': start_date.strftime("%Y/%m/%d"),
+            'end_date': end_date.strftime("%Y/%m/%d"),
+            'country': country,
+            'cost': cents_to_amount(round(index.cost_cents(start_date, end_date, country)))
+        }
+        if country is None:
+            result['by_country'] = {
+                name: cents_to_amount(round(index.cost_cents(start_date, end_date, name)))
+                for name in index.countries
+            }
+        return result
+    
+    def get_month_traffic(self, year, month):
+        """
+        获取导入的某月NAT实际流量，同一月份只读取一次
+        
+        Returns:
+            dict: {VPS名称: 字节数}
+        """
+        key = (year, month)
+        if key not in self._traffic_cache:
+            try:
+                self._traffic_cache[key] = self.traffic.month_bytes(year, month)
+            except Exception as e:
+                logger.error(f"读取{year}年{month}月NAT流量失败: {str(e)}")
+                self._traffic_cache[key] = {}
+        return self._traffic_cache[key]
+    
+    def ingest_traffic(self, paths):
+        """
+        导入NAT流量文件（CSV或JSONL），按(VPS, 日期)累加字节数；重复导入同一文件只读取新增的部分
+        
+        Args:
+            paths (list): 文件或目录路径，目录中导入所有.csv/.jsonl文件
             
-            # 遍历每个月份，生成账单数据
-            for year in range(start_year, end_year + 1):
-                # 确定月份范围
-                month_start = 1
-                month_end = 12
-                
-                if year == start_year:
-                    month_start = 1  # 起始年份从1月开始
-                    
-                if year == end_year:
-                    month_end = end_month  # 结束年份到指定月份结束
-                
-                for month in range(month_start, month_end + 1):
-                    logger.info(f"正在生成 {year}年{month}月 账单数据")
-                    
-                    # 获取所有VPS
-                    vps_list = self.vps_data
-                    
-                    # 设置当前处理的账单周期
-                    self.set_billing_period(year, month)
-                    
-                    # 初始化月数据
-                    month_data = []
-                    has_destroyed_vps_this_month = False
-                    
-                    # 检查是否有在当月销毁的VPS
-                    for vps in vps_list:
-                        if vps.get('status') == "销毁":
-                            cancel_date_str = vps.get('cancel_date', '')
-                            if cancel_date_str:
-                                try:
-                                    # 尝试解析yyyy/mm/dd格式
-                                    parts = cancel_date_str.split('/')
-                                    if len(parts) == 3:
-                                        cancel_year = int(parts[0])
-                                        cancel_month = int(parts[1])
-                                        
-                                        if cancel_year == year and cancel_month == month:
-                                            has_destroyed_vps_this_month = True
-                                            break
-                                except:
-                                    pass
-                    
-                    # 遍历每个VPS，计算当月使用情况
-                    for vps in vps_list:
-                        vps_name = vps.get('name', '未命名')
-                        use_nat = vps.get('use_nat', False)
-                        
-                        # 保存原始状态，用于后续判断
-                        original_status = vps.get('status', '')
-                        
-                        # 如果是销毁状态，需要检查销毁日期是否在查询月份
-                        cancel_date = None
-                        if original_status == "销毁":
-                            cancel_date_str = vps.get('cancel_date', '')
-                            try:
-                                # 尝试解析yyyy-mm-dd格式
-                                cancel_date = datetime.datetime.strptime(cancel_date_str, "%Y/%m/%d")
-                                cancel_date = cancel_date.replace(hour=23, minute=59, second=59)
-                            except ValueError:
-                                try:
-                                    # 尝试解析yyyy-mm-dd格式
-                                    cancel_date = datetime.datetime.strptime(cancel_date_str, "%Y-%m-%d")
-                                    cancel_date = cancel_date.replace(hour=23, minute=59, second=59)
-                                except ValueError:
-                                    try:
-                                        parts = cancel_date_str.split('/')
-                                        if len(parts) == 3:
-                                            y_part = int(parts[0])
-                                            m_part = int(parts[1])
-                                            d_part = int(parts[2])
-                                            cancel_date = datetime.datetime(y_part, m_part, d_part, 23, 59, 59)
-                                        else:
-                                            cancel_date = None
-                                    except Exception:
-                                        cancel_date = None
-                            
-                            # 如果销毁日期在查询月份之前，则跳过该VPS
-                            if cancel_date and (cancel_date.year < year or (cancel_date.year == year and cancel_date.month < month)):
-                                logger.info(f"VPS {vps_name} 在 {cancel_date.year}/{cancel_date.month}/{cancel_date.day} 销毁，早于查询月份 {year}/{month}，跳过显示")
-                                continue
-                            
-                            # 如果销毁日期在查询月份之后，则该月显示为"在用"
-                            if cancel_date and (cancel_date.year > year or (cancel_date.year == year and cancel_date.month > month)):
-                                # 创建临时副本以修改状态
-                                vps = vps.copy()
-                                vps['status'] = "在用"
-                                logger.info(f"VPS {vps_name} 在 {cancel_date.year}/{cancel_date.month}/{cancel_date.day} 销毁，晚于查询月份 {year}/{month}，当月显示为'在用'")
-                        
-                        # 获取购买日期
-                        purchase_date_str = vps.get('purchase_date', '')
-                        if not purchase_date_str:
-                            purchase_date_str = vps.get('start_date', '')
-                        
-                        # 如果有启用日期，检查是否在查询月份之后，如果是则跳过
-                        if purchase_date_str:
-                            purchase_date = None
-                            try:
-                                if ' ' in purchase_date_str:
-                                    purchase_date = datetime.datetime.strptime(purchase_date_str, "%Y/%m/%d %H:%M:%S")
-                                else:
-                                    purchase_date = datetime.datetime.strptime(purchase_date_str, "%Y/%m/%d")
-                            except ValueError:
-                                try:
-                                    purchase_date = datetime.datetime.strptime(purchase_date_str, "%Y-%m-%d")
-                                except ValueError:
-                                    try:
-                                        parts = purchase_date_str.split('/')
-                                        if len(parts) == 3:
-                                            y_part = int(parts[0])
-                                            m_part = int(parts[1])
-                                            d_part = int(parts[2])
-                                            purchase_date = datetime.datetime(y_part, m_part, d_part)
-                                    except:
-                                        purchase_date = None
-                            
-                            # 如果购买日期晚于查询月份的月末，则跳过
-                            if purchase_date:
-                                month_end_date = datetime.datetime(year, month, calendar.monthrange(year, month)[1], 23, 59, 59)
-                                if purchase_date > month_end_date:
-                                    logger.info(f"VPS {vps_name} 的购买/启用日期 {purchase_date_str} 晚于查询月份 {year}/{month} 的月末，跳过显示")
-                                    continue
-                            
-                        # 获取销毁日期（仅用于显示，使用原始状态）
-                        display_cancel_date_str = ''
-                        # 只有当VPS在当月销毁时才设置销毁时间显示
-                        if original_status == "销毁" and cancel_date and cancel_date.year == year and cancel_date.month == month:
-                            display_cancel_date_str = vps.get('cancel_date', '')
-                        
-                        # 计算使用时长，使用实时时间
-                        usage_result = self.calculate_usage_period(vps, year, month, now=current_time)
-                        usage_str = ''
-                        days = 0
-                        hours = 0
-                        minutes = 0
-                        
-                        if isinstance(usage_result, tuple) and len(usage_result) == 4:
-                            usage_str, days, hours, minutes = usage_result
-                            
-                        # 如果使用时长为0，则跳过该VPS
-                        if days == 0 and hours == 0 and minutes == 0:
-                            continue
-                            
-                        # 计算价格，使用更精确的方法
-                        price_per_month = float(vps.get('price_per_month', 0))
-                        total_price = self.calculate_price_with_purchase_date(vps, year, month)
-                        total_price = round(total_price, 2)  # 确保总价精确到2位小数
-                        
-                        # 决定在该月账单中显示的状态
-                        # 如果是销毁状态，仅在销毁当月显示销毁状态，其他情况显示为"在用"
-                        if original_status == "销毁":
-                            if cancel_date and cancel_date.year == year and cancel_date.month == month:
-                                display_status = "销毁"
-                            else:
-                                display_status = "在用"
-                        else:
-                            display_status = vps.get('status')
-                        
-                        # 创建行数据
-                        row_data = {
-                            'VPS名称': vps_name,
-                            '国家/地区': vps.get('country', ''),
-                            '使用状态': display_status,
-                            '使用时长': usage_str,
-                            '单价/月（$）': price_per_month,
-                            '合计（$）': total_price,
-                            '是否使用NAT': '是' if use_nat else '否',
-                            '购买日期': purchase_date_str,
-                            '销毁时间': display_cancel_date_str,
-                            'raw_value': vps  # 用于调试，JSON输出时会忽略这个字段
-                        }
-                        
-                        # 只有在当月有VPS销毁时才添加销毁时间列
-                        if has_destroyed_vps_this_month:
-                            row_data['销毁时间'] = display_cancel_date_str
-                            
-                        # 添加到月数据
-                        month_data.append(row_data)
-                    
-                    # 计算NAT费用 - 修改为使用指定年月的汇率
-                    nat_fee = self.calculate_nat_fee(year, month)
-                    nat_fee = round(nat_fee, 2)  # 确保NAT费用精确到2位小数
-                    
-                    # 计算月总费用
-                    month_total = sum(item['合计（$）'] for item in month_data)
-                    if nat_fee > 0:
-                        month_total += nat_fee
-                    month_total = round(month_total, 2)  # 确保月总费用精确到2位小数
-                    
-                    # 添加到账单数据
-                    if month_data:  # 只有当月有数据时才添加
-                        bill_data.append({
-                            '年份': year,
-                            '月份': month,
-                            '账单日期': f"{year}/{month}/1",
-                            'VPS数量': len(month_data),
-                            '月总费用': month_total,
-                            'NAT费用': nat_fee,
-                            '详细数据': month_data,
-                            '显示销毁时间列': has_destroyed_vps_this_month  # 添加标记，指示是否显示销毁时间列
-                        })
+        Returns:
+            dict: 每个文件的导入结果和总的读取行数、速度
+        """
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                    if name.lower().endswith(('.csv', '.jsonl', '.ndjson'))))
+            else:
+                files.append(path)
+        
+        start = time.perf_counter()
+        results = [self.traffic.ingest(path) for path in files]
+        seconds = time.perf_counter() - start
+        self._traffic_cache = {}
+        lines = sum(result['lines'] for result in results)
+        self.stats.incr('traffic_lines', lines)
+        logger.info(f"导入{len(files)}个流量文件，读取{lines}行，耗时{seconds:.3f}秒")
+        return {
+            'files': results,
+            'lines': lines,
+            'seconds': round(seconds, 3),
+            'lines_per_second': round(lines / seconds) if seconds > 0 else None
+        }
+    
+    def get_nat_traffic(self, year, month):
+        """
+        某月每台使用NAT的VPS的实际流量和按流量计算的NAT费用
+        
+        Returns:
+            dict: 每台VPS的流量（G）和NAT费用
+        """
+        traffic = self.get_month_traffic(int(year), int(month))
+        nat_fee, nat_days, nat_vps = self.compute_nat_fee(self.get_snapshot().records, int(year), int(month))
+        return {
+            'year': int(year),
+            'month': int(month),
+            'traffic_gb': {name: round(count / BYTES_PER_GB, 3) for name, count in traffic.items()},
+            'nat_fee': nat_fee,
+            'nat_days': nat_days,
+            'nat_vps': nat_vps
+        }
+    
+    def _day_bitmap_key(self, vps):
+        """按天位图只取决于这些字段，字段相同的VPS共用一个位图"""
+        return repr(tuple(vps.get(field) or '' for field in
+                          ('status', 'purchase_date', 'start_date', 'expire_date', 'cancel_date')))
+    
+    def _build_day_bitmap(self, vps):
+        """
+        根据VPS的生命周期建立按天位图，使用区间与calculate_usage_period一致：
+        从购买日期开始（需要有启用日期），销毁的VPS到销毁日期（优先expire_date，只有日期时到当天23:59:59）结束，
+        每一天分别判断，当天使用超过12小时算一天。只有同一个月内开始和结束都带有具体时刻时，
+        才会与按总时长取整（1天6小时算1天）的结果不同
+        
+        Args:
+            vps (dict): VPS信息
             
-            # 创建DataFrame
-            columns = [
-                '年份', '月份', '账单日期', 'VPS数量', 'NAT费用', '月总费用'
-            ]
+        Returns:
+            DayBitmap: 按天位图
+        """
+        bitmap = DayBitmap()
+        start = self._vps_date(vps, 'purchase_date')
+        if start is None or self._vps_date(vps, 'start_date') is None:
+            return bitmap
+        end = None
+        if vps.get('status') == "销毁" and (vps.get('expire_date') or vps.get('cancel_date')):
+            cancel_field = 'expire_date' if vps.get('expire_date') else 'cancel_date'
+            end = self._vps_date(vps, cancel_field)
+            if end is not None and ' ' not in str(vps.get(cancel_field)):
+                end = end.replace(hour=23, minute=59, second=59)
+            if end is not None and end <= start:
+                return bitmap
+        
+        half_day = datetime.timedelta(hours=12, minutes=1)  # 超过12小时（按分钟计）
+        first = day_number(start)
+        next_midnight = datetime.datetime.combine(start.date(), datetime.time()) + datetime.timedelta(days=1)
+        if end is None:
+            # 无法解析销毁日期时与calculate_usage_period一样按仍在使用处理
+            if next_midnight - start >= half_day:
+                bitmap.bits = 1 << first
+            bitmap.open_from = first + 1
+            return bitmap
+        last = day_number(end)
+        if first == last:
+            if end - start >= half_day:
+                bitmap.bits = 1 << first
+            return bitmap
+        if next_midnight - start >= half_day:
+            bitmap.bits |= 1 << first
+        if end - datetime.datetime.combine(end.date(), datetime.time()) >= half_day:
+            bitmap.bits |= 1 << last
+        # 中间的整天
+        bitmap.bits |= ((1 << (last - first - 1)) - 1) << (first + 1)
+        return bitmap
+    
+    def get_day_bitmap(self, vps):
+        """
+        获取VPS的按天位图，生命周期字段没有变化时使用缓存
+        
+        Args:
+            vps (dict): VPS信息
             
-            summary_data = []
-            for bill in bill_data:
-                row = [
-                    bill['年份'],
-                    bill['月份'],
-                    bill['账单日期'],
-                    bill['VPS数量'],
-                    bill['NAT费用'],
-                    bill['月总费用']
-                ]
-                summary_data.append(row)
+        Returns:
+            DayBitmap: 按天位图
+        """
+        self.load_nat_days()
+        key = self._day_bitmap_key(vps)
+        bitmap = self.nat_days.bitmaps.get(key)
+        if bitmap is None:
+            bitmap = self._build_day_bitmap(vps)
+            self.nat_days.bitmaps[key] = bitmap
+            self.nat_days.dirty = True
+            self.stats.incr('day_bitmap_build')
+        return bitmap
+    
+    def get_nat_days_path(self):
+        """
+        获取按天位图文件路径（与配置文件同目录）
+        
+        Returns:
+            str: 文件路径
+        """
+        return self.config_file + '.natdays.json'
+    
+    def load_nat_days(self):
+        """从文件加载按天位图，只加载一次"""
+        if self._nat_days_loaded:
+            return
+        self._nat_days_loaded = True
+        try:
+            with open(self.get_nat_days_path(), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            computed = self.nat_days.bitmaps
+            self.nat_days.load(data)
+            if computed:
+                self.nat_days.bitmaps.update(computed)
+                self.nat_days.dirty = True
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"读取按天位图失败: {str(e)}")
+    
+    def save_nat_days(self):
+        """
+        将有变化的按天位图写回文件，只保留当前VPS用到的位图
+        
+        Returns:
+            bool: 是否成功（没有变化时也返回True）
+        """
+        if not self.nat_days.dirty:
+            return True
+        try:
+            used = {self._day_bitmap_key(vps) for vps in self.get_snapshot().records}
+            # 自动保存在后台线程中执行，先复制一份再遍历，主线程可能同时在添加位图
+            bitmaps = dict(self.nat_days.bitmaps)
+            self.nat_days.bitmaps = {key: bitmap for key, bitmap in bitmaps.items() if key in used}
+            path = self.get_nat_days_path()
+            temp_path = path + '.tmp'
+            with self.file_lock.hold(exclusive=True):
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.nat_days.to_dict(), f, ensure_ascii=False)
+                os.replace(temp_path, path)
+            self.nat_days.dirty = False
+            return True
+        except Exception as e:
+            logger.error(f"保存按天位图失败: {str(e)}")
+            return False
+    
+    def get_nat_days(self, start_date, end_date):
+        """
+        统计任意日期区间（包含两端）内使用NAT的VPS天数，每天使用超过12小时算一天
+        
+        Args:
+            start_date (str|date): 开始日期，YYYY/MM/DD
+            end_date (str|date): 结束日期，YYYY/MM/DD
             
-            summary_df = pd.DataFrame(summary_data, columns=columns)
+        Returns:
+            dict: NAT总天数、使用NAT的VPS数和每台VPS的天数
+        """
+        if not isinstance(start_date, datetime.date):
+            start_date = self._strptime(str(start_date).replace('-', '/'), "%Y/%m/%d").date()
+        if not isinstance(end_date, datetime.date):
+            end_date = self._strptime(str(end_date).replace('-', '/'), "%Y/%m/%d").date()
+        if end_date < start_date:
+            raise ValueError(f"结束日期 {end_date} 早于开始日期 {start_date}")
+        
+        first, last = day_number(start_date), day_number(end_date)
+        by_vps = {}
+        for vps in self.get_snapshot().records:
+            if vps.get('use_nat', False) is True:
+                days = self.get_day_bitmap(vps).count(first, last)
+                if days > 0:
+                    by_vps[vps.get('name', '')] = by_vps.get(vps.get('name', ''), 0) + days
+        return {
+            'start_date': start_date.strftime("%Y/%m/%d"),
+            'end_date': end_date.strftime("%Y/%m/%d"),
+            'nat_days': sum(by_vps.values()),
+            'nat_vps': len(by_vps),
+            'by_vps': by_vps
+        }
+    
+    def get_fleet_as_of(self, when):
+        """
+        从变更日志还原指定时间点的VPS数据
+        
+        Args:
+            when (str|datetime): 时间点，YYYY/MM/DD [HH:MM:SS]，只有日期时为当天结束
             
-            return summary_df, bill_data
+        Returns:
+            tuple: (VPS数据字典列表, 还原信息)
+        """
+        if not isinstance(when, datetime.datetime):
+            text = str(when).replace('-', '/')
+            if ' ' in text:
+                when = self._strptime(text, "%Y/%m/%d %H:%M:%S")
+            else:
+                when = self._strptime(text, "%Y/%m/%d") + datetime.timedelta(days=1) - datetime.timedelta(microseconds=1)
+        records, info = self.events.state_at(when)
+        if records is None:
+            raise ValueError(f"变更日志中没有{when.strftime('%Y/%m/%d %H:%M:%S')}之前的记录")
+        info['at'] = when.strftime("%Y/%m/%d %H:%M:%S")
+        info['vps_count'] = len(records)
+        return records, info
+    
+    def get_monthly_bill_as_of(self, year, month, when):
+        """
+        用指定时间点的VPS数据计算月账单，例如还原当时发出的账单
         
-        except Exception as e:
-            logger.error(f"生成月账单表格时出错: {str(e)}", exc_info=True)
-            return pd.DataFrame(), []
+        Args:
+            year (int): 年份
+            month (int): 月份
+            when (str|datetime): 数据时间点
+            
+        Returns:
+            dict: 与get_monthly_bill_data相同结构的账单数据，附带还原信息
+        """
+        records, info = self.get_fleet_as_of(when)
+        snapshot = FleetSnapshot.from_vps_list(next(self._history_versions), records)
+        bill = self.compute_monthly_bill(snapshot, int(year), int(month), datetime.datetime.now())
+        bill['数据时间点'] = info['at']
+        return bill
     
     def get_current_month_bill(self):
         """
@@ -2028,198 +6459,15 @@ class BillingManager:
                 raise ValueError(f"无效的月份: {month}，月份必须在1-12之间")
             
             logger.info(f"开始获取{year}年{month}月账单数据")
-                
-            # 用于返回的账单数据结构
-            bill_data = {
-                '年份': year,
-                '月份': month,
-                '账单日期': f"{year}/{month}/1",
-                'VPS数量': 0,
-                'NAT费用': 0,
-                '月总费用': 0,
-                '账单行': []
-            }
-            
-            # 设置月份名称
-            month_names = {
-                1: "一月", 2: "二月", 3: "三月", 4: "四月",
-                5: "五月", 6: "六月", 7: "七月", 8: "八月",
-                9: "九月", 10: "十月", 11: "十一月", 12: "十二月"
-            }
-            month_name = month_names.get(month, str(month) + "月")
-            
-            # 强制重置NAT费用
-            self.reset_nat_fee()
-            
-            # 设置临时的账单周期
-            self.set_billing_period(year, month)
-            
-            # 获取所有VPS数据
-            vps_list = self.get_all_vps()
-            logger.info(f"获取到{len(vps_list)}台VPS数据")
-            
-            if not vps_list:
-                logger.warning("没有找到VPS数据，返回空账单")
-                return bill_data
-            
-            active_vps_count = 0
-            
-            # 获取当前实时时间用于计算
-            current_time = datetime.datetime.now()
-            logger.info(f"使用当前时间: {current_time}")
-            
-            # 计算每个VPS在指定月份的使用情况
-            for i, vps in enumerate(vps_list):
-                try:
-                    vps_name = vps.get('name', f'VPS-{i+1}')
-                    logger.info(f"处理VPS {i+1}/{len(vps_list)}: {vps_name}")
-                    
-                    # 计算使用时长，确保使用实时时间
-                    usage_result = self.calculate_usage_period(vps, year, month, now=current_time)
-                    
-                    if isinstance(usage_result, tuple) and len(usage_result) == 4:
-                        usage_string, days, hours, minutes = usage_result
-                        logger.info(f"VPS {vps_name} 使用时长: {usage_string}")
-                        
-                        # 只有使用时长大于0的才添加到账单
-                        if days > 0 or hours > 0 or minutes > 0:
-                            active_vps_count += 1
-                            
-                            # 计算VPS价格，使用更精确的方法
-                            price_per_month = vps.get('price_per_month', 0)
-                            total_price = self.calculate_price_with_purchase_date(vps, year, month)
-                            total_price = round(total_price, 2)  # 确保价格精确到2位小数
-                except Exception as vps_error:
-                    logger.error(f"处理VPS {vps.get('name', f'VPS-{i+1}')} 时出错: {str(vps_error)}")
-                    continue
-                
-                # 获取原始状态和销毁日期
-                original_status = vps.get('status', '')
-                cancel_date_str = vps.get('cancel_date', '')
-                display_status = original_status
-                display_cancel_date = ''
-                
-                # 如果是销毁状态，需要处理销毁日期和状态显示逻辑
-                if original_status == "销毁" and cancel_date_str:
-                    cancel_date = None
-                    try:
-                        # 尝试解析销毁日期
-                        try:
-                            cancel_date = datetime.datetime.strptime(cancel_date_str, "%Y/%m/%d")
-                        except ValueError:
-                            try:
-                                cancel_date = datetime.datetime.strptime(cancel_date_str, "%Y-%m-%d")
-                            except ValueError:
-                                try:
-                                    parts = cancel_date_str.split('/')
-                                    if len(parts) == 3:
-                                        y_part = int(parts[0])
-                                        m_part = int(parts[1])
-                                        d_part = int(parts[2])
-                                        cancel_date = datetime.datetime(y_part, m_part, d_part)
-                                except Exception:
-                                    pass
-                        
-                        # 根据销毁日期设置显示状态和时间
-                        if cancel_date:
-                            # 只在销毁当月显示"销毁"状态和销毁时间
-                            if cancel_date.year == year and cancel_date.month == month:
-                                display_status = "销毁"
-                                display_cancel_date = cancel_date_str
-                            else:
-                                # 在销毁之前的月份显示为"在用"，不显示销毁时间
-                                display_status = "在用"
-                                display_cancel_date = ''
-                            
-                            # 如果销毁日期在查询月份之前，则应该跳过此VPS
-                            if cancel_date.year < year or (cancel_date.year == year and cancel_date.month < month):
-                                logger.info(f"VPS {vps.get('name', '未命名')} 在 {cancel_date_str} 销毁，早于查询月份 {year}/{month}，跳过显示")
-                                continue
-                    except Exception as e:
-                        logger.error(f"解析销毁日期出错: {str(e)}")
-                
-                # 添加到账单行
-                bill_row = {
-                    'VPS名称': vps.get('name', '未命名'),
-                    'IP地址': vps.get('ip_address', ''),
-                    '国家/地区': vps.get('country', ''),
-                    '使用状态': display_status,
-                    '销毁时间': display_cancel_date,
-                    '统计截止时间': f"{year}年{month_name}",
-                    '使用时长': usage_string,
-                    '月单价': vps.get('price_per_month', 0),
-                    '总金额': total_price,
-                    '是否使用NAT': '是' if vps.get('use_nat', False) else '否',
-                    '单价/月（$）': vps.get('price_per_month', 0),
-                    '合计（$）': total_price
-                }
-                
-                bill_data['账单行'].append(bill_row)
             
-            # 计算当月NAT费用，使用指定年月的汇率
-            try:
-                nat_fee = self.calculate_nat_fee(year, month)
-                nat_fee = round(nat_fee, 2)  # 确保NAT费用精确到2位小数
-                logger.info(f"计算NAT费用: {nat_fee}")
-            except Exception as e:
-                logger.error(f"计算NAT费用失败: {str(e)}")
-                nat_fee = 0
-            
-            # 计算总费用
-            vps_total = sum(float(row.get('总金额', 0)) for row in bill_data['账单行'])
-            vps_total = round(vps_total, 2)  # 确保VPS总费用精确到2位小数
-            
-            total_bill = vps_total + nat_fee
-            total_bill = round(total_bill, 2)  # 确保总费用精确到2位小数
-            
-            # 更新账单数据
-            bill_data['VPS数量'] = active_vps_count
-            bill_data['NAT费用'] = nat_fee
-            bill_data['月总费用'] = total_bill
-            
-            logger.info(f"账单生成完成 - VPS数量: {active_vps_count}, NAT费用: {nat_fee}, 总费用: {total_bill}")
-            
-            # 如果NAT费用大于0，添加NAT使用详情
-            if nat_fee > 0:
-                # 计算使用NAT的VPS数量和总天数
-                nat_vps_list = [row for row in bill_data['账单行'] if row.get('是否使用NAT') == '是']
-                active_nat_vps = len(nat_vps_list)
-                
-                # 计算NAT总使用天数
-                total_nat_days = 0
-                for vps in nat_vps_list:
-                    usage_str = vps.get('使用时长', '')
-                    if '天' in usage_str:
-                        try:
-                            days_part = usage_str.split('天')[0]
-                            days = int(days_part)
-                            
-                            # 如果有小时部分，且超过12小时，天数+1
-                            if '小时' in usage_str:
-                                hours_part = usage_str.split('天')[1].split('小时')[0].strip()
-                                if hours_part:
-                                    hours = int(hours_part)
-                                    if hours > 12:
-                                        days += 1
-                                        
-                            total_nat_days += days
-                        except (ValueError, IndexError) as e:
-                            logger.warning(f"解析使用时长出错: {usage_str}, {str(e)}")
-                
-                # 获取指定月份的汇率
-                exchange_rate = self.get_exchange_rate(year, month)
-                exchange_rate_display = round(1 / exchange_rate, 2) if exchange_rate > 0 else 0
-                
-                # 添加NAT费用详情到账单数据
-                bill_data['NAT详情'] = {
-                    'NAT使用VPS数': active_nat_vps,
-                    'NAT总天数': total_nat_days,
-                    '单价': '¥1/G/天',
-                    '汇率': f'¥{exchange_rate_display}:$1',
-                    '费用说明': f'{active_nat_vps}台VPS共{total_nat_days}天×1G/天×¥1/G÷当月汇率¥{exchange_rate_display}:$1'
-                }
+            # 已结账月份直接使用账本中冻结的账单，之后修改VPS数据也不会改变
+            closed = self.ledger.get(year, month)
+            if closed is not None:
+                logger.info(f"{year}年{month}月已于{closed['closed_at']}结账，使用月结账本中的账单")
+                return copy.deepcopy(closed['bill'])
             
-            return bill_data
+            # 基于已发布快照计算，不修改账单年月和NAT费用
+            return self.compute_monthly_bill(self.get_snapshot(), year, month, datetime.datetime.now())
             
         except Exception as e:
             logger.error(f"获取{year}年{month}月账单数据失败: {str(e)}", exc_info=True)
@@ -2300,17 +6548,9 @@ class BillingManager:
                     
                     # 添加NAT费用和总计行
                     if bill_data['NAT费用'] > 0:
-                        # 获取NAT详情
-                        nat_details = bill_data.get('NAT详情', {})
-                        nat_vps_count = nat_details.get('NAT使用VPS数', 0)
-                        total_nat_days = nat_details.get('NAT总天数', 0)
-                        
-                        # 获取当月汇率
-                        exchange_rate = self.get_exchange_rate(specific_year, specific_month)
-                        exchange_rate_display = round(1 / exchange_rate, 2) if exchange_rate > 0 else 0
-                        
+                        # 费用说明与计算NAT费用时的天数、流量和计费规则一致
                         nat_row = pd.Series({
-                            'VPS名称': f'NAT费用({nat_vps_count}台VPS共{total_nat_days}天×1G/天×¥1/G÷当月汇率¥{exchange_rate_display}:$1)',
+                            'VPS名称': nat_fee_label(bill_data.get('NAT详情')),
                             '合计（$）': bill_data['NAT费用']
                         })
                         month_df = pd.concat([month_df, pd.DataFrame([nat_row])], ignore_index=True)
@@ -2629,35 +6869,9 @@ class BillingManager:
                         
                         # 添加NAT费用和总计行
                         if bill['NAT费用'] > 0:
-                            # 计算使用NAT的VPS和它们的总使用天数
-                            nat_vps_count = sum(1 for row in bill['详细数据'] if row.get('是否使用NAT') == '是')
-                            
-                            # 计算NAT VPS的总使用天数
-                            total_nat_days = 0
-                            for row in bill['详细数据']:
-                                if row.get('是否使用NAT') == '是':
-                                    usage_str = row.get('使用时长', '')
-                                    # 尝试解析使用时长中的天数
-                                    if '天' in usage_str:
-                                        try:
-                                            days_part = usage_str.split('天')[0]
-                                            days = int(days_part)
-                                            # 如果有小时且超过12小时，天数加1
-                                            if '小时' in usage_str:
-                                                hours_part = usage_str.split('天')[1].split('小时')[0]
-                                                hours = int(hours_part)
-                                                if hours > 12:
-                                                    days += 1
-                                            total_nat_days += days
-                                        except (ValueError, IndexError):
-                                            pass
-                            
-                            # 获取指定年月的实时汇率
-                            exchange_rate = self.get_exchange_rate(year, month)
-                            exchange_rate_display = round(1 / exchange_rate, 2) if exchange_rate > 0 else 0
-                            
+                            # 费用说明与计算NAT费用时的天数、流量和计费规则一致
                             nat_row = pd.Series({
-                                'VPS名称': f'NAT费用({nat_vps_count}台VPS共{total_nat_days}天×1G/天×¥1/G÷当月汇率¥{exchange_rate_display}:$1)',
+                                'VPS名称': nat_fee_label(bill.get('NAT详情')),
                                 '合计（$）': bill['NAT费用']
                             })
                             month_df = pd.concat([month_df, pd.DataFrame([nat_row])], ignore_index=True)
@@ -2882,7 +7096,7 @@ class BillingManager:
             ]
             
             # 将示例数据添加到VPS数据中
-            self.vps_data = sample_data
+            self.vps_data = [VpsRecord(vps) for vps in sample_data]
             
             # 保存数据
             result = self.save_data()
@@ -2934,7 +7148,7 @@ class BillingManager:
                     vps_data['purchase_date'] = datetime.datetime.now().strftime("%Y/%m/%d")
                     
                 # 添加VPS数据
-                self.vps_data.append(vps_data)
+                self.vps_data.append(VpsRecord.from_dict(vps_data))
                 success_count += 1
             
             # 只有在成功添加了VPS时才保存数据
@@ -2965,6 +7179,225 @@ class BillingManager:
                 "errors": [str(e)]
             }
 
+    def _normalize_import_row(self, row, today):
+        """
+        校验并规范化一条导入记录，规则与save_vps相同
+        
+        Args:
+            row (dict): 导入文件中的一行
+            today (str): 缺少购买日期时使用的日期（YYYY/MM/DD）
+            
+        Returns:
+            dict: 规范化后的VPS数据
+            
+        Raises:
+            ValueError: 记录无效
+        """
+        vps_data = {}
+        for key, value in row.items():
+            if value is None or (isinstance(value, str) and not value.strip()):
+                continue
+            if isinstance(value, (datetime.datetime, datetime.date)):
+                # Excel单元格中的日期
+                value = value.strftime("%Y/%m/%d")
+            vps_data[str(key).strip()] = value.strip() if isinstance(value, str) else value
+        
+        name = vps_data.get('name')
+        if not name:
+            raise ValueError("缺少name字段")
+        vps_data['name'] = str(name)
+        if 'price_per_month' in vps_data:
+            try:
+                vps_data['price_per_month'] = float(vps_data['price_per_month'])
+            except (TypeError, ValueError):
+                raise ValueError(f"无效的月单价: {vps_data['price_per_month']}")
+        if 'use_nat' in vps_data:
+            use_nat = vps_data['use_nat']
+            if isinstance(use_nat, str):
+                use_nat = use_nat.lower() in ('是', 'true', 'yes', 'y', '1')
+            vps_data['use_nat'] = bool(use_nat)
+        if 'status' in vps_data:
+            vps_data['status'] = str(vps_data['status'])
+        if 'currency' in vps_data:
+            vps_data['currency'] = normalize_currency(vps_data['currency'])
+        
+        for date_field in ('purchase_date', 'start_date', 'cancel_date'):
+            if date_field in vps_data:
+                date_value = str(vps_data[date_field]).replace('-', '/')
+                if self._parse_bill_date(date_value) is None:
+                    raise ValueError(f"无效的{date_field}: {vps_data[date_field]}")
+                vps_data[date_field] = date_value
+        # 状态不是销毁时不保留销毁日期
+        if vps_data.get('status') != '销毁':
+            vps_data.pop('cancel_date', None)
+        
+        vps_data.setdefault('purchase_date', today)
+        vps_data.setdefault('start_date', vps_data['purchase_date'])
+        return vps_data
+    
+    def import_vps(self, paths):
+        """
+        从CSV、JSONL或Excel文件批量导入VPS，逐行读取、分批校验规范化，全部读完后只保存一次
+        
+        名称已存在或在导入文件中重复出现的记录跳过（按名称的哈希集合判断），无效记录跳过并给出行号
+        
+        Args:
+            paths (list): 文件或目录路径，目录中导入所有.csv/.jsonl/.xlsx文件
+            
+        Returns:
+            dict: 读取、添加、重复、无效的记录数，错误信息和导入速度（条/秒）
+        """
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                    if name.lower().endswith(('.csv', '.jsonl', '.ndjson', '.xlsx', '.xlsm'))))
+            else:
+                files.append(path)
+        
+        start = time.perf_counter()
+        now = datetime.datetime.now()
+        today = now.strftime("%Y/%m/%d")
+        names = {vps.get('name') for vps in self.vps_data}
+        added = []
+        read = duplicates = invalid = 0
+        errors = []
+        
+        def add_error(message):
+            if len(errors) < VPS_IMPORT_MAX_ERRORS:
+                errors.append(message)
+        
+        for path in files:
+            rows = iter_vps_import_rows(path)
+            while True:
+                chunk = list(itertools.islice(rows, VPS_IMPORT_CHUNK_SIZE))
+                if not chunk:
+                    break
+                read += len(chunk)
+                for line_number, row in chunk:
+                    location = f"{os.path.basename(path)}第{line_number}行"
+                    if row is None:
+                        invalid += 1
+                        add_error(f"{location}: 无法解析")
+                        continue
+                    try:
+                        vps_data = self._normalize_import_row(row, today)
+                    except ValueError as e:
+                        invalid += 1
+                        add_error(f"{location}: {str(e)}")
+                        continue
+                    if vps_data['name'] in names:
+                        duplicates += 1
+                        add_error(f"{location}: VPS已存在: {vps_data['name']}")
+                        continue
+                    names.add(vps_data['name'])
+                    vps = VpsRecord.from_dict(vps_data)
+                    self._refresh_vps_price(vps, now)
+                    added.append(vps)
+                logger.info(f"已读取{path}中的{read}条记录，待添加{len(added)}台VPS")
+        
+        saved = True
+        if added:
+            self.vps_data.extend(added)
+            saved = self.save_data()
+            if not saved:
+                # 保存失败时撤销本次导入，内存中的数据与配置文件保持一致
+                del self.vps_data[-len(added):]
+                self.publish_snapshot()
+        seconds = time.perf_counter() - start
+        self.stats.incr('vps_import_records', read)
+        logger.info(f"导入{len(files)}个文件，读取{read}条记录，添加{len(added) if saved else 0}台VPS，耗时{seconds:.3f}秒")
+        return {
+            'success': saved and bool(added),
+            'message': f"已添加 {len(added) if saved else 0} 台VPS，重复 {duplicates} 条，无效 {invalid} 条" if saved else "保存VPS数据失败",
+            'files': files,
+            'read': read,
+            'added': len(added) if saved else 0,
+            'duplicates': duplicates,
+            'invalid': invalid,
+            'errors': errors,
+            'seconds': round(seconds, 3),
+            'records_per_second': round(read / seconds) if seconds > 0 else None
+        }
+    
+    def get_stats(self):
+        """
+        获取本进程的热点路径统计
+
+        Returns:
+            dict: 计数器、计时器和配置文件锁等待数据
+        """
+        stats = self.stats.to_dict()
+        stats['file_lock'] = self.file_lock.to_dict()
+        return stats
+
+    def get_stats_log_path(self):
+        """
+        获取每次调用统计的滚动日志路径（与配置文件同目录）
+
+        Returns:
+            str: 日志文件路径
+        """
+        return os.path.join(os.path.dirname(self.config_file), 'billing_stats.log')
+
+    def append_stats_log(self, action, log_file=None):
+        """
+        将本次调用的统计追加到滚动日志（JSON Lines），超过STATS_LOG_MAX_LINES行时丢弃最旧的记录
+
+        Args:
+            action (str): 本次执行的操作
+            log_file (str, optional): 日志文件路径，默认为get_stats_log_path()
+
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            log_file = log_file or self.get_stats_log_path()
+            entry = self.get_stats()
+            entry['action'] = action
+            entry['logged_at'] = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+
+            # 追加和截断之间不能有其他进程追加，否则它的记录会被截断覆盖
+            with self.file_lock.hold(exclusive=True):
+                with open(log_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+                # 超出上限时只保留最近的记录
+                with open(log_file, 'r', encoding='utf-8') as f:
+                    lines = f.readlines()
+                if len(lines) > STATS_LOG_MAX_LINES:
+                    with open(log_file, 'w', encoding='utf-8') as f:
+                        f.writelines(lines[-STATS_LOG_MAX_LINES:])
+            return True
+        except Exception as e:
+            logger.error(f"写入统计日志失败: {str(e)}")
+            return False
+
+    def read_stats_log(self, limit=50, log_file=None):
+        """
+        读取滚动日志中最近的统计记录
+
+        Args:
+            limit (int): 最多返回的记录数
+            log_file (str, optional): 日志文件路径，默认为get_stats_log_path()
+
+        Returns:
+            list: 统计记录列表，按时间先后排列
+        """
+        log_file = log_file or self.get_stats_log_path()
+        if not os.path.exists(log_file):
+            return []
+        entries = []
+        try:
+            with open(log_file, 'r', encoding='utf-8') as f:
+                for line in f.readlines()[-limit:]:
+                    line = line.strip()
+                    if line:
+                        entries.append(json.loads(line))
+        except Exception as e:
+            logger.error(f"读取统计日志失败: {str(e)}")
+        return entries
+
     def start_auto_save_timer(self):
         """启动自动保存定时器，定期保存VPS数据"""
         try:
@@ -2976,7 +7409,8 @@ class BillingManager:
             def auto_save_task():
                 try:
                     logger.info("执行自动保存VPS数据...")
-                    self.save_data()
+                    # 后台线程只写出已发布的快照
+                    self.save_data(publish=False)
                     # 重新设置下一次自动保存的定时器
                     self.auto_save_timer = threading.Timer(300, auto_save_task)
                     self.auto_save_timer.daemon = True  # 设置为守护线程，程序退出时不会阻塞
@@ -2992,6 +7426,548 @@ class BillingManager:
         except Exception as e:
             logger.error(f"启动自动保存定时器失败: {str(e)}")
 
+def get_profile_output_path(billing_manager, args):
+    """
+    获取 --profile 生成的.prof文件路径：有输出文件时写在输出文件旁，否则写在配置文件旁
+
+    Args:
+        billing_manager (BillingManager): 账单管理器实例
+        args (argparse.Namespace): 命令行参数
+
+    Returns:
+        str: .prof文件路径
+    """
+    if args.output:
+        return os.path.splitext(os.path.abspath(args.output))[0] + '.prof'
+    config_dir = os.path.dirname(billing_manager.config_file)
+    return os.path.join(config_dir, f"billing_{args.action}.prof")
+
+
+def report_profile(profiler, phase_timer, prof_file, stream=None):
+    """
+    保存cProfile结果，并把阶段耗时和热点函数统计输出到stderr
+
+    Args:
+        profiler (cProfile.Profile): 已停止的性能分析器
+        phase_timer (PhaseTimer): 阶段计时器
+        prof_file (str): .prof文件路径
+        stream: 输出流，默认为stderr
+    """
+    stream = stream or sys.stderr
+    try:
+        profiler.dump_stats(prof_file)
+        phase_timer.report(stream)
+
+        # 按函数名汇总累计耗时，同名函数（如json.dumps）合并统计
+        stats = pstats.Stats(profiler)
+        by_name = {}
+        for (filename, lineno, func_name), (cc, nc, tt, ct, callers) in stats.stats.items():
+            calls, cumulative = by_name.get(func_name, (0, 0.0))
+            by_name[func_name] = (calls + nc, max(cumulative, ct))
+
+        print("[profile] 热点函数(累计耗时/调用次数):", file=stream)
+        for label, func_name in PROFILE_HOTSPOTS:
+            if func_name in by_name:
+                calls, cumulative = by_name[func_name]
+                print(f"[profile]   {label:<16} {func_name:<36} {cumulative:8.3f}s {calls:>8}次", file=stream)
+
+        print(f"[profile] cProfile结果已写入: {prof_file} (可用 python -m pstats 或 snakeviz 查看)", file=stream)
+    except Exception as e:
+        print(f"[profile] 输出性能分析结果失败: {str(e)}", file=stream)
+
+
+class CliActionError(Exception):
+    """命令行操作失败，单个操作时错误信息原样输出到stderr"""
+
+
+def execute_cli_action(billing_manager, args):
+    """
+    执行命令行指定的操作
+
+    Args:
+        billing_manager (BillingManager): 账单管理器实例
+        args (argparse.Namespace): 命令行参数
+
+    Returns:
+        操作结果：可JSON序列化的对象，或直接输出的文本
+
+    Raises:
+        CliActionError: 操作失败，错误信息原样输出到stderr
+    """
+    # 根据action参数执行相应操作
+    if args.action == 'get_current_month_bill':
+        # 获取当前月账单
+        result = billing_manager.get_current_month_bill()
+        # 输出JSON格式结果
+        return result
+        
+    elif args.action == 'get_monthly_bill':
+        # 检查是否提供了年月参数
+        if args.year is None or args.month is None:
+            raise ValueError("获取月账单需要指定year和month参数")
+        
+        # 获取指定月账单，指定--at时使用变更日志还原的当时数据
+        if args.at:
+            result = billing_manager.get_monthly_bill_as_of(args.year, args.month, args.at)
+        else:
+            result = billing_manager.get_monthly_bill_data(args.year, args.month)
+        # 输出JSON格式结果
+        return result
+        
+    elif args.action == 'get_monthly_bill_summary':
+        # 获取月账单汇总
+        summary_df, bill_data = billing_manager.generate_monthly_bill_table()
+        
+        # 将DataFrame转换为字典列表
+        summary_list = []
+        for _, row in summary_df.iterrows():
+            summary_list.append(row.to_dict())
+        
+        # 输出JSON格式结果
+        return summary_list
+        
+    elif args.action == 'save_monthly_billing_to_excel':
+        # 导出月账单统计到Excel
+        output_file = args.output or '月账单统计.xlsx'
+        
+        # 检查是否提供了年月参数
+        if args.specific_year is not None and args.specific_month is not None:
+            # 如果提供了specific_year和specific_month参数，只导出指定月份的账单
+            success = billing_manager.save_monthly_billing_to_excel(
+                output_file, 
+                specific_year=args.specific_year, 
+                specific_month=args.specific_month
+            )
+        elif args.year is not None and args.month is not None:
+            # 兼容旧参数 year 和 month
+            success = billing_manager.save_monthly_billing_to_excel(
+                output_file, 
+                specific_year=args.year, 
+                specific_month=args.month
+            )
+        else:
+            # 否则导出所有月份的账单汇总
+            success = billing_manager.save_monthly_billing_to_excel(output_file)
+        
+        if not success:
+            raise CliActionError("保存月账单统计失败")
+        return f"成功保存月账单统计到 {output_file}"
+            
+    elif args.action == 'get_all_vps':
+        # 获取所有VPS数据
+        all_vps = billing_manager.get_all_vps()
+        # 输出JSON格式结果
+        return all_vps
+        
+    elif args.action == 'save_vps':
+        # 检查是否提供了VPS数据
+        if args.vps_data is None:
+            raise ValueError("保存VPS需要提供vps_data参数")
+        
+        # 解析VPS数据JSON字符串
+        try:
+            vps_data = json.loads(args.vps_data)
+            
+            # 确保所有的字段类型正确
+            if 'price_per_month' in vps_data:
+                vps_data['price_per_month'] = float(vps_data['price_per_month'])
+            if 'use_nat' in vps_data:
+                vps_data['use_nat'] = bool(vps_data['use_nat'])
+            
+            # 确保状态字段是字符串
+            if 'status' in vps_data:
+                vps_data['status'] = str(vps_data['status'])
+                
+            # 确保日期格式正确
+            for date_field in ['purchase_date', 'start_date', 'cancel_date']:
+                if date_field in vps_data and vps_data[date_field]:
+                    # 确保日期格式为 YYYY/MM/DD
+                    date_value = str(vps_data[date_field])
+                    if '/' not in date_value and '-' in date_value:
+                        vps_data[date_field] = date_value.replace('-', '/')
+            
+            # 如果状态不是销毁，确保不包含cancel_date或置为空
+            if vps_data.get('status') != '销毁' and 'cancel_date' in vps_data:
+                vps_data['cancel_date'] = ''
+            
+            # 保存VPS数据
+            if 'name' in vps_data:
+                vps_name = vps_data['name']
+                existing_vps = billing_manager.get_vps_by_name(vps_name)
+                
+                if existing_vps:
+                    # 更新已有VPS
+                    success = billing_manager.update_vps(vps_name, **vps_data)
+                    result = billing_manager.get_vps_by_name(vps_name)
+                else:
+                    # 添加新VPS
+                    success = billing_manager.add_vps(vps_data)
+                    result = billing_manager.get_vps_by_name(vps_name)
+                
+                if success and result:
+                    # 更新价格
+                    billing_manager.update_prices()
+                    # 输出更新后的VPS数据
+                    return result.to_dict()
+                raise CliActionError(f"保存VPS失败: {vps_name}")
+            raise CliActionError("VPS数据缺少name字段")
+        except CliActionError:
+            raise
+        except json.JSONDecodeError as e:
+            raise CliActionError(f"VPS数据JSON解析失败: {str(e)}")
+        except Exception as e:
+            raise CliActionError(f"处理VPS数据时出错: {str(e)}")
+            
+    elif args.action == 'delete_vps':
+        # 检查是否提供了VPS名称
+        if args.vps_name is None:
+            raise ValueError("删除VPS需要提供vps_name参数")
+        
+        # 删除VPS
+        success = billing_manager.delete_vps(args.vps_name)
+        return {"success": success}
+        
+    elif args.action == 'init_sample_data':
+        # 初始化示例数据
+        success = billing_manager.init_sample_vps_data()
+        return {"success": success}
+        
+    elif args.action == 'update_prices':
+        # 更新VPS价格
+        success = billing_manager.update_prices()
+        return {"success": success}
+        
+    elif args.action == 'batch_add_vps':
+        # 检查是否提供了VPS列表数据
+        if args.vps_list is None:
+            raise ValueError("批量添加VPS需要提供vps_list参数")
+        
+        # 解析VPS列表数据JSON字符串
+        vps_list = json.loads(args.vps_list)
+        
+        # 批量添加VPS
+        result = billing_manager.batch_add_vps(vps_list)
+        return result
+        
+    elif args.action == 'get_cost_ticker':
+        # 当月累计费用，VPS数据没有变化时直接由计时器计算
+        result = billing_manager.get_cost_ticker()
+        return result
+        
+    elif args.action == 'get_cost_projection':
+        # 本月月末和下个月的费用预测
+        result = billing_manager.project_costs()
+        return result
+        
+    elif args.action == 'get_aggregates':
+        # 分组统计，--group_by指定分组字段，--year/--month限定单个年份或月份
+        group_by = (args.group_by or 'country').split(',')
+        if args.year and args.month:
+            result = billing_manager.get_aggregates(group_by, args.year, args.month, args.year, args.month)
+        elif args.year:
+            result = billing_manager.get_aggregates(group_by, args.year, 1, args.year)
+        else:
+            result = billing_manager.get_aggregates(group_by)
+        return result
+        
+    elif args.action == 'get_occupancy':
+        # 在线VPS数量统计，--year/--month限定月份，--country限定国家/地区
+        if args.year and args.month:
+            result = billing_manager.get_occupancy(args.year, args.month, args.year, args.month, country=args.country)
+        elif args.year:
+            result = billing_manager.get_occupancy(args.year, 1, args.year, country=args.country)
+        else:
+            result = billing_manager.get_occupancy(country=args.country)
+        return result
+        
+    elif args.action == 'get_range_cost':
+        # 任意日期区间的费用，--start_date/--end_date为YYYY/MM/DD，--country限定国家/地区
+        if not args.start_date or not args.end_date:
+            raise ValueError("查询区间费用需要提供start_date和end_date参数")
+        result = billing_manager.get_range_cost(args.start_date, args.end_date, country=args.country)
+        return result
+        
+    elif args.action == 'get_nat_days':
+        # 任意日期区间内NAT VPS的使用天数，--start_date/--end_date为YYYY/MM/DD
+        if not args.start_date or not args.end_date:
+            raise ValueError("查询NAT天数需要提供start_date和end_date参数")
+        result = billing_manager.get_nat_days(args.start_date, args.end_date)
+        return result
+        
+    elif args.action in ('close_month', 'reopen_month', 'recompute_month'):
+        # 月结账本：close_month结账，reopen_month重新打开，recompute_month重新打开并按当前数据重新结账
+        if args.year is None or args.month is None:
+            raise ValueError(f"{args.action}需要指定year和month参数")
+        if args.action == 'close_month':
+            result = billing_manager.close_month(args.year, args.month)
+        else:
+            result = billing_manager.reopen_month(args.year, args.month, recompute=args.action == 'recompute_month')
+        return result
+        
+    elif args.action == 'get_fleet_as_of':
+        # 还原指定时间点的VPS数据，--at为YYYY/MM/DD [HH:MM:SS]
+        if not args.at:
+            raise ValueError("还原VPS数据需要提供at参数")
+        records, info = billing_manager.get_fleet_as_of(args.at)
+        return {'info': info, 'vps_servers': records}
+        
+    elif args.action == 'change_price':
+        # 调整单价：--vps_name、--price，--at为生效时间（默认为现在）
+        if not args.vps_name or args.price is None:
+            raise ValueError("调整单价需要提供vps_name和price参数")
+        if not billing_manager.change_vps_price(args.vps_name, args.price, effective=args.at):
+            raise ValueError(f"调整VPS {args.vps_name} 单价失败")
+        billing_manager.update_prices()
+        return billing_manager.get_vps_by_name(args.vps_name).to_dict()
+        
+    elif args.action == 'get_pricing_rules':
+        # 已注册的计费规则和规则组合，VPS的pricing_rule字段填写规则组合名称
+        result = {
+            'rules': {name: rule.description for name, rule in PRICING_RULES.items()},
+            'rule_sets': {name: {'server': rules[0].name, 'nat': rules[1].name}
+                          for name, rules in PRICING_RULE_SETS.items()},
+            'default': DEFAULT_PRICING_RULE_SET
+        }
+        return result
+        
+    elif args.action == 'ingest_traffic':
+        # 导入NAT流量文件，--input为逗号分隔的文件或目录
+        if not args.input:
+            raise ValueError("导入流量需要提供input参数")
+        result = billing_manager.ingest_traffic([path for path in args.input.split(',') if path])
+        return result
+        
+    elif args.action == 'import_vps':
+        # 从文件批量导入VPS，代替把整个列表放在--vps_list命令行参数中
+        if not args.input:
+            raise ValueError("导入VPS需要提供input参数")
+        return billing_manager.import_vps([path for path in args.input.split(',') if path])
+        
+    elif args.action == 'query_vps':
+        # 分页查询VPS，只输出当前页，代替get_all_vps输出全部数据
+        return billing_manager.query_vps(
+            filters=json.loads(args.filter) if args.filter else None,
+            sort=args.sort or 'name',
+            fields=[field for field in (args.fields or '').split(',') if field] or None,
+            limit=args.limit or VPS_QUERY_DEFAULT_LIMIT,
+            cursor=args.cursor)
+        
+    elif args.action in ('bulk_update', 'bulk_set_status'):
+        # 一次修改多台VPS：--vps_names和/或--filter选择VPS
+        names = [name for name in (args.vps_names or '').split(',') if name]
+        filters = json.loads(args.filter) if args.filter else None
+        if args.action == 'bulk_update':
+            if args.vps_data is None:
+                raise ValueError("批量修改需要提供vps_data参数")
+            result = billing_manager.bulk_update(json.loads(args.vps_data), names=names, filters=filters)
+        else:
+            result = billing_manager.bulk_set_status(args.status, names=names, filters=filters, cancel_date=args.at)
+        return result
+        
+    elif args.action == 'get_nat_traffic':
+        if args.year is None or args.month is None:
+            raise ValueError("查询NAT流量需要指定year和month参数")
+        return billing_manager.get_nat_traffic(args.year, args.month)
+        
+    elif args.action == 'get_currency_rates':
+        # 指定月份（默认当前月份）各货币兑美元汇率及两两之间的汇率
+        now = datetime.datetime.now()
+        year = args.year or now.year
+        month = args.month or now.month
+        matrix = billing_manager.get_currency_matrix([(year, month)])
+        result = {
+            'year': year,
+            'month': month,
+            'base': BASE_CURRENCY,
+            'rates': {currency: matrix.rate(currency, year, month) for currency in SUPPORTED_CURRENCIES},
+            'pairs': matrix.pair_table(year, month)
+        }
+        return result
+        
+    elif args.action == 'check_money':
+        # 用浮点计费结果核对整数金额计算，--year/--month指定结束年月
+        result = billing_manager.cross_check_money(end_year=args.year, end_month=args.month)
+        return result
+        
+    elif args.action == 'get_stats':
+        # 获取本进程统计和滚动日志中最近的统计记录
+        result = {
+            'current': billing_manager.get_stats(),
+            'history': billing_manager.read_stats_log(log_file=args.stats_log or None)
+        }
+        return result
+
+
+# 命令行结果的输出格式，json为默认格式
+OUTPUT_FORMATS = ('json', 'columnar', 'msgpack')
+
+
+def to_columnar(value):
+    """
+    把结果中的对象列表转换成列式结构，字段名只出现一次，每行是与columns顺序一致的数组
+
+    [{'a': 1, 'b': 2}, {'a': 3}] 转换为 {'columns': ['a', 'b'], 'rows': [[1, 2], [3, None]]}，
+    某行缺少的字段为None；其他列表和对象递归转换，标量原样返回
+
+    Args:
+        value: 可JSON序列化的结果
+
+    Returns:
+        转换后的结果
+    """
+    if isinstance(value, dict):
+        return {key: to_columnar(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            columns = list(dict.fromkeys(key for item in value for key in item))
+            return {'columns': columns,
+                    'rows': [[to_columnar(item.get(column)) for column in columns] for item in value]}
+        return [to_columnar(item) for item in value]
+    return value
+
+
+def from_columnar(value):
+    """
+    to_columnar的逆转换，把{'columns': [...], 'rows': [[...]]}还原成对象列表
+
+    Args:
+        value: to_columnar的结果
+
+    Returns:
+        还原后的结果，某行缺少的字段还原为None
+    """
+    if isinstance(value, dict):
+        if value.keys() == {'columns', 'rows'}:
+            columns = value['columns']
+            return [dict(zip(columns, (from_columnar(item) for item in row))) for row in value['rows']]
+        return {key: from_columnar(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [from_columnar(item) for item in value]
+    return value
+
+
+def print_cli_result(result, output_format='json'):
+    """
+    输出操作结果，None不输出
+
+    json：文本原样输出，其他结果以JSON格式输出
+    columnar：对象列表转换成列式结构后以JSON格式输出，文本原样输出
+    msgpack：结果（包括文本）以MessagePack二进制输出
+
+    Args:
+        result: execute_cli_action的返回值
+        output_format (str): 输出格式，OUTPUT_FORMATS之一
+    """
+    if result is None:
+        return
+    if output_format == 'msgpack':
+        if msgpack is None:
+            raise CliActionError("--format=msgpack需要安装msgpack")
+        sys.stdout.flush()
+        sys.stdout.buffer.write(msgpack.packb(result, use_bin_type=True))
+        sys.stdout.buffer.flush()
+    elif isinstance(result, str):
+        print(result)
+    elif output_format == 'columnar':
+        print(json.dumps(to_columnar(result), ensure_ascii=False, separators=(',', ':')))
+    else:
+        print(json.dumps(result, ensure_ascii=False))
+
+
+def run_cli_action(billing_manager, args):
+    """
+    执行命令行指定的操作，结果按--format输出到stdout
+
+    Args:
+        billing_manager (BillingManager): 账单管理器实例
+        args (argparse.Namespace): 命令行参数
+    """
+    print_cli_result(execute_cli_action(billing_manager, args), getattr(args, 'format', 'json'))
+
+
+# 批量执行时不能在单个操作中修改的参数
+BATCH_RESERVED_ARGS = {'action', 'batch', 'config', 'profile', 'stats_log', 'format'}
+
+
+def read_cli_batch(source):
+    """
+    读取--batch的操作列表
+
+    Args:
+        source (str): 文件路径，'-'表示从stdin读取
+
+    Returns:
+        list: [{'action': 操作, 'args': {参数: 值}}, ...]
+    """
+    if source == '-':
+        requests_data = json.load(sys.stdin)
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            requests_data = json.load(f)
+    if not isinstance(requests_data, list):
+        raise ValueError("批量操作需要JSON数组")
+    for position, request in enumerate(requests_data):
+        if not isinstance(request, dict) or not request.get('action'):
+            raise ValueError(f"第{position + 1}个批量操作缺少action")
+        if not isinstance(request.get('args', {}), dict):
+            raise ValueError(f"第{position + 1}个批量操作的args必须是对象")
+    return requests_data
+
+
+def build_batch_args(parser, request):
+    """
+    把一个批量操作转换成与命令行参数相同的Namespace，未指定的参数使用命令行默认值
+
+    Args:
+        parser (argparse.ArgumentParser): 命令行参数解析器
+        request (dict): {'action': 操作, 'args': {参数: 值}}
+
+    Returns:
+        argparse.Namespace: 操作参数
+    """
+    args = parser.parse_args(['--action', str(request['action'])])
+    for key, value in request.get('args', {}).items():
+        if key in BATCH_RESERVED_ARGS or not hasattr(args, key):
+            raise ValueError(f"批量操作不支持参数: {key}")
+        # vps_data、vps_list等参数在命令行上是JSON字符串，批量操作中可以直接写对象
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, ensure_ascii=False)
+        setattr(args, key, value)
+    return args
+
+
+def run_cli_batch(billing_manager, parser, requests_data, output_format='json'):
+    """
+    在同一个账单管理器上依次执行多个操作，整批只写一次配置文件，结果数组按output_format输出到stdout
+
+    某个操作失败不影响后续操作，失败的操作在结果中给出错误信息
+
+    Args:
+        billing_manager (BillingManager): 账单管理器实例
+        parser (argparse.ArgumentParser): 命令行参数解析器
+        requests_data (list): read_cli_batch读取的操作列表
+        output_format (str): 输出格式，OUTPUT_FORMATS之一
+    """
+    results = []
+    with billing_manager.deferred_save():
+        for request in requests_data:
+            action = request['action']
+            try:
+                result = execute_cli_action(billing_manager, build_batch_args(parser, request))
+                results.append({'action': action, 'success': True, 'result': result})
+            except Exception as e:
+                logger.error(f"批量操作 {action} 失败: {str(e)}")
+                results.append({'action': action, 'success': False, 'error': str(e)})
+            billing_manager.stats.incr('batch_action')
+    print_cli_result(results, output_format)
+
+
+# 会修改配置文件的操作，需要在加载数据前持有排他锁，直到写回完成
+WRITE_ACTIONS = {'save_vps', 'delete_vps', 'init_sample_data', 'update_prices', 'batch_add_vps',
+                 'close_month', 'reopen_month', 'recompute_month', 'change_price', 'ingest_traffic', 'import_vps',
+                 'bulk_update', 'bulk_set_status'}
+
+
 # 如果作为命令行脚本运行
 if __name__ == "__main__":
     # 设置日志格式
@@ -3002,8 +7978,8 @@ if __name__ == "__main__":
     
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='VPS账单管理工具')
-    parser.add_argument('--action', type=str, required=True, 
-                        help='要执行的操作: get_current_month_bill, get_monthly_bill, get_monthly_bill_summary, save_monthly_billing_to_excel, get_all_vps, save_vps, delete_vps, init_sample_data, update_prices, batch_add_vps')
+    parser.add_argument('--action', type=str, 
+                        help='要执行的操作: get_current_month_bill, get_monthly_bill, get_monthly_bill_summary, save_monthly_billing_to_excel, get_all_vps, save_vps, delete_vps, init_sample_data, update_prices, batch_add_vps, get_stats, check_money, get_cost_ticker, get_cost_projection, get_aggregates, get_occupancy, get_range_cost, get_nat_days, close_month, reopen_month, recompute_month, get_fleet_as_of, change_price, get_pricing_rules, ingest_traffic, get_nat_traffic, get_currency_rates, import_vps, bulk_update, bulk_set_status, query_vps')
     parser.add_argument('--year', type=int, help='指定的年份')
     parser.add_argument('--month', type=int, help='指定的月份')
     parser.add_argument('--specific_year', type=int, help='导出单个月账单时指定的年份')
@@ -3013,171 +7989,90 @@ if __name__ == "__main__":
     parser.add_argument('--vps_name', type=str, help='VPS名称')
     parser.add_argument('--vps_data', type=str, help='VPS数据JSON字符串')
     parser.add_argument('--vps_list', type=str, help='批量添加的VPS数据列表JSON字符串')
+    parser.add_argument('--group_by', type=str, help='get_aggregates的分组字段，逗号分隔：year,month,country,status,use_nat')
+    parser.add_argument('--country', type=str, help='get_occupancy、get_range_cost只统计的国家/地区')
+    parser.add_argument('--start_date', type=str, help='get_range_cost、get_nat_days的开始日期（YYYY/MM/DD）')
+    parser.add_argument('--end_date', type=str, help='get_range_cost、get_nat_days的结束日期（YYYY/MM/DD）')
+    parser.add_argument('--at', type=str, help='get_fleet_as_of、get_monthly_bill使用的数据时间点，change_price的生效时间，bulk_set_status的销毁日期（YYYY/MM/DD [HH:MM:SS]）')
+    parser.add_argument('--price', type=float, help='change_price的新月单价')
+    parser.add_argument('--vps_names', type=str, help='bulk_update、bulk_set_status的VPS名称，逗号分隔')
+    parser.add_argument('--filter', type=str,
+                        help='query_vps、bulk_update、bulk_set_status的筛选条件JSON，例如{"country": "日本", "status": "在用", "purchase_from": "2024/01/01"}')
+    parser.add_argument('--status', type=str, help='bulk_set_status的新状态')
+    parser.add_argument('--sort', type=str, help='query_vps的排序字段，前面加"-"为降序')
+    parser.add_argument('--fields', type=str, help='query_vps只返回的字段，逗号分隔')
+    parser.add_argument('--limit', type=int, help='query_vps每页条数')
+    parser.add_argument('--cursor', type=str, help='query_vps上一页返回的next_cursor')
+    parser.add_argument('--input', type=str, help='ingest_traffic的流量文件、import_vps的VPS数据文件（CSV/JSONL/xlsx）或目录，逗号分隔')
+    parser.add_argument('--profile', action='store_true',
+                        help='对本次操作进行性能分析：.prof文件写到输出文件旁，阶段耗时输出到stderr')
+    parser.add_argument('--stats_log', type=str, nargs='?', const='',
+                        help='将本次调用的统计追加到滚动日志，不指定路径时使用配置文件目录下的billing_stats.log')
+    parser.add_argument('--batch', type=str, nargs='?', const='-',
+                        help='从文件（不指定时从stdin）读取JSON数组[{"action": ..., "args": {...}}]，在一个进程中依次执行并只保存一次')
+    parser.add_argument('--format', type=str, choices=OUTPUT_FORMATS, default='json',
+                        help='stdout结果格式：json（默认）；columnar为列式JSON，对象列表的字段名只输出一次；msgpack为MessagePack二进制（需要安装msgpack）')
     args = parser.parse_args()
+    if args.format == 'msgpack' and msgpack is None:
+        parser.error('--format=msgpack需要安装msgpack')
+    
+    batch_requests = None
+    if args.batch is not None:
+        try:
+            batch_requests = read_cli_batch(args.batch)
+        except Exception as e:
+            print(json.dumps({"error": f"读取批量操作失败: {str(e)}"}, ensure_ascii=False), file=sys.stderr)
+            sys.exit(1)
+        args.action = 'batch'
+    elif not args.action:
+        parser.error('需要指定--action或--batch')
+    
+    # 阶段计时，模块导入耗时在导入完成时已记录
+    phase_timer = PhaseTimer()
+    phase_timer.add('模块导入', _MODULE_IMPORT_SECONDS)
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    
+    # 写操作在整个读取-修改-写回过程中持有排他锁，读操作只在读取文件时持有共享锁
+    file_lock = ConfigFileLock(resolve_config_path(args.config) + '.lock')
+    if batch_requests is not None:
+        holds_write_lock = any(request['action'] in WRITE_ACTIONS for request in batch_requests)
+    else:
+        holds_write_lock = args.action in WRITE_ACTIONS
+    if holds_write_lock:
+        with phase_timer.phase('等待文件锁'):
+            file_lock.acquire(exclusive=True)
     
     # 创建账单管理器实例
-    billing_manager = BillingManager(config_file=args.config)
+    with phase_timer.phase('加载数据'):
+        billing_manager = BillingManager(config_file=args.config, file_lock=file_lock)
     
     try:
-        # 根据action参数执行相应操作
-        if args.action == 'get_current_month_bill':
-            # 获取当前月账单
-            result = billing_manager.get_current_month_bill()
-            # 输出JSON格式结果
-            print(json.dumps(result, ensure_ascii=False))
-            
-        elif args.action == 'get_monthly_bill':
-            # 检查是否提供了年月参数
-            if args.year is None or args.month is None:
-                raise ValueError("获取月账单需要指定year和month参数")
-            
-            # 获取指定月账单
-            result = billing_manager.get_monthly_bill_data(args.year, args.month)
-            # 输出JSON格式结果
-            print(json.dumps(result, ensure_ascii=False))
-            
-        elif args.action == 'get_monthly_bill_summary':
-            # 获取月账单汇总
-            summary_df, bill_data = billing_manager.generate_monthly_bill_table()
-            
-            # 将DataFrame转换为字典列表
-            summary_list = []
-            for _, row in summary_df.iterrows():
-                summary_list.append(row.to_dict())
-            
-            # 输出JSON格式结果
-            print(json.dumps(summary_list, ensure_ascii=False))
-            
-        elif args.action == 'save_monthly_billing_to_excel':
-            # 导出月账单统计到Excel
-            output_file = args.output or '月账单统计.xlsx'
-            
-            # 检查是否提供了年月参数
-            if args.specific_year is not None and args.specific_month is not None:
-                # 如果提供了specific_year和specific_month参数，只导出指定月份的账单
-                success = billing_manager.save_monthly_billing_to_excel(
-                    output_file, 
-                    specific_year=args.specific_year, 
-                    specific_month=args.specific_month
-                )
-            elif args.year is not None and args.month is not None:
-                # 兼容旧参数 year 和 month
-                success = billing_manager.save_monthly_billing_to_excel(
-                    output_file, 
-                    specific_year=args.year, 
-                    specific_month=args.month
-                )
-            else:
-                # 否则导出所有月份的账单汇总
-                success = billing_manager.save_monthly_billing_to_excel(output_file)
-            
-            if success:
-                print(f"成功保存月账单统计到 {output_file}")
-                sys.exit(0)
-            else:
-                print(f"保存月账单统计失败", file=sys.stderr)
-                sys.exit(1)
-                
-        elif args.action == 'get_all_vps':
-            # 获取所有VPS数据
-            all_vps = billing_manager.get_all_vps()
-            # 输出JSON格式结果
-            print(json.dumps(all_vps, ensure_ascii=False))
-            
-        elif args.action == 'save_vps':
-            # 检查是否提供了VPS数据
-            if args.vps_data is None:
-                raise ValueError("保存VPS需要提供vps_data参数")
-            
-            # 解析VPS数据JSON字符串
-            try:
-                vps_data = json.loads(args.vps_data)
-                
-                # 确保所有的字段类型正确
-                if 'price_per_month' in vps_data:
-                    vps_data['price_per_month'] = float(vps_data['price_per_month'])
-                if 'use_nat' in vps_data:
-                    vps_data['use_nat'] = bool(vps_data['use_nat'])
-                
-                # 确保状态字段是字符串
-                if 'status' in vps_data:
-                    vps_data['status'] = str(vps_data['status'])
-                    
-                # 确保日期格式正确
-                for date_field in ['purchase_date', 'start_date', 'cancel_date']:
-                    if date_field in vps_data and vps_data[date_field]:
-                        # 确保日期格式为 YYYY/MM/DD
-                        date_value = str(vps_data[date_field])
-                        if '/' not in date_value and '-' in date_value:
-                            vps_data[date_field] = date_value.replace('-', '/')
-                
-                # 如果状态不是销毁，确保不包含cancel_date或置为空
-                if vps_data.get('status') != '销毁' and 'cancel_date' in vps_data:
-                    vps_data['cancel_date'] = ''
-                
-                # 保存VPS数据
-                if 'name' in vps_data:
-                    vps_name = vps_data['name']
-                    existing_vps = billing_manager.get_vps_by_name(vps_name)
-                    
-                    if existing_vps:
-                        # 更新已有VPS
-                        success = billing_manager.update_vps(vps_name, **vps_data)
-                        result = billing_manager.get_vps_by_name(vps_name)
-                    else:
-                        # 添加新VPS
-                        success = billing_manager.add_vps(vps_data)
-                        result = billing_manager.get_vps_by_name(vps_name)
-                    
-                    if success and result:
-                        # 更新价格
-                        billing_manager.update_prices()
-                        # 输出更新后的VPS数据
-                        print(json.dumps(result, ensure_ascii=False))
-                    else:
-                        print(f"保存VPS失败: {vps_name}", file=sys.stderr)
-                        sys.exit(1)
-                else:
-                    print("VPS数据缺少name字段", file=sys.stderr)
-                    sys.exit(1)
-            except json.JSONDecodeError as e:
-                print(f"VPS数据JSON解析失败: {str(e)}", file=sys.stderr)
-                sys.exit(1)
-            except Exception as e:
-                print(f"处理VPS数据时出错: {str(e)}", file=sys.stderr)
-                sys.exit(1)
-                
-        elif args.action == 'delete_vps':
-            # 检查是否提供了VPS名称
-            if args.vps_name is None:
-                raise ValueError("删除VPS需要提供vps_name参数")
-            
-            # 删除VPS
-            success = billing_manager.delete_vps(args.vps_name)
-            print(json.dumps({"success": success}, ensure_ascii=False))
-            
-        elif args.action == 'init_sample_data':
-            # 初始化示例数据
-            success = billing_manager.init_sample_vps_data()
-            print(json.dumps({"success": success}, ensure_ascii=False))
-            
-        elif args.action == 'update_prices':
-            # 更新VPS价格
-            success = billing_manager.update_prices()
-            print(json.dumps({"success": success}, ensure_ascii=False))
-            
-        elif args.action == 'batch_add_vps':
-            # 检查是否提供了VPS列表数据
-            if args.vps_list is None:
-                raise ValueError("批量添加VPS需要提供vps_list参数")
-            
-            # 解析VPS列表数据JSON字符串
-            vps_list = json.loads(args.vps_list)
-            
-            # 批量添加VPS
-            result = billing_manager.batch_add_vps(vps_list)
-            print(json.dumps(result, ensure_ascii=False))
-            
+        if batch_requests is not None:
+            with phase_timer.phase(f'批量执行 {len(batch_requests)}个操作'):
+                run_cli_batch(billing_manager, parser, batch_requests, args.format)
+        else:
+            with phase_timer.phase(f'执行操作 {args.action}'):
+                run_cli_action(billing_manager, args)
+    except CliActionError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
     except Exception as e:
         print(json.dumps({"error": str(e)}, ensure_ascii=False), file=sys.stderr)
-        sys.exit(1) 
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        # sys.exit 也会经过这里，确保失败的操作同样输出性能分析结果和统计日志
+        if profiler is not None:
+            profiler.disable()
+            report_profile(profiler, phase_timer, get_profile_output_path(billing_manager, args))
+        try:
+            # 只读操作也可能更新了物化汇总和按天位图，由save_data写回（VPS数据没有变化时不重写配置文件）；
+            # save_data自己会持有排他锁，写操作此时仍持有操作开始时的排他锁，写完旁路文件后才释放
+            billing_manager.save_data(publish=False)
+            if args.stats_log is not None:
+                billing_manager.append_stats_log(args.action, log_file=args.stats_log or None)
+        finally:
+            if holds_write_lock:
+                file_lock.release()
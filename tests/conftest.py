@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billing_manager  # noqa: E402
+
+# 测试中固定使用的人民币汇率，避免访问网络和写入exchange_rates目录
+TEST_CNY_RATE = 0.14
+
+
+def make_vps(name, purchase_date, price=20.0, **fields):
+    """生成一条与vps_data.yml格式一致的VPS记录"""
+    vps = {
+        'name': name,
+        'country': '日本',
+        'ip_address': '10.0.0.1',
+        'price_per_month': price,
+        'purchase_date': purchase_date,
+        'start_date': purchase_date,
+        'status': '在用',
+        'total_price': 0.0,
+        'usage_period': '0天0小时0分钟',
+        'use_nat': False,
+    }
+    vps.update(fields)
+    return vps
+
+
+@pytest.fixture
+def make_manager(tmp_path, monkeypatch):
+    """
+    返回一个工厂函数：把给定的VPS列表写入临时配置文件并创建BillingManager
+
+    自动保存定时器在测试结束时取消
+    """
+    monkeypatch.setattr(billing_manager.BillingManager, 'get_exchange_rate',
+                        lambda self, year=None, month=None: TEST_CNY_RATE)
+    managers = []
+
+    def factory(vps_list=(), config_name='vps_data.yml'):
+        config_file = str(tmp_path / config_name)
+        with open(config_file, 'w', encoding='utf-8') as f:
+            yaml.safe_dump({'nat_fee': 0, 'total_bill': 0, 'vps_servers': list(vps_list)}, f,
+                           allow_unicode=True)
+        manager = billing_manager.BillingManager(config_file=config_file)
+        managers.append(manager)
+        return manager
+
+    yield factory
+    for manager in managers:
+        if manager.auto_save_timer:
+            manager.auto_save_timer.cancel()
+
+
+def load_config(manager):
+    """读取管理器配置文件的原始YAML内容"""
+    with open(manager.config_file, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f)
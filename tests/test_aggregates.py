@@ -0,0 +1,86 @@
+import datetime
+
+import pytest
+
+from billing_manager import BillingManager, amount_to_cents
+from conftest import make_vps
+
+
+def fleet():
+    return [
+        make_vps('VPS-1', '2025/01/01', use_nat=True),
+        make_vps('VPS-2', '2025/02/10', price=13.37, country='美国'),
+        make_vps('VPS-3', '2025/01/15', price=9.99, status='销毁', cancel_date='2025/03/03'),
+        make_vps('VPS-4', '2025/03/20', price=7.5, country='美国'),
+    ]
+
+
+def test_grouped_costs_match_the_monthly_bills(make_manager):
+    manager = make_manager(fleet())
+    result = manager.get_aggregates(('year', 'month'), 2025, 1, 2025, 6)
+    assert (result['months'], result['recomputed_months']) == (6, 6)
+
+    snapshot = manager.get_snapshot()
+    for row in result['rows']:
+        bill = manager.compute_monthly_bill(snapshot, row['year'], row['month'], datetime.datetime.now())
+        assert row['count'] == len(bill['账单行'])
+        assert amount_to_cents(row['cost']) == sum(amount_to_cents(line['总金额']) for line in bill['账单行'])
+
+    by_country = manager.get_aggregates(('country',), 2025, 1, 2025, 6)
+    assert by_country['recomputed_months'] == 0
+    assert [row['country'] for row in by_country['rows']] == sorted(['日本', '美国'])
+    total = sum(amount_to_cents(row['cost']) for row in result['rows'])
+    assert sum(amount_to_cents(row['cost']) for row in by_country['rows']) == total
+
+
+def test_aggregates_are_reused_across_processes_until_data_changes(make_manager):
+    manager = make_manager(fleet())
+    manager.get_aggregates(('country',), 2025, 1, 2025, 6)
+
+    other_process = BillingManager(config_file=manager.config_file)
+    other_process.auto_save_timer.cancel()
+    assert other_process.get_aggregates(('status',), 2025, 1, 2025, 6)['recomputed_months'] == 0
+
+    assert manager.update_vps('VPS-2', price_per_month=20.0)
+    assert manager.get_aggregates(('country',), 2025, 1, 2025, 6)['recomputed_months'] == 6
+
+
+def test_unknown_group_field_is_rejected(make_manager):
+    manager = make_manager(fleet())
+    with pytest.raises(ValueError, match='ip_address'):
+        manager.get_aggregates(('ip_address',), 2025, 1, 2025, 2)
+
+
+def stats_rows(path):
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return {row[0]: row[1:3] for row in workbook.active.iter_rows(values_only=True)
+                if row and row[0] in ('使用NAT的VPS', '未使用NAT的VPS')}
+    finally:
+        workbook.close()
+
+
+def test_excel_statistics_for_a_closed_month(make_manager, tmp_path):
+    manager = make_manager(fleet())
+    manager.close_month(2025, 3)
+
+    # 新进程读取的是账本中冻结的账单，不会重新计算该月
+    other_process = BillingManager(config_file=manager.config_file)
+    other_process.auto_save_timer.cancel()
+    output = str(tmp_path / 'bill.xlsx')
+    assert other_process.save_to_excel(output, 2025, 3)
+
+    rows = stats_rows(output)
+    assert rows['使用NAT的VPS'] == (1, 20.0)
+    assert rows['未使用NAT的VPS'][0] == 3
+
+
+def test_save_data_persists_aggregates_for_library_callers(make_manager):
+    manager = make_manager(fleet())
+    manager.compute_monthly_bills([(2025, month) for month in range(1, 7)])
+    assert manager.save_data(publish=False)
+
+    other_process = BillingManager(config_file=manager.config_file)
+    other_process.auto_save_timer.cancel()
+    assert other_process.get_aggregates(('country',), 2025, 1, 2025, 6)['recomputed_months'] == 0
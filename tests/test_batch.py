@@ -0,0 +1,67 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import billing_manager
+from conftest import load_config, make_vps
+
+SCRIPT = os.path.abspath(billing_manager.__file__)
+
+
+def test_deferred_save_writes_the_file_once(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    manager.stats.reset()
+
+    with manager.deferred_save():
+        assert manager.add_vps({'name': 'VPS-2', 'price_per_month': 10.0, 'purchase_date': '2025/01/01'})
+        with manager.deferred_save():
+            assert manager.update_vps('VPS-1', price_per_month=30.0)
+        assert manager.delete_vps('VPS-2')
+        assert manager.add_vps({'name': 'VPS-3', 'price_per_month': 15.0, 'purchase_date': '2025/01/01'})
+        # 退出之前配置文件还没有写
+        assert [vps['name'] for vps in load_config(manager)['vps_servers']] == ['VPS-1']
+
+    counters = manager.stats.to_dict()['counters']
+    assert counters['save_data_write'] == 1
+    assert counters['save_data_deferred'] == 4
+    saved = {vps['name']: vps['price_per_month'] for vps in load_config(manager)['vps_servers']}
+    assert saved == {'VPS-1': 30.0, 'VPS-3': 15.0}
+
+
+def test_deferred_save_raises_when_the_final_write_fails(make_manager, monkeypatch):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    real_save = manager.save_data
+    monkeypatch.setattr(manager, 'save_data',
+                        lambda publish=True: real_save(publish) if manager._deferred_saves else False)
+    with pytest.raises(RuntimeError):
+        with manager.deferred_save():
+            assert manager.update_vps('VPS-1', price_per_month=30.0)
+
+
+def test_cli_batch_runs_actions_in_one_process(make_manager, tmp_path):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    requests_data = [
+        {'action': 'save_vps', 'args': {'vps_data': {'name': 'B1', 'price_per_month': 5, 'purchase_date': '2025/01/01'}}},
+        {'action': 'save_vps', 'args': {'vps_data': {'name': 'B2', 'price_per_month': 6, 'purchase_date': '2025/01/01'}}},
+        {'action': 'delete_vps', 'args': {'vps_name': 'VPS-1'}},
+        {'action': 'save_vps', 'args': {'config': 'other.yml'}},
+        {'action': 'get_all_vps'},
+    ]
+    stats_log = str(tmp_path / 'stats.log')
+    completed = subprocess.run(
+        [sys.executable, SCRIPT, '--config', manager.config_file, '--batch', '--stats_log', stats_log],
+        input=json.dumps(requests_data), capture_output=True, text=True, encoding='utf-8', check=True)
+
+    results = json.loads(completed.stdout)
+    assert [result['success'] for result in results] == [True, True, True, False, True]
+    assert '不支持参数: config' in results[3]['error']
+    assert [vps['name'] for vps in results[4]['result']] == ['B1', 'B2']
+    assert [vps['name'] for vps in load_config(manager)['vps_servers']] == ['B1', 'B2']
+
+    with open(stats_log, 'r', encoding='utf-8') as f:
+        counters = json.loads(f.readlines()[-1])['counters']
+    assert counters['save_data_write'] == 1
+    assert counters['batch_action'] == 5
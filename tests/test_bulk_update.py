@@ -0,0 +1,86 @@
+import pytest
+
+from conftest import load_config, make_vps
+
+
+@pytest.fixture
+def manager(make_manager):
+    return make_manager([
+        make_vps('VPS-1', '2025/01/01', country='日本'),
+        make_vps('VPS-2', '2025/02/01', country='日本', use_nat=True),
+        make_vps('VPS-3', '2025/03/01', country='德国'),
+        make_vps('VPS-4', '2025/04/01', country='日本', status='销毁', cancel_date='2025/06/01'),
+    ])
+
+
+def saved_servers(manager):
+    return {vps['name']: vps for vps in load_config(manager)['vps_servers']}
+
+
+def test_bulk_update_by_filter_saves_once(manager):
+    manager.stats.reset()
+    result = manager.bulk_update({'price_per_month': 25, 'use_nat': 1}, filters={'country': '日本', 'status': '在用'})
+
+    assert (result['success'], result['matched'], result['updated'], result['failed']) == (True, 2, 2, 0)
+    assert manager.stats.to_dict()['timers']['save_data']['calls'] == 1
+    saved = saved_servers(manager)
+    assert [saved[name]['price_per_month'] for name in ('VPS-1', 'VPS-2', 'VPS-3', 'VPS-4')] == [25.0, 25.0, 20.0, 20.0]
+    assert saved['VPS-1']['use_nat'] is True
+
+
+def test_bulk_update_by_name_reports_in_input_order(manager):
+    result = manager.bulk_update({'country': '美国'}, names=['VPS-3', 'VPS-X', 'VPS-1', 'VPS-3'])
+
+    assert [item['name'] for item in result['results']] == ['VPS-3', 'VPS-X', 'VPS-1']
+    assert result['results'][1] == {'name': 'VPS-X', 'success': False, 'error': '找不到VPS'}
+    assert (result['matched'], result['updated'], result['failed']) == (2, 2, 1)
+
+
+def test_failed_save_leaves_every_server_unchanged(manager, monkeypatch):
+    before_memory = [vps.to_dict() for vps in manager.vps_data]
+    before_file = load_config(manager)
+    monkeypatch.setattr(manager, 'save_data', lambda publish=True: False)
+
+    result = manager.bulk_update({'price_per_month': 99}, filters={'country': '日本'})
+
+    assert result['success'] is False and result['updated'] == 0
+    assert all(item['error'] == '保存VPS数据失败' for item in result['results'])
+    assert [vps.to_dict() for vps in manager.vps_data] == before_memory
+    assert [vps.to_dict() for vps in manager.get_snapshot().records] == before_memory
+    assert load_config(manager) == before_file
+
+
+def test_failing_server_is_left_untouched(manager, monkeypatch):
+    assert manager.change_vps_price('VPS-2', 30.0, '2025/05/01')
+    original = manager.get_vps_by_name('VPS-2').to_dict()
+
+    def broken_segment(vps, price, effective):
+        vps['price_history'] = []
+        raise RuntimeError('调价记录写入失败')
+
+    monkeypatch.setattr(manager, '_append_price_segment', broken_segment)
+    result = manager.bulk_update({'price_per_month': 40, 'country': '美国'}, names=['VPS-1', 'VPS-2'])
+
+    assert [item['success'] for item in result['results']] == [True, False]
+    assert manager.get_vps_by_name('VPS-2').to_dict() == original
+    assert saved_servers(manager)['VPS-2']['price_history'] == original['price_history']
+    assert saved_servers(manager)['VPS-1']['price_per_month'] == 40.0
+
+
+def test_bulk_set_status_keeps_existing_cancel_dates(manager):
+    result = manager.bulk_set_status('销毁', filters={'country': '日本'}, cancel_date='2025-07-15')
+
+    assert result['updated'] == 2
+    saved = saved_servers(manager)
+    assert (saved['VPS-1']['cancel_date'], saved['VPS-2']['cancel_date']) == ('2025/07/15', '2025/07/15')
+    assert saved['VPS-4']['cancel_date'] == '2025/06/01'
+    assert 'cancel_date' not in saved['VPS-3']
+
+
+def test_bulk_changes_need_a_selection(manager):
+    with pytest.raises(ValueError):
+        manager.bulk_update({'country': '美国'})
+    with pytest.raises(ValueError):
+        manager.bulk_update({'name': 'VPS-9'}, names=['VPS-1'])
+    with pytest.raises(ValueError):
+        manager.bulk_set_status('销毁', filters={'purchase_from': 'yesterday'})
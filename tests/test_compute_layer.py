@@ -0,0 +1,49 @@
+import datetime
+
+from conftest import make_vps
+
+AS_OF = datetime.datetime(2026, 1, 1)
+
+
+def fleet():
+    servers = [make_vps(f'VPS-{i}', f'2025/{i % 12 + 1:02d}/{i % 28 + 1:02d}', price=10.0 + i,
+                        use_nat=i % 3 == 0) for i in range(12)]
+    servers[0].update(status='销毁', cancel_date='2025/05/20')
+    return servers
+
+
+def test_compute_layer_leaves_instance_state_alone(make_manager):
+    manager = make_manager(fleet())
+    before = (manager.billing_year, manager.billing_month, manager.nat_total_fee, manager.total_bill,
+              [vps.to_dict() for vps in manager.vps_data], manager.get_snapshot().version)
+
+    manager.compute_monthly_bill(manager.get_snapshot(), 2025, 6, AS_OF)
+    manager.compute_monthly_bills([(2025, month) for month in range(1, 13)], as_of=AS_OF)
+    manager.compute_monthly_bill_table(manager.get_snapshot(), 2025, 2025, 12, AS_OF)
+
+    after = (manager.billing_year, manager.billing_month, manager.nat_total_fee, manager.total_bill,
+             [vps.to_dict() for vps in manager.vps_data], manager.get_snapshot().version)
+    assert after == before
+
+
+def test_parallel_months_match_single_months(make_manager):
+    manager = make_manager(fleet())
+    snapshot = manager.get_snapshot()
+    months = [(2025, month) for month in range(1, 13)]
+
+    parallel = manager.compute_monthly_bills(months, snapshot, AS_OF, max_workers=6)
+    single = [manager.compute_monthly_bill(snapshot, year, month, AS_OF) for year, month in months]
+    assert parallel == single
+
+
+def test_bill_and_summary_table_agree(make_manager):
+    manager = make_manager(fleet())
+    snapshot = manager.get_snapshot()
+    _, table = manager.compute_monthly_bill_table(snapshot, 2025, 2025, 12, AS_OF)
+
+    for month_table in table:
+        bill = manager.compute_monthly_bill(snapshot, month_table['年份'], month_table['月份'], AS_OF)
+        assert [row['VPS名称'] for row in bill['账单行']] == [row['VPS名称'] for row in month_table['详细数据']]
+        # 没有使用时长的VPS不出现在账单中
+        assert all(row['使用时长'] for row in bill['账单行'])
+        assert all(row['总金额'] > 0 for row in bill['账单行'])
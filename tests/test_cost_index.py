@@ -0,0 +1,58 @@
+import datetime
+
+import pytest
+
+from billing_manager import DailyCostIndex, amount_to_cents, epoch_minute
+from conftest import make_vps
+
+
+def minute(*args):
+    return epoch_minute(datetime.datetime(*args))
+
+
+def test_full_and_partial_months():
+    index = DailyCostIndex(datetime.date(2025, 1, 1), datetime.date(2025, 12, 31))
+    index.apply('日本', 3100, minute(2025, 1, 1), None)
+    index.apply('美国', 2800, minute(2025, 2, 1, 12), minute(2025, 2, 3, 12))
+
+    assert index.cost_cents(datetime.date(2025, 1, 1), datetime.date(2025, 1, 31)) == pytest.approx(3100)
+    assert index.cost_cents(datetime.date(2025, 1, 10), datetime.date(2025, 1, 10), '日本') == pytest.approx(100)
+    # 2月28天，两天的费用为2800 × 2 / 28
+    assert index.cost_cents(datetime.date(2025, 2, 1), datetime.date(2025, 2, 28), '美国') == pytest.approx(200)
+    assert index.cost_cents(datetime.date(2025, 2, 2), datetime.date(2025, 2, 2), '美国') == pytest.approx(100)
+    assert index.cost_cents(datetime.date(2025, 2, 1), datetime.date(2025, 2, 1), '火星') == 0.0
+    # 超出索引范围的部分不计
+    assert index.cost_cents(datetime.date(2024, 1, 1), datetime.date(2025, 1, 1)) == pytest.approx(100)
+
+
+def test_removing_an_entry_undoes_it():
+    index = DailyCostIndex(datetime.date(2025, 1, 1), datetime.date(2025, 6, 30))
+    index.apply('日本', 1999, minute(2025, 1, 7, 3, 17), minute(2025, 4, 2, 9))
+    index.apply('日本', 1000, minute(2025, 2, 1), None)
+    index.apply('日本', 1999, minute(2025, 1, 7, 3, 17), minute(2025, 4, 2, 9), sign=-1)
+    assert index.cost_cents(datetime.date(2025, 1, 1), datetime.date(2025, 1, 31)) == pytest.approx(0, abs=1e-6)
+    assert index.cost_cents(datetime.date(2025, 2, 1), datetime.date(2025, 3, 31)) == pytest.approx(2000)
+
+
+def test_range_cost_matches_monthly_bills_and_follows_updates(make_manager):
+    manager = make_manager([
+        make_vps('VPS-1', '2025/01/01'),
+        make_vps('VPS-2', '2025/02/10', price=13.37, country='美国'),
+        make_vps('VPS-3', '2025/01/15', price=9.99, status='销毁', cancel_date='2025/03/03'),
+    ])
+    result = manager.get_range_cost('2025/02/01', '2025/02/28')
+    bill = manager.compute_monthly_bill(manager.get_snapshot(), 2025, 2, datetime.datetime(2025, 3, 1))
+    bill_cents = sum(amount_to_cents(row['总金额']) for row in bill['账单行'])
+    assert abs(amount_to_cents(result['cost']) - bill_cents) <= len(bill['账单行'])
+    assert set(result['by_country']) == {'日本', '美国'}
+
+    manager.stats.reset()
+    assert manager.update_vps('VPS-1', price_per_month=40.0)
+    updated = manager.get_range_cost('2025-02-01', '2025-02-28', country='日本')
+    assert updated['cost'] == pytest.approx(result['by_country']['日本'] + 20.0, abs=0.01)
+    # 修改单价只加减这台VPS的贡献，不重新建立索引
+    counters = manager.stats.to_dict()['counters']
+    assert counters.get('cost_index_update') == 1 and 'cost_index_build' not in counters
+
+    with pytest.raises(ValueError):
+        manager.get_range_cost('2025/03/01', '2025/02/01')
@@ -0,0 +1,47 @@
+import datetime
+
+from billing_manager import amount_to_cents
+from conftest import make_vps
+
+AS_OF = datetime.datetime(2025, 3, 10, 12, 0, 0)
+
+
+def fleet():
+    return [
+        make_vps('VPS-1', '2025/01/01', use_nat=True),
+        make_vps('VPS-2', '2025/02/10', price=13.37),
+        make_vps('VPS-3', '2025/03/20', price=7.5),
+        make_vps('VPS-4', '2025/01/15', price=9.99, status='销毁', cancel_date='2025/03/03'),
+        make_vps('VPS-5', '2025/01/15', price=11.0, cancel_date='2025/04/18'),
+        make_vps('VPS-6', '2025/04/12', price=5.0, use_nat=True),
+    ]
+
+
+def test_projection_matches_the_bills_at_month_end(make_manager):
+    manager = make_manager(fleet())
+    projection = manager.project_costs(AS_OF)
+    snapshot = manager.get_snapshot()
+
+    current = manager.compute_monthly_bill(snapshot, 2025, 3, datetime.datetime(2025, 4, 1))
+    current_cents = sum(amount_to_cents(row['总金额']) for row in current['账单行'])
+    projected = projection['current_month']
+    assert (projected['year'], projected['month']) == (2025, 3)
+    # 账单逐行取整，预测只取整一次：每台VPS最多相差半分
+    assert abs(amount_to_cents(projected['projected_vps_cost']) - current_cents) <= len(current['账单行'])
+    assert projected['accrued'] <= projected['projected_total']
+
+    upcoming = manager.compute_monthly_bill(snapshot, 2025, 4, datetime.datetime(2025, 5, 1))
+    upcoming_cents = sum(amount_to_cents(row['总金额']) for row in upcoming['账单行'])
+    projected = projection['next_month']
+    assert (projected['year'], projected['month']) == (2025, 4)
+    assert projected['servers'] == len(upcoming['账单行']) == 5
+    assert projected['nat_servers'] == 2
+    assert abs(amount_to_cents(projected['projected_vps_cost']) - upcoming_cents) <= len(upcoming['账单行'])
+
+
+def test_projection_is_read_only(make_manager):
+    manager = make_manager(fleet())
+    version = manager.get_snapshot().version
+    first = manager.project_costs(AS_OF)
+    assert manager.project_costs(AS_OF) == first
+    assert manager.get_snapshot().version == version
@@ -0,0 +1,47 @@
+import datetime
+
+from billing_manager import BillingManager, amount_to_cents
+from conftest import make_vps
+
+CHECKPOINT = datetime.datetime(2025, 3, 5, 8, 0, 0)
+
+
+def fleet():
+    return [
+        make_vps('VPS-1', '2025/01/01'),
+        make_vps('VPS-2', '2025/02/10', price=13.37),
+        make_vps('VPS-3', '2025/03/02', price=7.5),
+        make_vps('VPS-4', '2025/01/15', price=9.99, status='销毁', cancel_date='2025/03/03'),
+        make_vps('VPS-5', '2025/03/20', price=30.0),
+    ]
+
+
+def test_ticker_tracks_the_full_bill_between_checkpoints(make_manager):
+    manager = make_manager(fleet())
+    ticker = manager.build_cost_ticker(CHECKPOINT)
+    # VPS-5在3月20日开始计费，计时器只能用到那时
+    assert ticker.valid_until == datetime.datetime(2025, 3, 20)
+
+    for hours in (0, 1, 30, 200, 350):
+        when = CHECKPOINT + datetime.timedelta(hours=hours, minutes=17)
+        bill = manager.compute_monthly_bill(manager.get_snapshot(), 2025, 3, when)
+        exact_cents = sum(amount_to_cents(row['总金额']) for row in bill['账单行'])
+        ticker_cents = amount_to_cents(ticker.value_at(when)['vps_cost'])
+        # 账单逐行取整，计时器只取整一次：每台计费中的VPS最多相差半分
+        assert abs(ticker_cents - exact_cents) <= ticker.active_servers
+
+
+def test_ticker_is_reused_from_memory_then_file(make_manager):
+    manager = make_manager(fleet())
+    when = CHECKPOINT + datetime.timedelta(days=1)
+    assert manager.get_cost_ticker(when)['source'] == 'rebuilt'
+    assert manager.get_cost_ticker(when + datetime.timedelta(hours=1))['source'] == 'memory'
+
+    other_process = BillingManager(config_file=manager.config_file)
+    other_process.auto_save_timer.cancel()
+    assert other_process.get_cost_ticker(when + datetime.timedelta(hours=2))['source'] == 'file'
+
+    assert manager.update_vps('VPS-1', price_per_month=40.0)
+    result = manager.get_cost_ticker(when + datetime.timedelta(hours=3))
+    assert result['source'] == 'rebuilt'
+    assert manager.get_cost_ticker(when + datetime.timedelta(days=30))['month'] == 4
@@ -0,0 +1,57 @@
+import datetime
+import random
+
+import pytest
+
+from billing_manager import (DEFAULT_CURRENCY_RATES, SUPPORTED_CURRENCIES, CurrencyMatrix, amount_to_cents,
+                             normalize_currency)
+from conftest import TEST_CNY_RATE, make_vps
+
+MONTHS = [(2025, 1), (2025, 2), (2025, 3)]
+RATES = [{'USD': 1.0, 'CNY': 0.1387, 'EUR': 1.0825},
+         {'USD': 1.0, 'CNY': 0.14, 'EUR': 1.05},
+         {'USD': 1.0, 'CNY': 0.1371, 'EUR': 1.1}]
+
+
+def test_normalize_currency():
+    assert normalize_currency('cny') == 'CNY'
+    assert normalize_currency(None) == normalize_currency('') == 'USD'
+    assert normalize_currency('JPY') == 'USD'
+
+
+def test_matrix_lookups_and_pair_table():
+    matrix = CurrencyMatrix(MONTHS, RATES)
+    assert matrix.has_month(2025, 2) and not matrix.has_month(2025, 4)
+    assert matrix.rate('eur', 2025, 3) == 1.1
+    table = matrix.pair_table(2025, 2)
+    assert table['EUR']['USD'] == 1.05
+    assert table['USD']['CNY'] == round(1 / 0.14, 6)
+    assert all(table[currency][currency] == 1.0 for currency in SUPPORTED_CURRENCIES)
+
+
+def test_batch_conversion_matches_single_conversion(make_manager):
+    manager = make_manager()
+    matrix = manager.get_currency_matrix(MONTHS)
+    rng = random.Random(5)
+    items = [(rng.choice(MONTHS), rng.choice(SUPPORTED_CURRENCIES), rng.randrange(0, 10 ** 7)) for _ in range(300)]
+    batched = matrix.to_base_cents([matrix.month_index(*month) for month, _, _ in items],
+                                   [matrix.currency_index(currency) for _, currency, _ in items],
+                                   [cents for _, _, cents in items])
+    single = [manager._to_base_cents({'currency': currency}, cents, *month) for month, currency, cents in items]
+    assert batched.tolist() == single
+
+
+def test_bill_converts_each_line_to_dollars(make_manager):
+    manager = make_manager([
+        make_vps('VPS-1', '2025/01/01', price=10.0),
+        make_vps('VPS-2', '2025/01/01', price=100.0, currency='CNY'),
+        make_vps('VPS-3', '2025/01/01', price=10.0, currency='eur'),
+    ])
+    bill = manager.compute_monthly_bill(manager.get_snapshot(), 2025, 3, datetime.datetime(2025, 4, 1))
+    lines = {row['VPS名称']: row for row in bill['账单行']}
+
+    assert '币种' not in lines['VPS-1']
+    assert lines['VPS-2']['总金额'] == round(100.0 * TEST_CNY_RATE, 2)
+    assert (lines['VPS-2']['币种'], lines['VPS-2']['原币金额']) == ('CNY', 100.0)
+    assert lines['VPS-3']['总金额'] == pytest.approx(10.0 * DEFAULT_CURRENCY_RATES['EUR'])
+    assert amount_to_cents(bill['月总费用']) == sum(amount_to_cents(row['总金额']) for row in bill['账单行'])
@@ -0,0 +1,66 @@
+import datetime
+
+import pytest
+
+from billing_manager import FleetEventLog
+from conftest import make_vps
+
+
+def names_and_prices(records):
+    return {vps['name']: vps['price_per_month'] for vps in records}
+
+
+def test_state_at_replays_across_snapshot_boundaries(tmp_path):
+    log = FleetEventLog(str(tmp_path / 'vps_data.yml.events.jsonl'), snapshot_every=3)
+    start = datetime.datetime(2025, 1, 1)
+    fleet = [make_vps('VPS-0', '2025/01/01')]
+    expected = []
+    previous = list(fleet)
+    for step in range(1, 12):
+        fleet = [dict(vps) for vps in fleet]
+        if step % 4 == 0:
+            fleet.pop(0)
+        elif step % 2 == 0:
+            fleet[-1]['price_per_month'] = 20.0 + step
+        else:
+            fleet.append(make_vps(f'VPS-{step}', '2025/01/01', price=float(step)))
+        when = start + datetime.timedelta(days=step)
+        assert log.record(previous, fleet, when=when) > 0
+        expected.append((when, names_and_prices(fleet)))
+        previous = fleet
+
+    # 11个事件、每3个事件一个快照：除初始快照外还有3个快照
+    assert len(log._read_index()) == 4
+    for when, state in expected:
+        for probe in (when, when + datetime.timedelta(hours=12)):
+            records, info = log.state_at(probe)
+            assert names_and_prices(records) == state
+            assert info['replayed'] <= 3
+
+    # 日志从第一次记录开始，之前的时间点无法还原
+    assert log.state_at(start + datetime.timedelta(hours=23)) == (None, None)
+
+
+def test_unchanged_save_records_no_event(tmp_path):
+    log = FleetEventLog(str(tmp_path / 'vps_data.yml.events.jsonl'))
+    fleet = [make_vps('VPS-1', '2025/01/01')]
+    changed = [dict(fleet[0], usage_period='1天0小时0分钟', total_price=1.0)]
+    assert log.record(fleet, changed) == 0
+
+
+def test_get_fleet_as_of_restores_earlier_saves(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    manager.events = FleetEventLog(manager.events.path, snapshot_every=2)
+    checkpoints = []
+    for step in range(5):
+        assert manager.add_vps({'name': f'VPS-N{step}', 'price_per_month': 10.0, 'purchase_date': '2025/01/01'})
+        assert manager.update_vps('VPS-1', price_per_month=20.0 + step)
+        checkpoints.append((datetime.datetime.now(), names_and_prices(manager.get_all_vps())))
+
+    for when, state in checkpoints:
+        records, info = manager.get_fleet_as_of(when)
+        assert names_and_prices(records) == state
+        assert info['vps_count'] == len(state)
+
+    with pytest.raises(ValueError):
+        manager.get_fleet_as_of('2000/01/01')
@@ -0,0 +1,46 @@
+import pytest
+
+from billing_manager import ConfigFileLock
+from conftest import make_vps
+
+
+def test_shared_lock_cannot_be_upgraded(tmp_path):
+    lock = ConfigFileLock(str(tmp_path / 'vps_data.yml.lock'))
+    with lock.hold(exclusive=False):
+        with pytest.raises(RuntimeError):
+            lock.acquire(exclusive=True)
+        # 升级失败不影响已经持有的共享锁，之后仍可正常释放
+        with lock.hold(exclusive=False):
+            pass
+    with lock.hold(exclusive=True):
+        with lock.hold(exclusive=False):
+            pass
+
+
+def test_exclusive_lock_blocks_other_holders(tmp_path):
+    path = str(tmp_path / 'vps_data.yml.lock')
+    owner = ConfigFileLock(path)
+    other = ConfigFileLock(path, timeout=0.1, poll_interval=0.01)
+    with owner.hold(exclusive=True):
+        with pytest.raises(TimeoutError):
+            other.acquire(exclusive=False)
+    with other.hold(exclusive=False):
+        pass
+
+
+def test_sidecar_writes_wait_for_the_config_lock(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2024/01/10')])
+    manager.file_lock.timeout = 0.1
+    manager.file_lock.poll_interval = 0.01
+    manager.aggregates.dirty = True
+    manager.nat_days.dirty = True
+
+    other_process = ConfigFileLock(manager.file_lock.lock_file)
+    with other_process.hold(exclusive=True):
+        assert manager.save_aggregates() is False
+        assert manager.save_nat_days() is False
+        assert manager.append_stats_log('get_all_vps') is False
+
+    assert manager.save_aggregates() is True
+    assert manager.save_nat_days() is True
+    assert manager.append_stats_log('get_all_vps') is True
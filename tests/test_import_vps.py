@@ -0,0 +1,76 @@
+import json
+
+import openpyxl
+
+from conftest import load_config, make_vps
+
+
+def write_csv(path, lines):
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+def test_csv_with_duplicates_and_invalid_rows(make_manager, tmp_path):
+    manager = make_manager([make_vps('VPS-OLD', '2025/01/01')])
+    csv_file = write_csv(tmp_path / 'servers.csv', [
+        'VPS名称,国家/地区,月单价,购买日期,是否使用NAT',
+        'VPS-A,日本,20,2025-02-01,是',
+        'VPS-B,德国,12.5,2025/03/01,否',
+        'VPS-A,日本,20,2025-02-01,是',
+        'VPS-OLD,日本,20,2025-02-01,否',
+        ',日本,20,2025-02-01,否',
+        'VPS-C,日本,abc,2025-02-01,否',
+        'VPS-D,日本,20,2025-13-45,否',
+        '',
+    ])
+    manager.stats.reset()
+
+    result = manager.import_vps([csv_file])
+
+    assert (result['read'], result['added'], result['duplicates'], result['invalid']) == (7, 2, 2, 3)
+    assert len(result['errors']) == 5
+    assert any('第4行' in error and 'VPS-A' in error for error in result['errors'])
+    assert manager.stats.to_dict()['timers']['save_data']['calls'] == 1
+
+    saved = {vps['name']: vps for vps in load_config(manager)['vps_servers']}
+    assert set(saved) == {'VPS-OLD', 'VPS-A', 'VPS-B'}
+    assert saved['VPS-A']['purchase_date'] == '2025/02/01'
+    assert saved['VPS-A']['start_date'] == '2025/02/01'
+    assert saved['VPS-A']['use_nat'] is True
+    assert saved['VPS-B']['price_per_month'] == 12.5
+
+
+def test_jsonl_and_xlsx_in_one_import(make_manager, tmp_path):
+    manager = make_manager()
+    jsonl_file = tmp_path / 'servers.jsonl'
+    jsonl_file.write_text('\n'.join([
+        json.dumps({'name': 'VPS-J1', 'price_per_month': 10, 'purchase_date': '2025/01/05'}),
+        '{not json',
+        json.dumps({'name': 'VPS-X1', 'price_per_month': 10}),
+    ]) + '\n', encoding='utf-8')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['name', 'price_per_month', 'status', 'cancel_date'])
+    sheet.append(['VPS-X1', 15, '在用', None])
+    sheet.append(['VPS-X2', 15, '销毁', '2025/04/01'])
+    xlsx_file = str(tmp_path / 'servers.xlsx')
+    workbook.save(xlsx_file)
+
+    result = manager.import_vps([str(jsonl_file), xlsx_file])
+
+    assert (result['read'], result['added'], result['duplicates'], result['invalid']) == (5, 3, 1, 1)
+    names = [vps['name'] for vps in manager.get_all_vps()]
+    assert names == ['VPS-J1', 'VPS-X1', 'VPS-X2']
+    assert manager.get_vps_by_name('VPS-X2')['cancel_date'] == '2025/04/01'
+
+
+def test_failed_save_rolls_the_import_back(make_manager, tmp_path, monkeypatch):
+    manager = make_manager([make_vps('VPS-OLD', '2025/01/01')])
+    csv_file = write_csv(tmp_path / 'servers.csv', ['name,price_per_month', 'VPS-A,20'])
+    monkeypatch.setattr(manager, 'save_data', lambda publish=True: False)
+
+    result = manager.import_vps([csv_file])
+
+    assert result['success'] is False and result['added'] == 0
+    assert [vps['name'] for vps in manager.vps_data] == ['VPS-OLD']
+    assert [vps['name'] for vps in manager.get_snapshot().records] == ['VPS-OLD']
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from billing_manager import BillingManager
+from conftest import make_vps
+
+
+def month_total(manager, year, month):
+    return manager.compute_monthly_bills([(year, month)])[0]['月总费用']
+
+
+@pytest.fixture
+def manager(make_manager):
+    return make_manager([make_vps('VPS-1', '2025/01/01'), make_vps('VPS-2', '2025/01/10', price=10.0)])
+
+
+def test_closed_month_is_frozen(manager):
+    closed = manager.close_month(2025, 3)
+    assert closed['total'] == 30.0
+
+    assert manager.update_vps('VPS-1', price_per_month=40.0)
+    assert month_total(manager, 2025, 3) == 30.0
+    assert month_total(manager, 2025, 4) == 50.0
+
+
+def test_close_rejects_open_and_already_closed_months(manager):
+    manager.close_month(2025, 3)
+    with pytest.raises(ValueError):
+        manager.close_month(2025, 3)
+    with pytest.raises(ValueError):
+        manager.close_month(2999, 1)
+
+
+def test_tampered_entry_and_later_entries_are_ignored(manager):
+    manager.close_month(2025, 3)
+    manager.close_month(2025, 4)
+    assert manager.update_vps('VPS-1', price_per_month=40.0)
+
+    with open(manager.ledger.path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    entry = json.loads(lines[0])
+    entry['bill']['月总费用'] = 1.0
+    lines[0] = json.dumps(entry, ensure_ascii=False) + '\n'
+    with open(manager.ledger.path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+
+    reloaded = BillingManager(config_file=manager.config_file)
+    reloaded.auto_save_timer.cancel()
+    assert reloaded.ledger.get(2025, 3) is None
+    assert reloaded.ledger.get(2025, 4) is None
+    assert month_total(reloaded, 2025, 3) == 50.0
+
+
+def test_reopen_recomputes_with_current_data(manager):
+    manager.close_month(2025, 3)
+    assert manager.update_vps('VPS-1', price_per_month=40.0)
+
+    reopened = manager.reopen_month(2025, 3)
+    assert reopened['previous_total'] == 30.0
+    assert manager.ledger.get(2025, 3) is None
+    assert month_total(manager, 2025, 3) == 50.0
+
+    with pytest.raises(ValueError):
+        manager.reopen_month(2025, 3)
+
+    assert manager.close_month(2025, 3)['total'] == 50.0
+    assert manager.reopen_month(2025, 3, recompute=True)['closed']['total'] == 50.0
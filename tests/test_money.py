@@ -0,0 +1,55 @@
+import datetime
+
+from billing_manager import (
+    amount_to_cents, cents_to_amount, get_monthly_rate, to_micro_cents, _div_round_half_up,
+)
+from conftest import make_vps
+
+
+def test_amounts_convert_through_their_decimal_form():
+    assert amount_to_cents(0.1 + 0.2) == 30
+    # round(2.675, 2)按二进制浮点得到2.67，按十进制写法应为2.68
+    assert round(2.675, 2) == 2.67
+    assert amount_to_cents(2.675) == 268
+    assert amount_to_cents('19.995') == 2000
+    assert to_micro_cents(20) == 2000000000
+    assert cents_to_amount(1999) == 19.99
+
+
+def test_half_up_rounding_is_symmetric():
+    assert _div_round_half_up(5, 10) == 1
+    assert _div_round_half_up(4, 10) == 0
+    assert _div_round_half_up(-5, 10) == -1
+    assert _div_round_half_up(-4, 10) == 0
+
+
+def test_monthly_rate_charges_prorated_cents():
+    rate = get_monthly_rate(20.0, 2025, 2)
+    assert rate.charge_cents(datetime.timedelta(days=28)) == 2000
+    assert rate.charge_cents(datetime.timedelta(days=14)) == 1000
+    # 20 × 1天 / 28天 = 0.714...
+    assert rate.charge_cents(datetime.timedelta(days=1)) == 71
+
+
+def test_exact_cents_match_the_float_path(make_manager):
+    prices = [19.99, 20, 7.5, 3.33, 12.345, 0.99]
+    fleet = []
+    for i in range(30):
+        fields = {}
+        if i % 4 == 0:
+            fields = {'status': '销毁', 'cancel_date': f'2025/{i % 12 + 1:02d}/{i % 27 + 1:02d}'}
+        fleet.append(make_vps(f'VPS-{i}', f'2024/{i % 12 + 1:02d}/{i % 28 + 1:02d}',
+                              price=prices[i % len(prices)], **fields))
+    manager = make_manager(fleet)
+
+    result = manager.cross_check_money(2024, 2025, 12)
+    assert result['lines_checked'] > 200
+    assert result['mismatch_count'] == 0, result['mismatches'][:5]
+
+
+def test_bill_total_is_the_exact_sum_of_rows(make_manager):
+    manager = make_manager([make_vps(f'VPS-{i}', '2025/03/%02d' % (i + 1), price=3.33) for i in range(25)])
+    bill = manager.compute_monthly_bill(manager.get_snapshot(), 2025, 3, datetime.datetime(2025, 4, 1))
+
+    row_cents = sum(amount_to_cents(row['总金额']) for row in bill['账单行'])
+    assert amount_to_cents(bill['月总费用']) == row_cents
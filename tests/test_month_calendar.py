@@ -0,0 +1,33 @@
+import calendar
+import datetime
+
+from billing_manager import MONTH_CALENDAR, MonthCalendar, MonthInfo
+
+
+def test_month_boundaries_match_the_standard_library():
+    for info in MONTH_CALENDAR.months_between(MONTH_CALENDAR.min_year, 1, MONTH_CALENDAR.max_year, 12):
+        days = calendar.monthrange(info.year, info.month)[1]
+        assert info.days == days
+        assert info.start == datetime.datetime(info.year, info.month, 1)
+        assert info.next_start == info.start + datetime.timedelta(days=days)
+        assert info.end == info.next_start - datetime.timedelta(seconds=1)
+        assert info.last_day == datetime.datetime(info.year, info.month, days)
+        assert info.minutes == days * 24 * 60
+        assert info.end_minute - info.start_minute == info.minutes
+
+
+def test_lookups_inside_and_outside_the_table():
+    assert MONTH_CALENDAR.get(2024, 2) is MONTH_CALENDAR.get(2024, 2)
+    assert MONTH_CALENDAR.get(2024, 2).days == 29
+    outside = MONTH_CALENDAR.get(MONTH_CALENDAR.max_year + 5, 2)
+    assert isinstance(outside, MonthInfo) and outside.year == MONTH_CALENDAR.max_year + 5
+    assert not MONTH_CALENDAR.contains(2024, 13)
+
+
+def test_months_between_spans_years_inside_and_outside_the_table():
+    months = [(info.year, info.month) for info in MONTH_CALENDAR.months_between(2024, 11, 2025, 2)]
+    assert months == [(2024, 11), (2024, 12), (2025, 1), (2025, 2)]
+
+    small = MonthCalendar(2025, 2025)
+    months = [(info.year, info.month) for info in small.months_between(2024, 12, 2026, 1)]
+    assert len(months) == 14 and months[0] == (2024, 12) and months[-1] == (2026, 1)
@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+from billing_manager import BillingManager, DayBitmap, day_number
+from conftest import make_vps
+
+
+def fleet():
+    return [
+        make_vps('VPS-1', '2025/01/01', use_nat=True),
+        make_vps('VPS-2', '2025/01/10', use_nat=True, status='销毁', cancel_date='2025/02/05'),
+        make_vps('VPS-3', '2025/01/01'),
+    ]
+
+
+def test_bitmap_counts_closed_and_open_ranges():
+    first = day_number(datetime.date(2025, 1, 1))
+    bitmap = DayBitmap(sum(1 << day for day in range(first + 3, first + 6)), open_from=first + 10)
+    assert bitmap.count(first, first + 9) == 3
+    assert bitmap.count(first + 4, first + 12) == 2 + 3
+    assert bitmap.count(first + 12, first + 11) == 0
+
+    restored = DayBitmap.from_dict(bitmap.to_dict())
+    assert (restored.bits, restored.open_from) == (bitmap.bits, bitmap.open_from)
+
+
+def test_nat_days_in_any_range(make_manager):
+    manager = make_manager(fleet())
+    result = manager.get_nat_days('2025/01/01', '2025/02/28')
+    # 销毁当天也算一天：1月10日到2月5日
+    assert result['by_vps'] == {'VPS-1': 59, 'VPS-2': 22 + 5}
+    assert (result['nat_days'], result['nat_vps']) == (86, 2)
+
+    bill = manager.compute_monthly_bill(manager.get_snapshot(), 2025, 2, datetime.datetime(2025, 3, 1))
+    february = manager.get_nat_days(datetime.date(2025, 2, 1), datetime.date(2025, 2, 28))
+    assert february['nat_days'] == bill['NAT详情']['NAT总天数'] == 28 + 5
+
+    with pytest.raises(ValueError):
+        manager.get_nat_days('2025/02/01', '2025/01/01')
+
+
+def test_bitmaps_are_shared_saved_and_rebuilt_on_lifecycle_changes(make_manager):
+    manager = make_manager(fleet() + [make_vps('VPS-4', '2025/01/01', use_nat=True)])
+    manager.stats.reset()
+    manager.get_nat_days('2025/01/01', '2025/01/31')
+    # 生命周期相同的VPS-1和VPS-4共用一个位图
+    assert manager.stats.to_dict()['counters']['day_bitmap_build'] == 2
+    assert manager.save_nat_days()
+
+    other_process = BillingManager(config_file=manager.config_file)
+    other_process.auto_save_timer.cancel()
+    other_process.stats.reset()
+    assert other_process.get_nat_days('2025/01/01', '2025/01/31')['nat_days'] == 31 * 2 + 22
+    assert 'day_bitmap_build' not in other_process.stats.to_dict()['counters']
+
+    assert other_process.update_vps('VPS-1', status='销毁', cancel_date='2025/01/15')
+    assert other_process.get_nat_days('2025/01/01', '2025/01/31')['by_vps']['VPS-1'] == 15
+    assert other_process.stats.to_dict()['counters']['day_bitmap_build'] == 1
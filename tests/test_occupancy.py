@@ -0,0 +1,59 @@
+import datetime
+import random
+
+from billing_manager import OccupancyTimeline
+from conftest import make_vps
+
+
+def brute_count(intervals, minute):
+    return sum(1 for start, end in intervals if start <= minute and (end is None or minute < end))
+
+
+def test_timeline_matches_brute_force():
+    rng = random.Random(7)
+    intervals = []
+    for _ in range(40):
+        start = rng.randrange(0, 1000)
+        intervals.append((start, None if rng.random() < 0.3 else start + rng.randrange(1, 300)))
+    timeline = OccupancyTimeline(intervals)
+
+    for minute in range(-5, 1400, 7):
+        assert timeline.count_at(minute) == brute_count(intervals, minute)
+    for _ in range(50):
+        start = rng.randrange(0, 1300)
+        end = start + rng.randrange(1, 200)
+        counts = [brute_count(intervals, minute) for minute in range(start, end)]
+        assert timeline.peak(start, end) == max(counts)
+        assert timeline.integral(end) - timeline.integral(start) == sum(counts)
+
+
+def test_empty_timeline():
+    timeline = OccupancyTimeline([])
+    assert timeline.count_at(100) == 0
+    assert timeline.summarize(0, 60) == {'peak': 0, 'average': 0, 'server_days': 0}
+
+
+def test_monthly_occupancy_by_country(make_manager):
+    manager = make_manager([
+        make_vps('VPS-1', '2025/01/01'),
+        make_vps('VPS-2', '2025/01/11', country='美国'),
+        make_vps('VPS-3', '2025/01/01', status='销毁', cancel_date='2025/01/20'),
+    ])
+    at = datetime.datetime(2025, 2, 15)
+    result = manager.get_occupancy(2025, 1, 2025, 3, at=at)
+
+    assert result['running'] == 2
+    # 尚未开始的3月不统计
+    assert [(month['year'], month['month']) for month in result['months']] == [(2025, 1), (2025, 2)]
+    january, february = result['months']
+    assert january['peak'] == 3
+    # 1日-31日 + 11日-31日 + 1日-20日（销毁当天也算在线）
+    assert january['server_days'] == 31 + 21 + 20
+    assert january['by_country']['美国']['server_days'] == 21
+    # 2月只统计到15日0点
+    assert (february['peak'], february['average'], february['server_days']) == (2, 2.0, 2 * 14)
+
+    japan = manager.get_occupancy(2025, 1, 2025, 1, country='日本', at=at)
+    assert japan['running'] == 1 and japan['months'][0]['server_days'] == 31 + 20
+    assert 'by_country' not in japan['months'][0]
+    assert manager.get_occupancy(country='火星', at=at)['running'] == 0
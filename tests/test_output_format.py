@@ -0,0 +1,66 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import billing_manager
+from billing_manager import CliActionError, from_columnar, print_cli_result, to_columnar
+from conftest import make_vps
+
+SCRIPT = os.path.abspath(billing_manager.__file__)
+
+
+def test_columnar_round_trip():
+    result = {
+        'total': 2,
+        'items': [{'名称': 'A', '价格': 1.5, 'tags': [{'k': 1}]}, {'名称': 'B', '备注': None}],
+        'empty': [],
+        'scalars': [1, 'x', None],
+    }
+    columnar = to_columnar(result)
+    assert columnar['items']['columns'] == ['名称', '价格', 'tags', '备注']
+    assert columnar['items']['rows'][1] == ['B', None, None, None]
+    assert columnar['items']['rows'][0][2] == {'columns': ['k'], 'rows': [[1]]}
+    assert (columnar['empty'], columnar['scalars']) == ([], [1, 'x', None])
+
+    restored = from_columnar(columnar)
+    # 缺少的字段还原为None
+    assert restored['items'][1] == {'名称': 'B', '价格': None, 'tags': None, '备注': None}
+    assert restored['items'][0] == dict(result['items'][0], 备注=None)
+    assert {key: restored[key] for key in ('total', 'empty', 'scalars')} == \
+        {key: result[key] for key in ('total', 'empty', 'scalars')}
+
+
+def test_print_cli_result_formats(capsys):
+    print_cli_result([{'a': 1}, {'a': 2}], 'columnar')
+    print_cli_result('文本', 'columnar')
+    print_cli_result(None, 'json')
+    print_cli_result({'名称': 'A'})
+    lines = capsys.readouterr().out.splitlines()
+    assert json.loads(lines[0]) == {'columns': ['a'], 'rows': [[1], [2]]}
+    assert lines[1:] == ['文本', '{"名称": "A"}']
+
+
+def test_msgpack_without_the_package_is_a_clean_error(monkeypatch):
+    monkeypatch.setattr(billing_manager, 'msgpack', None)
+    with pytest.raises(CliActionError, match='msgpack'):
+        print_cli_result({'a': 1}, 'msgpack')
+
+
+def test_msgpack_output_round_trips(capsysbinary):
+    msgpack = pytest.importorskip('msgpack')
+    print_cli_result({'名称': 'A', 'items': [1, 2]}, 'msgpack')
+    assert msgpack.unpackb(capsysbinary.readouterr().out, raw=False) == {'名称': 'A', 'items': [1, 2]}
+
+
+def test_cli_batch_with_columnar_output(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01'), make_vps('VPS-2', '2025/02/01')])
+    completed = subprocess.run(
+        [sys.executable, SCRIPT, '--config', manager.config_file, '--batch', '--format', 'columnar'],
+        input=json.dumps([{'action': 'get_all_vps'}, {'action': 'get_all_vps', 'args': {'format': 'json'}}]),
+        capture_output=True, text=True, encoding='utf-8', check=True)
+    results = from_columnar(json.loads(completed.stdout))
+    assert [vps['name'] for vps in results[0]['result']] == ['VPS-1', 'VPS-2']
+    assert results[1]['success'] is False and 'format' in results[1]['error']
@@ -0,0 +1,70 @@
+import datetime
+
+from conftest import make_vps
+
+AS_OF = datetime.datetime(2026, 1, 1)
+
+
+def bill_row(manager, year, month, name='VPS-1'):
+    bill = manager.compute_monthly_bill(manager.get_snapshot(), year, month, AS_OF)
+    return next(row for row in bill['账单行'] if row['VPS名称'] == name)
+
+
+def test_change_price_stores_one_from_format(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    assert manager.change_vps_price('VPS-1', 25.0, '2025/06/01')
+    assert manager.change_vps_price('VPS-1', 30.0, datetime.datetime(2025, 8, 15, 12, 0, 0))
+
+    history = manager.get_vps_by_name('VPS-1')['price_history']
+    assert history == [
+        {'from': '2025/01/01 00:00:00', 'price': 20.0},
+        {'from': '2025/06/01 00:00:00', 'price': 25.0},
+        {'from': '2025/08/15 12:00:00', 'price': 30.0},
+    ]
+
+
+def test_back_dated_change_before_start_date_applies(make_manager):
+    # 启用日期晚于购买日期，调价时间在两者之间：原单价必须从购买日期开始，而不是在启用日期重新生效
+    manager = make_manager([make_vps('VPS-1', '2025/01/01', start_date='2025/03/01'),
+                            make_vps('VPS-25', '2025/01/01', price=25.0, start_date='2025/03/01')])
+    assert manager.change_vps_price('VPS-1', 25.0, '2025/02/01')
+
+    for month in (3, 4, 5):
+        row = bill_row(manager, 2025, month)
+        assert row['总金额'] == bill_row(manager, 2025, month, 'VPS-25')['总金额']
+        assert row['月单价'] == 25.0
+
+
+def test_change_before_purchase_replaces_base_price(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    assert manager.change_vps_price('VPS-1', 25.0, '2024/12/01')
+
+    assert manager.get_vps_by_name('VPS-1')['price_history'] == [{'from': '2024/12/01 00:00:00', 'price': 25.0}]
+    assert bill_row(manager, 2025, 1)['总金额'] == 25.0
+
+
+def test_mid_month_change_splits_the_month(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    assert manager.change_vps_price('VPS-1', 31.0, '2025/05/16')
+
+    april = bill_row(manager, 2025, 4)
+    assert (april['月单价'], april['总金额']) == (20.0, 20.0)
+    # 5月1日-15日按20，16日-31日按31
+    may = bill_row(manager, 2025, 5)
+    assert may['总金额'] == round((15 * 20 + 16 * 31) / 31, 2)
+    assert may['月单价'] == 31.0
+    june = bill_row(manager, 2025, 6)
+    assert (june['月单价'], june['总金额']) == (31.0, 31.0)
+
+
+def test_historical_rows_show_the_price_of_that_month(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    assert manager.change_vps_price('VPS-1', 25.0, '2025/06/01')
+
+    may = bill_row(manager, 2025, 5)
+    assert (may['月单价'], may['单价/月（$）'], may['总金额']) == (20.0, 20.0, 20.0)
+
+    _, table = manager.generate_monthly_bill_table(2025, 2025, 6)
+    rows = {(month['年份'], month['月份']): month for month in table}
+    may_rows = [row for row in rows[(2025, 5)]['详细数据'] if row['VPS名称'] == 'VPS-1']
+    assert may_rows[0]['单价/月（$）'] == 20.0
@@ -0,0 +1,117 @@
+import datetime
+import random
+
+import pytest
+
+from billing_manager import (MICRO_CENTS_PER_CENT, PRICING_RULE_SETS, PRICING_RULES, NatPricingRule, PricingTerms,
+                             ServerPricingRule, amount_to_cents, evaluate_pricing_terms, get_pricing_rule_set,
+                             register_pricing_rule_set, to_micro_cents)
+from conftest import make_vps
+
+HOUR = 60 * 60 * 1000000
+MONTH = 31 * 24 * HOUR
+
+
+def test_batch_evaluation_matches_single_evaluation():
+    rng = random.Random(3)
+    terms = []
+    for rule in PRICING_RULES.values():
+        if not hasattr(rule, 'evaluate_traffic_batch'):
+            for _ in range(50):
+                # 包含正好在半分上的取整
+                price = to_micro_cents(rng.choice([0.01, 9.99, 12.5, 13.37, 100.0, 0.05]))
+                elapsed = rng.randrange(0, MONTH)
+                terms.append(PricingTerms(rule, price, elapsed, MONTH, rng.random() < 0.2))
+    batched = evaluate_pricing_terms(terms)
+    single = [item.rule.evaluate(item.price_micro_cents, item.elapsed_microseconds, item.month_microseconds,
+                                 item.full_month) for item in terms]
+    assert batched == single
+
+
+def test_server_rules():
+    price = 672 * MICRO_CENTS_PER_CENT * 100  # 每月$672
+    assert PRICING_RULES['prorate_minute'].evaluate(price, MONTH // 2, MONTH, False) == 33600
+    # 30天计费：31天的月份里用15.5天
+    assert PRICING_RULES['legacy_30day'].evaluate(price, MONTH // 2, MONTH, False) == 34720
+    # 不足1天按1天
+    assert PRICING_RULES['minimum_charge'].evaluate(price, HOUR, MONTH, False) == \
+        PRICING_RULES['prorate_minute'].evaluate(price, 24 * HOUR, MONTH, False)
+    hourly = PRICING_RULES['hourly_capped']
+    assert hourly.evaluate(price, HOUR + 1, MONTH, False) == 200
+    assert hourly.evaluate(price, MONTH, MONTH, False) == 67200
+    assert hourly.evaluate(price, HOUR, MONTH, True) == 67200
+
+
+def test_nat_rules():
+    assert PRICING_RULES['nat_daily'].evaluate(31) == 31.0
+    tiered = PRICING_RULES['nat_tiered']
+    assert tiered.evaluate(5) == pytest.approx(5.0)
+    assert tiered.evaluate(15) == pytest.approx(10 + 5 * 0.8)
+    assert tiered.evaluate(31) == pytest.approx(10 + 8 + 11 * 0.6)
+
+
+def test_rule_sets_are_validated_and_unknown_names_fall_back():
+    with pytest.raises(ValueError):
+        register_pricing_rule_set('broken', 'nat_daily', 'nat_daily')
+    with pytest.raises(ValueError):
+        register_pricing_rule_set('broken', 'prorate_minute', 'missing')
+    assert 'broken' not in PRICING_RULE_SETS
+    assert get_pricing_rule_set('missing') is PRICING_RULE_SETS['default']
+    assert get_pricing_rule_set(None) is PRICING_RULE_SETS['default']
+
+
+def test_bill_uses_each_servers_rule_set(make_manager):
+    manager = make_manager([
+        make_vps('VPS-1', '2025/03/31 23:00:00', price=67.2),
+        make_vps('VPS-2', '2025/03/31 23:00:00', price=67.2, pricing_rule='hourly'),
+        make_vps('VPS-3', '2025/03/01', use_nat=True, pricing_rule='tiered_nat'),
+    ])
+    bill = manager.compute_monthly_bill(manager.get_snapshot(), 2025, 3, datetime.datetime(2025, 4, 1))
+    cents = {row['VPS名称']: amount_to_cents(row['总金额']) for row in bill['账单行']}
+    # 用了1小时：按分钟为 6720 × 60 / 44640 ≈ 9分，按小时为 6720 / 672 = 10分
+    assert (cents['VPS-1'], cents['VPS-2']) == (9, 10)
+    # 31天流量阶梯计费 ¥24.6
+    assert bill['NAT费用'] == round(24.6 * 0.14, 2)
+
+
+def test_incomplete_rules_cannot_be_instantiated():
+    class NoBatch(ServerPricingRule):
+        name = 'no_batch'
+
+    class NoTraffic(NatPricingRule):
+        name = 'no_traffic'
+
+    with pytest.raises(TypeError):
+        NoBatch()
+    with pytest.raises(TypeError):
+        NoTraffic()
+
+
+def test_price_methods_each_return_one_type(make_manager):
+    servers = [make_vps('VPS-1', '2025/03/10'), make_vps('VPS-2', '2025/03/10', pricing_rule='hourly'),
+               make_vps('VPS-3', '2025/01/01', price_history=[{'from': '2025/01/01 00:00:00', 'price': 10.0},
+                                                              {'from': '2025/03/16 00:00:00', 'price': 40.0}]),
+               make_vps('VPS-4', '2025/03/10', price=0.0)]
+    servers[1].pop('purchase_date')
+    servers[1].pop('start_date')
+    manager = make_manager(servers)
+    now = datetime.datetime(2025, 4, 1)
+
+    for vps in manager.get_snapshot().records:
+        amount = manager.calculate_price_with_purchase_date(vps, 2025, 3, now=now)
+        cents = manager.calculate_price_cents(vps, 2025, 3, now=now)
+        terms = manager.calculate_price_terms(vps, 2025, 3, now=now)
+        assert type(amount) is float and type(cents) is int and type(terms) is tuple
+        assert all(isinstance(item, PricingTerms) for item in terms)
+        assert amount_to_cents(amount) == cents
+    # 两个单价区段：15天$10 + 16天$40
+    assert manager.calculate_price_cents(manager.vps_data[2], 2025, 3, now=now) == round((15 * 1000 + 16 * 4000) / 31)
+    assert manager.calculate_price_terms(manager.vps_data[3], 2025, 3, now=now) == ()
+
+
+def test_each_price_calculation_is_timed_once(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/03/10')])
+    manager.stats.reset()
+    manager.calculate_price_cents(manager.vps_data[0], 2025, 3)
+    manager.calculate_price_terms(manager.vps_data[0], 2025, 3)
+    assert manager.stats.to_dict()['timers']['pricing_terms']['calls'] == 2
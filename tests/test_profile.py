@@ -0,0 +1,43 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import subprocess
+import sys
+
+import billing_manager
+from billing_manager import PhaseTimer, report_profile
+from conftest import make_vps
+
+SCRIPT = os.path.abspath(billing_manager.__file__)
+
+
+def test_report_profile_writes_prof_file_and_phases(tmp_path):
+    timer = PhaseTimer()
+    timer.add('模块导入', 0.25)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    with timer.phase('执行操作'):
+        json.dumps([{'a': i} for i in range(1000)])
+    profiler.disable()
+    stream = io.StringIO()
+    prof_file = str(tmp_path / 'run.prof')
+
+    report_profile(profiler, timer, prof_file, stream)
+
+    output = stream.getvalue()
+    assert '模块导入' in output and '执行操作' in output and '合计' in output
+    assert pstats.Stats(prof_file).total_calls > 0
+
+
+def test_cli_profile_keeps_stdout_json(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    completed = subprocess.run(
+        [sys.executable, SCRIPT, '--config', manager.config_file, '--action', 'get_all_vps', '--profile'],
+        capture_output=True, text=True, encoding='utf-8', check=True)
+
+    assert [vps['name'] for vps in json.loads(completed.stdout)] == ['VPS-1']
+    assert '[profile] 阶段耗时' in completed.stderr
+    prof_file = os.path.join(os.path.dirname(manager.config_file), 'billing_get_all_vps.prof')
+    assert pstats.Stats(prof_file).total_calls > 0
@@ -0,0 +1,83 @@
+import pytest
+
+from conftest import make_vps
+
+
+def fleet():
+    servers = []
+    for i in range(40):
+        fields = {'country': ['日本', '德国', '美国'][i % 3], 'use_nat': i % 5 == 0}
+        if i % 4 == 0:
+            fields.update(status='销毁', cancel_date=f'2025/06/{i % 28 + 1:02d}')
+        # 单价只有4种，排序时大量并列，由名称决定顺序
+        servers.append(make_vps(f'VPS-{i:02d}', f'2025/{i % 12 + 1:02d}/01', price=float(10 + i % 4), **fields))
+    return servers
+
+
+def all_pages(manager, filters=None, sort='name', limit=7):
+    names, cursor = [], None
+    while True:
+        page = manager.query_vps(filters, sort, ['name'], limit, cursor)
+        names += [item['name'] for item in page['items']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            return names, page['total']
+
+
+@pytest.mark.parametrize('sort', ['name', '-name', 'price_per_month', '-price_per_month',
+                                  'purchase_date', '-cancel_date', 'country'])
+def test_pages_follow_a_stable_total_order(make_manager, sort):
+    manager = make_manager(fleet())
+    field = sort.lstrip('-')
+    records = manager.get_snapshot().records
+    expected = [vps['name'] for vps in sorted(records, key=lambda vps: manager._query_sort_key(vps, field),
+                                               reverse=sort.startswith('-'))]
+
+    names, total = all_pages(manager, sort=sort)
+    assert names == expected
+    assert total == len(records) == len(set(names))
+
+
+def test_records_missing_the_sort_field_come_last(make_manager):
+    manager = make_manager(fleet())
+    names, _ = all_pages(manager, sort='cancel_date', limit=100)
+    cancelled = [vps['name'] for vps in manager.get_snapshot().records if vps.get('cancel_date')]
+    assert set(names[:len(cancelled)]) == set(cancelled)
+
+
+def test_cursor_continues_after_inserts(make_manager):
+    manager = make_manager(fleet())
+    first = manager.query_vps(None, 'name', ['name'], 10)
+    assert first['items'][-1]['name'] == 'VPS-09'
+
+    assert manager.add_vps({'name': 'VPS-00a', 'price_per_month': 10.0, 'purchase_date': '2025/01/01'})
+    assert manager.add_vps({'name': 'VPS-10a', 'price_per_month': 10.0, 'purchase_date': '2025/01/01'})
+    second = manager.query_vps(None, 'name', ['name'], 3, first['next_cursor'])
+    # 游标之前插入的记录不会出现，之后插入的记录按顺序出现，已返回的记录不会重复
+    assert [item['name'] for item in second['items']] == ['VPS-10', 'VPS-10a', 'VPS-11']
+
+
+def test_filters_and_projection(make_manager):
+    manager = make_manager(fleet())
+    filters = {'country': '日本', 'status': '在用', 'purchase_from': '2025/03/01'}
+    page = manager.query_vps(filters, '-price_per_month', ['name', 'price_per_month'], 100)
+
+    expected = [vps for vps in manager.get_snapshot().records
+                if vps['country'] == '日本' and vps['status'] == '在用' and vps['purchase_date'] >= '2025/03/01']
+    assert page['total'] == len(expected) > 0
+    assert all(set(item) == {'name', 'price_per_month'} for item in page['items'])
+    prices = [item['price_per_month'] for item in page['items']]
+    assert prices == sorted(prices, reverse=True)
+
+
+def test_invalid_cursor_and_sort_are_rejected(make_manager):
+    manager = make_manager(fleet())
+    cursor = manager.query_vps(None, 'name', None, 5)['next_cursor']
+    with pytest.raises(ValueError):
+        manager.query_vps(None, '-name', None, 5, cursor)
+    with pytest.raises(ValueError):
+        manager.query_vps(None, 'name', None, 5, 'not-a-cursor')
+    with pytest.raises(ValueError):
+        manager.query_vps(None, 'colour', None, 5)
+    with pytest.raises(ValueError):
+        manager.query_vps({'colour': 'red'})
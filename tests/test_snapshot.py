@@ -0,0 +1,78 @@
+import pytest
+
+from conftest import load_config, make_vps
+
+
+def test_snapshot_is_isolated_from_working_data(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    snapshot = manager.get_snapshot()
+
+    manager.vps_data[0]['price_per_month'] = 99.0
+    assert snapshot.records[0]['price_per_month'] == 20.0
+    with pytest.raises(TypeError):
+        snapshot.records[0]['price_per_month'] = 1.0
+
+    published = manager.publish_snapshot()
+    assert published.version == snapshot.version + 1
+    assert manager.get_snapshot() is published
+    assert published.records[0]['price_per_month'] == 99.0
+    assert snapshot.records[0]['price_per_month'] == 20.0
+
+
+def test_background_save_writes_only_the_published_snapshot(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    manager.stats.reset()
+
+    # 没有发布新快照时，自动保存不重写文件
+    assert manager.save_data(publish=False)
+    assert 'save_data_write' not in manager.stats.to_dict()['counters']
+
+    manager.vps_data[0]['price_per_month'] = 30.0
+    manager.publish_snapshot()
+    # 发布之后主线程继续修改，还没有发布的修改不会被自动保存写出
+    manager.vps_data[0]['price_per_month'] = 40.0
+    assert manager.save_data(publish=False)
+    assert load_config(manager)['vps_servers'][0]['price_per_month'] == 30.0
+    assert manager.stats.to_dict()['counters']['save_data_write'] == 1
+
+    assert manager.save_data()
+    assert load_config(manager)['vps_servers'][0]['price_per_month'] == 40.0
+
+
+def test_bills_read_the_snapshot_they_were_given(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/01/01')])
+    snapshot = manager.get_snapshot()
+    assert manager.update_vps('VPS-1', price_per_month=50.0)
+
+    old = manager.compute_monthly_bill(snapshot, 2025, 3)
+    new = manager.compute_monthly_bill(manager.get_snapshot(), 2025, 3)
+    assert (old['月总费用'], new['月总费用']) == (20.0, 50.0)
+
+
+def test_unchanged_records_are_shared_between_versions(make_manager):
+    manager = make_manager([make_vps(f'VPS-{i}', '2025/01/01') for i in range(5)])
+    first = manager.get_snapshot()
+    assert manager.update_vps('VPS-2', price_per_month=30.0)
+    second = manager.get_snapshot()
+
+    shared = [old is new for old, new in zip(first.records, second.records)]
+    assert shared == [True, True, False, True, True]
+    assert (first.records[2]['price_per_month'], second.records[2]['price_per_month']) == (20.0, 30.0)
+
+    # 写回相同的值不算修改
+    manager.vps_data[0]['status'] = '在用'
+    assert manager.publish_snapshot().records[0] is second.records[0]
+
+
+def test_nested_values_are_not_shared_with_the_working_data(make_manager):
+    history = [{'from': '2025/01/01 00:00:00', 'price': 20.0}]
+    manager = make_manager([make_vps('VPS-1', '2025/01/01', price_history=history)])
+    working = manager.vps_data[0]
+    snapshot = manager.get_snapshot()
+    assert snapshot.records[0]['price_history'] == history
+    assert snapshot.records[0]['price_history'] is not working['price_history']
+
+    working['price_history'].append({'from': '2025/02/01 00:00:00', 'price': 30.0})
+    assert len(snapshot.records[0]['price_history']) == 1
+    assert len(working.copy()['price_history']) == 2
+    assert working.copy()['price_history'] is not working['price_history']
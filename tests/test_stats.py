@@ -0,0 +1,42 @@
+import concurrent.futures
+import datetime
+
+from billing_manager import BillingStats
+from conftest import make_vps
+
+
+def test_concurrent_counters_are_not_lost():
+    stats = BillingStats()
+
+    def work(_):
+        for _ in range(2000):
+            stats.incr('hits')
+            stats.record('step', 0.001)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(work, range(8)))
+
+    result = stats.to_dict()
+    assert result['counters']['hits'] == 16000
+    assert result['timers']['step']['calls'] == 16000
+
+
+def test_parallel_bills_count_like_sequential_bills(make_manager):
+    manager = make_manager([make_vps(f'VPS-{i}', '2024/01/10', use_nat=i % 2 == 0) for i in range(20)])
+    months = [(2024, month) for month in range(1, 13)]
+    as_of = datetime.datetime(2025, 1, 1)
+    snapshot = manager.get_snapshot()
+
+    manager.stats.reset()
+    for year, month in months:
+        manager.compute_monthly_bill(snapshot, year, month, as_of)
+    sequential = manager.stats.to_dict()
+
+    manager.stats.reset()
+    manager.compute_monthly_bills(months, snapshot, as_of, max_workers=8)
+    parallel = manager.stats.to_dict()
+
+    # 缓存只在第一次计算时建立，这里只比较每个月都会发生的计数
+    for name in ('nat_recompute', 'pricing_batch_lines'):
+        assert parallel['counters'][name] == sequential['counters'][name]
+    assert parallel['counters']['nat_recompute'] == len(months)
@@ -0,0 +1,93 @@
+import os
+
+from billing_manager import BYTES_PER_GB, TrafficStore, iter_traffic_records
+from conftest import make_vps
+
+
+def write(path, text, mode='w'):
+    with open(path, mode, encoding='utf-8', newline='') as f:
+        f.write(text)
+
+
+def test_records_from_csv_and_jsonl(tmp_path):
+    csv_path = tmp_path / 'traffic.csv'
+    write(csv_path, 'name,date,bytes\nVPS-1,2025-03-01,100\nbroken\n"VPS,2",2025/03/02,5\nVPS-1,2025-03-03,7')
+    records = [record[1:] for record in iter_traffic_records(str(csv_path))]
+    # 最后一行没有换行符，视为尚未写完
+    assert records == [('VPS-1', '2025/03/01', 100), (None, None, 0), ('VPS,2', '2025/03/02', 5)]
+
+    jsonl_path = tmp_path / 'traffic.jsonl'
+    write(jsonl_path, '{"server": "VPS-1", "timestamp": "2025-03-01T10:00:00", "rx_bytes": 3, "tx_bytes": 4}\n')
+    assert [record[1:] for record in iter_traffic_records(str(jsonl_path))] == [('VPS-1', '2025/03/01', 7)]
+
+
+def test_reingest_skips_appends_and_rewrites(tmp_path):
+    store = TrafficStore(str(tmp_path / 'store'))
+    path = tmp_path / 'traffic.csv'
+    write(path, 'name,date,bytes\nVPS-1,2025/03/01,100\nVPS-2,2025/03/31,50\nVPS-1,2025/04/01,9\n')
+    result = store.ingest(str(path))
+    assert (result['mode'], result['lines'], result['bytes']) == ('full', 3, 159)
+    assert store.ingest(str(path))['mode'] == 'skipped'
+
+    write(path, 'VPS-1,2025/03/02,10\nVPS-3,not-a-date,1\n', mode='a')
+    result = store.ingest(str(path))
+    assert (result['mode'], result['lines'], result['invalid_lines']) == ('incremental', 2, 1)
+    assert store.month_bytes(2025, 3) == {'VPS-1': 110, 'VPS-2': 50}
+
+    # 另一个进程重新加载清单后看到同样的数据
+    assert TrafficStore(store.directory).month_bytes(2025, 4) == {'VPS-1': 9}
+
+    write(path, 'name,date,bytes\nVPS-2,2025/03/05,1\n')
+    assert store.ingest(str(path))['mode'] == 'full'
+    assert store.month_bytes(2025, 3) == {'VPS-2': 1}
+    assert store.month_bytes(2025, 4) == {}
+
+
+def test_nat_fee_uses_ingested_traffic(make_manager, tmp_path):
+    manager = make_manager([make_vps('VPS-1', '2025/03/01', use_nat=True),
+                            make_vps('VPS-2', '2025/03/01', use_nat=True)])
+    estimated = manager.get_nat_traffic(2025, 3)['nat_fee']
+
+    directory = tmp_path / 'logs'
+    directory.mkdir()
+    write(directory / 'a.csv', f'name,date,bytes\nVPS-1,2025/03/01,{5 * BYTES_PER_GB}\n')
+    write(directory / 'b.jsonl', f'{{"name": "VPS-1", "date": "2025/03/02", "bytes": {BYTES_PER_GB}}}\n')
+    write(directory / 'ignored.txt', 'x\n')
+    result = manager.ingest_traffic([str(directory)])
+    assert [os.path.basename(item['file']) for item in result['files']] == ['a.csv', 'b.jsonl']
+
+    traffic = manager.get_nat_traffic(2025, 3)
+    assert traffic['traffic_gb'] == {'VPS-1': 6.0}
+    # VPS-1按实际流量6G，VPS-2没有流量数据仍按31天估算
+    assert traffic['nat_fee'] < estimated
+    assert traffic['nat_fee'] == round((6 + 31) * 0.14, 2)
+
+
+def test_nat_detail_matches_nat_fee(make_manager, tmp_path):
+    manager = make_manager([make_vps('VPS-1', '2025/03/01', use_nat=True),
+                            make_vps('VPS-2', '2025/03/10', use_nat=True)])
+    detail = manager.compute_monthly_bill(manager.get_snapshot(), 2025, 3)['NAT详情']
+    assert detail['费用说明'].startswith('2台VPS共53天')
+    assert '×1G/天×¥1/G' in detail['费用说明']
+
+    path = tmp_path / 'traffic.csv'
+    write(path, f'name,date,bytes\nVPS-1,2025/03/01,{50 * BYTES_PER_GB}\n')
+    manager.ingest_traffic([str(path)])
+    snapshot = manager.get_snapshot()
+    _, days, vps = manager.compute_nat_fee(snapshot.records, 2025, 3)
+    detail = manager.compute_monthly_bill(snapshot, 2025, 3)['NAT详情']
+    # 天数与计算NAT费用时一致，VPS-1按实际流量计费
+    assert (detail['NAT使用VPS数'], detail['NAT总天数']) == (vps, days)
+    assert detail['实际流量(G)'] == 50.0
+    assert '其中1台按实际流量共50.0G' in detail['费用说明']
+    assert '×1G/天' not in detail['费用说明']
+    assert manager.compute_bill_table_month(snapshot, 2025, 3)['NAT详情'] == detail
+
+
+def test_nat_detail_uses_rule_description(make_manager):
+    manager = make_manager([make_vps('VPS-1', '2025/03/01', use_nat=True, pricing_rule='tiered_nat')])
+    detail = manager.compute_monthly_bill(manager.get_snapshot(), 2025, 3)['NAT详情']
+    rule = manager._pricing_rules(manager.vps_data[0])[1]
+    assert detail['单价'] == rule.description
+    assert rule.description in detail['费用说明']
+    assert '×1G/天' not in detail['费用说明']
@@ -0,0 +1,74 @@
+import datetime
+
+import pytest
+
+from billing_manager import VpsRecord
+from conftest import load_config, make_vps
+
+
+def test_record_round_trips_fields_and_order():
+    data = {'name': 'VPS-1', 'country': '日本', 'price_per_month': 20.0, 'currency': 'CNY',
+            'status': '在用', 'purchase_date': '2025/01/01', 'custom_note': {'a': 1}}
+    record = VpsRecord(data)
+
+    assert record.to_dict() == data
+    assert list(record) == list(data)
+    assert len(record) == len(data)
+    assert record['currency'] == 'CNY' and record.get('missing', 'x') == 'x'
+    assert 'cancel_date' not in record
+    with pytest.raises(KeyError):
+        record['cancel_date']
+
+
+def test_record_updates_keep_insertion_order():
+    record = VpsRecord({'name': 'VPS-1', 'status': '在用'})
+    record['cancel_date'] = '2025/06/01'
+    record['note'] = 'x'
+    del record['status']
+    assert list(record.to_dict().items()) == [('name', 'VPS-1'), ('cancel_date', '2025/06/01'), ('note', 'x')]
+    with pytest.raises(KeyError):
+        del record['status']
+
+
+def test_repeated_strings_and_key_orders_are_shared():
+    first = VpsRecord({'name': 'A', 'country': ''.join(['日', '本']), 'status': '在用'})
+    second = VpsRecord({'name': 'B', 'country': ''.join(['日', '本']), 'status': '在用'})
+    assert first['country'] is second['country']
+    assert first._keys is second._keys
+
+
+def test_parsed_dates_are_cached_until_the_field_changes():
+    calls = []
+
+    def parser(value):
+        calls.append(value)
+        return datetime.datetime.strptime(value, '%Y/%m/%d')
+
+    record = VpsRecord({'name': 'VPS-1', 'purchase_date': '2025/01/01'})
+    assert record.get_date('purchase_date', parser) == datetime.datetime(2025, 1, 1)
+    assert record.get_date('purchase_date', parser) == datetime.datetime(2025, 1, 1)
+    record['purchase_date'] = '2025/02/01'
+    assert record.get_date('purchase_date', parser) == datetime.datetime(2025, 2, 1)
+    assert calls == ['2025/01/01', '2025/02/01']
+
+
+def test_copies_are_independent_and_frozen_copies_are_read_only():
+    record = VpsRecord({'name': 'VPS-1', 'extra': 'a'})
+    copy = record.copy()
+    copy['extra'] = 'b'
+    assert record['extra'] == 'a'
+
+    frozen = record.copy(frozen=True)
+    with pytest.raises(TypeError):
+        frozen['name'] = 'other'
+    with pytest.raises(TypeError):
+        del frozen['extra']
+
+
+def test_config_file_is_rewritten_unchanged(make_manager):
+    servers = [make_vps('VPS-1', '2025/01/01', currency='EUR', pricing_rule='legacy'),
+               make_vps('VPS-2', '2025/02/01', status='销毁', cancel_date='2025/06/01')]
+    manager = make_manager(servers)
+    before = load_config(manager)
+    assert manager.save_data()
+    assert load_config(manager) == before